@@ -0,0 +1,14 @@
+"""
+Models shared by the platform and the public API
+"""
+
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class Pagination(BaseModel):
+    page: int = 1
+    per_page: int = 10
+    # The next_cursor of the previous page. When set, page is ignored
+    cursor: Optional[str] = None
@@ -1,7 +1,15 @@
 from fastapi import APIRouter, Depends
 from propelauth_py.user import User
 
-from app.security.authentification import propelauth
+from app.core import config
+from app.security.authentification import (
+    api_key_cache,
+    project_org_cache,
+    propelauth,
+)
+from app.services.mongo.query_cache import query_cache
+from app.services.mongo.usage import org_metadata_cache
+from phospho.lab.language_models import get_client_metrics
 
 router = APIRouter(include_in_schema=False)
 
@@ -14,3 +22,26 @@ def read_root(user: User = Depends(propelauth.require_user)):
 @router.get("/health")
 def health_check():
     return {"status": "OK"}
+
+
+@router.get("/debug/caches")
+def get_caches_stats(user: User = Depends(propelauth.require_user)):
+    """
+    Hit ratio and time saved by the in-process caches of this worker
+    """
+    return {
+        "api_keys": api_key_cache.stats(),
+        "project_orgs": project_org_cache.stats(),
+        "org_metadata": org_metadata_cache.stats(),
+        "queries": query_cache.stats(),
+    }
+
+
+@router.get("/debug/llm_clients")
+def get_llm_clients_metrics(user: User = Depends(propelauth.require_user)):
+    """
+    Number of clients and of requests in flight per LLM provider in this worker.
+    Only for the members of the phospho org.
+    """
+    propelauth.require_org_member(user, config.PHOSPHO_ORG_ID)
+    return get_client_metrics()
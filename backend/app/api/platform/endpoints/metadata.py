@@ -18,6 +18,7 @@ from app.services.mongo.metadata import (
     collect_unique_metadata_fields,
     breakdown_by_sum_of_metadata_field,
 )
+from app.services.mongo.query_cache import query_cache
 
 # Models
 from app.api.platform.models import (
@@ -216,12 +217,22 @@ async def post_metadata_pivot(
             pivot_query.filters.created_at_end.timestamp()
         )
 
-    pivot_table = await breakdown_by_sum_of_metadata_field(
-        project_id=project_id,
-        metric=pivot_query.metric,
-        metadata_field=pivot_query.metric_metadata,
-        breakdown_by=pivot_query.breakdown_by,
-        filters=pivot_query.filters,
+    pivot_table = await query_cache.get_or_compute(
+        project_id,
+        "breakdown_by_sum_of_metadata_field",
+        {
+            "metric": pivot_query.metric,
+            "metadata_field": pivot_query.metric_metadata,
+            "breakdown_by": pivot_query.breakdown_by,
+            "filters": pivot_query.filters.model_dump(mode="json"),
+        },
+        lambda: breakdown_by_sum_of_metadata_field(
+            project_id=project_id,
+            metric=pivot_query.metric,
+            metadata_field=pivot_query.metric_metadata,
+            breakdown_by=pivot_query.breakdown_by,
+            filters=pivot_query.filters,
+        ),
     )
 
     return MetadataPivotResponse(pivot_table=pivot_table)
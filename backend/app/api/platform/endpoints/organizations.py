@@ -20,6 +20,7 @@ from app.services.mongo.organizations import (
     get_projects_from_org_id,
     get_usage_quota,
 )
+from app.services.mongo.usage import invalidate_org_metadata
 from app.services.mongo.projects import populate_default
 from app.services.slack import slack_notification
 from customerio import analytics
@@ -151,6 +152,7 @@ def post_init_org(
                 max_users=config.PLAN_SELFHOSTED_MAX_USERS,
                 metadata={"plan": "self-hosted", "initialized": True},
             )
+            invalidate_org_metadata(org_id)
             logger.info(
                 f"Organization {org_id} initialized with max_users={config.PLAN_SELFHOSTED_MAX_USERS} and plan=self-hosted"
             )
@@ -163,6 +165,7 @@ def post_init_org(
             max_users=config.PLAN_HOBBY_MAX_USERS,
             metadata={"plan": "hobby", "initialized": True},
         )
+        invalidate_org_metadata(org_id)
         logger.info(
             f"Organization {org_id} initialized with max_users={config.PLAN_HOBBY_MAX_USERS} and plan=hobby"
         )
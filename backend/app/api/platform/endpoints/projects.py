@@ -38,17 +38,17 @@ from app.services.mongo.projects import (
     delete_project_from_id,
     delete_project_related_resources,
     email_project_tasks,
-    get_all_sessions,
     get_all_tests,
     get_all_users_metadata,
     get_project_by_id,
+    get_sessions_page,
     update_project,
 )
 from app.services.mongo.search import (
     search_sessions_in_project,
     search_tasks_in_project,
 )
-from app.services.mongo.tasks import get_all_tasks
+from app.services.mongo.tasks import get_tasks_page
 
 router = APIRouter(tags=["Projects"])
 
@@ -138,7 +138,7 @@ async def post_sessions(
 
     logger.debug(query.sessions_ids)
 
-    sessions = await get_all_sessions(
+    sessions, next_cursor = await get_sessions_page(
         project_id=project_id,
         get_events=True,
         get_tasks=False,
@@ -147,7 +147,7 @@ async def post_sessions(
         sorting=query.sorting,
         sessions_ids=query.sessions_ids,
     )
-    return Sessions(sessions=sessions)
+    return Sessions(sessions=sessions, next_cursor=next_cursor)
 
 
 @router.get(
@@ -269,7 +269,7 @@ async def post_tasks(
             query.filters.metadata = {}
         query.filters.metadata["user_id"] = query.filters.user_id
 
-    tasks = await get_all_tasks(
+    tasks, next_cursor = await get_tasks_page(
         project_id=project_id,
         limit=None,
         validate_metadata=True,
@@ -277,7 +277,7 @@ async def post_tasks(
         sorting=query.sorting,
         pagination=query.pagination,
     )
-    return Tasks(tasks=tasks)
+    return Tasks(tasks=tasks, next_cursor=next_cursor)
 
 
 @router.get(
@@ -2,6 +2,8 @@ from pydantic import BaseModel, Field
 from typing import List, Literal, Optional
 from phospho.models import ProjectDataFilters
 
+from app.api.models import Pagination
+
 
 class AggregateMetricsRequest(BaseModel):
     index: Optional[List[str]] = Field(default_factory=lambda: ["days"])
@@ -39,11 +41,6 @@ class DashboardMetricsFilter(BaseModel):
     graph_name: Optional[List[str]] = None
 
 
-class Pagination(BaseModel):
-    page: int = 1
-    per_page: int = 10
-
-
 class Sorting(BaseModel):
     id: str
     desc: bool
@@ -8,6 +8,7 @@ from app.services.mongo.cron import (
     run_langfuse_sync_pipeline,
     run_langsmith_sync_pipeline,
     run_postgresql_sync_pipeline,
+    run_rollups_refresh_pipeline,
 )
 
 router = APIRouter(tags=["cron"])
@@ -15,7 +16,7 @@ router = APIRouter(tags=["cron"])
 
 @router.post(
     "/cron/sync_pipeline",
-    description="Run the synchronisation pipeline for Langsmith and Langfuse",
+    description="Run the synchronisation pipeline for Langsmith and Langfuse, and refresh the analytics rollups",
     response_model=dict,
 )
 @rate_limiter(limit=2, seconds=60)
@@ -28,6 +29,7 @@ async def run_sync_pipeline(
     try:
         await run_langsmith_sync_pipeline()
         await run_langfuse_sync_pipeline()
+        await run_rollups_refresh_pipeline()
         # Only run the PostgreSQL sync pipeline once a day, at 10am
         if datetime.datetime.now().hour == 10:
             await run_postgresql_sync_pipeline()
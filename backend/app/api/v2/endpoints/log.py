@@ -1,5 +1,5 @@
 import sys
-from typing import List, Union
+from typing import List, Optional, Union
 
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from loguru import logger
@@ -17,11 +17,14 @@ from app.security import (
     get_quota,
 )
 from app.services.mongo.extractor import ExtractorClient
+from app.services.mongo.usage import release_usage, reserve_usage
 
 from app.services.mongo.emails import send_quota_exceeded_email
 from app.core import config
+from app.utils import generate_uuid
+from app.utils.compression import GzipRoute
 
-router = APIRouter(tags=["Logs"])
+router = APIRouter(tags=["Logs"], route_class=GzipRoute)
 
 
 @router.post(
@@ -48,34 +51,30 @@ async def store_batch_of_log_events(
 
     # We return the valid log events
     logged_events: List[Union[LogEvent, LogError]] = []
+    valid_log_events: List[LogEvent] = []
 
     usage_quota = await get_quota(project_id)
-    current_usage = usage_quota.current_usage
-    max_usage = usage_quota.max_usage
 
-    extractor_client = ExtractorClient(
-        project_id=project_id,
-        org_id=org["org"].get("org_id"),
-    )
-
-    nbr_valid_logs = 0
-    nbr_extra_logs = 0
+    # Projects for which the org ownership was already checked in this batch
+    verified_project_ids = {project_id}
 
     for log_event_model in log_request.batched_log_events:
         # We now validate the logs
         try:
             if log_event_model.project_id is None:
                 log_event_model.project_id = project_id
-            else:
+            elif log_event_model.project_id not in verified_project_ids:
                 # Check that the org owns the project_id
                 await verify_propelauth_org_owns_project_id(
                     org, log_event_model.project_id
                 )
+                verified_project_ids.add(log_event_model.project_id)
 
             valid_log_event = LogEvent.model_validate(
                 log_event_model.model_dump(), strict=True
             )
             logged_events.append(valid_log_event)
+            valid_log_events.append(valid_log_event)
 
             # Compute the object size in bytes
             object_size = sys.getsizeof(valid_log_event.model_dump())
@@ -84,29 +83,6 @@ async def store_batch_of_log_events(
                     f"Large log event project {project_id}: {object_size} bytes"
                     + f"\n{valid_log_event.model_dump()}"
                 )
-
-            # Process this log only if the usage quota is not reached
-            if max_usage is None or (
-                max_usage is not None and current_usage < max_usage
-            ):
-                current_usage += 1
-                nbr_valid_logs += 1
-                await extractor_client.run_process_log_for_tasks(
-                    logs_to_process=[valid_log_event],
-                )
-            else:
-                logger.warning(f"Max usage quota reached for project: {project_id}")
-                background_tasks.add_task(send_quota_exceeded_email, project_id)
-                logged_events.append(
-                    LogError(
-                        error_in_log=f"Max usage quota reached for project {project_id}: {current_usage}/{max_usage} logs"
-                    )
-                )
-                nbr_extra_logs += 1
-                await extractor_client.run_process_log_for_tasks(
-                    logs_to_process=[],
-                    extra_logs_to_save=[valid_log_event],
-                )
         except ValidationError as e:
             logger.info(f"Skip logevent processing due to validation error: {e}")
             logged_events.append(LogError(error_in_log=str(e)))
@@ -118,11 +94,50 @@ async def store_batch_of_log_events(
             logger.warning(f"Skip logevent processing due to unknown error: {e}")
             logged_events.append(LogError(error_in_log=str(e)))
 
+    # Process the logs only if the usage quota is not reached
+    reservation_id = generate_uuid()
+    nb_logs_to_process = await reserve_usage(
+        usage_quota, len(valid_log_events), reservation_id
+    )
+    logs_to_process = valid_log_events[:nb_logs_to_process]
+    extra_logs_to_save = valid_log_events[nb_logs_to_process:]
+    if len(extra_logs_to_save) > 0:
+        logger.warning(f"Max usage quota reached for project: {project_id}")
+        background_tasks.add_task(send_quota_exceeded_email, project_id)
+        for _ in extra_logs_to_save:
+            logged_events.append(
+                LogError(
+                    error_in_log=f"Max usage quota reached for project {project_id}: {usage_quota.current_usage + nb_logs_to_process}/{usage_quota.max_usage} logs"
+                )
+            )
+
     log_reply = LogReply(logged_events=logged_events)
     logger.debug(
-        f"Project {project_id} replying to log request with {len(logged_events)}: {nbr_valid_logs} valid logs and {nbr_extra_logs} extra logs to save."
+        f"Project {project_id} replying to log request with {len(logged_events)}: {len(logs_to_process)} valid logs and {len(extra_logs_to_save)} extra logs to save."
     )
 
+    # The whole batch is sent to the extractor in a single workflow. We only wait
+    # for the workflow to be queued by Temporal, not for the processing.
+    if len(logs_to_process) > 0 or len(extra_logs_to_save) > 0:
+        extractor_client = ExtractorClient(
+            project_id=project_id,
+            org_id=org["org"].get("org_id"),
+        )
+        try:
+            await extractor_client.run_process_log_for_tasks(
+                logs_to_process=logs_to_process,
+                extra_logs_to_save=extra_logs_to_save,
+                nb_reserved_usage=(
+                    nb_logs_to_process if usage_quota.max_usage is not None else 0
+                ),
+                reservation_id=reservation_id,
+                raise_on_error=True,
+            )
+        except HTTPException:
+            # The logs won't be processed: give back their usage
+            await release_usage(usage_quota, reservation_id)
+            raise
+
     return log_reply
 
 
@@ -134,20 +149,57 @@ async def store_batch_of_log_events(
 async def store_opentelemetry_log(
     project_id: str,
     open_telemetry_data: dict,
-    background_tasks: BackgroundTasks,
     org: dict = Depends(authenticate_org_key),
 ):
     """Store the opentelemetry data in the opentelemetry database"""
 
     await verify_propelauth_org_owns_project_id(org, project_id)
 
+    usage_quota = await get_quota(project_id)
+    # Only the GenAI spans become logs: the number of spans is an upper bound
+    reservation_id = generate_uuid()
+    nb_reserved = await reserve_usage(
+        usage_quota, count_opentelemetry_spans(open_telemetry_data), reservation_id
+    )
+    if usage_quota.max_usage is not None:
+        # The extractor processes at most the reserved spans
+        max_usage: Optional[int] = usage_quota.current_usage + nb_reserved
+        nb_reserved_usage = nb_reserved
+    else:
+        max_usage = None
+        nb_reserved_usage = 0
+
     extractor_client = ExtractorClient(
         project_id=project_id,
         org_id=org["org"].get("org_id"),
     )
-    background_tasks.add_task(
-        extractor_client.store_open_telemetry_data,
-        open_telemetry_data=open_telemetry_data,
-    )
+    try:
+        await extractor_client.store_open_telemetry_data(
+            open_telemetry_data=open_telemetry_data,
+            current_usage=usage_quota.current_usage,
+            max_usage=max_usage,
+            nb_reserved_usage=nb_reserved_usage,
+            reservation_id=reservation_id,
+            raise_on_error=True,
+        )
+    except HTTPException:
+        await release_usage(usage_quota, reservation_id)
+        raise
 
     return {"status": "ok"}
+
+
+def count_opentelemetry_spans(open_telemetry_data: dict) -> int:
+    """
+    Number of spans in an OTLP/JSON export request
+    """
+    nb_spans = 0
+    for resource_spans in open_telemetry_data.get("resourceSpans") or []:
+        if not isinstance(resource_spans, dict):
+            continue
+        for scope_spans in resource_spans.get("scopeSpans") or []:
+            if isinstance(scope_spans, dict) and isinstance(
+                scope_spans.get("spans"), list
+            ):
+                nb_spans += len(scope_spans["spans"])
+    return nb_spans
@@ -15,15 +15,16 @@ from app.api.v2.models import (
 from app.db.models import AnalyticsQuery
 from app.security import authenticate_org_key, verify_propelauth_org_owns_project_id
 from app.services.mongo.explore import (
-    fetch_flattened_tasks,
+    fetch_flattened_tasks_page,
     update_from_flattened_tasks,
     run_analytics_query,
 )
 from app.services.mongo.projects import (
     backcompute_recipes,
-    get_all_sessions,
+    get_sessions_page,
 )
-from app.services.mongo.tasks import get_all_tasks
+from app.services.mongo.query_cache import query_cache
+from app.services.mongo.tasks import get_tasks_page
 
 router = APIRouter(tags=["Projects"])
 
@@ -36,11 +37,25 @@ router = APIRouter(tags=["Projects"])
 async def get_sessions(
     project_id: str,
     limit: int = 1000,
+    query: Optional[QuerySessionsTasksRequest] = None,
     org: dict = Depends(authenticate_org_key),
 ):
+    """
+    Fetch the sessions of a project.
+
+    Pass a pagination to fetch them page by page, with the next_cursor of the previous
+    page as the cursor.
+    """
     await verify_propelauth_org_owns_project_id(org, project_id)
-    sessions = await get_all_sessions(project_id, limit)
-    return Sessions(sessions=sessions)
+    if query is None:
+        query = QuerySessionsTasksRequest()
+    sessions, next_cursor = await get_sessions_page(
+        project_id,
+        limit=limit,
+        filters=query.filters,
+        pagination=query.pagination,
+    )
+    return Sessions(sessions=sessions, next_cursor=next_cursor)
 
 
 @router.post(
@@ -56,7 +71,9 @@ async def post_tasks(
     """
     Fetch all the tasks of a project.
 
-    The filters are combined as AND conditions on the different fields.
+    The filters are combined as AND conditions on the different fields. Pass a
+    pagination to fetch the tasks page by page, with the next_cursor of the previous
+    page as the cursor.
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
     if query is None:
@@ -66,13 +83,14 @@ async def post_tasks(
             query.filters.metadata = {}
         query.filters.metadata["user_id"] = query.filters.user_id
 
-    tasks = await get_all_tasks(
+    tasks, next_cursor = await get_tasks_page(
         project_id=project_id,
         limit=None,
         validate_metadata=True,
         filters=query.filters,
+        pagination=query.pagination,
     )
-    return Tasks(tasks=tasks)
+    return Tasks(tasks=tasks, next_cursor=next_cursor)
 
 
 @router.post(
@@ -90,14 +108,15 @@ async def get_flattened_tasks(
     """
     await verify_propelauth_org_owns_project_id(org, project_id)
 
-    flattened_tasks = await fetch_flattened_tasks(
+    flattened_tasks, next_cursor = await fetch_flattened_tasks_page(
         project_id=project_id,
         limit=flattened_tasks_request.limit,
         with_events=flattened_tasks_request.with_events,
         with_sessions=flattened_tasks_request.with_sessions,
         with_removed_events=flattened_tasks_request.with_removed_events,
+        pagination=flattened_tasks_request.pagination,
     )
-    return FlattenedTasks(flattened_tasks=flattened_tasks)
+    return FlattenedTasks(flattened_tasks=flattened_tasks, next_cursor=next_cursor)
 
 
 @router.post(
@@ -198,9 +217,17 @@ async def post_run_query(
         limit=analytics_query_request.limit,
     )
 
-    # Run the query
-    query_result = await run_analytics_query(
-        query, fill_missing_dates=analytics_query_request.fill_missing_dates
+    # Run the query, or get its cached result
+    query_result = await query_cache.get_or_compute(
+        project_id,
+        "run_analytics_query",
+        {
+            "query": query.model_dump(mode="json"),
+            "fill_missing_dates": analytics_query_request.fill_missing_dates,
+        },
+        lambda: run_analytics_query(
+            query, fill_missing_dates=analytics_query_request.fill_missing_dates
+        ),
     )
 
     return query_result
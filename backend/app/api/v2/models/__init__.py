@@ -27,6 +27,7 @@ from .projects import (
     UserMetadata,
     Users,
     ProjectDataFilters,
+    Pagination,
     QuerySessionsTasksRequest,
 )
 from .search import SearchQuery, SearchResponse
@@ -1,5 +1,6 @@
 from typing import List, Optional, Literal, Dict
 from pydantic import BaseModel, Field
+from app.api.models import Pagination
 from app.core import config
 
 from app.db.models import (
@@ -51,6 +52,8 @@ class FlattenedTasksRequest(BaseModel):
     with_events: bool = True
     with_sessions: bool = True
     with_removed_events: bool = False
+    # Paginate the tasks instead of limiting the rows
+    pagination: Optional[Pagination] = None
 
 
 class ComputeJobsRequest(BaseModel):
@@ -60,6 +63,7 @@ class ComputeJobsRequest(BaseModel):
 
 class QuerySessionsTasksRequest(BaseModel):
     filters: ProjectDataFilters = Field(default_factory=ProjectDataFilters)
+    pagination: Optional[Pagination] = None
 
 
 class AnalyticsQueryRequest(BaseModel):
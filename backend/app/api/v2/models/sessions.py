@@ -5,6 +5,8 @@ from app.db.models import Session
 
 class Sessions(BaseModel):
     sessions: List[Session]
+    # Cursor of the next page, if the query was paginated and there is one
+    next_cursor: Optional[str] = None
 
 
 class SessionCreationRequest(BaseModel):
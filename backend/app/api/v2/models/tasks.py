@@ -9,6 +9,8 @@ from app.utils import generate_uuid
 
 class Tasks(BaseModel):
     tasks: List[Task]
+    # Cursor of the next page, if the query was paginated and there is one
+    next_cursor: Optional[str] = None
 
 
 class TaskCreationRequest(BaseModel):
@@ -48,3 +50,5 @@ class TaskUpdateRequest(BaseModel):
 
 class FlattenedTasks(BaseModel):
     flattened_tasks: List[FlattenedTask]
+    # Cursor of the next page, if the query was paginated and there is one
+    next_cursor: Optional[str] = None
@@ -11,6 +11,7 @@ from app.security import (
     verify_propelauth_org_owns_project_id,
 )
 from app.services.mongo.metadata import breakdown_by_sum_of_metadata_field
+from app.services.mongo.query_cache import query_cache
 
 from phospho.models import ProjectDataFilters
 from app.api.v3.models.analytics import AnalyticsQuery, AnalyticsResponse
@@ -44,12 +45,22 @@ async def post_metadata_pivot(
             pivot_query.filters.created_at_end.timestamp()
         )
 
-    pivot_table = await breakdown_by_sum_of_metadata_field(
-        project_id=pivot_query.project_id,
-        metric=pivot_query.metric,
-        metadata_field=pivot_query.metric_metadata,
-        breakdown_by=pivot_query.breakdown_by,
-        filters=pivot_query.filters,
+    pivot_table = await query_cache.get_or_compute(
+        pivot_query.project_id,
+        "breakdown_by_sum_of_metadata_field",
+        {
+            "metric": pivot_query.metric,
+            "metadata_field": pivot_query.metric_metadata,
+            "breakdown_by": pivot_query.breakdown_by,
+            "filters": pivot_query.filters.model_dump(mode="json"),
+        },
+        lambda: breakdown_by_sum_of_metadata_field(
+            project_id=pivot_query.project_id,
+            metric=pivot_query.metric,
+            metadata_field=pivot_query.metric_metadata,
+            breakdown_by=pivot_query.breakdown_by,
+            filters=pivot_query.filters,
+        ),
     )
 
     return AnalyticsResponse(pivot_table=pivot_table)
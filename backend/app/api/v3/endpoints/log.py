@@ -13,11 +13,13 @@ from app.security import (
 from app.security.authorization import get_quota_for_org
 from app.services.mongo.emails import send_quota_exceeded_email
 from app.services.mongo.extractor import ExtractorClient
+from app.services.mongo.usage import release_usage, reserve_usage
+from app.utils import generate_uuid
+from app.utils.compression import GzipRoute
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
 from loguru import logger
-from pydantic import ValidationError
 
-router = APIRouter(tags=["Log"])
+router = APIRouter(tags=["Log"], route_class=GzipRoute)
 
 
 @router.post(
@@ -42,44 +44,29 @@ async def store_batch_of_log_events(
 
     # We return the valid log events
     logged_events: List[Union[MinimalLogEventForMessages, LogError]] = []
-    logs_to_process: List[MinimalLogEventForMessages] = []
-    extra_logs_to_save: List[MinimalLogEventForMessages] = []
 
     usage_quota = await get_quota_for_org(org["org"].get("org_id"))
-    current_usage = usage_quota.current_usage
-    max_usage = usage_quota.max_usage
 
-    for log_event_model in log_request.batched_log_events:
-        # We now validate the logs
-        try:
-            if max_usage is None or (
-                max_usage is not None and current_usage < max_usage
-            ):
-                logs_to_process.append(log_event_model)
-                current_usage += 1
-            else:
-                logger.warning(
-                    f"Max usage quota reached for project: {log_request.project_id}"
-                )
-                background_tasks.add_task(
-                    send_quota_exceeded_email, log_request.project_id
-                )
-                logged_events.append(
-                    LogError(
-                        error_in_log=f"Max usage quota reached for project {log_request.project_id}: {current_usage}/{max_usage} logs"
-                    )
+    # Process the logs only if the usage quota is not reached
+    reservation_id = generate_uuid()
+    nb_logs_to_process = await reserve_usage(
+        usage_quota, len(log_request.batched_log_events), reservation_id
+    )
+    logs_to_process: List[MinimalLogEventForMessages] = log_request.batched_log_events[
+        :nb_logs_to_process
+    ]
+    extra_logs_to_save: List[MinimalLogEventForMessages] = (
+        log_request.batched_log_events[nb_logs_to_process:]
+    )
+    if len(extra_logs_to_save) > 0:
+        logger.warning(f"Max usage quota reached for project: {log_request.project_id}")
+        background_tasks.add_task(send_quota_exceeded_email, log_request.project_id)
+        for _ in extra_logs_to_save:
+            logged_events.append(
+                LogError(
+                    error_in_log=f"Max usage quota reached for project {log_request.project_id}: {usage_quota.current_usage + nb_logs_to_process}/{usage_quota.max_usage} logs"
                 )
-                extra_logs_to_save.append(log_event_model)
-        except ValidationError as e:
-            logger.info(f"Skip logevent processing due to validation error: {e}")
-            logged_events.append(LogError(error_in_log=str(e)))
-        except HTTPException as e:
-            logger.info(f"Skip logevent processing due to validation error: {e}")
-            logged_events.append(LogError(error_in_log=str(e)))
-
-        except Exception as e:
-            logger.warning(f"Skip logevent processing due to unknown error: {e}")
-            logged_events.append(LogError(error_in_log=str(e)))
+            )
 
     log_reply = LogReply(logged_events=logged_events)
 
@@ -88,10 +75,19 @@ async def store_batch_of_log_events(
         project_id=log_request.project_id,
         org_id=org["org"].get("org_id"),
     )
-    background_tasks.add_task(
-        extractor_client.run_log_process_for_messages,
-        logs_to_process=logs_to_process,
-        extra_logs_to_save=extra_logs_to_save,
-    )
+    try:
+        await extractor_client.run_log_process_for_messages(
+            logs_to_process=logs_to_process,
+            extra_logs_to_save=extra_logs_to_save,
+            nb_reserved_usage=(
+                nb_logs_to_process if usage_quota.max_usage is not None else 0
+            ),
+            reservation_id=reservation_id,
+            raise_on_error=True,
+        )
+    except HTTPException:
+        # The logs won't be processed: give back their usage
+        await release_usage(usage_quota, reservation_id)
+        raise
 
     return log_reply
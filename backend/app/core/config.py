@@ -38,12 +38,37 @@ IS_MAINTENANCE = os.getenv("IS_MAINTENANCE", "false") == "true"
 
 ### USAGE LIMITS ###
 PLAN_HOBBY_MAX_NB_DETECTIONS = 10
+# The usage counters are reset to the true count of job_results at this interval
+QUOTA_RECONCILIATION_INTERVAL = 15 * 60  # in seconds
+# The usage reserved for a batch of logs not released after this delay (eg: the
+# workflow crashed) is dropped on reconciliation
+RESERVATION_TTL = 60 * 60  # in seconds
+# How long the org plan and metadata fetched from Propelauth are cached
+ORG_METADATA_CACHE_TTL = 60  # in seconds
 
 PLAN_HOBBY_MAX_USERS = 1
 PLAN_PRO_MAX_USERS = 15
 PLAN_SELFHOSTED_MAX_USERS = os.getenv("PLAN_SELFHOSTED_MAX_USERS", 100)
 
+# Max size of a decompressed request body sent with Content-Encoding: gzip
+MAX_DECOMPRESSED_BODY_SIZE = 50 * 1024 * 1024  # in bytes
+
 QUERY_MAX_LEN_LIMIT = 2000  # Limit the number of returned rows for a query to run_analytics_query() service
+# Answer run_analytics_query() from the rollups maintained by the extractor, when possible
+ANALYTICS_ROLLUPS_ENABLED = os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true") == "true"
+# Same as the extractor: the backfills that take longer are started again, and the
+# stale hours left behind are recomputed by the cron after this interval
+ROLLUP_BACKFILL_TIMEOUT = 2 * 60 * 60  # in seconds
+ROLLUP_UPDATE_INTERVAL = 60  # in seconds
+# Cache of the results of the analytics queries: "memory", "mongo" or "none"
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "memory")
+QUERY_CACHE_TTL = 10 * 60  # in seconds
+QUERY_CACHE_MAX_SIZE = 1_000  # Max number of entries of the "memory" backend
+# How long the data version of a project is cached: delay before a write is seen
+QUERY_CACHE_DATA_VERSION_TTL = 5  # in seconds
+QUERY_CACHE_STALE_WHILE_REVALIDATE = (
+    os.getenv("QUERY_CACHE_STALE_WHILE_REVALIDATE", "false") == "true"
+)
 
 ### DOCUMENTATION ##
 
@@ -55,6 +80,9 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ### PROPELAUTH ###
 PROPELAUTH_URL = os.getenv("PROPELAUTH_URL")
 PROPELAUTH_API_KEY = os.getenv("PROPELAUTH_API_KEY")
+# How long validated API keys and project owners are cached, in seconds
+API_KEY_CACHE_TTL = 60
+PROJECT_ORG_CACHE_TTL = 5 * 60
 if ENVIRONMENT == "test":
     PHOSPHO_ORG_ID = "3fe248a3-834c-4c26-8dcc-4e55112f702d"
 else:
@@ -197,3 +225,6 @@ except:
     )
     TEMPORAL_MTLS_TLS_CERT = None
     TEMPORAL_MTLS_TLS_KEY = None
+
+TEMPORAL_HOST_URL = os.getenv("TEMPORAL_HOST_URL")
+TEMPORAL_NAMESPACE = os.getenv("TEMPORAL_NAMESPACE", "default")
@@ -54,6 +54,15 @@ async def connect_and_init_db():
             mongo_db[MONGODB_NAME]["sessions"].create_index(
                 ["project_id", ("created_at", pymongo.DESCENDING)], background=True
             )
+            # Keyset pagination: the id breaks the ties of created_at
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                [
+                    "project_id",
+                    ("created_at", pymongo.DESCENDING),
+                    ("id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
 
             # Tasks
             mongo_db[MONGODB_NAME]["tasks"].create_index(
@@ -80,6 +89,24 @@ async def connect_and_init_db():
                 ["project_id", "test_id", ("created_at", pymongo.ASCENDING)],
                 background=True,
             )
+            # Keyset pagination: the id breaks the ties of created_at
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                [
+                    "project_id",
+                    "test_id",
+                    ("created_at", pymongo.DESCENDING),
+                    ("id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                [
+                    "project_id",
+                    ("created_at", pymongo.DESCENDING),
+                    ("id", pymongo.DESCENDING),
+                ],
+                background=True,
+            )
             mongo_db[MONGODB_NAME]["tasks"].create_index(
                 ["project_id", "flag"], background=True
             )
@@ -132,168 +159,20 @@ async def connect_and_init_db():
                 ["project_id", ("created_at", pymongo.DESCENDING)], background=True
             )
 
-            try:
-                # if the view exists, delete it
-                if (
-                    "sessions_with_events"
-                    in await mongo_db[MONGODB_NAME].list_collection_names()
-                ):
-                    await mongo_db[MONGODB_NAME]["sessions_with_events"].drop()
-                await mongo_db[MONGODB_NAME].command(
-                    {
-                        "create": "sessions_with_events",
-                        "viewOn": "sessions",
-                        "pipeline": [
-                            {
-                                "$lookup": {
-                                    "from": "events",
-                                    "localField": "id",
-                                    "foreignField": "session_id",
-                                    "as": "events",
-                                },
-                            },
-                            {
-                                "$addFields": {
-                                    "events": {
-                                        "$filter": {
-                                            "input": "$events",
-                                            "as": "event",
-                                            "cond": {"$ne": ["$$event.removed", True]},
-                                        }
-                                    }
-                                }
-                            },
-                            # Remove duplicates
-                            {
-                                "$set": {
-                                    "events": {
-                                        "$reduce": {
-                                            "input": "$events",
-                                            "initialValue": [],
-                                            "in": {
-                                                "$concatArrays": [
-                                                    "$$value",
-                                                    {
-                                                        "$cond": [
-                                                            {
-                                                                "$in": [
-                                                                    "$$this.event_definition.id",
-                                                                    "$$value.event_definition.id",
-                                                                ]
-                                                            },
-                                                            [],
-                                                            ["$$this"],
-                                                        ]
-                                                    },
-                                                ]
-                                            },
-                                        }
-                                    },
-                                }
-                            },
-                        ],
-                    }
-                )
-            except Exception:
-                logger.info("sessions_with_events already exists")
-            try:
-                if (
-                    "tasks_with_events"
-                    in await mongo_db[MONGODB_NAME].list_collection_names()
-                ):
-                    await mongo_db[MONGODB_NAME]["tasks_with_events"].drop()
-                await mongo_db[MONGODB_NAME].command(
-                    {
-                        "create": "tasks_with_events",
-                        "viewOn": "tasks",
-                        "pipeline": [
-                            {
-                                "$lookup": {
-                                    "from": "events",
-                                    "localField": "id",
-                                    "foreignField": "task_id",
-                                    "as": "events",
-                                },
-                            },
-                            {
-                                "$addFields": {
-                                    "events": {
-                                        "$filter": {
-                                            "input": "$events",
-                                            "as": "event",
-                                            "cond": {
-                                                "$and": [
-                                                    {
-                                                        "$ne": [
-                                                            "$$event.removed",
-                                                            True,
-                                                        ],
-                                                    },
-                                                    {
-                                                        "$or": [
-                                                            # The field is present in the event definition and the task
-                                                            {
-                                                                "$and": [
-                                                                    {
-                                                                        "$eq": [
-                                                                            "$$event.event_definition.is_last_task",
-                                                                            True,
-                                                                        ]
-                                                                    },
-                                                                    {
-                                                                        "$eq": [
-                                                                            "$is_last_task",
-                                                                            True,
-                                                                        ]
-                                                                    },
-                                                                ]
-                                                            },
-                                                            # the field is not present in the event definition
-                                                            {
-                                                                "$not": [
-                                                                    "$$event.event_definition.is_last_task",
-                                                                ]
-                                                            },
-                                                        ],
-                                                    },
-                                                ]
-                                            },
-                                        }
-                                    }
-                                }
-                            },
-                            {
-                                "$set": {
-                                    "events": {
-                                        "$reduce": {
-                                            "input": "$events",
-                                            "initialValue": [],
-                                            "in": {
-                                                "$concatArrays": [
-                                                    "$$value",
-                                                    {
-                                                        "$cond": [
-                                                            {
-                                                                "$in": [
-                                                                    "$$this.event_definition.id",
-                                                                    "$$value.event_definition.id",
-                                                                ]
-                                                            },
-                                                            [],
-                                                            ["$$this"],
-                                                        ]
-                                                    },
-                                                ]
-                                            },
-                                        }
-                                    },
-                                }
-                            },
-                        ],
-                    }
-                )
-            except Exception:
-                logger.info("tasks_with_events already exists")
+            # Events summary of the tasks and the sessions, to filter them by event.
+            # They replace the tasks_with_events and sessions_with_events views.
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                ["project_id", "events_summary.event_name"], background=True
+            )
+            mongo_db[MONGODB_NAME]["tasks"].create_index(
+                "events_summary.id", background=True
+            )
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                ["project_id", "events_summary.event_name"], background=True
+            )
+            mongo_db[MONGODB_NAME]["sessions"].create_index(
+                "events_summary.id", background=True
+            )
 
             # EventDefinitions
             mongo_db[MONGODB_NAME]["event_definitions"].create_index(
@@ -315,6 +194,32 @@ async def connect_and_init_db():
             mongo_db[MONGODB_NAME]["job_results"].create_index(
                 ["project_id", "job_metadata.id"], background=True
             )
+            mongo_db[MONGODB_NAME]["job_results"].create_index(
+                "org_id", background=True
+            )
+            mongo_db[MONGODB_NAME]["org_usage"].create_index(
+                "org_id", unique=True, background=True
+            )
+            # Analytics rollups, maintained by the extractor
+            mongo_db[MONGODB_NAME]["analytics_rollups"].create_index(
+                [
+                    "project_id",
+                    "collection",
+                    "granularity",
+                    "bucket_start",
+                    "dimension",
+                    "value",
+                ],
+                unique=True,
+                background=True,
+            )
+            mongo_db[MONGODB_NAME]["analytics_rollups_status"].create_index(
+                ["project_id", "collection"], unique=True, background=True
+            )
+            # Results of the analytics queries, when QUERY_CACHE_BACKEND is "mongo"
+            mongo_db[MONGODB_NAME]["query_cache"].create_index(
+                "expires_at", expireAfterSeconds=0, background=True
+            )
             # mongo_db[MONGODB_NAME]["recipes"].create_index(
             #     "id", unique=True, background=True
             # )
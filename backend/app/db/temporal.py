@@ -0,0 +1,112 @@
+"""
+Process-wide Temporal client.
+
+Connecting to Temporal (mTLS handshake + gRPC channel setup) is expensive, so
+the client is created once at startup and shared by every ExtractorClient.
+"""
+
+import asyncio
+from typing import Optional
+
+from loguru import logger
+from temporalio.client import Client, TLSConfig
+
+from app.core import config
+from app.temporal.pydantic_converter import pydantic_data_converter
+
+temporal_client: Optional[Client] = None
+_temporal_client_lock = asyncio.Lock()
+
+
+async def _connect() -> Client:
+    tls: "TLSConfig | bool" = False
+    if config.TEMPORAL_MTLS_TLS_CERT and config.TEMPORAL_MTLS_TLS_KEY:
+        tls = TLSConfig(
+            client_cert=config.TEMPORAL_MTLS_TLS_CERT,
+            client_private_key=config.TEMPORAL_MTLS_TLS_KEY,
+        )
+    return await Client.connect(
+        config.TEMPORAL_HOST_URL,
+        namespace=config.TEMPORAL_NAMESPACE,
+        tls=tls,
+        data_converter=pydantic_data_converter,
+    )
+
+
+async def get_temporal_client() -> Client:
+    """
+    Return the shared Temporal client. Connect lazily if it is not initialized
+    (startup failed or the client was reset after a connection error).
+    """
+    global temporal_client
+
+    if temporal_client is not None:
+        return temporal_client
+
+    async with _temporal_client_lock:
+        # Another coroutine may have connected while we were waiting
+        if temporal_client is None:
+            temporal_client = await _connect()
+            logger.info(
+                f"Connected to temporal (TEMPORAL_NAMESPACE={config.TEMPORAL_NAMESPACE})"
+            )
+    return temporal_client
+
+
+async def init_temporal() -> None:
+    """
+    Connect to Temporal at startup. Failures are logged and the connection is
+    retried on the first workflow submission.
+    """
+    if config.TEMPORAL_HOST_URL is None:
+        logger.warning("TEMPORAL_HOST_URL is None. Skipping temporal connection.")
+        return
+    try:
+        await get_temporal_client()
+    except Exception as e:
+        logger.error(f"Error while connecting to temporal: {e}")
+
+
+async def reset_temporal_client(client: Optional[Client] = None) -> None:
+    """
+    Drop the shared client so that the next call to get_temporal_client reconnects.
+
+    If `client` is passed, only reset if it's still the shared client. This avoids
+    dropping a fresh client created by a concurrent reconnection.
+    """
+    global temporal_client
+
+    async with _temporal_client_lock:
+        if client is None or client is temporal_client:
+            temporal_client = None
+            logger.warning("Temporal client reset, will reconnect on next call")
+
+
+async def check_health_temporal() -> bool:
+    """
+    Check if the Temporal server is reachable with the shared client
+    """
+    try:
+        client = await get_temporal_client()
+        is_healthy = await client.service_client.check_health()
+    except Exception as e:
+        logger.error(f"Temporal server is not reachable: {e}")
+        return False
+
+    if not is_healthy:
+        logger.error("Temporal server is not healthy")
+    return is_healthy
+
+
+async def close_temporal() -> None:
+    """
+    The temporalio client has no explicit close method: the underlying connection
+    is closed when the client is garbage collected.
+    """
+    global temporal_client
+
+    if temporal_client is None:
+        logger.info("Temporal is not initialized.")
+        return
+    temporal_client = None
+    logger.info("Temporal connection closed.")
@@ -8,8 +8,10 @@ from urllib.parse import urlparse
 import phospho
 from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db
+from app.db.temporal import check_health_temporal, close_temporal, init_temporal
 from app.services.mongo.ai_hub import check_health_ai_hub
 from app.services.integrations import check_health_argilla
+from phospho.lab.language_models import close_clients
 
 logging.info(f"ENVIRONMENT : {config.ENVIRONMENT}")
 
@@ -104,11 +106,15 @@ app.add_middleware(
 
 app.add_event_handler("startup", connect_and_init_db)
 app.add_event_handler("shutdown", close_mongo_db)
+app.add_event_handler("startup", init_temporal)
+app.add_event_handler("shutdown", close_temporal)
+app.add_event_handler("shutdown", close_clients)
 
 
 # Other services
 app.add_event_handler("startup", check_health_ai_hub)
 app.add_event_handler("startup", check_health_argilla)
+app.add_event_handler("startup", check_health_temporal)
 
 # TODO: Add a healthcheck for the Argilla service, error logged if not available
 
@@ -4,6 +4,9 @@ Handle all authentification related tasks.
 We now use Propelauth for authentification.
 """
 
+import asyncio
+import hashlib
+import time
 from typing import Optional
 
 from fastapi import Depends, HTTPException, Request
@@ -14,9 +17,16 @@ from propelauth_fastapi import User, init_auth
 
 from app.core import config
 from app.db.mongo import get_mongo_db
+from app.utils.cache import TTLCache
 
 propelauth = init_auth(config.PROPELAUTH_URL, config.PROPELAUTH_API_KEY)
 
+# Orgs of the validated API keys, keyed by the hash of the API key.
+# A revoked API key stays valid until its entry expires.
+api_key_cache = TTLCache(ttl=config.API_KEY_CACHE_TTL, max_size=10_000)
+# org_id owning each project_id
+project_org_cache = TTLCache(ttl=config.PROJECT_ORG_CACHE_TTL, max_size=100_000)
+
 
 bearer = HTTPBearer()
 
@@ -32,7 +42,53 @@ def is_org_in_alpha(org: dict) -> bool:
     return org_metadata.get("is_in_alpha", False)
 
 
-def authenticate_org_key(
+async def validate_org_api_key(api_key_token: str) -> dict:
+    """
+    Validate an org API key with Propelauth and return the org.
+    Valid API keys are cached. Raises an exception if the API key is invalid.
+    """
+    cache_key = hashlib.sha256(api_key_token.encode()).hexdigest()
+    org = api_key_cache.get(cache_key)
+    if org is not None:
+        return org
+
+    start_time = time.perf_counter()
+    # propelauth is synchronous: don't block the event loop
+    org = await asyncio.to_thread(propelauth.validate_org_api_key, api_key_token)
+    api_key_cache.record_load_time(time.perf_counter() - start_time)
+    api_key_cache.set(cache_key, org)
+    return org
+
+
+async def get_project_org_id(project_id: str) -> Optional[str]:
+    """
+    Get the org_id owning a project. Returns None if the project doesn't exist.
+    The result is cached: call invalidate_project_org_id if the project is deleted
+    or moved to another org.
+    """
+    org_id = project_org_cache.get(project_id)
+    if org_id is not None:
+        return org_id
+
+    start_time = time.perf_counter()
+    mongo_db = await get_mongo_db()
+    project_data = await mongo_db["projects"].find_one(
+        {"id": project_id}, {"org_id": 1}
+    )
+    project_org_cache.record_load_time(time.perf_counter() - start_time)
+    if not project_data:
+        return None
+    org_id = project_data.get("org_id")
+    if org_id is not None:
+        project_org_cache.set(project_id, org_id)
+    return org_id
+
+
+def invalidate_project_org_id(project_id: str) -> None:
+    project_org_cache.pop(project_id)
+
+
+async def authenticate_org_key(
     authorization: HTTPAuthorizationCredentials = Depends(bearer),
 ) -> dict:
     """
@@ -44,7 +100,7 @@ def authenticate_org_key(
     api_key_token = authorization.credentials
 
     try:
-        org = propelauth.validate_org_api_key(api_key_token)
+        org = await validate_org_api_key(api_key_token)
 
     except Exception as e:
         logger.debug(f"Caught Exception: {e}")
@@ -57,7 +113,7 @@ def authenticate_org_key(
     return org
 
 
-def authenticate_org_key_in_alpha(
+async def authenticate_org_key_in_alpha(
     authorization: HTTPAuthorizationCredentials = Depends(bearer),
 ) -> dict:
     """
@@ -68,7 +124,7 @@ def authenticate_org_key_in_alpha(
     api_key_token = authorization.credentials
 
     try:
-        org = propelauth.validate_org_api_key(api_key_token)
+        org = await validate_org_api_key(api_key_token)
 
         if not is_org_in_alpha(org):
             raise HTTPException(
@@ -87,7 +143,7 @@ def authenticate_org_key_in_alpha(
     return org
 
 
-def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
+async def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
     """
     API key authentification for orgs. Does NOT raise an exception if the token is invalid.
     """
@@ -97,7 +153,7 @@ def authenticate_org_key_no_exception(request: Request) -> Optional[dict]:
         scheme, credentials = get_authorization_scheme_param(authorization)
         if authorization is None or scheme.lower() != "bearer":
             return None
-        org = propelauth.validate_org_api_key(credentials)
+        org = await validate_org_api_key(credentials)
     except Exception as e:
         logger.debug(f"Caught Exception: {e}")
         return None
@@ -120,14 +176,12 @@ async def verify_propelauth_org_owns_project_id(org: dict, project_id: str) -> N
     if not org_id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    mongo_db = await get_mongo_db()
-    project_data = await mongo_db["projects"].find_one({"id": project_id})
-    if not project_data:
+    org_id_of_project = await get_project_org_id(project_id)
+    if org_id_of_project is None:
         raise HTTPException(
             status_code=404,
             detail=f"Project {project_id} not found",
         )
-    org_id_of_project = project_data.get("org_id")
 
     # Check that the org is the owner of the project
     if org_id != org_id_of_project:
@@ -1,6 +1,7 @@
 from app.db.mongo import get_mongo_db
-from app.security.authentification import propelauth
+from app.security.authentification import get_project_org_id
 from app.services.mongo.organizations import get_usage_quota
+from app.services.mongo.usage import fetch_org_metadata
 from fastapi import HTTPException
 from phospho.models import UsageQuota
 
@@ -8,18 +9,16 @@ from phospho.models import UsageQuota
 async def get_quota_for_org(
     org_id: str,
 ) -> UsageQuota:
-    org = propelauth.fetch_org(org_id)
-    if not org:
+    """
+    Get the quota of an org. The Stripe balance transaction is not fetched.
+    """
+    org_metadata = await fetch_org_metadata(org_id)
+    if org_metadata is None:
         raise HTTPException(
             status_code=404, detail=f"Organization {org_id} not found for quota"
         )
-    org_plan = "hobby"
-    org_metadata = org.get("metadata", None)
-    customer_id = None
-    if org_metadata:
-        org_plan = org_metadata.get("plan", "hobby")
-        customer_id = org_metadata.get("customer_id", None)
-    usage = await get_usage_quota(org_id=org_id, plan=org_plan, customer_id=customer_id)
+    org_plan = org_metadata.get("plan", "hobby")
+    usage = await get_usage_quota(org_id=org_id, plan=org_plan)
     return usage
 
 
@@ -27,13 +26,11 @@ async def get_quota(project_id: str) -> UsageQuota:
     """
     Get the quota of a project
     """
-    mongo_db = await get_mongo_db()
-    project = await mongo_db["projects"].find_one({"id": project_id})
-    if not project:
+    org_id = await get_project_org_id(project_id)
+    if org_id is None:
         raise HTTPException(
             status_code=404, detail=f"Project {project_id} not found for quota"
         )
-    org_id = project["org_id"]
     return await get_quota_for_org(org_id)
 
 
@@ -49,18 +46,12 @@ async def authorize_main_pipeline(project_id: str) -> bool:
         raise ValueError(f"Project {project_id} not found for authorization")
     # Get the organization plan from the propelauth metadata
     org_id = project["org_id"]
-    org = propelauth.fetch_org(org_id)
-    if not org:
+    org_metadata = await fetch_org_metadata(org_id)
+    if org_metadata is None:
         raise ValueError(f"Organization {org_id} not found for authorization")
 
-    # Default org_plan: org_plan = "hobby"
-    org_plan = "hobby"
-
-    # Get the org plan
-    org_metadata = org.get("metadata", None)
-
-    if org_metadata:
-        org_plan = org_metadata.get("plan", "hobby")
+    # Get the org plan. Default org_plan: org_plan = "hobby"
+    org_plan = org_metadata.get("plan", "hobby")
 
     # Get the usage quota
     usage = await get_usage_quota(org_id, org_plan)
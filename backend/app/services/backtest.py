@@ -65,7 +65,6 @@ async def run_backtests(
 ) -> None:
     # Provider verification has been done in the API endpoint
     provider, model = phospho.lab.get_provider_and_model(provider_and_model)
-    client = phospho.lab.get_async_client(provider, api_key=openai_api_key)
 
     all_messages = BacktestLoader(project_id=project_id, filters=filters)
 
@@ -76,6 +75,8 @@ async def run_backtests(
 
     async def run_model(message: phospho.lab.Message) -> Optional[str]:
         system_prompt = system_prompt_template.format(**system_prompt_variables)
+        # The workload runs in its own event loop: get the client of this loop
+        client = phospho.lab.get_async_client(provider, api_key=openai_api_key)
         response = await client.chat.completions.create(
             model=model,
             messages=[
@@ -7,6 +7,8 @@ from app.services.mongo.events import (
     get_last_event_for_task,
     remove_event,
 )
+from app.services.mongo.events_summary import refresh_events_summary
+from app.services.mongo.project_version import mark_data_changed
 import argilla as rg
 import pandas as pd
 from app.api.platform.models.integrations import (
@@ -475,6 +477,10 @@ async def pull_dataset_from_argilla(
                 )
                 event_model = Event.model_validate(tagger)
                 await mongo_db["events"].insert_one(tagger.model_dump())
+                await refresh_events_summary(tasks_ids=[task_id])
+                await mark_data_changed(
+                    pull_request.project_id, "events", [tagger.created_at]
+                )
             else:
                 event_model = Event.model_validate(last_event_in_db)
 
@@ -516,6 +522,10 @@ async def pull_dataset_from_argilla(
                 )
                 event_model = Event.model_validate(new_event)
                 await mongo_db["events"].insert_one(new_event.model_dump())
+                await refresh_events_summary(tasks_ids=[task_id])
+                await mark_data_changed(
+                    pull_request.project_id, "events", [new_event.created_at]
+                )
             else:
                 event_model = Event.model_validate(last_event_in_db)
 
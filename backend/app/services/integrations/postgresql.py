@@ -4,7 +4,7 @@ import pandas as pd
 from app.api.platform.models import Pagination
 from app.core import config
 from app.db.mongo import get_mongo_db
-from app.services.mongo.explore import fetch_flattened_tasks
+from app.services.mongo.explore import fetch_flattened_tasks_page
 from app.services.mongo.tasks import get_total_nb_of_tasks
 from app.utils import generate_uuid, slugify_string
 from fastapi import HTTPException
@@ -256,17 +256,21 @@ class PostgresqlIntegration:
                 )
                 nb_batches = total_nb_tasks // batch_size
                 columns = None
-                for i in range(nb_batches + 1):
+                # Walk the tasks with a cursor, so that every batch costs the same
+                pagination = Pagination(page=0, per_page=batch_size)
+                i = 0
+                while True:
                     logger.debug(
                         f"Exporting batch {i}/{nb_batches} ({batch_size} tasks)"
                     )
-                    flattened_tasks = await fetch_flattened_tasks(
+                    flattened_tasks, cursor = await fetch_flattened_tasks_page(
                         project_id=self.project_id,
-                        limit=batch_size,
                         with_events=True,
                         with_sessions=True,
-                        pagination=Pagination(page=i, per_page=batch_size),
+                        pagination=pagination,
                     )
+                    if not flattened_tasks:
+                        break
                     # Convert the list of FlattenedTask to a pandas dataframe
                     tasks_df = pd.DataFrame(
                         [task.model_dump() for task in flattened_tasks]
@@ -290,6 +294,10 @@ class PostgresqlIntegration:
                         index=False,
                     )
                     logger.debug("Batch uploaded to Postgres")
+                    if cursor is None:
+                        break
+                    pagination = Pagination(per_page=batch_size, cursor=cursor)
+                    i += 1
 
                 connection.close()
 
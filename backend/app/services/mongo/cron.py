@@ -1,3 +1,4 @@
+from app.core import config
 from app.db.mongo import get_mongo_db
 from app.security.authorization import get_quota
 from app.services.integrations.postgresql import (
@@ -6,6 +7,9 @@ from app.services.integrations.postgresql import (
 )
 from app.services.mongo.extractor import ExtractorClient
 from app.services.mongo.projects import get_project_by_id
+from app.services.mongo.rollups import ROLLUPS_STATUS_COLLECTION
+from app.utils import generate_timestamp
+from fastapi import HTTPException
 from loguru import logger
 
 
@@ -79,3 +83,63 @@ async def run_postgresql_sync_pipeline():
                 f"Error running postgresql sync pipeline {integration.get('org_id')}: {e}"
             )
     return {"status": "ok"}
+
+
+async def run_rollups_refresh_pipeline():
+    """
+    Start the jobs that backfill the analytics rollups that are not ready, and that
+    recompute the stale hours left behind by the extractor
+    """
+    logger.debug("Running rollups refresh pipeline")
+    if not config.ANALYTICS_ROLLUPS_ENABLED:
+        return {"status": "ok"}
+    mongo_db = await get_mongo_db()
+    now = generate_timestamp()
+    statuses = (
+        await mongo_db[ROLLUPS_STATUS_COLLECTION]
+        .find(
+            {
+                "$or": [
+                    # Not backfilled, and no backfill job running
+                    {
+                        "ready": {"$ne": True},
+                        "backfill_started_at": {
+                            "$not": {"$gte": now - config.ROLLUP_BACKFILL_TIMEOUT}
+                        },
+                    },
+                    # Stale hours not recomputed by the extractor
+                    {
+                        "ready": True,
+                        "stale_hours.0": {"$exists": True},
+                        "updated_at": {
+                            "$not": {"$gte": now - config.ROLLUP_UPDATE_INTERVAL}
+                        },
+                    },
+                ]
+            }
+        )
+        .to_list(length=None)
+    )
+    for status in statuses:
+        if not status.get("ready"):
+            # Claim the backfill, so that it isn't started twice
+            claimed = await mongo_db[ROLLUPS_STATUS_COLLECTION].update_one(
+                {
+                    "_id": status["_id"],
+                    "backfill_started_at": status.get("backfill_started_at"),
+                },
+                {"$set": {"backfill_started_at": now}},
+            )
+            if claimed.modified_count == 0:
+                continue
+        project_id = status["project_id"]
+        try:
+            project = await get_project_by_id(project_id)
+            extractor_client = ExtractorClient(
+                org_id=project.org_id, project_id=project_id
+            )
+            await extractor_client.refresh_rollups(collection=status["collection"])
+        except HTTPException as e:
+            logger.error(f"Error refreshing the rollups of project {project_id}: {e}")
+
+    return {"status": "ok"}
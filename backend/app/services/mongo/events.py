@@ -2,6 +2,11 @@ from typing import Dict, List, Optional
 
 from app.db.models import EventDefinition
 from app.db.mongo import get_mongo_db
+from app.services.mongo.events_summary import refresh_events_summary
+from app.services.mongo.project_version import (
+    increment_project_version,
+    mark_data_changed,
+)
 from app.utils import cast_datetime_or_timestamp_to_timestamp
 from fastapi import HTTPException
 from loguru import logger
@@ -70,16 +75,15 @@ async def get_event_from_name_and_project_id(
     return validated_event
 
 
-async def get_all_events(
+def event_filtering_pipeline_match(
     project_id: str,
-    limit: Optional[int] = None,
     filters: Optional[ProjectDataFilters] = None,
     include_removed: bool = False,
-    unique: bool = False,
-) -> List[Event]:
-    mongo_db = await get_mongo_db()
+) -> Dict[str, object]:
+    """
+    Builds the $match stage of the events of a project.
+    """
     additional_event_filters: Dict[str, object] = {}
-    pipeline: List[Dict[str, object]] = []
     if filters is not None:
         if filters.event_name is not None:
             if isinstance(filters.event_name, str):
@@ -98,14 +102,24 @@ async def get_all_events(
     if not include_removed:
         additional_event_filters["removed"] = {"$ne": True}
 
-    pipeline.append(
+    return {"project_id": project_id, **additional_event_filters}
+
+
+async def get_all_events(
+    project_id: str,
+    limit: Optional[int] = None,
+    filters: Optional[ProjectDataFilters] = None,
+    include_removed: bool = False,
+    unique: bool = False,
+) -> List[Event]:
+    mongo_db = await get_mongo_db()
+    pipeline: List[Dict[str, object]] = [
         {
-            "$match": {
-                "project_id": project_id,
-                **additional_event_filters,
-            }
+            "$match": event_filtering_pipeline_match(
+                project_id=project_id, filters=filters, include_removed=include_removed
+            )
         }
-    )
+    ]
 
     if unique:
         # Deduplicate the events based on event name
@@ -149,6 +163,8 @@ async def confirm_event(
         {"project_id": project_id, "id": event_id},
         {"$set": {"confirmed": True}},
     )
+    await increment_project_version(project_id)
+    await mark_data_changed(project_id, "events", [event_model.created_at])
 
     event_model.confirmed = True
 
@@ -174,6 +190,11 @@ async def remove_event(
         {"project_id": project_id, "id": event_id},
         {"$set": {"removed": True}},
     )
+    await refresh_events_summary(
+        tasks_ids=[event_model.task_id], sessions_ids=[event_model.session_id]
+    )
+    await increment_project_version(project_id)
+    await mark_data_changed(project_id, "events", [event_model.created_at])
 
     event_model.removed = True
 
@@ -205,6 +226,8 @@ async def change_label_event(
             }
         },
     )
+    await increment_project_version(project_id)
+    await mark_data_changed(project_id, "events", [event_model.created_at])
 
     event_model.score_range.corrected_label = new_label
     event_model.confirmed = True
@@ -237,6 +260,8 @@ async def change_value_event(
             }
         },
     )
+    await increment_project_version(project_id)
+    await mark_data_changed(project_id, "events", [event_model.created_at])
 
     event_model.score_range.corrected_value = new_value
     event_model.confirmed = True
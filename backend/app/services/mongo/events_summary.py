@@ -0,0 +1,222 @@
+"""
+Summary of the events of the tasks and of the sessions.
+
+The `events_summary` field of a task or a session lists its events that are not
+removed, one per event definition:
+[{"id": ..., "event_name": ..., "event_definition_id": ..., "is_last_task": ...}]
+
+It's indexed, so that filtering tasks and sessions by event is a match instead of a
+lookup in the events collection. The events of a task whose definition has
+`is_last_task` only apply if the task is the last of its session: this is checked at
+read time, since the last task of a session changes.
+
+Call refresh_events_summary after adding, removing or restoring events. The full
+events are fetched for the returned documents only, with attach_events.
+"""
+
+from typing import Dict, Iterable, List, Literal, Optional
+
+from pymongo import UpdateOne
+
+from app.db.mongo import get_mongo_db
+
+EVENTS_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "task_id": 1,
+    "session_id": 1,
+    "event_name": 1,
+    "event_definition.id": 1,
+    "event_definition.is_last_task": 1,
+    "created_at": 1,
+}
+
+
+def summarize_events(events: List[dict]) -> List[dict]:
+    """
+    Summary of the events of a task or a session: the first event of each event
+    definition, ignoring the removed events
+    """
+    summary: List[dict] = []
+    definitions_ids = set()
+    for event in sorted(events, key=lambda event: event.get("created_at") or 0):
+        if event.get("removed"):
+            continue
+        event_definition = event.get("event_definition") or {}
+        # Old events don't have a definition: deduplicate them by name
+        definition_id = event_definition.get("id") or event["event_name"]
+        if definition_id in definitions_ids:
+            continue
+        definitions_ids.add(definition_id)
+        summary.append(
+            {
+                "id": event["id"],
+                "event_name": event["event_name"],
+                "event_definition_id": event_definition.get("id"),
+                "is_last_task": event_definition.get("is_last_task") is True,
+            }
+        )
+    return summary
+
+
+def is_active_in_task(event_summary: dict, task: dict) -> bool:
+    return not event_summary.get("is_last_task") or task.get("is_last_task") is True
+
+
+def task_events_summary_expression(prefix: str = "") -> Dict[str, object]:
+    """
+    Aggregation expression of the events of the summary that apply to the task
+    """
+    return {
+        "$filter": {
+            "input": {"$ifNull": [f"${prefix}events_summary", []]},
+            "as": "event",
+            "cond": {
+                "$or": [
+                    {"$ne": ["$$event.is_last_task", True]},
+                    {"$eq": [f"${prefix}is_last_task", True]},
+                ]
+            },
+        }
+    }
+
+
+def events_summary_match(
+    field: Literal["event_name", "id"],
+    values: List[str],
+    prefix: str = "",
+    collection: Literal["tasks", "sessions"] = "tasks",
+) -> Dict[str, object]:
+    """
+    Match the tasks or the sessions with one of these events (by name or by id)
+    """
+    if collection == "sessions":
+        return {f"{prefix}events_summary.{field}": {"$in": values}}
+    return {
+        "$or": [
+            {
+                f"{prefix}events_summary": {
+                    "$elemMatch": {field: {"$in": values}, "is_last_task": False}
+                }
+            },
+            {
+                f"{prefix}is_last_task": True,
+                f"{prefix}events_summary.{field}": {"$in": values},
+            },
+        ]
+    }
+
+
+async def _refresh(
+    collection: Literal["tasks", "sessions"],
+    key: Literal["task_id", "session_id"],
+    ids: List[str],
+) -> None:
+    if not ids:
+        return
+    mongo_db = await get_mongo_db()
+    events = (
+        await mongo_db["events"]
+        .find(
+            {key: {"$in": ids}, "removed": {"$ne": True}},
+            EVENTS_SUMMARY_PROJECTION,
+        )
+        .to_list(length=None)
+    )
+    events_per_id: Dict[str, List[dict]] = {id: [] for id in ids}
+    for event in events:
+        events_per_id[event[key]].append(event)
+    await mongo_db[collection].bulk_write(
+        [
+            UpdateOne({"id": id}, {"$set": {"events_summary": summarize_events(evs)}})
+            for id, evs in events_per_id.items()
+        ],
+        ordered=False,
+    )
+
+
+async def refresh_events_summary(
+    tasks_ids: Optional[Iterable[Optional[str]]] = None,
+    sessions_ids: Optional[Iterable[Optional[str]]] = None,
+) -> None:
+    """
+    Recompute the events summary of these tasks and sessions from the events collection
+    """
+    await _refresh("tasks", "task_id", list({id for id in tasks_ids or [] if id}))
+    await _refresh(
+        "sessions", "session_id", list({id for id in sessions_ids or [] if id})
+    )
+
+
+async def refresh_events_summary_of_events(events_filter: Dict[str, object]) -> None:
+    """
+    Recompute the events summary of the tasks and the sessions of the events matching
+    the filter, after updating them
+    """
+    mongo_db = await get_mongo_db()
+    events = (
+        await mongo_db["events"]
+        .find(events_filter, {"_id": 0, "task_id": 1, "session_id": 1})
+        .to_list(length=None)
+    )
+    await refresh_events_summary(
+        tasks_ids=[event.get("task_id") for event in events],
+        sessions_ids=[event.get("session_id") for event in events],
+    )
+
+
+async def attach_events(
+    documents: List[dict], collection: Literal["tasks", "sessions"]
+) -> None:
+    """
+    Set the `events` of the tasks or the sessions, from their events summary
+    """
+    if not documents:
+        return
+    summaries: Dict[str, List[dict]] = {}
+    missing_ids = []
+    for document in documents:
+        if document.get("events_summary") is None:
+            # Not backfilled yet
+            missing_ids.append(document["id"])
+        else:
+            summaries[document["id"]] = document["events_summary"]
+
+    mongo_db = await get_mongo_db()
+    if missing_ids:
+        key = "task_id" if collection == "tasks" else "session_id"
+        events = (
+            await mongo_db["events"]
+            .find(
+                {key: {"$in": missing_ids}, "removed": {"$ne": True}},
+                EVENTS_SUMMARY_PROJECTION,
+            )
+            .to_list(length=None)
+        )
+        missing_events: Dict[str, List[dict]] = {id: [] for id in missing_ids}
+        for event in events:
+            missing_events[event[key]].append(event)
+        for id, document_events in missing_events.items():
+            summaries[id] = summarize_events(document_events)
+
+    for document in documents:
+        summary = summaries[document["id"]]
+        if collection == "tasks":
+            summary = [event for event in summary if is_active_in_task(event, document)]
+        document["events_summary"] = summary
+
+    events_ids = [
+        event["id"] for document in documents for event in document["events_summary"]
+    ]
+    events = (
+        await mongo_db["events"]
+        .find({"id": {"$in": events_ids}}, {"_id": 0})
+        .to_list(length=None)
+    )
+    events_per_id = {event["id"]: event for event in events}
+    for document in documents:
+        document["events"] = [
+            events_per_id[event["id"]]
+            for event in document.pop("events_summary")
+            if event["id"] in events_per_id
+        ]
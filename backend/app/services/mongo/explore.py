@@ -22,8 +22,10 @@ import pydantic
 from app.api.platform.models import ABTest, ProjectDataFilters
 from app.db.models import AnalyticsQuery, Eval, FlattenedTask
 from app.db.mongo import get_mongo_db
-from app.services.mongo.events import get_all_events
-from app.services.mongo.tasks import get_all_tasks
+from app.services.mongo.events import event_filtering_pipeline_match
+from app.services.mongo.pagination import next_cursor, pagination_stages
+from app.services.mongo.project_version import mark_data_changed
+from app.services.mongo.rollups import get_created_at, run_analytics_query_on_rollups
 from app.services.mongo.tasks import (
     get_total_nb_of_tasks,
     task_filtering_pipeline_match,
@@ -89,6 +91,98 @@ async def project_has_enough_labelled_tasks(project_id: str, enough: int = 1) ->
     return len(doc)
 
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def time_bucket(bucket_size: int, field: str = "$created_at") -> Dict[str, object]:
+    """
+    Mongo expression of the start of the time bucket of a timestamp (in seconds, UTC)
+    eg: with bucket_size=SECONDS_PER_DAY, the timestamp of the start of the day
+    """
+    return {"$subtract": [field, {"$mod": [field, bucket_size]}]}
+
+
+async def aggregate_per_day(
+    collection: str,
+    main_filter: Dict[str, object],
+    accumulators: Dict[str, object],
+) -> List[dict]:
+    """
+    Group the documents matching the filter by day of creation. Only the aggregated
+    points are returned: {"date": start of the day, "first_created_at", **accumulators}
+    """
+    mongo_db = await get_mongo_db()
+    pipeline: List[Dict[str, object]] = [
+        {"$match": main_filter},
+        {
+            "$group": {
+                "_id": time_bucket(SECONDS_PER_DAY),
+                "first_created_at": {"$min": "$created_at"},
+                **accumulators,
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "date": "$_id",
+                "first_created_at": 1,
+                **{name: 1 for name in accumulators.keys()},
+            }
+        },
+    ]
+    return await mongo_db[collection].aggregate(pipeline).to_list(length=None)
+
+
+def fill_missing_days(
+    points: List[dict],
+    filters: ProjectDataFilters,
+    columns: List[str],
+) -> List[dict]:
+    """
+    Add the days without documents to the points of aggregate_per_day, with 0 as value.
+
+    The days range from filters.created_at_start (or the first document if None) to
+    filters.created_at_end (or now if None).
+    """
+    df = pd.DataFrame(points)
+    if not df.empty:
+        # Documents without created_at are not in any day
+        df = df.dropna(subset=["date"])
+
+    if not df.empty:
+        # If start and end date are not provided, we take the first and last task date
+        if filters.created_at_start is None:
+            filters.created_at_start = df["first_created_at"].min()
+    else:
+        if filters.created_at_start is None:
+            filters.created_at_start = datetime.datetime.now().timestamp()
+
+    if filters.created_at_end is None:
+        filters.created_at_end = datetime.datetime.now().timestamp()
+
+    complete_date_range = pd.date_range(
+        datetime.datetime.fromtimestamp(
+            filters.created_at_start, datetime.timezone.utc
+        ),
+        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
+        freq="D",
+    )
+    complete_df = pd.DataFrame({"date": complete_date_range})
+    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
+
+    if not df.empty:
+        df["date"] = pd.to_datetime(df["date"], unit="s", utc=True).dt.date
+        # Add missing days
+        df = pd.merge(complete_df, df[["date", *columns]], on="date", how="left")
+        df = df.fillna(0)
+    else:
+        df = complete_df
+        for column in columns:
+            df[column] = 0
+
+    return df[["date", *columns]].to_dict(orient="records")
+
+
 async def deprecated_get_dashboard_aggregated_metrics(
     project_id: str,
     index: List[Literal["days", "minutes"]],
@@ -137,37 +231,63 @@ async def deprecated_get_dashboard_aggregated_metrics(
                 metadata=None,
             )
 
-    # Fetch the data
+    # Count the documents per time bucket and column values in Mongo
     if count_of == "tasks":
         if filters is None:
             filters = ProjectDataFilters()
         if isinstance(filters.event_name, str):
             filters.event_name = [filters.event_name]
-        tasks = await get_all_tasks(project_id=project_id, limit=limit, filters=filters)
-        df = pd.DataFrame([task.model_dump() for task in tasks])
+        main_filter, collection = await task_filtering_pipeline_match(
+            project_id=project_id, filters=filters
+        )
+        main_filter["test_id"] = None
     if count_of == "events":
-        events = await get_all_events(
-            project_id=project_id,
-            limit=limit,
-            filters=filters,
+        main_filter = event_filtering_pipeline_match(
+            project_id=project_id, filters=filters
         )
-        df = pd.DataFrame([event.model_dump() for event in events])
+        collection = "events"
+
+    pipeline: List[Dict[str, object]] = [{"$match": main_filter}]
+    if limit is not None:
+        # Only count the most recent documents
+        pipeline.extend([{"$sort": {"created_at": -1}}, {"$limit": limit}])
+    bucket_sizes = {"days": SECONDS_PER_DAY, "minutes": 60}
+    pipeline.extend(
+        [
+            # Like pivot_table, the documents without a value in a column are ignored
+            {"$match": {column: {"$ne": None} for column in columns}},
+            {
+                "$group": {
+                    "_id": {
+                        **{
+                            time_index: time_bucket(bucket_sizes[time_index])
+                            for time_index in index
+                        },
+                        **{column: f"${column}" for column in columns},
+                    },
+                    # Named "id" to keep the output of the former pivot on "id"
+                    "id": {"$sum": 1},
+                }
+            },
+        ]
+    )
+    mongo_db = await get_mongo_db()
+    result = await mongo_db[collection].aggregate(pipeline).to_list(length=None)
+    df = pd.DataFrame([{**point["_id"], "id": point["id"]} for point in result])
 
     if not df.empty:
-        # Convert the created_at column to datetime, assuming timestamp stored in UTC
-        df["created_at"] = pd.to_datetime(df["created_at"], unit="s", utc=True)
-        if index:
-            if "days" in index:
-                df["days"] = df["created_at"].dt.date
-            if "minutes" in index:
-                df["minutes"] = df["created_at"].dt.floor("min")
-
-        # Aggregate
+        # Convert the time buckets to datetime, assuming timestamp stored in UTC
+        if "days" in index:
+            df["days"] = pd.to_datetime(df["days"], unit="s", utc=True).dt.date
+        if "minutes" in index:
+            df["minutes"] = pd.to_datetime(df["minutes"], unit="s", utc=True)
+
+        # Pivot the aggregated points
         df = df.pivot_table(
             values="id",
             index=index,
             columns=columns,
-            aggfunc="count",
+            aggfunc="sum",
         ).reset_index()
 
     # For the last 7 days, fill the missing days with 0
@@ -515,38 +635,10 @@ def generate_date_range(
     return date_list
 
 
-async def run_analytics_query(
-    query: AnalyticsQuery, fill_missing_dates: bool = False
-) -> List[dict]:
+async def _run_analytics_query_on_raw_data(query: AnalyticsQuery) -> List[dict]:
     """
-    Function to run complex analytics queries, returned as a list of dictionaries.
-    For instance, it should be used for the frontend dataviz.
-    TODO: try to use it as much as possible in more specific functions below.
-
-    The `AnalyticsQuery` model defines the expected input:
-    - project_id: The project id
-    - collection: The collection to aggregate (e.g., tasks, sessions, events, clusters)
-    - aggregation_operation: The type of aggregation to perform ("count", "sum", "avg", "min", "max")
-    - aggregation_field: The field to aggregate on. Not required for count. Can be `metadata.{field_name}` for metadata fields or any nested field.
-    - dimensions: The dimensions to group by (e.g., flag, metadata.model, ...). Can be `month`, `day`, `hour`, or`minute`, which will be computed from the created_at field. Can be `metadata.{field_name}` for metadata fields or any nested field.
-    - filters: Optional filters to apply, passed in MongoDB query format if need be (e.g., {"created_at": {"$gte": 1723218277}})
-    - sort: Optional sorting criteria (e.g., {"date": 1} for ascending, {"date": -1} for descending)
-    - limit: Optional limit on the number of results to return
-
-    fill_missing_dates: If True, fill missing dates between start and end with 0. Default is False.
-
-    In dimensions, the following special values are supported:
-    - "minute": the minute part of the created_at field, "YYYY-MM-DD HH:mm"
-    - hour": the hour part of the created_at field, "YYYY-MM-DD HH"
-    - "day": the date part of the created_at field, "YYYY-MM-DD"
-    - "month": the month part of the created_at field, "YYYY-MM"
-    They will be generated from the created_at field in a new field with the same name.
-
-    If the query is not valid, mongo will raise an hunhandled error.
-
-    Returns a list of dictionaries.
+    Run the analytics query with an aggregation pipeline on the raw collection.
     """
-
     mongo_db = await get_mongo_db()
 
     # Let's build the pipeline
@@ -682,10 +774,52 @@ async def run_analytics_query(
         pipeline.append({"$sort": query.sort})
 
     # Run the query
-    result = (
+    return (
         await mongo_db[query.collection].aggregate(pipeline).to_list(length=query.limit)
     )
 
+
+async def run_analytics_query(
+    query: AnalyticsQuery, fill_missing_dates: bool = False
+) -> List[dict]:
+    """
+    Function to run complex analytics queries, returned as a list of dictionaries.
+    For instance, it should be used for the frontend dataviz.
+    TODO: try to use it as much as possible in more specific functions below.
+
+    The `AnalyticsQuery` model defines the expected input:
+    - project_id: The project id
+    - collection: The collection to aggregate (e.g., tasks, sessions, events, clusters)
+    - aggregation_operation: The type of aggregation to perform ("count", "sum", "avg", "min", "max")
+    - aggregation_field: The field to aggregate on. Not required for count. Can be `metadata.{field_name}` for metadata fields or any nested field.
+    - dimensions: The dimensions to group by (e.g., flag, metadata.model, ...). Can be `month`, `day`, `hour`, or`minute`, which will be computed from the created_at field. Can be `metadata.{field_name}` for metadata fields or any nested field.
+    - filters: Optional filters to apply, passed in MongoDB query format if need be (e.g., {"created_at": {"$gte": 1723218277}})
+    - sort: Optional sorting criteria (e.g., {"date": 1} for ascending, {"date": -1} for descending)
+    - limit: Optional limit on the number of results to return
+
+    fill_missing_dates: If True, fill missing dates between start and end with 0. Default is False.
+
+    In dimensions, the following special values are supported:
+    - "minute": the minute part of the created_at field, "YYYY-MM-DD HH:mm"
+    - hour": the hour part of the created_at field, "YYYY-MM-DD HH"
+    - "day": the date part of the created_at field, "YYYY-MM-DD"
+    - "month": the month part of the created_at field, "YYYY-MM"
+    They will be generated from the created_at field in a new field with the same name.
+
+    When possible, the query is answered from the hourly and daily rollups maintained by
+    the extractor (see rollups.py), with the same result as a scan of the collection.
+
+    If the query is not valid, mongo will raise an hunhandled error.
+
+    Returns a list of dictionaries.
+    """
+
+    result = None
+    if config.ANALYTICS_ROLLUPS_ENABLED:
+        result = await run_analytics_query_on_rollups(query)
+    if result is None:
+        result = await _run_analytics_query_on_raw_data(query)
+
     # Fill missing dates with 0
     if fill_missing_dates:
         # we select the smallest time dimension for the date range
@@ -756,50 +890,16 @@ async def get_nb_of_daily_tasks(
     """
     Get the number of daily tasks of a project.
     """
-    tasks = await get_all_tasks(project_id=project_id, limit=None, filters=filters)
-    df = pd.DataFrame([task.model_dump() for task in tasks])
-
-    if not df.empty:
-        # If start and end date are not provided, we take the first and last task date
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
-
-    if filters.created_at_end is None:
-        filters.created_at_end = datetime.datetime.now().timestamp()
-
-    complete_date_range = pd.date_range(
-        datetime.datetime.fromtimestamp(
-            filters.created_at_start, datetime.timezone.utc
-        ),
-        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
-        freq="D",
+    main_filter, collection = await task_filtering_pipeline_match(
+        project_id=project_id, filters=filters
     )
-    complete_df = pd.DataFrame({"date": complete_date_range})
-
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        nb_tasks_per_day = (
-            df.groupby(["date"])
-            .count()
-            .reset_index()[["date", "id"]]
-            .rename(columns={"id": "nb_tasks"})
-        )
-
-        # Add missing days
-
-        complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
-        nb_tasks_per_day = pd.merge(
-            complete_df, nb_tasks_per_day, on="date", how="left"
-        ).fillna(0)
-    else:
-        nb_tasks_per_day = complete_df
-        nb_tasks_per_day["nb_tasks"] = 0
-
-    return nb_tasks_per_day[["date", "nb_tasks"]].to_dict(orient="records")
+    main_filter["test_id"] = None
+    nb_tasks_per_day = await aggregate_per_day(
+        collection=collection,
+        main_filter=main_filter,
+        accumulators={"nb_tasks": {"$sum": 1}},
+    )
+    return fill_missing_days(nb_tasks_per_day, filters=filters, columns=["nb_tasks"])
 
 
 async def get_top_taggers_names_and_count(
@@ -879,69 +979,19 @@ async def get_daily_success_rate(
     """
     Get the daily success rate of a project.
     """
-    mongo_db = await get_mongo_db()
-
     main_filter, collection = await task_filtering_pipeline_match(
         project_id=project_id, filters=filters
     )
-    # Add the success rate computation
-    pipeline = [
-        {"$match": main_filter},
-        {"$addFields": {"is_success": {"$eq": ["$flag", "success"]}}},
-        {
-            "$project": {
-                "_id": 0,
-                "created_at": 1,
-                "is_success": 1,
-            }
+    daily_success_rate = await aggregate_per_day(
+        collection=collection,
+        main_filter=main_filter,
+        accumulators={
+            "success_rate": {"$avg": {"$cond": [{"$eq": ["$flag", "success"]}, 1, 0]}}
         },
-        {"$sort": {"date": 1}},
-    ]
-    result = await mongo_db[collection].aggregate(pipeline).to_list(length=None)
-
-    df = pd.DataFrame(result)
-
-    # If start and end date are not provided, we take the first and last task date
-    if not df.empty:
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
-
-    if filters.created_at_end is None:
-        filters.created_at_end = datetime.datetime.now().timestamp()
-
-    complete_date_range = pd.date_range(
-        datetime.datetime.fromtimestamp(
-            filters.created_at_start, datetime.timezone.utc
-        ),
-        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
-        freq="D",
     )
-    complete_df = pd.DataFrame({"date": complete_date_range})
-    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
-
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        daily_success_rate = (
-            df.groupby(["date"])[["is_success"]]
-            .mean()
-            .reset_index()[["date", "is_success"]]
-            .rename(columns={"is_success": "success_rate"})
-        )
-
-        # Add missing days
-
-        daily_success_rate = pd.merge(
-            complete_df, daily_success_rate, on="date", how="left"
-        ).fillna(0)
-    else:
-        daily_success_rate = complete_df
-        daily_success_rate["success_rate"] = 0
-
-    return daily_success_rate[["date", "success_rate"]].to_dict(orient="records")
+    return fill_missing_days(
+        daily_success_rate, filters=filters, columns=["success_rate"]
+    )
 
 
 async def get_tasks_aggregated_metrics(
@@ -1223,69 +1273,17 @@ async def get_nb_sessions_per_day(
     """
     Get the nb of sessions per day of a project.
     """
-    mongo_db = await get_mongo_db()
-
     global_filter, collection_name = await session_filtering_pipeline_match(
         project_id=project_id, filters=filters
     )
-
-    pipeline: List[Dict[str, object]] = [
-        {"$match": global_filter},
-    ]
-
-    result = (
-        await mongo_db[collection_name]
-        .aggregate(
-            pipeline
-            + [
-                {"$project": {"_id": 0, "created_at": 1}},
-                {"$sort": {"date": 1}},
-            ]
-        )
-        .to_list(length=None)
+    nb_sessions_per_day = await aggregate_per_day(
+        collection=collection_name,
+        main_filter=global_filter,
+        accumulators={"nb_sessions": {"$sum": 1}},
     )
-    df = pd.DataFrame(result)
-
-    if not df.empty:
-        # If start and end date are not provided, we take the first and last task date
-        if filters.created_at_start is None:
-            filters.created_at_start = df["created_at"].min()
-    else:
-        if filters.created_at_start is None:
-            filters.created_at_start = datetime.datetime.now().timestamp()
-
-    if filters.created_at_end is None:
-        filters.created_at_end = datetime.datetime.now().timestamp()
-
-    complete_date_range = pd.date_range(
-        datetime.datetime.fromtimestamp(
-            filters.created_at_start, datetime.timezone.utc
-        ),
-        datetime.datetime.fromtimestamp(filters.created_at_end, datetime.timezone.utc),
-        freq="D",
+    return fill_missing_days(
+        nb_sessions_per_day, filters=filters, columns=["nb_sessions"]
     )
-    complete_df = pd.DataFrame({"date": complete_date_range})
-    complete_df["date"] = pd.to_datetime(complete_df["date"]).dt.date
-
-    if not df.empty:
-        df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
-        # Group by date and count
-        nb_sessions_per_day = (
-            df.groupby(["date"])
-            .count()
-            .reset_index()[["date", "created_at"]]
-            .rename(columns={"created_at": "nb_sessions"})
-        )
-
-        # Add missing days
-        nb_sessions_per_day = pd.merge(
-            complete_df, nb_sessions_per_day, on="date", how="left"
-        ).fillna(0)
-    else:
-        nb_sessions_per_day = complete_df
-        nb_sessions_per_day["nb_sessions"] = 0
-
-    return nb_sessions_per_day[["date", "nb_sessions"]].to_dict(orient="records")
 
 
 async def get_nb_sessions_histogram(
@@ -1310,11 +1308,14 @@ async def get_nb_sessions_histogram(
         .aggregate(
             pipeline
             + [
+                {"$project": {"_id": 0, "id": 1}},
+                # Only the ids of the tasks are needed to count them
                 {
                     "$lookup": {
                         "from": "tasks",
                         "localField": "id",
                         "foreignField": "session_id",
+                        "pipeline": [{"$project": {"_id": 1}}],
                         "as": "tasks",
                     }
                 },
@@ -2393,6 +2394,32 @@ async def fetch_flattened_tasks(
     The with_sessions parameter allows to include the session length in the result.
     The with_removed_events parameter allows to include the removed events in the result ; if with_events is False, this parameter is ignored.
     """
+    flattened_tasks, _ = await fetch_flattened_tasks_page(
+        project_id=project_id,
+        limit=limit,
+        with_events=with_events,
+        with_sessions=with_sessions,
+        pagination=pagination,
+        with_removed_events=with_removed_events,
+    )
+    return flattened_tasks
+
+
+async def fetch_flattened_tasks_page(
+    project_id: str,
+    limit: int = 1000,
+    with_events: bool = True,
+    with_sessions: bool = True,
+    pagination: Optional[Pagination] = None,
+    with_removed_events: bool = False,
+) -> Tuple[List[FlattenedTask], Optional[str]]:
+    """
+    Same as fetch_flattened_tasks, with the cursor of the next page if there is one.
+
+    With a pagination, the tasks are paginated before being flattened: a page has
+    per_page tasks, with all their events. With a cursor, the page is fetched with a
+    keyset match instead of skipping the previous pages.
+    """
 
     if not with_events and with_removed_events:
         logger.warning(
@@ -2406,6 +2433,11 @@ async def fetch_flattened_tasks(
     pipeline: List[Dict[str, object]] = [
         {"$match": {"project_id": project_id}},
     ]
+    # Paginate the tasks before looking up their sessions and events
+    tasks_sort = {"created_at": -1, "id": -1}
+    if pagination:
+        pipeline.extend(pagination_stages(pagination, tasks_sort))
+
     return_columns = {
         "task_id": "$id",
         "task_input": "$input",
@@ -2588,42 +2620,28 @@ async def fetch_flattened_tasks(
     pipeline.extend(
         [
             {"$project": return_columns},
-            {"$sort": {"task_created_at": -1}},
+            {"$sort": {"task_created_at": -1, "task_id": -1}},
         ]
     )
 
-    # Pagination
-
-    if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+    # Limit the rows. With a pagination, the tasks are already limited
+    length: Optional[int] = None
+    if not pagination:
+        pipeline.append({"$limit": limit})
+        length = limit
 
-    # Limit
-    else:
-        pipeline.extend(
-            [
-                {"$limit": limit},
-            ]
-        )
+    # Query Mongo. The pipeline looks up the events itself
+    flattened_tasks = await mongo_db["tasks"].aggregate(pipeline).to_list(length=length)
 
-    # Query Mongo
-    flattened_tasks = (
-        await mongo_db["tasks_with_events"].aggregate(pipeline).to_list(length=limit)
-    )
-    if with_events and with_removed_events:
-        flattened_tasks = (
-            await mongo_db["tasks"].aggregate(pipeline).to_list(length=limit)
-        )
-    else:
-        flattened_tasks = (
-            await mongo_db["tasks_with_events"]
-            .aggregate(pipeline)
-            .to_list(length=limit)
-        )
+    # One row per task and event: the cursor is the one of the last task
+    page_tasks = {
+        task["task_id"]: {
+            "created_at": task.get("task_created_at"),
+            "id": task["task_id"],
+        }
+        for task in flattened_tasks
+    }
+    cursor = next_cursor(list(page_tasks.values()), tasks_sort, pagination)
 
     new_flattened_tasks = []
     for task in flattened_tasks:
@@ -2644,7 +2662,7 @@ async def fetch_flattened_tasks(
         new_task = FlattenedTask.model_validate(task)
         new_flattened_tasks.append(new_task)
 
-    return new_flattened_tasks
+    return new_flattened_tasks, cursor
 
 
 async def update_from_flattened_tasks(
@@ -2734,6 +2752,11 @@ async def update_from_flattened_tasks(
         tasks_results = await mongo_db["tasks"].bulk_write(tasks_update_statements)
     if eval_create_statements:
         eval_results = await mongo_db["evals"].bulk_write(eval_create_statements)
+    if task_update:
+        tasks_created_at = await get_created_at(
+            "tasks", {"project_id": project_id, "id": {"$in": list(task_update.keys())}}
+        )
+        await mark_data_changed(project_id, "tasks", tasks_created_at)
 
     return tasks_results.modified_count > 0 or eval_results.inserted_count > 0
 
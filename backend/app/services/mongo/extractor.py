@@ -8,18 +8,18 @@ import stripe
 from app.api.v2.models import LogEvent
 from app.api.v3.models import MinimalLogEventForMessages
 from app.core import config
+from app.services.mongo.usage import fetch_org_metadata
 from app.services.slack import slack_notification
 from app.utils import generate_uuid
-from app.temporal.pydantic_converter import pydantic_data_converter
-from app.security import propelauth
+from app.db.temporal import get_temporal_client, reset_temporal_client
+from fastapi import HTTPException
 from loguru import logger
 
 from phospho.lab import Message
 from phospho.models import PipelineResults, Recipe, Task
 
-from temporalio.client import Client, TLSConfig
-
-import os
+from temporalio.client import Client
+from temporalio.service import RPCError, RPCStatusCode
 
 
 async def bill_on_stripe(
@@ -41,8 +41,7 @@ async def bill_on_stripe(
     stripe.api_key = config.STRIPE_SECRET_KEY
 
     # Get the stripe customer id from the org metadata
-    org = propelauth.fetch_org(org_id)
-    org_metadata = org.get("metadata", {})
+    org_metadata = await fetch_org_metadata(org_id) or {}
     customer_id = org_metadata.get("customer_id", None)
 
     if customer_id:
@@ -89,8 +88,9 @@ class ExtractorClient:
             logger.error("Org_id is missing.")
             return None
 
-        org = propelauth.fetch_org(self.org_id)
-        org_metadata = org.get("metadata", {})
+        org_metadata = await fetch_org_metadata(self.org_id)
+        if org_metadata is None:
+            return None
         return org_metadata.get("customer_id", None)
 
     async def _post(
@@ -98,13 +98,22 @@ class ExtractorClient:
         endpoint: str,  # Should be the name of the workflow
         data: dict,  # Should be just one pydantic model
         on_success_callback: Optional[Callable] = None,
+        wait_for_result: bool = True,
+        raise_on_error: bool = False,
     ) -> Optional[httpx.Response]:
         """
         Post data to the extractor server
+
+        If wait_for_result is False, the workflow is only started (fire-and-forget):
+        this returns as soon as Temporal has durably queued the workflow.
+
+        Errors are logged. With raise_on_error, a 503 HTTPException is raised if the
+        workflow couldn't be submitted, so that the log endpoints don't report the data
+        as processed.
         """
 
         # We check that "org_id", "project_id" and "customer_id" are present in the data
-        if endpoint not in ["store_open_telemetry_data_workflow"] and (
+        if (
             "org_id" not in data
             or "project_id" not in data
             or "customer_id" not in data
@@ -114,22 +123,26 @@ class ExtractorClient:
             )
             return None
         try:
-            client_cert = config.TEMPORAL_MTLS_TLS_CERT
-            client_key = config.TEMPORAL_MTLS_TLS_KEY
-
-            client: Client = await Client.connect(
-                os.getenv("TEMPORAL_HOST_URL"),
-                namespace=os.getenv("TEMPORAL_NAMESPACE"),
-                tls=TLSConfig(
-                    client_cert=client_cert,
-                    client_private_key=client_key,
-                ),
-                data_converter=pydantic_data_converter,
-            )
-
-            response = await client.execute_workflow(
-                endpoint, data, id=generate_uuid(), task_queue="default"
-            )
+            workflow_id = generate_uuid()
+            client = await get_temporal_client()
+            try:
+                response = await self._submit_workflow(
+                    client, endpoint, data, workflow_id, wait_for_result
+                )
+            except RPCError as e:
+                if e.status != RPCStatusCode.UNAVAILABLE:
+                    raise e
+                # The connection was lost: reconnect and retry once. The workflow id is
+                # kept so that Temporal rejects the retry if the first call went through.
+                logger.warning(
+                    f"Temporal unavailable while calling {endpoint}, reconnecting: {e}"
+                )
+                # Only drop this client: a concurrent call may have reconnected already
+                await reset_temporal_client(client)
+                client = await get_temporal_client()
+                response = await self._submit_workflow(
+                    client, endpoint, data, workflow_id, wait_for_result
+                )
 
             if on_success_callback:
                 await on_success_callback(response)
@@ -150,12 +163,42 @@ class ExtractorClient:
                     slack_message = error_message
                 await slack_notification(slack_message)
 
+            if not raise_on_error:
+                return None
+            raise HTTPException(
+                status_code=503,
+                detail=f"Error while processing the data, please retry later (error_id: {error_id})",
+            ) from e
+
+        return None
+
+    async def _submit_workflow(
+        self,
+        client: Client,
+        endpoint: str,
+        data: dict,
+        workflow_id: str,
+        wait_for_result: bool,
+    ):
+        """
+        Submit a workflow with the Temporal client
+        """
+        if wait_for_result:
+            return await client.execute_workflow(
+                endpoint, data, id=workflow_id, task_queue="default"
+            )
+        await client.start_workflow(
+            endpoint, data, id=workflow_id, task_queue="default"
+        )
         return None
 
     async def run_process_log_for_tasks(
         self,
         logs_to_process: List[LogEvent],
         extra_logs_to_save: Optional[List[LogEvent]] = None,
+        nb_reserved_usage: int = 0,
+        reservation_id: Optional[str] = None,
+        raise_on_error: bool = False,
     ) -> None:
         """
         Run the log procesing pipeline on a task asynchronously
@@ -200,14 +243,21 @@ class ExtractorClient:
                 ],
                 "project_id": self.project_id,
                 "org_id": self.org_id,
+                "nb_reserved_usage": nb_reserved_usage,
+                "reservation_id": reservation_id,
                 "customer_id": await self._fetch_stripe_customer_id(),
             },
+            wait_for_result=False,
+            raise_on_error=raise_on_error,
         )
 
     async def run_log_process_for_messages(
         self,
         logs_to_process: List[MinimalLogEventForMessages],
         extra_logs_to_save: Optional[List[MinimalLogEventForMessages]] = None,
+        nb_reserved_usage: int = 0,
+        reservation_id: Optional[str] = None,
+        raise_on_error: bool = False,
     ):
         """
         Run the log procesing pipeline on *messages* asynchronously
@@ -229,8 +279,12 @@ class ExtractorClient:
                 ],
                 "project_id": self.project_id,
                 "org_id": self.org_id,
+                "nb_reserved_usage": nb_reserved_usage,
+                "reservation_id": reservation_id,
                 "customer_id": await self._fetch_stripe_customer_id(),
             },
+            wait_for_result=False,
+            raise_on_error=raise_on_error,
         )
 
     async def run_main_pipeline_on_task(self, task: Task) -> PipelineResults:
@@ -311,6 +365,11 @@ class ExtractorClient:
     async def store_open_telemetry_data(
         self,
         open_telemetry_data: dict,
+        current_usage: int,
+        max_usage: Optional[int] = None,
+        nb_reserved_usage: int = 0,
+        reservation_id: Optional[str] = None,
+        raise_on_error: bool = False,
     ):
         await self._post(
             "store_open_telemetry_data_workflow",
@@ -318,8 +377,27 @@ class ExtractorClient:
                 "open_telemetry_data": open_telemetry_data,
                 "project_id": self.project_id,
                 "org_id": self.org_id,
-                # No customer_id because we don't bill for open telemetry data, we simply log
+                "current_usage": current_usage,
+                "max_usage": max_usage,
+                "nb_reserved_usage": nb_reserved_usage,
+                "reservation_id": reservation_id,
+                "customer_id": await self._fetch_stripe_customer_id(),
+            },
+            wait_for_result=False,
+            raise_on_error=raise_on_error,
+        )
+
+    async def refresh_rollups(self, collection: str):
+        await self._post(
+            "refresh_rollups_workflow",
+            {
+                "collection": collection,
+                "project_id": self.project_id,
+                "org_id": self.org_id,
+                # Not billed
+                "customer_id": None,
             },
+            wait_for_result=False,
         )
 
     async def collect_langsmith_data(
@@ -1,5 +1,6 @@
 from typing import Dict, List, Literal, Optional
 from app.api.v2.models.projects import UserMetadata
+from app.services.mongo.events_summary import task_events_summary_expression
 from app.services.mongo.tasks import task_filtering_pipeline_match
 from fastapi import HTTPException
 from loguru import logger
@@ -490,7 +491,7 @@ async def breakdown_by_sum_of_metadata_field(
     mongo_db = await get_mongo_db()
 
     main_filter, collection_name = await task_filtering_pipeline_match(
-        project_id=project_id, filters=filters, collection="tasks_with_events"
+        project_id=project_id, filters=filters, collection="tasks"
     )
 
     def _merge_sessions(pipeline: List[Dict[str, object]]) -> List[Dict[str, object]]:
@@ -530,6 +531,12 @@ async def breakdown_by_sum_of_metadata_field(
     pipeline: List[Dict[str, object]] = [
         {"$match": main_filter},
     ]
+    if breakdown_by == "event_name" or metric.lower() in [
+        "event count",
+        "event distribution",
+    ]:
+        # The events of the tasks, from their events summary
+        pipeline.append({"$set": {"events": task_events_summary_expression()}})
     category_metadata_fields = constants.RESERVED_CATEGORY_METADATA_FIELDS
     number_metadata_fields = constants.RESERVED_NUMBER_METADATA_FIELDS
 
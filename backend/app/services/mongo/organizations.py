@@ -1,3 +1,4 @@
+import asyncio
 from typing import List, Optional
 
 import pydantic
@@ -6,6 +7,7 @@ from app.core import config
 from app.db.models import Project
 from app.db.mongo import get_mongo_db
 from app.security.authentification import propelauth
+from app.services.mongo.usage import get_org_usage, invalidate_org_metadata
 from fastapi import HTTPException
 from loguru import logger
 
@@ -95,11 +97,11 @@ async def get_usage_quota(
     """
     Calculate the usage quota of an organization.
     The usage quota is the number of tasks logged by the organization.
-    """
-    mongo_db = await get_mongo_db()
 
+    The balance transaction is only fetched from Stripe if a customer_id is passed.
+    """
     # Get usage info for the orgnization
-    nb_tasks_logged = await mongo_db["job_results"].count_documents({"org_id": org_id})
+    nb_tasks_logged = await get_org_usage(org_id)
 
     # Default config (plan == "hobby")
     max_usage: Optional[int] = config.PLAN_HOBBY_MAX_NB_DETECTIONS
@@ -121,7 +123,8 @@ async def get_usage_quota(
     balance_transaction = None
     if customer_id is not None and config.ENVIRONMENT != "test":
         stripe.api_key = config.STRIPE_SECRET_KEY
-        response = stripe.Customer.list_balance_transactions(
+        response = await asyncio.to_thread(
+            stripe.Customer.list_balance_transactions,
             customer_id,
             limit=1,
         )
@@ -187,6 +190,7 @@ def change_organization_plan(
         propelauth.update_org_metadata(
             org_id, max_users=config.PLAN_PRO_MAX_USERS, metadata=org_metadata
         )
+        invalidate_org_metadata(org_id)
         stripe.api_key = config.STRIPE_SECRET_KEY
 
         # Update the customer metadata with the org_id
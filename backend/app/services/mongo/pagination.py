@@ -0,0 +1,165 @@
+"""
+Keyset (cursor) pagination of the tasks and the sessions.
+
+Skipping `page * per_page` documents costs as much as reading them, so deep pages get
+slower and slower. Instead, a cursor stores the sort values and the id of the last
+document of a page, and the next page matches the documents that come after it. The
+id breaks the ties, so the order is total and stays stable when documents are
+inserted while paginating.
+
+The cursors are opaque to the clients: they are the base64 of the JSON of the sort
+and of the values. Only scalar and datetime sort fields are supported (no arrays nor
+documents), and all the values of a sort field are expected to have the same type.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from app.api.models import Pagination
+from app.api.platform.models.explore import Sorting
+
+
+def sorting_to_dict(
+    sorting: Optional[List[Sorting]], default: str = "created_at"
+) -> Dict[str, int]:
+    """
+    Convert the sorting of a query to a Mongo $sort, with the id to break the ties
+    """
+    if not sorting:
+        sort = {default: -1}
+    else:
+        sort = {s.id: 1 if s.desc else -1 for s in sorting}
+    if "id" not in sort:
+        sort["id"] = next(iter(sort.values()))
+    return sort
+
+
+def _get_value(document: dict, key: str) -> object:
+    value: object = document
+    for part in key.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _encode_value(key: str, value: object) -> object:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    raise HTTPException(
+        status_code=400,
+        detail=f"Can't paginate with a cursor when sorting on {key}: its values are not scalars",
+    )
+
+
+def _decode_value(value: object) -> object:
+    if isinstance(value, dict):
+        return datetime.datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(document: dict, sort: Dict[str, int]) -> str:
+    """
+    Cursor of the documents after this one. Raises a 400 if a sort value is not a
+    scalar nor a datetime.
+    """
+    values = [_encode_value(key, _get_value(document, key)) for key in sort.keys()]
+    content = json.dumps({"sort": list(sort.items()), "values": values})
+    return base64.urlsafe_b64encode(content.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: Dict[str, int]) -> List[object]:
+    """
+    Sort values stored in the cursor. Raises a 400 if the cursor is invalid or was
+    created with another sort.
+    """
+    try:
+        content = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        cursor_sort = [(key, direction) for key, direction in content["sort"]]
+        values = [_decode_value(value) for value in content["values"]]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if cursor_sort != list(sort.items()) or len(values) != len(sort):
+        raise HTTPException(
+            status_code=400,
+            detail="The pagination cursor was created with another sorting",
+        )
+    return values
+
+
+def _after(key: str, direction: int, value: object) -> Optional[Dict[str, object]]:
+    """
+    Match the values of the key strictly after the value. Null values come first in
+    ascending order, last in descending order.
+    """
+    if direction == 1:
+        if value is None:
+            return {key: {"$ne": None}}
+        return {key: {"$gt": value}}
+    if value is None:
+        return None
+    return {"$or": [{key: {"$lt": value}}, {key: None}]}
+
+
+def keyset_match(cursor: str, sort: Dict[str, int]) -> Dict[str, object]:
+    """
+    Match the documents that come after the cursor in this sort
+    """
+    values = decode_cursor(cursor, sort)
+    branches: List[Dict[str, object]] = []
+    equal: Dict[str, object] = {}
+    for (key, direction), value in zip(sort.items(), values):
+        after = _after(key, direction, value)
+        if after is not None:
+            branches.append({**equal, **after} if equal else after)
+        equal[key] = value
+    if not branches:
+        # Nothing comes after the cursor
+        return {"id": {"$in": []}}
+    return {"$or": branches}
+
+
+def next_cursor(
+    documents: List[dict], sort: Dict[str, int], pagination: Optional[Pagination]
+) -> Optional[str]:
+    """
+    Cursor of the next page, or None if this page is the last one. A page fetched with
+    a cursor raises a 400 if the sort can't be paginated with cursors.
+    """
+    if pagination is None or not documents or len(documents) < pagination.per_page:
+        return None
+    if pagination.cursor is None:
+        # An offset page, eg: the tables of the platform sorted on the events. The
+        # next page can be fetched with its page number.
+        try:
+            return encode_cursor(documents[-1], sort)
+        except HTTPException:
+            return None
+    return encode_cursor(documents[-1], sort)
+
+
+def pagination_stages(
+    pagination: Pagination, sort: Dict[str, int]
+) -> List[Dict[str, object]]:
+    """
+    Stages of an aggregation pipeline to get a page of documents sorted with sort.
+    With a cursor, the page is fetched with a keyset match instead of a $skip.
+    """
+    if pagination.cursor is not None:
+        return [
+            {"$match": keyset_match(pagination.cursor, sort)},
+            {"$sort": sort},
+            {"$limit": pagination.per_page},
+        ]
+    return [
+        {"$sort": sort},
+        {"$skip": pagination.page * pagination.per_page},
+        {"$limit": pagination.per_page},
+    ]
@@ -1,5 +1,6 @@
 from typing import List, Any, Optional
 from app.services.mongo.extractor import bill_on_stripe
+from app.services.mongo.usage import increment_org_usage
 from app.db.mongo import get_mongo_db
 from app.db.models import JobResult
 from loguru import logger
@@ -45,9 +46,11 @@ async def metered_prediction(
 
     logger.debug(f"jobresults: {jobresults}")
     mongo_db = await get_mongo_db()
-    mongo_db["job_results"].insert_many(
-        [jobresult.model_dump() for jobresult in jobresults]
-    )
+    if len(jobresults) > 0:
+        await mongo_db["job_results"].insert_many(
+            [jobresult.model_dump() for jobresult in jobresults]
+        )
+        await increment_org_usage(org_id, len(jobresults))
 
     logger.info(
         f"{len(jobresults)} predictions made for org_id {org_id} with model_id {model_id}"
@@ -0,0 +1,46 @@
+"""
+Version of the projects.
+
+The extractor caches the project settings, the event definitions and the few-shot
+examples (confirmed events and events removed by the user) of a project. It reloads
+them when the `version` of the project document changes: increment it after changing
+any of those.
+
+The backend caches the results of the analytics queries of a project. It recomputes
+them when the `data_version` of the project document changes, and it reads the rollups
+of the extractor outside of their stale hours: call mark_data_changed after writing
+tasks, sessions or events.
+"""
+
+from typing import Iterable, Optional
+
+from app.db.mongo import get_mongo_db
+from app.services.mongo.rollups import mark_rollups_stale
+
+
+async def increment_project_version(project_id: str) -> None:
+    mongo_db = await get_mongo_db()
+    await mongo_db["projects"].update_one({"id": project_id}, {"$inc": {"version": 1}})
+
+
+async def increment_data_version(project_id: str) -> None:
+    mongo_db = await get_mongo_db()
+    await mongo_db["projects"].update_one(
+        {"id": project_id}, {"$inc": {"data_version": 1}}
+    )
+
+
+async def mark_data_changed(
+    project_id: str,
+    collection: str,
+    timestamps: Optional[Iterable[Optional[float]]],
+) -> None:
+    """
+    After writing documents of the collection created at these timestamps: mark their
+    rollups as stale and invalidate the cached analytics queries.
+
+    timestamps is None if they are unknown: all the rollups of the collection are
+    rebuilt.
+    """
+    await mark_rollups_stale(project_id, collection, timestamps)
+    await increment_data_version(project_id)
@@ -1,6 +1,6 @@
 import datetime
 import io
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 import resend
@@ -17,10 +17,25 @@ from app.db.models import (
     Event,
 )
 from app.db.mongo import get_mongo_db
-from app.security.authentification import propelauth
+from app.security.authentification import invalidate_project_org_id, propelauth
+from app.services.mongo.events_summary import (
+    attach_events,
+    events_summary_match,
+    refresh_events_summary_of_events,
+)
 from app.services.mongo.explore import fetch_flattened_tasks
 from app.services.mongo.extractor import ExtractorClient
 from app.services.mongo.metadata import fetch_user_metadata
+from app.services.mongo.pagination import (
+    next_cursor,
+    pagination_stages,
+    sorting_to_dict,
+)
+from app.services.mongo.project_version import (
+    increment_project_version,
+    mark_data_changed,
+)
+from app.services.mongo.rollups import get_created_at
 from app.services.mongo.tasks import (
     get_all_tasks,
     label_sentiment_analysis,
@@ -149,6 +164,7 @@ async def delete_project_from_id(project_id: str) -> bool:
     """
     mongo_db = await get_mongo_db()
     delete_result = await mongo_db["projects"].delete_one({"id": project_id})
+    invalidate_project_org_id(project_id)
     status = delete_result.deleted_count > 0
     return status
 
@@ -162,6 +178,8 @@ async def delete_project_related_resources(project_id: str):
     collections = ["sessions", "tasks", "events", "evals", "logs"]
     for collection_name in collections:
         await mongo_db[collection_name].delete_many({"project_id": project_id})
+    for collection_name in ["tasks", "sessions", "events"]:
+        await mark_data_changed(project_id, collection_name, None)
 
 
 async def update_project(project: Project, **kwargs) -> Project:
@@ -215,11 +233,11 @@ async def update_project(project: Project, **kwargs) -> Project:
                         recipe_type="event_detection",
                         parameters=event_definition_model.model_dump(),
                     )
-                    mongo_db["recipes"].insert_one(recipe.model_dump())
+                    await mongo_db["recipes"].insert_one(recipe.model_dump())
                     updated_project.settings.events[event_name].recipe_id = recipe.id
                     event_definition_model.recipe_id = recipe.id
                     # update event_definition with event_id
-                    mongo_db["event_definitions"].update_one(
+                    await mongo_db["event_definitions"].update_one(
                         {"project_id": project.id, "id": event_definition_model.id},
                         {"$set": event_definition_model.model_dump()},
                         upsert=True,
@@ -239,7 +257,7 @@ async def update_project(project: Project, **kwargs) -> Project:
                     # Event has been removed
                     try:
                         event_definition.removed = True
-                        mongo_db["event_definitions"].update_one(
+                        await mongo_db["event_definitions"].update_one(
                             {"project_id": project.id, "id": event_definition.id},
                             {"$set": event_definition.model_dump()},
                         )
@@ -254,7 +272,7 @@ async def update_project(project: Project, **kwargs) -> Project:
                         )
                         recipe = Recipe.model_validate(recipe)
                         recipe.status = "deleted"
-                        mongo_db["recipes"].update_one(
+                        await mongo_db["recipes"].update_one(
                             {"id": event_definition.recipe_id},
                             {"$set": recipe.model_dump()},
                         )
@@ -264,13 +282,18 @@ async def update_project(project: Project, **kwargs) -> Project:
                         )
                     # Remove all historical events
                     try:
-                        mongo_db["events"].update_many(
-                            {
-                                "project_id": project.id,
-                                "event_definition.id": event_definition.id,
-                            },
-                            {"$set": {"removed": True}},
+                        events_filter = {
+                            "project_id": project.id,
+                            "event_definition.id": event_definition.id,
+                        }
+                        events_created_at = await get_created_at(
+                            "events", events_filter
+                        )
+                        await mongo_db["events"].update_many(
+                            events_filter, {"$set": {"removed": True}}
                         )
+                        await refresh_events_summary_of_events(events_filter)
+                        await mark_data_changed(project.id, "events", events_created_at)
                         logger.debug(
                             f"Removing all historical events for event {event_definition.id}"
                         )
@@ -283,6 +306,9 @@ async def update_project(project: Project, **kwargs) -> Project:
         await mongo_db["projects"].update_one(
             {"id": project.id}, {"$set": updated_project.model_dump()}
         )
+        # The project may have been moved to another org
+        invalidate_project_org_id(project.id)
+        await increment_project_version(project.id)
 
     updated_project = await get_project_by_id(project.id)
     return updated_project
@@ -317,6 +343,7 @@ async def add_project_events(project_id: str, events: List[EventDefinition]) ->
     await mongo_db["event_definitions"].insert_many(
         [event.model_dump() for event in events]
     )
+    await increment_project_version(project_id)
     updated_project = await get_project_by_id(project_id)
     return updated_project
 
@@ -465,6 +492,35 @@ async def get_all_sessions(
     sorting: Optional[List[Sorting]] = None,
     sessions_ids: Optional[List[str]] = None,
 ) -> List[Session]:
+    sessions, _ = await get_sessions_page(
+        project_id=project_id,
+        limit=limit,
+        filters=filters,
+        get_events=get_events,
+        get_tasks=get_tasks,
+        pagination=pagination,
+        sorting=sorting,
+        sessions_ids=sessions_ids,
+    )
+    return sessions
+
+
+async def get_sessions_page(
+    project_id: str,
+    limit: int = 1000,
+    filters: Optional[ProjectDataFilters] = None,
+    get_events: bool = True,
+    get_tasks: bool = False,
+    pagination: Optional[Pagination] = None,
+    sorting: Optional[List[Sorting]] = None,
+    sessions_ids: Optional[List[str]] = None,
+) -> Tuple[List[Session], Optional[str]]:
+    """
+    Get the sessions of a project, and the cursor of the next page if there is one.
+
+    With a cursor in the pagination, the page is fetched with a keyset match instead
+    of skipping the previous pages (see app/services/mongo/pagination.py).
+    """
     mongo_db = await get_mongo_db()
     collection_name = "sessions"
     additional_sessions_filter: Dict[str, object] = {}
@@ -536,27 +592,15 @@ async def get_all_sessions(
             }
         },
     ]
-    if get_events or (filters is not None and filters.event_name is not None):
-        collection_name = "sessions_with_events"
-        if filters is not None and filters.event_name is not None:
-            pipeline.extend(
-                [
-                    {
-                        "$match": {
-                            "$and": [
-                                {"events": {"$ne": []}},
-                                {
-                                    "events": {
-                                        "$elemMatch": {
-                                            "event_name": {"$in": filters.event_name}
-                                        }
-                                    }
-                                },
-                            ]
-                        },
-                    },
-                ]
-            )
+    if filters is not None and filters.event_name is not None:
+        # Indexed match on the events summary of the sessions
+        pipeline.append(
+            {
+                "$match": events_summary_match(
+                    "event_name", filters.event_name, collection="sessions"
+                )
+            }
+        )
 
     if get_tasks or (filters is not None and filters.user_id is not None):
         pipeline.extend(
@@ -586,32 +630,6 @@ async def get_all_sessions(
                 ]
             )
 
-    # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"created_at": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
-    pipeline.extend(
-        [
-            {
-                "$project": {
-                    "id": 1,
-                    **{sort_key: 1 for sort_key in sorting_dict.keys()},
-                }
-            },
-            {"$sort": sorting_dict},
-        ]
-    )
-
-    # Add pagination
-    if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
-
     if sessions_ids is not None:
         pipeline.extend(
             [
@@ -623,12 +641,31 @@ async def get_all_sessions(
             ]
         )
 
-    # ... and then we add the lookup and the deduplication
+    # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
+    sorting_dict = sorting_to_dict(sorting)
+    pipeline.append(
+        {
+            "$project": {
+                "id": 1,
+                **{sort_key: 1 for sort_key in sorting_dict.keys()},
+            }
+        },
+    )
+
+    # Add pagination
+    if pagination:
+        pipeline.extend(pagination_stages(pagination, sorting_dict))
+    else:
+        pipeline.append({"$sort": sorting_dict})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+
+    # ... and then we add the lookup of the sessions of the page
     pipeline.extend(
         [
             {
                 "$lookup": {
-                    "from": "sessions_with_events",
+                    "from": "sessions",
                     "localField": "id",
                     "foreignField": "id",
                     "as": "sessions",
@@ -642,12 +679,18 @@ async def get_all_sessions(
     )
 
     sessions = await mongo_db[collection_name].aggregate(pipeline).to_list(length=limit)
+    cursor = next_cursor(sessions, sorting_dict, pagination)
+    if get_events:
+        await attach_events(sessions, "sessions")
+    else:
+        for session in sessions:
+            session["events"] = []
 
     # Filter the _id field from the Sessions
     for session in sessions:
         session.pop("_id", None)
-    sessions = [Session.model_validate(data) for data in sessions]
-    return sessions
+    valid_sessions = [Session.model_validate(data) for data in sessions]
+    return valid_sessions, cursor
 
 
 async def get_all_tests(project_id: str, limit: int = 1000) -> List[Test]:
@@ -817,6 +860,9 @@ async def populate_default(
         session_ids.append(session.id)
         sessions.append(session.model_dump())
     await mongo_db["sessions"].insert_many(sessions)
+    await mark_data_changed(
+        project_id, "sessions", [session["created_at"] for session in sessions]
+    )
 
     # Add events definitions to the project
 
@@ -910,6 +956,9 @@ async def populate_default(
         events.append(validated_event)
         event_pairs[validated_event.event_name] = validated_event
     await mongo_db["events"].insert_many([event.model_dump() for event in events])
+    await mark_data_changed(
+        project_id, "events", [event.created_at for event in events]
+    )
 
     # Redefine events on tasks
     for index in range(len(tasks)):
@@ -920,6 +969,8 @@ async def populate_default(
         tasks[index] = task
 
     await mongo_db["tasks"].insert_many([task.model_dump() for task in tasks])
+    await mark_data_changed(project_id, "tasks", [task.created_at for task in tasks])
+    await refresh_events_summary_of_events({"project_id": project_id})
 
     logger.debug(
         f"Populated project {project_id} with event definitions {event_definition_pairs}"
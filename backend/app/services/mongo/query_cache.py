@@ -0,0 +1,254 @@
+"""
+Cache of the results of the analytics queries (explore, pivot tables).
+
+The dashboards send the same queries again and again. Their results are cached, keyed
+by the project and a hash of the query. Each entry stores the `data_version` of the
+project when it was computed. The extractor and the backend increment it after writing
+the tasks, sessions or events of the project: the entries computed before are then
+stale. A stale entry is recomputed, or, if QUERY_CACHE_STALE_WHILE_REVALIDATE is set,
+returned while it's recomputed in the background.
+
+The entries are stored in a backend:
+- "memory": an LRU cache per worker process, bounded by QUERY_CACHE_MAX_SIZE entries
+- "mongo": the query_cache collection, shared by the workers
+- "none": no cache
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from loguru import logger
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.utils.cache import TTLCache
+
+QUERY_CACHE_COLLECTION = "query_cache"
+
+
+class QueryCacheBackend(ABC):
+    """
+    Where the entries of the query cache are stored. An entry is a dict with the
+    data_version it was computed at and the cached value.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, entry: dict) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryQueryCacheBackend(QueryCacheBackend):
+    def __init__(self, ttl: float, max_size: int):
+        self._cache = TTLCache(ttl=ttl, max_size=max_size)
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, entry: dict) -> None:
+        self._cache.set(key, entry)
+
+    def stats(self) -> dict:
+        return {"size": len(self._cache)}
+
+
+class MongoQueryCacheBackend(QueryCacheBackend):
+    """
+    The entries expire with a TTL index on expires_at (see connect_and_init_db)
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[dict]:
+        mongo_db = await get_mongo_db()
+        entry = await mongo_db[QUERY_CACHE_COLLECTION].find_one({"_id": key})
+        if entry is None:
+            return None
+        # The TTL monitor only runs every minute
+        expires_at = entry["expires_at"].replace(tzinfo=datetime.timezone.utc)
+        if expires_at < datetime.datetime.now(datetime.timezone.utc):
+            return None
+        return entry
+
+    async def set(self, key: str, entry: dict) -> None:
+        mongo_db = await get_mongo_db()
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            seconds=self.ttl
+        )
+        await mongo_db[QUERY_CACHE_COLLECTION].replace_one(
+            {"_id": key}, {**entry, "expires_at": expires_at}, upsert=True
+        )
+
+
+def get_query_cache_backend(name: str) -> Optional[QueryCacheBackend]:
+    if name == "memory":
+        return InMemoryQueryCacheBackend(
+            ttl=config.QUERY_CACHE_TTL, max_size=config.QUERY_CACHE_MAX_SIZE
+        )
+    if name == "mongo":
+        return MongoQueryCacheBackend(ttl=config.QUERY_CACHE_TTL)
+    if name == "none":
+        return None
+    raise ValueError(f"Unknown query cache backend: {name}")
+
+
+def query_cache_key(project_id: str, name: str, params: Dict[str, Any]) -> str:
+    """
+    Key of a query: the project and a hash of the query. The params are serialized
+    with sorted keys, so that the same query always has the same key.
+    """
+    canonical_params = json.dumps(params, sort_keys=True, default=str)
+    params_hash = hashlib.sha256(canonical_params.encode()).hexdigest()
+    return f"{project_id}:{name}:{params_hash}"
+
+
+class QueryCache:
+    def __init__(
+        self,
+        backend: Optional[QueryCacheBackend],
+        stale_while_revalidate: bool = False,
+        data_version_ttl: float = config.QUERY_CACHE_DATA_VERSION_TTL,
+    ):
+        """
+        :param backend: where the entries are stored. If None, nothing is cached.
+        :param data_version_ttl: how long the data version of a project is cached.
+            A write is seen by the cache after at most this delay.
+        """
+        self.backend = backend
+        self.stale_while_revalidate = stale_while_revalidate
+        self._data_versions = TTLCache(ttl=data_version_ttl, max_size=10_000)
+        # Computations in progress, shared by the concurrent requests of a query
+        self._pending: Dict[str, asyncio.Task] = {}
+        # Keep a reference to the background computations so they are not garbage
+        # collected
+        self._background_tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.nb_computations = 0
+        self.total_computation_time = 0.0
+
+    async def get_data_version(self, project_id: str) -> int:
+        data_version = self._data_versions.get(project_id)
+        if data_version is not None:
+            return data_version
+        mongo_db = await get_mongo_db()
+        project = await mongo_db["projects"].find_one(
+            {"id": project_id}, {"_id": 0, "data_version": 1}
+        )
+        data_version = project.get("data_version", 0) if project else 0
+        self._data_versions.set(project_id, data_version)
+        return data_version
+
+    async def _compute(
+        self, key: str, data_version: int, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        start_time = time.perf_counter()
+        value = await compute()
+        self.nb_computations += 1
+        self.total_computation_time += time.perf_counter() - start_time
+        # The data version was read before the computation: if the data changed in
+        # the meantime, the entry is already stale
+        try:
+            await self.backend.set(key, {"data_version": data_version, "value": value})
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error caching the query {key}: {e}")
+        return value
+
+    def _compute_once(
+        self, key: str, data_version: int, compute: Callable[[], Awaitable[Any]]
+    ) -> asyncio.Task:
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, data_version, compute))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    async def get_or_compute(
+        self,
+        project_id: str,
+        name: str,
+        params: Dict[str, Any],
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Return the cached result of the query `name` with these params, or compute it.
+        Don't mutate the returned value: it's shared.
+        """
+        if self.backend is None:
+            return await compute()
+
+        key = query_cache_key(project_id, name, params)
+        data_version = await self.get_data_version(project_id)
+        try:
+            entry = await self.backend.get(key)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error reading the query cache {key}: {e}")
+            entry = None
+
+        if entry is not None and entry["data_version"] >= data_version:
+            self.hits += 1
+            return entry["value"]
+        if entry is not None and self.stale_while_revalidate:
+            self.stale_hits += 1
+            task = self._compute_once(key, data_version, compute)
+            self._background_tasks.add(task)
+            task.add_done_callback(self._on_background_task_done)
+            return entry["value"]
+
+        self.misses += 1
+        # If this request is cancelled, the other requests waiting for the same
+        # computation still get its result
+        return await asyncio.shield(self._compute_once(key, data_version, compute))
+
+    def _on_background_task_done(self, task: asyncio.Task) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error recomputing a stale query: {task.exception()}")
+
+    def stats(self) -> dict:
+        """
+        Hit ratio of the cache and time saved, estimated from the average time to
+        compute a query
+        """
+        nb_lookups = self.hits + self.stale_hits + self.misses
+        avg_computation_time = (
+            self.total_computation_time / self.nb_computations
+            if self.nb_computations
+            else 0.0
+        )
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": (
+                (self.hits + self.stale_hits) / nb_lookups if nb_lookups else None
+            ),
+            "avg_computation_time": avg_computation_time,
+            "time_saved": (self.hits + self.stale_hits) * avg_computation_time,
+            **(self.backend.stats() if self.backend else {}),
+        }
+
+
+query_cache = QueryCache(
+    backend=get_query_cache_backend(config.QUERY_CACHE_BACKEND),
+    stale_while_revalidate=config.QUERY_CACHE_STALE_WHILE_REVALIDATE,
+)
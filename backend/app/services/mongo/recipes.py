@@ -4,7 +4,7 @@ from app.db.mongo import get_mongo_db
 from app.services.mongo.events import get_event_definition_from_event_id
 from app.services.mongo.extractor import ExtractorClient
 from app.services.mongo.projects import get_project_by_id
-from app.services.mongo.tasks import get_all_tasks, get_total_nb_of_tasks
+from app.services.mongo.tasks import get_tasks_page, get_total_nb_of_tasks
 from fastapi import HTTPException
 from loguru import logger
 from phospho.models import EventDefinition, ProjectDataFilters, Recipe
@@ -93,16 +93,22 @@ async def run_recipe_on_tasks_batched(
         project_id=project_id,
         org_id=org_id,
     )
-    for i in range(nb_batches + 1):
-        tasks = await get_all_tasks(
+    # Walk the tasks with a cursor, so that every batch costs the same
+    pagination = Pagination(page=0, per_page=batch_size)
+    for _ in range(nb_batches + 1):
+        tasks, cursor = await get_tasks_page(
             project_id=project_id,
             filters=filters,
-            pagination=Pagination(page=i, per_page=batch_size),
+            get_events=False,
+            pagination=pagination,
         )
         await extractor_client.run_recipe_on_tasks(
             tasks_ids=[task.id for task in tasks],
             recipe=recipe,
         )
+        if cursor is None:
+            break
+        pagination = Pagination(per_page=batch_size, cursor=cursor)
 
 
 async def run_recipe_types_on_tasks(
@@ -0,0 +1,437 @@
+"""
+Analytics queries answered from the hourly and daily rollups maintained by the
+extractor (see extractor/app/services/rollups.py).
+
+The buckets fully inside the time range of the query are read from the rollups. The
+edges of the range, the stale hours and the buckets where the dimension or the field of
+the query isn't rolled up are scanned in the raw collection. So the result is the same
+as the one of a raw scan.
+"""
+
+import datetime
+import math
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.db.models import AnalyticsQuery
+from app.db.mongo import get_mongo_db
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+ROLLUPS_COLLECTION = "analytics_rollups"
+ROLLUPS_STATUS_COLLECTION = "analytics_rollups_status"
+ROLLUP_COLLECTIONS = ["tasks", "sessions", "events"]
+
+# Time dimensions that can be computed from the buckets, and their format
+TIME_DIMENSIONS = {
+    "hour": "%Y-%m-%d %H",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+# group key (time, value of the dimension) -> {"count", "sum", "n", "min", "max"}
+Aggregates = Dict[Tuple[Optional[str], Any], Dict[str, Any]]
+
+
+async def mark_rollups_stale(
+    project_id: str,
+    collection: str,
+    timestamps: Optional[Iterable[Optional[float]]],
+) -> None:
+    """
+    Mark the hours of these timestamps as stale, after updating documents of the
+    collection. They are scanned in the raw collection until the extractor recomputes
+    them.
+
+    If timestamps is None (eg: an update of all the documents of the project), the
+    rollups of the collection are scanned in the raw collection until they are
+    backfilled again.
+    """
+    mongo_db = await get_mongo_db()
+    status_key = {"project_id": project_id, "collection": collection}
+    if timestamps is None:
+        await mongo_db[ROLLUPS_STATUS_COLLECTION].update_one(
+            status_key,
+            {"$set": {"ready": False}, "$unset": {"backfill_started_at": ""}},
+        )
+        return
+    hours = [
+        int(timestamp) - int(timestamp) % HOUR
+        for timestamp in timestamps
+        if timestamp is not None
+    ]
+    if not hours:
+        return
+    await mongo_db[ROLLUPS_STATUS_COLLECTION].update_one(
+        status_key,
+        {"$addToSet": {"stale_hours": {"$each": hours}}},
+    )
+
+
+async def get_created_at(collection: str, query: Dict[str, Any]) -> List[float]:
+    """
+    Distinct created_at of the documents of the collection matching the query, to
+    mark their hours as stale
+    """
+    mongo_db = await get_mongo_db()
+    return await mongo_db[collection].distinct("created_at", query)
+
+
+def _split_dimensions(
+    dimensions: List[str],
+) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """(time dimension, other dimension), or None if the rollups can't group by them"""
+    time_dimensions = [d for d in dimensions if d in TIME_DIMENSIONS]
+    other_dimensions = [d for d in dimensions if d not in TIME_DIMENSIONS]
+    if len(time_dimensions) > 1 or len(other_dimensions) > 1:
+        return None
+    if "minute" in other_dimensions:
+        return None
+    return (
+        time_dimensions[0] if time_dimensions else None,
+        other_dimensions[0] if other_dimensions else None,
+    )
+
+
+def _covered_range(filters: dict) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """
+    The hours fully inside the time range of the filters: [start, end), where None is
+    unbounded. None if the filters are not only on created_at.
+    """
+    if any(key != "created_at" for key in filters.keys()):
+        return None
+    conditions = filters.get("created_at", {})
+    if not isinstance(conditions, dict):
+        return None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    for operator, value in conditions.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return None
+        if operator == "$gte":
+            bound = math.ceil(value / HOUR) * HOUR
+        elif operator == "$gt":
+            bound = (math.floor(value / HOUR) + 1) * HOUR
+        elif operator in ("$lte", "$lt"):
+            bound = math.floor(value / HOUR) * HOUR
+        else:
+            return None
+        if operator in ("$gte", "$gt"):
+            start = bound if start is None else max(start, bound)
+        else:
+            end = bound if end is None else min(end, bound)
+    return start, end
+
+
+def _bucket_filter(start: Optional[int], end: Optional[int]) -> Dict[str, object]:
+    """Filter of the buckets in [start, end), where None is unbounded"""
+    bucket_filter: Dict[str, int] = {}
+    if start is not None:
+        bucket_filter["$gte"] = start
+    if end is not None:
+        bucket_filter["$lt"] = end
+    if not bucket_filter:
+        return {}
+    return {"bucket_start": bucket_filter}
+
+
+def _covers(total: dict, dimension: Optional[str], field: Optional[str]) -> bool:
+    """Whether the dimension and the field are rolled up in a bucket"""
+    return (dimension is None or dimension in total["dimensions"]) and (
+        field is None or field in total["fields"]
+    )
+
+
+def _add(aggregates: Aggregates, key: Tuple[Optional[str], Any], other: dict) -> None:
+    aggregate = aggregates.get(key)
+    if aggregate is None:
+        aggregates[key] = dict(other)
+        return
+    aggregate["count"] += other["count"]
+    aggregate["sum"] += other["sum"]
+    aggregate["n"] += other["n"]
+    for operation, pick in (("min", min), ("max", max)):
+        if other[operation] is not None:
+            aggregate[operation] = (
+                other[operation]
+                if aggregate[operation] is None
+                else pick(aggregate[operation], other[operation])
+            )
+
+
+async def _aggregate_rollups(
+    query: AnalyticsQuery,
+    granularity: str,
+    buckets: List[int],
+    time_dimension: Optional[str],
+    dimension: Optional[str],
+    aggregates: Aggregates,
+) -> None:
+    if not buckets:
+        return
+    mongo_db = await get_mongo_db()
+    rollups = (
+        await mongo_db[ROLLUPS_COLLECTION]
+        .find(
+            {
+                "project_id": query.project_id,
+                "collection": query.collection,
+                "granularity": granularity,
+                "bucket_start": {"$in": buckets},
+                "dimension": dimension,
+            }
+        )
+        .to_list(length=None)
+    )
+    for rollup in rollups:
+        time = None
+        if time_dimension is not None:
+            time = datetime.datetime.fromtimestamp(
+                rollup["bucket_start"], datetime.timezone.utc
+            ).strftime(TIME_DIMENSIONS[time_dimension])
+        field_stats = next(
+            (
+                stats
+                for stats in rollup["stats"]
+                if stats["field"] == query.aggregation_field
+            ),
+            None,
+        )
+        _add(
+            aggregates,
+            (time, rollup["value"]),
+            {
+                "count": rollup["count"],
+                "sum": field_stats["sum"] if field_stats else 0,
+                "n": field_stats["count"] if field_stats else 0,
+                "min": field_stats["min"] if field_stats else None,
+                "max": field_stats["max"] if field_stats else None,
+            },
+        )
+
+
+async def _aggregate_raw(
+    query: AnalyticsQuery,
+    match: Dict[str, object],
+    time_dimension: Optional[str],
+    dimension: Optional[str],
+    aggregates: Aggregates,
+) -> None:
+    group_id: Dict[str, object] = {}
+    if time_dimension is not None:
+        group_id["time"] = {
+            "$dateToString": {
+                "format": TIME_DIMENSIONS[time_dimension],
+                "date": {"$toDate": {"$multiply": ["$created_at", 1000]}},
+            }
+        }
+    if dimension is not None:
+        group_id["value"] = {"$ifNull": [f"${dimension}", None]}
+    field = f"${query.aggregation_field}" if query.aggregation_field else None
+    pipeline: List[Dict[str, object]] = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": group_id,
+                "count": {"$sum": 1},
+                "sum": {"$sum": field} if field else {"$sum": 0},
+                "n": (
+                    {"$sum": {"$cond": [{"$isNumber": field}, 1, 0]}}
+                    if field
+                    else {"$sum": 0}
+                ),
+                "min": {"$min": field} if field else {"$min": None},
+                "max": {"$max": field} if field else {"$max": None},
+            }
+        },
+    ]
+    mongo_db = await get_mongo_db()
+    result = await mongo_db[query.collection].aggregate(pipeline).to_list(length=None)
+    for row in result:
+        _add(
+            aggregates,
+            (row["_id"].get("time"), row["_id"].get("value")),
+            {key: row[key] for key in ("count", "sum", "n", "min", "max")},
+        )
+
+
+def _value(operation: str, aggregate: Dict[str, Any]) -> Any:
+    if operation == "count":
+        return aggregate["count"]
+    if operation == "sum":
+        return aggregate["sum"]
+    if operation == "avg":
+        return aggregate["sum"] / aggregate["n"] if aggregate["n"] else None
+    return aggregate[operation]
+
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    # Same order of the types as Mongo: null, numbers, strings, booleans
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, str(value))
+
+
+def _sort(rows: List[dict], sort: Dict[str, int]) -> List[dict]:
+    # Sort by the last key first: the sort is stable
+    for key, direction in reversed(list(sort.items())):
+        rows.sort(key=lambda row: _sort_key(row.get(key)), reverse=direction == -1)
+    return rows
+
+
+async def run_analytics_query_on_rollups(
+    query: AnalyticsQuery,
+) -> Optional[List[dict]]:
+    """
+    Answer an analytics query with the rollups. Returns None if the rollups can't
+    answer it: the caller scans the raw collection.
+
+    The rollups can answer the queries:
+    - on tasks, sessions or events
+    - with filters only on created_at
+    - grouped by at most one of hour, day, month and one other dimension
+    - counting the documents, or aggregating a numeric field rolled up by the extractor
+    """
+    if query.collection not in ROLLUP_COLLECTIONS:
+        return None
+    if query.aggregation_operation != "count" and query.aggregation_field is None:
+        return None
+    dimensions = _split_dimensions(query.dimensions or [])
+    if dimensions is None:
+        return None
+    time_dimension, dimension = dimensions
+    covered_range = _covered_range(query.filters or {})
+    if covered_range is None:
+        return None
+    start, end = covered_range
+    if start is not None and end is not None and start >= end:
+        return None
+    field = query.aggregation_field if query.aggregation_operation != "count" else None
+
+    mongo_db = await get_mongo_db()
+    status = await mongo_db[ROLLUPS_STATUS_COLLECTION].find_one(
+        {"project_id": query.project_id, "collection": query.collection}
+    )
+    if status is None or not status.get("ready"):
+        return None
+    stale_hours: Set[int] = {
+        hour
+        for hour in status.get("stale_hours", [])
+        if (start is None or hour >= start) and (end is None or hour < end)
+    }
+    bucket_key = {"project_id": query.project_id, "collection": query.collection}
+
+    # Full days of the range: read from the daily rollups, if they can be used
+    days: List[int] = []
+    hours_ranges: List[Tuple[Optional[int], Optional[int]]] = []
+    day_start = math.ceil(start / DAY) * DAY if start is not None else None
+    day_end = math.floor(end / DAY) * DAY if end is not None else None
+    if time_dimension != "hour" and (
+        day_start is None or day_end is None or day_start < day_end
+    ):
+        daily_totals = await (
+            mongo_db[ROLLUPS_COLLECTION]
+            .find(
+                {
+                    **bucket_key,
+                    "granularity": "day",
+                    "dimension": None,
+                    **_bucket_filter(day_start, day_end),
+                },
+                {"bucket_start": 1, "dimensions": 1, "fields": 1},
+            )
+            .to_list(length=None)
+        )
+        stale_days = {hour - hour % DAY for hour in stale_hours}
+        for total in daily_totals:
+            day = total["bucket_start"]
+            if _covers(total, dimension, field) and day not in stale_days:
+                days.append(day)
+            else:
+                hours_ranges.append((day, day + DAY))
+        # The hours of the range before the first and after the last full day
+        if start is not None:
+            hours_ranges.append((start, day_start))
+        if end is not None:
+            hours_ranges.append((day_end, end))
+    else:
+        hours_ranges.append((start, end))
+
+    # The other hours of the range: read from the hourly rollups, if they can be used
+    hours: List[int] = []
+    raw_hours: Set[int] = set(stale_hours)
+    hours_filters = [
+        _bucket_filter(range_start, range_end)
+        for range_start, range_end in hours_ranges
+        if range_start is None or range_end is None or range_start < range_end
+    ]
+    if hours_filters:
+        hourly_filter = {**bucket_key, "granularity": "hour", "dimension": None}
+        if all(hours_filters):
+            hourly_filter["$or"] = hours_filters
+        hourly_totals = await (
+            mongo_db[ROLLUPS_COLLECTION]
+            .find(hourly_filter, {"bucket_start": 1, "dimensions": 1, "fields": 1})
+            .to_list(length=None)
+        )
+        for total in hourly_totals:
+            hour = total["bucket_start"]
+            if hour in stale_hours:
+                continue
+            if _covers(total, dimension, field):
+                hours.append(hour)
+            else:
+                raw_hours.add(hour)
+
+    if not days and not hours:
+        # Nothing to read from the rollups
+        return None
+
+    # Everything else is scanned in the raw collection
+    raw_conditions: List[Dict[str, object]] = [
+        # Like the raw scan, count the documents without a timestamp
+        {"created_at": {"$not": {"$type": "number"}}}
+    ]
+    if start is not None:
+        raw_conditions.append({"created_at": {"$lt": start}})
+    if end is not None:
+        raw_conditions.append({"created_at": {"$gte": end}})
+    raw_conditions.extend(
+        {"created_at": {"$gte": hour, "$lt": hour + HOUR}} for hour in raw_hours
+    )
+    raw_match: Dict[str, object] = {
+        "project_id": query.project_id,
+        "$or": raw_conditions,
+    }
+    if query.filters:
+        raw_match = {"$and": [raw_match, query.filters]}
+
+    aggregates: Aggregates = {}
+    await _aggregate_rollups(query, "day", days, time_dimension, dimension, aggregates)
+    await _aggregate_rollups(
+        query, "hour", hours, time_dimension, dimension, aggregates
+    )
+    await _aggregate_raw(query, raw_match, time_dimension, dimension, aggregates)
+    logger.debug(
+        f"Analytics query of {query.project_id} on rollups: {len(days)} days, "
+        f"{len(hours)} hours, {len(raw_hours)} raw hours"
+    )
+
+    rows = []
+    for (time, value), aggregate in aggregates.items():
+        row: Dict[str, Any] = {}
+        if time_dimension is not None:
+            row[time_dimension] = time
+        if dimension is not None:
+            row[dimension.replace(".", "_")] = value
+        row["value"] = _value(query.aggregation_operation, aggregate)
+        rows.append(row)
+    if query.sort:
+        rows = _sort(rows, query.sort)
+    return rows[: query.limit]
@@ -2,6 +2,17 @@ from typing import Dict, List, Literal, Optional, Tuple, cast
 
 from app.db.models import Event, EventDefinition, Project, Session, Task
 from app.db.mongo import get_mongo_db
+from app.services.mongo.project_version import (
+    increment_project_version,
+    mark_data_changed,
+)
+from app.services.mongo.rollups import get_created_at
+from app.services.mongo.events_summary import (
+    attach_events,
+    events_summary_match,
+    refresh_events_summary,
+    refresh_events_summary_of_events,
+)
 from app.services.mongo.tasks import task_filtering_pipeline_match
 from fastapi import HTTPException
 from loguru import logger
@@ -20,24 +31,17 @@ async def create_session(
     mongo_db = await get_mongo_db()
     new_session = Session(project_id=project_id, org_id=org_id, data=data)
     mongo_db["sessions"].insert_one(new_session.model_dump())
+    await mark_data_changed(project_id, "sessions", [new_session.created_at])
     return new_session
 
 
 async def get_session_by_id(session_id: str) -> Session:
     mongo_db = await get_mongo_db()
-    # session = await mongo_db["sessions"].find_one({"id": session_id})
-    # Merge events from the session
-    found_session = (
-        await mongo_db["sessions_with_events"]
-        .find(
-            {"id": session_id},
-        )
-        .to_list(length=1)
-    )
-    session = found_session[0] if found_session else None
-
+    session = await mongo_db["sessions"].find_one({"id": session_id})
     if session is None:
         raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    # Merge events from the session
+    await attach_events([session], "sessions")
     try:
         session_model = Session.model_validate(session)
     except Exception as e:
@@ -55,11 +59,12 @@ async def fetch_session_tasks(session_id: str, limit: int = 1000) -> List[Task]:
     """
     mongo_db = await get_mongo_db()
     tasks = (
-        await mongo_db["tasks_with_events"]
+        await mongo_db["tasks"]
         .find({"session_id": session_id})
         .sort("created_at", -1)
         .to_list(length=limit)
     )
+    await attach_events(tasks, "tasks")
     tasks = [Task.model_validate(data) for data in tasks]
     return tasks
 
@@ -99,6 +104,9 @@ async def edit_session_metadata(session_data: Session, **kwargs) -> Session:
     _ = await mongo_db["sessions"].update_one(
         {"id": session_data.id}, {"$set": session_data.model_dump()}
     )
+    await mark_data_changed(
+        session_data.project_id, "sessions", [session_data.created_at]
+    )
     updated_session = await get_session_by_id(session_data.id)
     return updated_session
 
@@ -374,6 +382,7 @@ async def add_event_to_session(
         score_range=score_range,
     )
     _ = await mongo_db["events"].insert_one(detected_event_data.model_dump())
+    await refresh_events_summary(sessions_ids=[session.id])
 
     if session.events is None:
         session.events = []
@@ -384,6 +393,10 @@ async def add_event_to_session(
         {"id": session.id, "project_id": session.project_id},
         {"$set": session.model_dump()},
     )
+    await mark_data_changed(
+        session.project_id, "events", [detected_event_data.created_at]
+    )
+    await mark_data_changed(session.project_id, "sessions", [session.created_at])
 
     return session
 
@@ -398,8 +411,10 @@ async def remove_event_from_session(session: Session, event_name: str) -> Sessio
         e.event_name for e in session.events
     ]:
         # Mark the event as removed in the events database
+        events_query = {"session_id": session.id, "event_name": event_name}
+        events_created_at = await get_created_at("events", events_query)
         await mongo_db["events"].update_many(
-            {"session_id": session.id, "event_name": event_name},
+            events_query,
             {
                 "$set": {
                     "removed": True,
@@ -407,6 +422,12 @@ async def remove_event_from_session(session: Session, event_name: str) -> Sessio
                 }
             },
         )
+        # The events of the tasks of the session are removed too
+        await refresh_events_summary_of_events(
+            {"session_id": session.id, "event_name": event_name}
+        )
+        await increment_project_version(session.project_id)
+        await mark_data_changed(session.project_id, "events", events_created_at)
 
         # Remove the event from the session
         session.events = [e for e in session.events if e.event_name != event_name]
@@ -439,6 +460,9 @@ async def human_eval_session(
         },
     )
     session_model.stats.human_eval = flag
+    await mark_data_changed(
+        session_model.project_id, "sessions", [session_model.created_at]
+    )
 
     return session_model
 
@@ -486,31 +510,18 @@ async def session_filtering_pipeline_match(
     if filters.flag is not None:
         match["stats.most_common_flag"] = filters.flag
 
+    # Indexed match on the events summary of the sessions (see events_summary.py)
     if filters.event_name is not None:
-        collection = "sessions_with_events"
-        match["$and"] = [
-            {"events": {"$ne": []}},
-            {
-                "events": {
-                    "$elemMatch": {
-                        "event_name": {"$in": filters.event_name},
-                    }
-                }
-            },
-        ]
+        match.update(
+            events_summary_match(
+                "event_name", filters.event_name, collection="sessions"
+            )
+        )
 
     if filters.event_id is not None:
-        collection = "sessions_with_events"
-        match["$and"] = [
-            {"events": {"$ne": []}},
-            {
-                "events": {
-                    "$elemMatch": {
-                        "id": {"$in": filters.event_id},
-                    }
-                }
-            },
-        ]
+        match.update(
+            events_summary_match("id", filters.event_id, collection="sessions")
+        )
 
     if filters.clustering_id is not None and filters.clusters_ids is None:
         # Fetch the clusterings
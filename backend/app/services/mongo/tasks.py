@@ -7,6 +7,21 @@ from phospho.utils import filter_nonjsonable_keys
 import pydantic
 from app.db.models import Eval, EventDefinition, Task, Event
 from app.db.mongo import get_mongo_db
+from app.services.mongo.project_version import (
+    increment_project_version,
+    mark_data_changed,
+)
+from app.services.mongo.events_summary import (
+    attach_events,
+    events_summary_match,
+    refresh_events_summary,
+)
+from app.services.mongo.pagination import (
+    next_cursor,
+    pagination_stages,
+    sorting_to_dict,
+)
+from app.services.mongo.rollups import get_created_at
 from fastapi import HTTPException
 
 from app.utils import generate_uuid
@@ -47,14 +62,16 @@ async def create_task(
     doc_creation = await mongo_db["tasks"].insert_one(task_data.model_dump())
     if not doc_creation:
         raise Exception("Failed to insert the task in database")
+    await mark_data_changed(project_id, "tasks", [task_data.created_at])
     return task_data
 
 
 async def get_task_by_id(task_id: str) -> Task:
     mongo_db = await get_mongo_db()
-    task = await mongo_db["tasks_with_events"].find_one({"id": task_id})
+    task = await mongo_db["tasks"].find_one({"id": task_id})
     if task is None:
         raise HTTPException(status_code=404, detail=f"Task {task_id} not found")
+    await attach_events([task], "tasks")
 
     # Account for schema discrepancies
     if "id" not in task.keys():
@@ -119,6 +136,7 @@ async def human_eval_task(
         raise HTTPException(
             status_code=500, detail=f"Failed to update Task {task_model.id}: {e}"
         )
+    await mark_data_changed(task_model.project_id, "tasks", [task_model.created_at])
     # Update the session object
 
     try:
@@ -147,10 +165,15 @@ async def human_eval_task(
             session_flag = "success"
         else:
             session_flag = "failure"
-        await mongo_db["sessions"].update_one(
+        session = await mongo_db["sessions"].find_one_and_update(
             {"id": validated_task.session_id},
             {"$set": {"stats.human_eval": session_flag}},
+            projection={"created_at": 1},
         )
+        if session is not None:
+            await mark_data_changed(
+                task_model.project_id, "sessions", [session.get("created_at")]
+            )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -205,6 +228,7 @@ async def update_task(
         raise HTTPException(
             status_code=500, detail=f"Failed to update Task {task_model.id}: {e}"
         )
+    await mark_data_changed(task_model.project_id, "tasks", [task_model.created_at])
 
     return task_model
 
@@ -260,6 +284,9 @@ async def add_event_to_task(
         score_range=score_range,
     )
     await mongo_db["events"].insert_one(detected_event_data.model_dump())
+    await refresh_events_summary(tasks_ids=[task.id], sessions_ids=[task.session_id])
+    await increment_project_version(task.project_id)
+    await mark_data_changed(task.project_id, "events", [detected_event_data.created_at])
 
     if task.events is None:
         task.events = []
@@ -276,8 +303,10 @@ async def remove_event_from_task(task: Task, event_name: str) -> Task:
     # Check if the event is in the task
     if task.events is not None and event_name in [e.event_name for e in task.events]:
         # Mark the event as removed in the events database
+        events_query = {"task_id": task.id, "event_name": event_name}
+        events_created_at = await get_created_at("events", events_query)
         await mongo_db["events"].update_many(
-            {"task_id": task.id, "event_name": event_name},
+            events_query,
             {
                 "$set": {
                     "removed": True,
@@ -285,6 +314,11 @@ async def remove_event_from_task(task: Task, event_name: str) -> Task:
                 }
             },
         )
+        await refresh_events_summary(
+            tasks_ids=[task.id], sessions_ids=[task.session_id]
+        )
+        await increment_project_version(task.project_id)
+        await mark_data_changed(task.project_id, "events", events_created_at)
         # Remove the event from the task
         task.events = [e for e in task.events if e.event_name != event_name]
 
@@ -314,6 +348,7 @@ async def task_filtering_pipeline_match(
         prefix += "."
 
     match: Dict[str, object] = {f"{prefix}project_id": project_id}
+    and_conditions: List[Dict[str, object]] = []
 
     if filters.tasks_ids is not None:
         match[f"{prefix}id"] = {"$in": filters.tasks_ids}
@@ -353,23 +388,16 @@ async def task_filtering_pipeline_match(
     if filters.flag is not None:
         match[f"{prefix}flag"] = filters.flag
 
+    # Indexed match on the events summary of the tasks (see events_summary.py)
     if filters.event_name is not None:
-        collection = "tasks_with_events"
-        match["$and"] = [
-            {f"{prefix}events": {"$ne": []}},
-            {
-                f"{prefix}events": {
-                    "$elemMatch": {"event_name": {"$in": filters.event_name}}
-                }
-            },
-        ]
+        and_conditions.append(
+            events_summary_match("event_name", filters.event_name, prefix=prefix)
+        )
 
     if filters.event_id is not None:
-        collection = "tasks_with_events"
-        match["$and"] = [
-            {f"{prefix}events": {"$ne": []}},
-            {f"{prefix}events": {"$elemMatch": {"id": {"$in": filters.event_id}}}},
-        ]
+        and_conditions.append(
+            events_summary_match("id", filters.event_id, prefix=prefix)
+        )
 
     if filters.clustering_id is not None and filters.clusters_ids is None:
         # Fetch the clusterings
@@ -400,11 +428,13 @@ async def task_filtering_pipeline_match(
             match[f"{prefix}id"] = {"$in": new_task_ids}
 
     if filters.has_notes is not None and filters.has_notes:
-        match["$and"] = [
-            {f"{prefix}notes": {"$exists": True}},
-            {f"{prefix}notes": {"$ne": None}},
-            {f"{prefix}notes": {"$ne": ""}},
-        ]
+        and_conditions.extend(
+            [
+                {f"{prefix}notes": {"$exists": True}},
+                {f"{prefix}notes": {"$ne": None}},
+                {f"{prefix}notes": {"$ne": ""}},
+            ]
+        )
 
     if filters.is_last_task is not None:
         logger.debug("FILTER: is last task")
@@ -423,6 +453,9 @@ async def task_filtering_pipeline_match(
     if filters.sessions_ids is not None:
         match[f"{prefix}session_id"] = {"$in": filters.sessions_ids}
 
+    if and_conditions:
+        match["$and"] = and_conditions
+
     return match, collection
 
 
@@ -519,6 +552,8 @@ async def label_sentiment_analysis(
             "$set": {"sentiment.label": "mixed"},
         },
     )
+    # All the tasks of the project may have been relabeled
+    await mark_data_changed(project_id, "tasks", None)
 
     return None
 
@@ -536,6 +571,35 @@ async def get_all_tasks(
     """
     Get all the tasks of a project.
     """
+    tasks, _ = await get_tasks_page(
+        project_id=project_id,
+        filters=filters,
+        get_events=get_events,
+        get_tests=get_tests,
+        validate_metadata=validate_metadata,
+        limit=limit,
+        pagination=pagination,
+        sorting=sorting,
+    )
+    return tasks
+
+
+async def get_tasks_page(
+    project_id: str,
+    filters: Optional[ProjectDataFilters] = None,
+    get_events: bool = True,
+    get_tests: bool = False,
+    validate_metadata: bool = False,
+    limit: Optional[int] = None,
+    pagination: Optional[Pagination] = None,
+    sorting: Optional[List[Sorting]] = None,
+) -> Tuple[List[Task], Optional[str]]:
+    """
+    Get the tasks of a project, and the cursor of the next page if there is one.
+
+    With a cursor in the pagination, the page is fetched with a keyset match instead
+    of skipping the previous pages (see app/services/mongo/pagination.py).
+    """
 
     mongo_db = await get_mongo_db()
     collection = "tasks"
@@ -563,42 +627,32 @@ async def get_all_tasks(
         }
     )
 
-    if not get_events:
-        collection = "tasks"
-
     # To avoid the sort to OOM on Serverless MongoDB executor, we restrain the pipeline to the necessary fields...
-    if sorting is None:
-        sorting_dict = {"created_at": -1}
-    else:
-        sorting_dict = {sort.id: 1 if sort.desc else -1 for sort in sorting}
-    pipeline.extend(
-        [
-            {
-                "$project": {
-                    "id": 1,
-                    **{sort_key: 1 for sort_key in sorting_dict.keys()},
-                }
-            },
-            {"$sort": sorting_dict},
-        ]
+    sorting_dict = sorting_to_dict(sorting)
+    pipeline.append(
+        {
+            "$project": {
+                "id": 1,
+                **{sort_key: 1 for sort_key in sorting_dict.keys()},
+            }
+        },
     )
 
     # Add pagination
     if pagination:
-        pipeline.extend(
-            [
-                {"$skip": pagination.page * pagination.per_page},
-                {"$limit": pagination.per_page},
-            ]
-        )
+        pipeline.extend(pagination_stages(pagination, sorting_dict))
         limit = None
+    else:
+        pipeline.append({"$sort": sorting_dict})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
 
-    # ... and then we add the lookup and the deduplication
+    # ... and then we add the lookup of the tasks of the page
     pipeline.extend(
         [
             {
                 "$lookup": {
-                    "from": "tasks_with_events",
+                    "from": "tasks",
                     "localField": "id",
                     "foreignField": "id",
                     "as": "tasks",
@@ -612,6 +666,12 @@ async def get_all_tasks(
     )
 
     tasks = await mongo_db[collection].aggregate(pipeline).to_list(length=limit)
+    cursor = next_cursor(tasks, sorting_dict, pagination)
+    if get_events:
+        await attach_events(tasks, "tasks")
+    else:
+        for task in tasks:
+            task["events"] = []
 
     # Cast to tasks
     valid_tasks = [Task.model_validate(data) for data in tasks]
@@ -622,4 +682,4 @@ async def get_all_tasks(
             if task.metadata is not None:
                 task.metadata = filter_nonjsonable_keys(task.metadata)
 
-    return valid_tasks
+    return valid_tasks, cursor
@@ -0,0 +1,281 @@
+"""
+Usage counters of organizations.
+
+The usage of an organization is its number of job_results. Counting them on every
+log request is a full index scan, so we maintain a counter per org in the
+`org_usage` collection:
+- nb_job_results: incremented by the extractor when it inserts job_results
+- nb_reserved: pending delta of the logs accepted by the /log endpoints of orgs with
+  a max usage and not processed yet. It's the sum of `reservations`.
+- reservations: {reservation_id: {"nb": nb_logs, "at": timestamp}}, one per batch.
+  The extractor releases the reservation of a batch once its job_results are
+  counted, and the backend releases it if the batch can't be submitted. Releasing
+  a reservation twice (eg: a retried activity) does nothing. Leftovers older than
+  RESERVATION_TTL (eg: crashed workflows) are dropped on reconciliation.
+- reconciled_at: last time nb_job_results was reset to the true count
+
+The org metadata (plan, customer_id) is fetched from Propelauth and cached.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+from loguru import logger
+from pymongo import ReturnDocument
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.security.authentification import propelauth
+from app.utils import generate_timestamp
+from app.utils.cache import TTLCache
+from phospho.models import UsageQuota
+
+org_metadata_cache = TTLCache(ttl=config.ORG_METADATA_CACHE_TTL, max_size=10_000)
+
+# Keep a reference to the background reconciliations so they are not garbage collected
+_reconciliation_tasks: set = set()
+
+
+async def fetch_org_metadata(org_id: str) -> Optional[dict]:
+    """
+    Fetch the org from Propelauth and return its metadata.
+    Returns None if the org doesn't exist.
+    """
+    cached_metadata = org_metadata_cache.get(org_id)
+    if cached_metadata is not None:
+        return cached_metadata
+
+    start_time = time.perf_counter()
+    # propelauth is synchronous: don't block the event loop
+    org = await asyncio.to_thread(propelauth.fetch_org, org_id)
+    org_metadata_cache.record_load_time(time.perf_counter() - start_time)
+    if not org:
+        return None
+    org_metadata = org.get("metadata", None) or {}
+    org_metadata_cache.set(org_id, org_metadata)
+    return org_metadata
+
+
+def invalidate_org_metadata(org_id: str) -> None:
+    """
+    Call this when the org metadata is updated (eg: plan change)
+    """
+    org_metadata_cache.pop(org_id)
+
+
+async def reconcile_org_usage(org_id: str) -> int:
+    """
+    Reset the usage counter of an org to the true number of job_results, and drop its
+    stale reservations. Returns the true number of job_results.
+    """
+    mongo_db = await get_mongo_db()
+    nb_job_results = await mongo_db["job_results"].count_documents({"org_id": org_id})
+    now = generate_timestamp()
+    # The reservations of the batches still being processed are kept
+    await mongo_db["org_usage"].update_one(
+        {"org_id": org_id},
+        [
+            {
+                "$set": {
+                    "reservations": {
+                        "$arrayToObject": {
+                            "$filter": {
+                                "input": {
+                                    "$objectToArray": {"$ifNull": ["$reservations", {}]}
+                                },
+                                "as": "reservation",
+                                "cond": {
+                                    "$gte": [
+                                        "$$reservation.v.at",
+                                        now - config.RESERVATION_TTL,
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            },
+            {
+                "$set": {
+                    "nb_job_results": nb_job_results,
+                    "nb_reserved": {
+                        "$sum": {
+                            "$map": {
+                                "input": {"$objectToArray": "$reservations"},
+                                "as": "reservation",
+                                "in": "$$reservation.v.nb",
+                            }
+                        }
+                    },
+                    "reconciled_at": now,
+                }
+            },
+        ],
+        upsert=True,
+    )
+    logger.debug(f"Reconciled usage of org {org_id}: {nb_job_results} job results")
+    return nb_job_results
+
+
+async def _schedule_reconciliation(org_id: str, reconciled_at: int) -> None:
+    """
+    Reconcile the usage of the org in the background. The reconciled_at timestamp is
+    claimed first, so that only one request triggers the reconciliation.
+    """
+    mongo_db = await get_mongo_db()
+    claimed = await mongo_db["org_usage"].update_one(
+        {"org_id": org_id, "reconciled_at": reconciled_at},
+        {"$set": {"reconciled_at": generate_timestamp()}},
+    )
+    if claimed.modified_count == 0:
+        # Another request already scheduled it
+        return
+    task = asyncio.create_task(reconcile_org_usage(org_id))
+    _reconciliation_tasks.add(task)
+    task.add_done_callback(_reconciliation_tasks.discard)
+
+
+async def get_org_usage(org_id: str) -> int:
+    """
+    Get the current usage of an org from its counter.
+
+    If the counter doesn't exist, it's created from the true count. If it's older
+    than QUOTA_RECONCILIATION_INTERVAL, it's reconciled in the background.
+    """
+    mongo_db = await get_mongo_db()
+    org_usage = await mongo_db["org_usage"].find_one({"org_id": org_id})
+    if org_usage is None or org_usage.get("reconciled_at") is None:
+        return await reconcile_org_usage(org_id)
+
+    if (
+        generate_timestamp() - org_usage["reconciled_at"]
+        > config.QUOTA_RECONCILIATION_INTERVAL
+    ):
+        await _schedule_reconciliation(org_id, org_usage["reconciled_at"])
+
+    return org_usage.get("nb_job_results", 0) + org_usage.get("nb_reserved", 0)
+
+
+async def reserve_usage(
+    usage_quota: UsageQuota, nb_logs: int, reservation_id: str
+) -> int:
+    """
+    Atomically reserve up to nb_logs units of usage for an org, under reservation_id.
+    Returns the number of logs that can be processed. The remaining logs are over
+    the quota.
+
+    Concurrent requests can't reserve more than max_usage in total.
+    """
+    if usage_quota.max_usage is None:
+        return nb_logs
+    if nb_logs <= 0:
+        return 0
+
+    mongo_db = await get_mongo_db()
+    current_usage = {
+        "$add": [
+            {"$ifNull": ["$nb_job_results", 0]},
+            {"$ifNull": ["$nb_reserved", 0]},
+        ]
+    }
+    # nb_granted = max(0, min(nb_logs, max_usage - current_usage))
+    nb_granted = {
+        "$max": [
+            0,
+            {
+                "$min": [
+                    nb_logs,
+                    {"$subtract": [usage_quota.max_usage, current_usage]},
+                ]
+            },
+        ]
+    }
+    # The update is atomic: we compute the same nb_granted from the document before it
+    org_usage_before = await mongo_db["org_usage"].find_one_and_update(
+        {"org_id": usage_quota.org_id},
+        [
+            {"$set": {"nb_granted": nb_granted}},
+            {
+                "$set": {
+                    "nb_reserved": {
+                        "$add": [{"$ifNull": ["$nb_reserved", 0]}, "$nb_granted"]
+                    },
+                    "reservations": {
+                        "$cond": [
+                            {"$gt": ["$nb_granted", 0]},
+                            {
+                                "$mergeObjects": [
+                                    {"$ifNull": ["$reservations", {}]},
+                                    {
+                                        reservation_id: {
+                                            "nb": "$nb_granted",
+                                            "at": generate_timestamp(),
+                                        }
+                                    },
+                                ]
+                            },
+                            {"$ifNull": ["$reservations", {}]},
+                        ]
+                    },
+                }
+            },
+            {"$unset": "nb_granted"},
+        ],
+        upsert=True,
+        return_document=ReturnDocument.BEFORE,
+    )
+    if org_usage_before is None:
+        org_usage_before = {}
+    available = usage_quota.max_usage - (
+        org_usage_before.get("nb_job_results", 0)
+        + org_usage_before.get("nb_reserved", 0)
+    )
+    return max(0, min(nb_logs, available))
+
+
+async def release_usage(usage_quota: UsageQuota, reservation_id: str) -> None:
+    """
+    Release the usage reserved for logs that won't be processed (eg: the workflow
+    couldn't be submitted). Does nothing if the reservation was already released.
+    """
+    if usage_quota.max_usage is None:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["org_usage"].update_one(
+        {
+            "org_id": usage_quota.org_id,
+            f"reservations.{reservation_id}": {"$exists": True},
+        },
+        [
+            {
+                "$set": {
+                    "nb_reserved": {
+                        "$max": [
+                            0,
+                            {
+                                "$subtract": [
+                                    {"$ifNull": ["$nb_reserved", 0]},
+                                    f"$reservations.{reservation_id}.nb",
+                                ]
+                            },
+                        ]
+                    }
+                }
+            },
+            {"$unset": f"reservations.{reservation_id}"},
+        ],
+    )
+
+
+async def increment_org_usage(org_id: Optional[str], nb_job_results: int) -> None:
+    """
+    Increment the usage counter of an org after inserting job_results
+    """
+    if org_id is None or nb_job_results == 0:
+        return
+    mongo_db = await get_mongo_db()
+    await mongo_db["org_usage"].update_one(
+        {"org_id": org_id},
+        {"$inc": {"nb_job_results": nb_job_results}},
+    )
@@ -0,0 +1,58 @@
+"""
+Decompression of request bodies.
+
+The SDK gzips its log batches and sets the `Content-Encoding: gzip` header. Use
+`route_class=GzipRoute` on a router to decode those bodies before FastAPI parses them.
+"""
+
+import zlib
+from typing import Callable
+
+from fastapi import HTTPException, Request, Response
+from fastapi.routing import APIRoute
+
+from app.core import config
+
+
+def decompress_gzip(body: bytes, max_size: int) -> bytes:
+    """
+    Decompress a gzip body. Raise an HTTPException if the body is invalid or if
+    it's bigger than max_size once decompressed (protection against zip bombs).
+    """
+    # 16 + MAX_WBITS: expect a gzip header and trailer
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        decompressed = decompressor.decompress(body, max_size)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    if decompressor.unconsumed_tail:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Decompressed body is larger than {max_size} bytes",
+        )
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Truncated gzip body")
+    return decompressed
+
+
+class GzipRequest(Request):
+    async def body(self) -> bytes:
+        if not hasattr(self, "_body"):
+            body = await super().body()
+            if "gzip" in self.headers.getlist("Content-Encoding"):
+                body = decompress_gzip(body, config.MAX_DECOMPRESSED_BODY_SIZE)
+            self._body = body
+        return self._body
+
+
+class GzipRoute(APIRoute):
+    """Route that accepts request bodies sent with Content-Encoding: gzip"""
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request: Request) -> Response:
+            request = GzipRequest(request.scope, request.receive)
+            return await original_route_handler(request)
+
+        return custom_route_handler
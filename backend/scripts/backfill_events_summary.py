@@ -0,0 +1,67 @@
+"""
+Migration: compute the events summary of the existing tasks and sessions.
+
+The events summary replaces the tasks_with_events and sessions_with_events views (see
+app/services/mongo/events_summary.py). New events keep it up to date. Until this
+script is run, filtering by event ignores the tasks and sessions without a summary.
+
+Only the documents without a summary are processed, so the script can be interrupted
+and run again.
+
+Usage: python -m scripts.backfill_events_summary [project_id ...] (with the backend
+environment variables). Without project ids, all the projects are migrated.
+"""
+
+import asyncio
+import sys
+from typing import List
+
+from app.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
+from app.services.mongo.events_summary import refresh_events_summary
+
+BATCH_SIZE = 1_000
+
+
+async def backfill(project_id: str, collection: str) -> int:
+    mongo_db = await get_mongo_db()
+    cursor = mongo_db[collection].find(
+        {"project_id": project_id, "events_summary": {"$exists": False}},
+        {"_id": 0, "id": 1},
+        batch_size=BATCH_SIZE,
+    )
+    nb_documents = 0
+    batch: List[str] = []
+    async for document in cursor:
+        batch.append(document["id"])
+        if len(batch) >= BATCH_SIZE:
+            await _refresh(collection, batch)
+            nb_documents += len(batch)
+            batch = []
+    await _refresh(collection, batch)
+    return nb_documents + len(batch)
+
+
+async def _refresh(collection: str, ids: List[str]) -> None:
+    if collection == "tasks":
+        await refresh_events_summary(tasks_ids=ids)
+    else:
+        await refresh_events_summary(sessions_ids=ids)
+
+
+async def main(project_ids: List[str]) -> None:
+    await connect_and_init_db()
+    mongo_db = await get_mongo_db()
+    if not project_ids:
+        project_ids = await mongo_db["projects"].distinct("id")
+    for i, project_id in enumerate(project_ids):
+        nb_tasks = await backfill(project_id, "tasks")
+        nb_sessions = await backfill(project_id, "sessions")
+        print(
+            f"[{i + 1}/{len(project_ids)}] Project {project_id}: "
+            f"{nb_tasks} tasks, {nb_sessions} sessions"
+        )
+    await close_mongo_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,55 @@
+"""
+This script is meant to be run in local environment to compare the number of workflow
+submissions per second when connecting to Temporal on every call (previous behaviour of
+ExtractorClient._post) and when reusing one shared client (app.db.temporal).
+
+Start a local Temporal dev server first: `temporal server start-dev`
+No worker is needed, the workflows are only queued with start_workflow.
+"""
+
+import asyncio
+import os
+import time
+
+from temporalio.client import Client
+
+TEMPORAL_HOST_URL = os.getenv("TEMPORAL_HOST_URL", "localhost:7233")
+TEMPORAL_NAMESPACE = os.getenv("TEMPORAL_NAMESPACE", "default")
+NB_SUBMISSIONS = int(os.getenv("NB_SUBMISSIONS", 200))
+WORKFLOW_NAME = "benchmark_workflow"
+TASK_QUEUE = "benchmark"
+
+
+async def submit(client: Client, i: int) -> None:
+    await client.start_workflow(
+        WORKFLOW_NAME,
+        {"logs_to_process": [], "index": i},
+        id=f"benchmark-{time.time_ns()}-{i}",
+        task_queue=TASK_QUEUE,
+    )
+
+
+async def connect_per_submission() -> float:
+    start = time.perf_counter()
+    for i in range(NB_SUBMISSIONS):
+        client = await Client.connect(TEMPORAL_HOST_URL, namespace=TEMPORAL_NAMESPACE)
+        await submit(client, i)
+    return NB_SUBMISSIONS / (time.perf_counter() - start)
+
+
+async def shared_client() -> float:
+    client = await Client.connect(TEMPORAL_HOST_URL, namespace=TEMPORAL_NAMESPACE)
+    start = time.perf_counter()
+    for i in range(NB_SUBMISSIONS):
+        await submit(client, i)
+    return NB_SUBMISSIONS / (time.perf_counter() - start)
+
+
+async def main():
+    print(f"Submitting {NB_SUBMISSIONS} workflows to {TEMPORAL_HOST_URL}")
+    print(f"Connect per submission: {await connect_per_submission():.1f} submissions/s")
+    print(f"Shared client:          {await shared_client():.1f} submissions/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,15 +5,21 @@ Major pytest fixtures (app, db,...) are defined here
 
 import logging
 import os
+import time
 
 import pymongo
 import pytest
 from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
 from app.security.authentification import propelauth
-from phospho.models import Project, Task, ProjectSettings, EventDefinition
+from phospho.models import Project, Task, ProjectSettings, EventDefinition, Session
 
-from tests.utils import cleanup
+from tests.utils import (
+    SEEDED_NB_DAYS,
+    SEEDED_NB_TASKS,
+    SEEDED_TASKS_PER_SESSION,
+    cleanup,
+)
 
 import phospho
 
@@ -210,6 +216,57 @@ def populated_project(mongo_db, org_id):
         cleanup(mongo_db, {"tasks": [task.id]})
 
 
+@pytest.fixture
+def seeded_project(mongo_db, org_id):
+    """
+    A project with SEEDED_NB_TASKS tasks spread over the last SEEDED_NB_DAYS days, in
+    sessions of SEEDED_TASKS_PER_SESSION tasks. The inputs and outputs are long, as
+    in real projects.
+    """
+    seeded_project = Project(project_name="seeded", org_id=org_id)
+    mongo_db["projects"].insert_one(seeded_project.model_dump())
+
+    end = int(time.time())
+    start = end - SEEDED_NB_DAYS * 24 * 60 * 60
+    step = (end - start) // SEEDED_NB_TASKS
+    tasks = []
+    sessions = []
+    for i in range(SEEDED_NB_TASKS):
+        created_at = start + i * step
+        if i % SEEDED_TASKS_PER_SESSION == 0:
+            session = Session(
+                project_id=seeded_project.id,
+                org_id=org_id,
+                created_at=created_at,
+                session_length=SEEDED_TASKS_PER_SESSION,
+            )
+            sessions.append(session)
+        tasks.append(
+            Task(
+                project_id=seeded_project.id,
+                org_id=org_id,
+                session_id=session.id,
+                created_at=created_at,
+                input=f"Question {i} " * 100,
+                output=f"Answer {i} " * 200,
+                flag="success" if i % 3 else "failure",
+            )
+        )
+    mongo_db["tasks"].insert_many([task.model_dump() for task in tasks])
+    mongo_db["sessions"].insert_many([session.model_dump() for session in sessions])
+
+    yield seeded_project
+
+    cleanup(
+        mongo_db,
+        {
+            "projects": [seeded_project.id],
+            "tasks": [task.id for task in tasks],
+            "sessions": [session.id for session in sessions],
+        },
+    )
+
+
 @pytest.fixture
 def minimal_log_content(dummy_project):
     return [
@@ -0,0 +1,61 @@
+from app.services.mongo.events_summary import (
+    events_summary_match,
+    is_active_in_task,
+    summarize_events,
+)
+
+
+def test_summarize_events():
+    events = [
+        {
+            "id": "e2",
+            "event_name": "question",
+            "event_definition": {"id": "d1"},
+            "created_at": 2,
+        },
+        {
+            "id": "e1",
+            "event_name": "question",
+            "event_definition": {"id": "d1"},
+            "created_at": 1,
+        },
+        {
+            "id": "e3",
+            "event_name": "goodbye",
+            "event_definition": {"id": "d2", "is_last_task": True},
+            "created_at": 3,
+        },
+        {
+            "id": "e4",
+            "event_name": "removed",
+            "event_definition": {"id": "d3"},
+            "created_at": 4,
+            "removed": True,
+        },
+    ]
+    summary = summarize_events(events)
+    assert [event["id"] for event in summary] == ["e1", "e3"]
+
+    # The events of the "last task" definitions only apply to the last task
+    assert is_active_in_task(summary[0], {"is_last_task": False})
+    assert not is_active_in_task(summary[1], {"is_last_task": False})
+    assert is_active_in_task(summary[1], {"is_last_task": True})
+
+
+def test_events_summary_match():
+    assert events_summary_match("event_name", ["a"], collection="sessions") == {
+        "events_summary.event_name": {"$in": ["a"]}
+    }
+    assert events_summary_match("id", ["e1"], prefix="tasks.") == {
+        "$or": [
+            {
+                "tasks.events_summary": {
+                    "$elemMatch": {"id": {"$in": ["e1"]}, "is_last_task": False}
+                }
+            },
+            {
+                "tasks.is_last_task": True,
+                "tasks.events_summary.id": {"$in": ["e1"]},
+            },
+        ]
+    }
@@ -1,3 +1,8 @@
+import math
+import time
+import tracemalloc
+
+import pandas as pd
 import pytest
 from loguru import logger
 
@@ -8,7 +13,13 @@ from app.services.mongo.explore import (
     compute_successrate_metadata_quantiles,
     compute_nb_items_with_metadata_field,
     compute_session_length_per_metadata,
+    get_daily_success_rate,
+    get_nb_of_daily_tasks,
+    get_nb_sessions_per_day,
 )
+from app.api.platform.models import ProjectDataFilters
+from app.services.mongo.tasks import get_all_tasks
+from tests.utils import SEEDED_NB_TASKS, SEEDED_TASKS_PER_SESSION
 
 
 @pytest.mark.asyncio
@@ -84,3 +95,62 @@ async def test_main_pipeline(db, populated_project):
         assert isinstance(average, float)
         assert isinstance(top_quantile, float)
         # assert bottom_quantile <= average <= top_quantile
+
+
+async def measure(coroutine_function, **kwargs):
+    """Returns the result, the duration in seconds and the peak of memory in MB"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = await coroutine_function(**kwargs)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak / 1024**2
+
+
+async def pandas_nb_of_daily_tasks(project_id: str):
+    """Former implementation: fetch all the tasks and group them with pandas"""
+    tasks = await get_all_tasks(project_id=project_id, limit=None)
+    df = pd.DataFrame([task.model_dump() for task in tasks])
+    df["date"] = pd.to_datetime(df["created_at"], unit="s", utc=True).dt.date
+    return df.groupby(["date"]).count().reset_index()[["date", "id"]]
+
+
+@pytest.mark.asyncio
+async def test_daily_metrics_benchmark(db, seeded_project):
+    async for mongo_db in db:
+        project_id = seeded_project.id
+
+        expected, pandas_duration, pandas_peak = await measure(
+            pandas_nb_of_daily_tasks, project_id=project_id
+        )
+        nb_daily_tasks, duration, peak = await measure(
+            get_nb_of_daily_tasks,
+            project_id=project_id,
+            filters=ProjectDataFilters(),
+        )
+        logger.info(
+            f"nb_daily_tasks of {SEEDED_NB_TASKS} tasks: "
+            f"pandas {pandas_duration:.2f}s {pandas_peak:.1f}MB, "
+            f"mongo {duration:.2f}s {peak:.1f}MB"
+        )
+
+        assert sum(point["nb_tasks"] for point in nb_daily_tasks) == SEEDED_NB_TASKS
+        nb_tasks_per_date = {
+            point["date"]: point["nb_tasks"] for point in nb_daily_tasks
+        }
+        for date, nb_tasks in zip(expected["date"], expected["id"]):
+            assert nb_tasks_per_date[date] == nb_tasks
+        assert peak < pandas_peak
+
+        daily_success_rate = await get_daily_success_rate(
+            project_id=project_id, filters=ProjectDataFilters()
+        )
+        assert all(0 <= point["success_rate"] <= 1 for point in daily_success_rate)
+
+        nb_sessions_per_day = await get_nb_sessions_per_day(
+            project_id=project_id, filters=ProjectDataFilters()
+        )
+        assert sum(point["nb_sessions"] for point in nb_sessions_per_day) == math.ceil(
+            SEEDED_NB_TASKS / SEEDED_TASKS_PER_SESSION
+        )
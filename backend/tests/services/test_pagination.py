@@ -0,0 +1,56 @@
+import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.models import Pagination
+from app.services.mongo.pagination import decode_cursor, encode_cursor, keyset_match
+from app.services.mongo.tasks import get_all_tasks, get_tasks_page
+
+
+def test_keyset_match():
+    sort = {"created_at": -1, "id": -1}
+    cursor = encode_cursor({"created_at": 10, "id": "b"}, sort)
+    assert cursor is not None
+    assert keyset_match(cursor, sort) == {
+        "$or": [
+            {"$or": [{"created_at": {"$lt": 10}}, {"created_at": None}]},
+            {"created_at": 10, "$or": [{"id": {"$lt": "b"}}, {"id": None}]},
+        ]
+    }
+    # Nulls come first in ascending order
+    sort = {"flag": 1, "id": 1}
+    cursor = encode_cursor({"id": "b"}, sort)
+    assert cursor is not None
+    assert keyset_match(cursor, sort) == {
+        "$or": [{"flag": {"$ne": None}}, {"flag": None, "id": {"$gt": "b"}}]
+    }
+    # Arrays can't be compared in a cursor
+    with pytest.raises(HTTPException) as e:
+        encode_cursor({"flag": ["a"], "id": "b"}, sort)
+    assert e.value.status_code == 400
+    # Datetimes can
+    sort = {"metadata.date": -1, "id": -1}
+    date = datetime.datetime(2024, 6, 1, 12, 30)
+    cursor = encode_cursor({"metadata": {"date": date}, "id": "b"}, sort)
+    assert decode_cursor(cursor, sort) == [date, "b"]
+
+
+@pytest.mark.asyncio
+async def test_tasks_cursor_pagination(db, populated_project):
+    async for mongo_db in db:
+        project_id = populated_project.id
+        all_tasks = await get_all_tasks(project_id=project_id, get_events=False)
+
+        tasks_ids = []
+        pagination = Pagination(page=0, per_page=2)
+        while True:
+            tasks, cursor = await get_tasks_page(
+                project_id=project_id, get_events=False, pagination=pagination
+            )
+            tasks_ids.extend(task.id for task in tasks)
+            if cursor is None:
+                break
+            pagination = Pagination(per_page=2, cursor=cursor)
+
+        assert tasks_ids == [task.id for task in all_tasks]
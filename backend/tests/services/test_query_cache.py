@@ -0,0 +1,47 @@
+import pytest
+
+from app.services.mongo.project_version import increment_data_version
+from app.services.mongo.query_cache import (
+    InMemoryQueryCacheBackend,
+    QueryCache,
+    query_cache_key,
+)
+
+
+def test_query_cache_key():
+    assert query_cache_key("p", "q", {"a": 1, "b": {"c": 2, "d": 3}}) == (
+        query_cache_key("p", "q", {"b": {"d": 3, "c": 2}, "a": 1})
+    )
+    assert query_cache_key("p", "q", {"a": 1}) != query_cache_key("p", "q", {"a": 2})
+    assert query_cache_key("p", "q", {"a": 1}) != query_cache_key("p2", "q", {"a": 1})
+
+
+@pytest.mark.asyncio
+async def test_query_cache(db, populated_project):
+    async for mongo_db in db:
+        project_id = populated_project.id
+        # Read the data version at every lookup
+        query_cache = QueryCache(
+            InMemoryQueryCacheBackend(ttl=60, max_size=10), data_version_ttl=0
+        )
+        nb_computations = 0
+
+        async def compute():
+            nonlocal nb_computations
+            nb_computations += 1
+            return [{"value": nb_computations}]
+
+        result = await query_cache.get_or_compute(project_id, "q", {"a": 1}, compute)
+        assert result == [{"value": 1}]
+        result = await query_cache.get_or_compute(project_id, "q", {"a": 1}, compute)
+        assert result == [{"value": 1}]
+        assert nb_computations == 1
+
+        # A write makes the entries of the project stale
+        await increment_data_version(project_id)
+        result = await query_cache.get_or_compute(project_id, "q", {"a": 1}, compute)
+        assert result == [{"value": 2}]
+
+        stats = query_cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
@@ -0,0 +1,69 @@
+import pytest
+
+from app.services.mongo.usage import (
+    get_org_usage,
+    increment_org_usage,
+    reconcile_org_usage,
+    release_usage,
+    reserve_usage,
+)
+from phospho.models import UsageQuota
+
+
+@pytest.mark.asyncio
+async def test_reserve_and_release_usage(db, org_id):
+    async for mongo_db in db:
+        await mongo_db["org_usage"].delete_many({"org_id": org_id})
+        current_usage = await get_org_usage(org_id)
+        usage_quota = UsageQuota(
+            org_id=org_id,
+            plan="hobby",
+            current_usage=current_usage,
+            max_usage=current_usage + 10,
+            max_usage_label="10",
+        )
+
+        assert await reserve_usage(usage_quota, 8, "batch_1") == 8
+        assert await reserve_usage(usage_quota, 8, "batch_2") == 2
+        assert await get_org_usage(org_id) == current_usage + 10
+
+        # A batch that couldn't be submitted gives back its usage
+        await release_usage(usage_quota, "batch_2")
+        assert await get_org_usage(org_id) == current_usage + 8
+
+        # Once processed, the logs are counted as job results, not reservations
+        await increment_org_usage(org_id, 8)
+        await release_usage(usage_quota, "batch_1")
+        assert await get_org_usage(org_id) == current_usage + 8
+
+        # Releasing a batch twice (eg: a retried workflow) does nothing
+        await release_usage(usage_quota, "batch_1")
+        assert await get_org_usage(org_id) == current_usage + 8
+
+
+@pytest.mark.asyncio
+async def test_reconcile_keeps_pending_reservations(db, org_id):
+    async for mongo_db in db:
+        await mongo_db["org_usage"].delete_many({"org_id": org_id})
+        usage_quota = UsageQuota(
+            org_id=org_id,
+            plan="hobby",
+            current_usage=0,
+            max_usage=100,
+            max_usage_label="100",
+        )
+        assert await reserve_usage(usage_quota, 5, "pending") == 5
+        # A reservation never released, eg: by a crashed workflow
+        await mongo_db["org_usage"].update_one(
+            {"org_id": org_id},
+            {
+                "$set": {"reservations.stale": {"nb": 3, "at": 0}},
+                "$inc": {"nb_reserved": 3},
+            },
+        )
+
+        nb_job_results = await reconcile_org_usage(org_id)
+        org_usage = await mongo_db["org_usage"].find_one({"org_id": org_id})
+        assert org_usage["nb_reserved"] == 5
+        assert list(org_usage["reservations"].keys()) == ["pending"]
+        assert await get_org_usage(org_id) == nb_job_results + 5
@@ -1,9 +1,15 @@
 import logging
+import os
 import pymongo
 from typing import Dict, List
 
 logger = logging.getLogger(__name__)
 
+# Size of the seeded_project fixture, used to benchmark the analytics
+SEEDED_NB_TASKS = int(os.getenv("SEEDED_NB_TASKS", 20_000))
+SEEDED_NB_DAYS = 30
+SEEDED_TASKS_PER_SESSION = 5
+
 
 def cleanup(
     mongo_db: pymongo.MongoClient,
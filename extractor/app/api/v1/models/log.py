@@ -57,6 +57,9 @@ class LogProcessRequestForTasks(BaseModel):
     extra_logs_to_save: List[LogEventForTasks]
     project_id: str
     org_id: str
+    # Usage reserved by the backend for this batch, released once it's processed
+    nb_reserved_usage: int = 0
+    reservation_id: Optional[str] = None
     customer_id: Optional[str] = None
 
 
@@ -77,4 +80,7 @@ class LogProcessRequestForMessages(BaseModel):
     extra_logs_to_save: List[MinimalLogEventForMessages]
     project_id: str
     org_id: str
+    # Usage reserved by the backend for this batch, released once it's processed
+    nb_reserved_usage: int = 0
+    reservation_id: Optional[str] = None
     customer_id: Optional[str] = None
@@ -43,6 +43,10 @@ class PipelineOpentelemetryRequest(BaseModel):
     current_usage: int
     max_usage: Optional[int] = None
     open_telemetry_data: dict
+    # Usage reserved by the backend for this export, released once it's processed
+    nb_reserved_usage: int = 0
+    reservation_id: Optional[str] = None
+    customer_id: Optional[str] = None
 
 
 class PipelineLangsmithRequest(BaseModel):
@@ -63,3 +67,10 @@ class PipelineLangfuseRequest(BaseModel):
     langfuse_public_key: Optional[str] = None
     langfuse_secret_key: Optional[str] = None
     customer_id: Optional[str] = None
+
+
+class RefreshRollupsRequest(BaseModel):
+    project_id: str
+    org_id: str
+    collection: str
+    customer_id: Optional[str] = None
@@ -48,6 +48,20 @@ OPENAI_MODEL_ID_FOR_EVAL = "gpt-4"
 OPENAI_MODEL_ID_FOR_EVENTS = "gpt-3.5-turbo-16k"
 EVALUATION_SOURCE = "phospho-6"  # If phospho
 FEW_SHOT_MAX_NUMBER_OF_EXAMPLES = 10
+# Max number of previous tasks of the session used as context of a task
+SESSION_CONTEXT_MAX_TASKS = 50
+# Projects and few-shot examples are cached, and reloaded when the project version
+# changes or at the latest after this time
+PROJECT_CACHE_TTL = 300  # in seconds
+# Limits of the LLM calls of the event detection, shared by all the pipelines of
+# the worker
+EVENT_DETECTION_MAX_CONCURRENCY = 10
+# Detect the LLM events with the same scope in a single LLM call per task
+GROUPED_EVENT_DETECTION = os.getenv("GROUPED_EVENT_DETECTION", "false") == "true"
+OPENAI_MAX_REQUESTS_PER_MINUTE = 500
+OPENAI_MAX_TOKENS_PER_MINUTE = 200_000
+# Responses of the LLM calls of the jobs are cached in Mongo for this time
+LLM_CACHE_TTL = 30 * 24 * 60 * 60  # in seconds
 
 
 ### SENTRY ###
@@ -79,6 +93,54 @@ if credentials_natural_language is not None:
         credentials_dict
     )
     GCP_SENTIMENT_CLIENT = language_v2.LanguageServiceClient(credentials=credentials)
+# Max number of sentiment analysis calls running at the same time
+SENTIMENT_MAX_CONCURRENCY = 16
+# Default quota of the GCP Natural Language API
+SENTIMENT_MAX_REQUESTS_PER_MINUTE = 600
+
+### WEBHOOKS ###
+WEBHOOK_TIMEOUT = 3  # in seconds
+WEBHOOK_MAX_CONNECTIONS = 100
+# Max number of requests sent at the same time to a host
+WEBHOOK_MAX_CONCURRENCY_PER_HOST = 4
+WEBHOOK_MAX_RETRIES = 3
+WEBHOOK_RETRY_BASE_DELAY = 1.0  # in seconds, doubled at each retry
+# Max number of events sent in a request. Above 1, the body is a list of events
+WEBHOOK_BATCH_SIZE = 1
+
+### ANALYTICS ROLLUPS ###
+# Hourly and daily buckets of the analytics, read by run_analytics_query
+ANALYTICS_ROLLUPS_ENABLED = os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true") == "true"
+ROLLUP_COLLECTIONS = ["tasks", "sessions", "events"]
+# Fields with few values, rolled up in every bucket
+ROLLUP_DIMENSIONS = {
+    "tasks": ["flag", "language", "environment"],
+    "sessions": ["environment"],
+    "events": ["event_name", "source"],
+}
+# Metadata keys rolled up in a bucket: the most frequent ones with string values
+ROLLUP_MAX_METADATA_KEYS = 10
+# A dimension with more values in a bucket isn't rolled up in this bucket
+ROLLUP_MAX_DIMENSION_VALUES = 50
+# Fields with count, sum, min and max in the buckets
+ROLLUP_NUMERIC_FIELDS = {
+    "tasks": [
+        "metadata.total_tokens",
+        "metadata.prompt_tokens",
+        "metadata.completion_tokens",
+        "metadata.sentiment_score",
+    ],
+    "sessions": [
+        "session_length",
+        "metadata.total_tokens",
+        "metadata.prompt_tokens",
+        "metadata.completion_tokens",
+    ],
+    "events": ["score_range.value"],
+}
+# The stale hours of a project are recomputed at most once per interval
+ROLLUP_UPDATE_INTERVAL = 60  # in seconds
+ROLLUP_BACKFILL_TIMEOUT = 2 * 60 * 60  # in seconds
 
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 SLACK_URL = os.getenv("SLACK_URL")
@@ -1,9 +1,185 @@
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from loguru import logger
 
+from app.api.v1.models import LogEventForTasks
 from app.db.mongo import get_mongo_db
 from app.services.connectors.base import BaseConnector
+from app.services.log import process_log_for_tasks
+
+
+def unpack_value(value: dict) -> Any:
+    """
+    Convert an OTLP/JSON AnyValue to a python value
+    """
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "intValue" in value:
+        # int64 are encoded as strings in OTLP/JSON
+        return int(value["intValue"])
+    if "boolValue" in value:
+        return value["boolValue"]
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "arrayValue" in value:
+        return [unpack_value(v) for v in value["arrayValue"].get("values", [])]
+    if "kvlistValue" in value:
+        return {
+            kv["key"]: unpack_value(kv.get("value", {}))
+            for kv in value["kvlistValue"].get("values", [])
+        }
+    if "bytesValue" in value:
+        return value["bytesValue"]
+    raise ValueError(f"Unknown value type: {value}")
+
+
+def unpack_attributes(attributes: List[dict]) -> dict:
+    """
+    Convert a list of OTLP attributes to a nested dict.
+    eg: "gen_ai.prompt.0.content" -> {"gen_ai": {"prompt": [{"content": ...}]}}
+    """
+    unpacked_attributes: dict = {}
+    for attr in attributes:
+        k = attr["key"]
+        try:
+            value = unpack_value(attr.get("value", {}))
+        except ValueError as e:
+            logger.error(e)
+            continue
+
+        keys = k.split(".")
+        current_dict = unpacked_attributes
+        for i, key in enumerate(keys[:-1]):
+            if key.isdigit():
+                # Skip if key is a digit: No need to unpack
+                continue
+
+            # Initialize the key if it does not exist
+            if key not in current_dict:
+                if keys[i + 1].isdigit():
+                    # If next key is a digit, then current key is a list
+                    current_dict[key] = []
+                else:
+                    # If next key is not a digit, then current key is a dictionary
+                    current_dict[key] = {}
+
+            # Move to the next level
+            if keys[i + 1].isdigit():
+                # If next key is a digit, then the current key is a list
+                if not isinstance(current_dict[key], list):
+                    break
+                while len(current_dict[key]) < int(keys[i + 1]) + 1:
+                    current_dict[key].append({})
+                current_dict = current_dict[key][int(keys[i + 1])]
+            else:
+                if not isinstance(current_dict[key], dict):
+                    # The key is both a value and a prefix: keep the value
+                    break
+                current_dict = current_dict[key]
+        else:
+            current_dict[keys[-1]] = value
+    return unpacked_attributes
+
+
+def iter_spans(data: dict) -> Iterator[Tuple[dict, dict]]:
+    """
+    Iterate over all the spans of an OTLP/JSON export request.
+    Yields (attributes of the resource, span)
+    """
+    for resource_spans in data.get("resourceSpans", []):
+        resource_attributes = unpack_attributes(
+            resource_spans.get("resource", {}).get("attributes", [])
+        )
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                yield resource_attributes, span
+
+
+def _nano_to_seconds(timestamp: Optional[Any]) -> Optional[int]:
+    # fixed64 are encoded as strings in OTLP/JSON
+    if timestamp is None:
+        return None
+    return int(timestamp) // 1_000_000_000
+
+
+def _get_nested(d: Any, *keys: str) -> Any:
+    """d[key1][key2]..., or None if a key is missing"""
+    for key in keys:
+        if not isinstance(d, dict):
+            return None
+        d = d.get(key)
+    return d
+
+
+def _message_content(message: Any) -> Optional[str]:
+    content = _get_nested(message, "content")
+    if content is None:
+        return None
+    return content if isinstance(content, str) else str(content)
+
+
+def span_to_log_event(
+    span: dict,
+    attributes: dict,
+    resource_attributes: dict,
+    project_id: str,
+    org_id: str,
+) -> LogEventForTasks:
+    """
+    Convert a span with the GenAI semantic conventions attributes to a log event.
+    The attributes of the span must be unpacked.
+    """
+    prompt = _get_nested(attributes, "gen_ai", "prompt")
+    prompt = prompt if isinstance(prompt, list) else []
+    completion = _get_nested(attributes, "gen_ai", "completion")
+    completion = completion if isinstance(completion, list) else []
+
+    # The input is the last message of the user
+    user_messages = [m for m in prompt if _get_nested(m, "role") == "user"]
+    input = _message_content(user_messages[-1] if user_messages else None)
+    if input is None and prompt:
+        input = _message_content(prompt[-1])
+    output = _message_content(completion[0]) if completion else None
+
+    trace_id = span.get("traceId")
+    span_id = span.get("spanId")
+    metadata = {
+        "model": _get_nested(attributes, "gen_ai", "response", "model")
+        or _get_nested(attributes, "gen_ai", "request", "model"),
+        "gen_ai_system": _get_nested(attributes, "gen_ai", "system"),
+        # Names of the current and of the older semantic conventions
+        "prompt_tokens": _get_nested(attributes, "gen_ai", "usage", "input_tokens")
+        or _get_nested(attributes, "gen_ai", "usage", "prompt_tokens"),
+        "completion_tokens": _get_nested(attributes, "gen_ai", "usage", "output_tokens")
+        or _get_nested(attributes, "gen_ai", "usage", "completion_tokens"),
+        "service_name": _get_nested(resource_attributes, "service", "name"),
+        "otel_span_name": span.get("name"),
+        "otel_trace_id": trace_id,
+        "otel_span_id": span_id,
+    }
+    log_event = LogEventForTasks(
+        project_id=project_id,
+        org_id=org_id,
+        input=input or "",
+        output=output,
+        raw_input=prompt or None,
+        raw_output=completion or None,
+        # The spans of a trace are in the same session
+        session_id=_get_nested(attributes, "session", "id") or trace_id,
+        user_id=_get_nested(attributes, "user", "id"),
+        metadata={k: v for k, v in metadata.items() if v is not None},
+    )
+    created_at = _nano_to_seconds(span.get("startTimeUnixNano"))
+    if created_at is not None:
+        log_event.client_created_at = created_at
+        log_event.created_at = created_at
+    last_update = _nano_to_seconds(span.get("endTimeUnixNano"))
+    if last_update is not None:
+        log_event.last_update = last_update
+    if trace_id and span_id:
+        # Deterministic, so that an export sent again doesn't create the tasks twice
+        log_event.task_id = f"{trace_id}{span_id}"
+    return log_event
 
 
 class OpenTelemetryConnector(BaseConnector):
@@ -18,7 +194,7 @@ class OpenTelemetryConnector(BaseConnector):
         Store the raw data in the database
         """
         mongo_db = await get_mongo_db()
-        mongo_db["logs_opentelemetry"].insert_one(self.data)
+        await mongo_db["logs_opentelemetry"].insert_one(self.data)
 
     async def process(
         self,
@@ -27,86 +203,77 @@ class OpenTelemetryConnector(BaseConnector):
         max_usage: Optional[int] = None,
     ) -> int:
         """
-        Push the data and process it
+        Convert all the GenAI spans of the export request to logs and process them.
+        Returns the number of processed logs.
         """
-        self._dump()
-        try:
-            # TODO: Find better way of doing this
-            resource_spans = self.data["resourceSpans"]
-            resource = resource_spans[0]["scopeSpans"]
-            spans = resource[0]["spans"][0]
-
-            # Unpack attributes
-            attributes = spans["attributes"]
-            unpacked_attributes = {}
-            for attr in attributes:
-                k = attr["key"]
-
-                if "stringValue" in attr["value"]:
-                    value = attr["value"]["stringValue"]
-                elif "intValue" in attr["value"]:
-                    value = attr["value"]["intValue"]
-                elif "boolValue" in attr["value"]:
-                    value = attr["value"]["boolValue"]
-                elif "doubleValue" in attr["value"]:
-                    value = attr["value"]["doubleValue"]
-                elif "arrayValue" in attr["value"]:
-                    value = attr["value"]["arrayValue"]
-                else:
-                    logger.error(f"Unknown value type: {attr['value']}")
-                    continue
-
-                keys = k.split(".")
-                current_dict = unpacked_attributes
-                for i, key in enumerate(keys[:-1]):
-                    if key.isdigit():
-                        # Skip if key is a digit: No need to unpack
-                        continue
-
-                    # Initialize the key if it does not exist
-                    if key not in current_dict:
-                        if keys[i + 1].isdigit():
-                            # If next key is a digit, then current key is a list
-                            current_dict[key] = []
-                        else:
-                            # If next key is not a digit, then current key is a dictionary
-                            current_dict[key] = {}
-
-                    # Move to the next level
-                    if keys[i + 1].isdigit():
-                        # If next key is a digit, then the current key is a list
-                        if len(current_dict[key]) < int(keys[i + 1]) + 1:
-                            current_dict[key].append({})
-                        try:
-                            current_dict = current_dict[key][int(keys[i + 1])]
-                        except IndexError:
-                            logger.error(
-                                f"IndexError: {key} {keys[i + 1]} {current_dict[key]}"
-                            )
-                            continue
-                    else:
-                        current_dict = current_dict[key]
-                current_dict[keys[-1]] = value
-
-            spans["attributes"] = unpacked_attributes
-
-            # We only keep the spans that have the "gen_ai.system" attribute
-            if "gen_ai" in unpacked_attributes:
-                mongo_db = await get_mongo_db()
-
-                # Store the data in the database
-                mongo_db["opentelemetry"].insert_one(
-                    {
-                        "org_id": org_id,
-                        "project_id": self.project_id,
-                        "open_telemetry_data": spans,
-                    }
+        await self._dump()
+
+        spans_to_store: List[Dict[str, Any]] = []
+        log_events: List[LogEventForTasks] = []
+        nb_spans = 0
+        for resource_attributes, span in iter_spans(self.data):
+            nb_spans += 1
+            attributes = unpack_attributes(span.get("attributes", []))
+            # We only keep the spans that have the "gen_ai.*" attributes
+            if not isinstance(attributes.get("gen_ai"), dict):
+                continue
+            try:
+                log_event = span_to_log_event(
+                    span,
+                    attributes,
+                    resource_attributes,
+                    project_id=self.project_id,
+                    org_id=org_id,
+                )
+            except Exception as e:
+                logger.error(
+                    f"Error converting OpenTelemetry span {span.get('spanId')} for project id: {self.project_id}, {e}"
                 )
-                logger.info("Opentelemetry data stored in the database")
+                continue
+            spans_to_store.append(
+                {
+                    "org_id": org_id,
+                    "project_id": self.project_id,
+                    "open_telemetry_data": {**span, "attributes": attributes},
+                }
+            )
+            log_events.append(log_event)
 
-            # TODO: Implement the log processing
+        # The spans of an export sent again are already tasks: they are neither
+        # processed nor counted in the usage a second time
+        mongo_db = await get_mongo_db()
+        existing_task_ids = set(
+            await mongo_db["tasks"].distinct(
+                "id",
+                {
+                    "project_id": self.project_id,
+                    "id": {"$in": [log_event.task_id for log_event in log_events]},
+                },
+            )
+        )
+        logs_to_process: List[LogEventForTasks] = []
+        extra_logs_to_save: List[LogEventForTasks] = []
+        for log_event in log_events:
+            if log_event.task_id in existing_task_ids:
+                continue
+            existing_task_ids.add(log_event.task_id)
+            if max_usage is None or current_usage < max_usage:
+                logs_to_process.append(log_event)
+                current_usage += 1
+            else:
+                extra_logs_to_save.append(log_event)
 
-        except KeyError as e:
-            logger.error(f"KeyError: {e}")
+        logger.info(
+            f"Project {self.project_id}: {len(spans_to_store)} GenAI spans out of {nb_spans} OpenTelemetry spans"
+        )
+        if not spans_to_store:
+            return 0
 
-        return 0
+        await mongo_db["opentelemetry"].insert_many(spans_to_store)
+        await process_log_for_tasks(
+            project_id=self.project_id,
+            org_id=org_id,
+            logs_to_process=logs_to_process,
+            extra_logs_to_save=extra_logs_to_save,
+        )
+        return len(logs_to_process)
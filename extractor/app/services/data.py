@@ -2,43 +2,614 @@
 Data pipeline related code
 """
 
-from typing import List
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 
-from app.services.tasks import get_task_by_id
+from app.core import config
 from app.db.mongo import get_mongo_db
-from app.db.models import Task
+from app.db.models import Project, Task
+from phospho.models import SessionStats
+from app.services.projects import get_cached
+from pymongo import UpdateOne
 
+PHOSPHO_EVENT_MODEL_NAMES = ["phospho-6", "owner", "phospho-4"]
 
-async def fetch_previous_tasks(task_id: str) -> List[Task]:
+
+async def fetch_previous_tasks(
+    tasks: List[Task],
+    max_previous_tasks: int = config.SESSION_CONTEXT_MAX_TASKS,
+) -> Dict[str, List[Task]]:
     """
-    Fetch all the previous tasks until the task, if the task is linked to a session.
-    TODO : Query limits
+    Fetch the previous tasks of the session of each task, oldest first.
+    Returns a dict task_id -> previous tasks. Only the max_previous_tasks most recent
+    tasks before each task are kept.
+
+    The tasks of all the sessions are fetched in a single query, so the cost depends
+    on the number of sessions and not on the number of tasks. An extra query is only
+    needed when tasks of a session are far apart in the batch.
     """
-    # Get the document with a specific ID
+    previous_tasks_by_task_id: Dict[str, List[Task]] = {task.id: [] for task in tasks}
+    if max_previous_tasks <= 0:
+        return previous_tasks_by_task_id
+
+    # Tasks whose previous tasks are not loaded yet, grouped by session
+    pending: Dict[Tuple[str, str], List[Task]] = defaultdict(list)
+    for task in tasks:
+        if task.session_id is not None:
+            pending[(task.project_id, task.session_id)].append(task)
+    # Tasks of the session loaded so far, by id
+    histories: Dict[Tuple[str, str], Dict[str, Task]] = defaultdict(dict)
+
     mongo_db = await get_mongo_db()
-    task = await get_task_by_id(task_id)
+    while pending:
+        # Load the most recent tasks before the latest pending task of each session
+        limits = {
+            session_key: max_previous_tasks + len(session_tasks)
+            for session_key, session_tasks in pending.items()
+        }
+        sessions = (
+            await mongo_db["tasks"]
+            .aggregate(
+                [
+                    {
+                        "$match": {
+                            "$or": [
+                                {
+                                    "project_id": project_id,
+                                    "session_id": session_id,
+                                    "created_at": {
+                                        "$lt": max(t.created_at for t in session_tasks)
+                                    },
+                                }
+                                for (
+                                    project_id,
+                                    session_id,
+                                ), session_tasks in pending.items()
+                            ]
+                        }
+                    },
+                    {"$sort": {"created_at": -1}},
+                    {
+                        "$group": {
+                            "_id": {
+                                "project_id": "$project_id",
+                                "session_id": "$session_id",
+                            },
+                            # Most recent first, thanks to the sort
+                            "tasks": {
+                                "$firstN": {
+                                    "input": "$$ROOT",
+                                    "n": max(limits.values()),
+                                }
+                            },
+                        }
+                    },
+                ]
+            )
+            .to_list(length=None)
+        )
+        loaded_tasks = {
+            (session["_id"]["project_id"], session["_id"]["session_id"]): session[
+                "tasks"
+            ]
+            for session in sessions
+        }
 
-    if task.session_id is None:
-        return [task]
+        still_pending: Dict[Tuple[str, str], List[Task]] = defaultdict(list)
+        for session_key, session_tasks in pending.items():
+            session_data = loaded_tasks.get(session_key, [])[: limits[session_key]]
+            history = histories[session_key]
+            for data in session_data:
+                if data["id"] not in history:
+                    history[data["id"]] = Task.model_validate(data)
+            # Fewer tasks than the limit: we reached the start of the session
+            reached_start = len(session_data) < limits[session_key]
+            sorted_history = sorted(history.values(), key=lambda t: t.created_at)
+            for task in session_tasks:
+                previous_tasks = [
+                    previous_task
+                    for previous_task in sorted_history
+                    if previous_task.created_at < task.created_at
+                ]
+                if reached_start or len(previous_tasks) >= max_previous_tasks:
+                    previous_tasks_by_task_id[task.id] = previous_tasks[
+                        -max_previous_tasks:
+                    ]
+                else:
+                    still_pending[session_key].append(task)
+        pending = still_pending
 
-    # Get the tasks of the session before the task
-    previous_tasks = (
-        await mongo_db["tasks"]
-        .find(
+    return previous_tasks_by_task_id
+
+
+async def fetch_few_shot_examples(project: Project) -> Dict[str, List[dict]]:
+    """
+    Fetch the most recent successful (confirmed) and unsuccessful (removed by the
+    user) detection of each llm based event of the project, with the input and
+    output of its task.
+    """
+    mongo_db = await get_mongo_db()
+    llm_based_events = []
+    for event_name, event in project.settings.events.items():
+        if event.detection_engine == "llm_detection":
+            llm_based_events.append(event_name)
+
+    # Matches at most one successful example per event_name
+    successful_events = (
+        await mongo_db["events"]
+        .aggregate(
+            [
+                {
+                    "$match": {
+                        "project_id": project.id,
+                        "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
+                        "confirmed": True,
+                        "removed": False,
+                        "event_name": {
+                            "$in": llm_based_events
+                        },  # filter by event names in project.settings.event
+                    }
+                },
+                {
+                    "$facet": {
+                        "event_names": [{"$group": {"_id": "$event_name"}}],
+                        "events": [
+                            {"$sort": {"created_at": -1}},
+                            {
+                                "$group": {
+                                    "_id": "$event_name",
+                                    "first_event": {"$first": "$$ROOT"},
+                                }
+                            },
+                            {"$replaceRoot": {"newRoot": "$first_event"}},
+                            {
+                                "$lookup": {
+                                    "from": "tasks",
+                                    "localField": "task_id",
+                                    "foreignField": "id",
+                                    "as": "task",
+                                }
+                            },
+                            {"$unwind": "$task"},
+                            {
+                                "$addFields": {
+                                    "event_name": "$event_name",
+                                    "output": "$task.output",
+                                    "input": "$task.input",
+                                }
+                            },
+                            {
+                                "$project": {
+                                    "input": 1,
+                                    "output": 1,
+                                    "event_name": 1,
+                                }
+                            },
+                        ],
+                    }
+                },
+                {
+                    "$project": {
+                        "events": {
+                            "$setDifference": [
+                                "$events",
+                                {
+                                    "$map": {
+                                        "input": "$event_names",
+                                        "as": "event_name",
+                                        "in": {
+                                            "$filter": {
+                                                "input": "$events",
+                                                "as": "event",
+                                                "cond": {
+                                                    "$eq": [
+                                                        "$$event.event_name",
+                                                        "$$event_name._id",
+                                                    ]
+                                                },
+                                            }
+                                        },
+                                    }
+                                },
+                            ]
+                        }
+                    }
+                },
+                {"$unwind": "$events"},
+                {"$replaceRoot": {"newRoot": "$events"}},
+            ]
+        )
+        .to_list(length=None)
+    )
+
+    # Matches at most one unsuccessful example per event_name
+    unsuccessful_events = (
+        await mongo_db["events"]
+        .aggregate(
+            [
+                {
+                    "$match": {
+                        "project_id": project.id,
+                        "removed": True,
+                        "confirmed": False,
+                        "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
+                        "removal_reason": {"$regex": "removed_by_user"},
+                        "event_name": {"$in": llm_based_events},
+                    }
+                },
+                {
+                    "$facet": {
+                        "event_names": [{"$group": {"_id": "$event_name"}}],
+                        "events": [
+                            {"$sort": {"created_at": -1}},
+                            {
+                                "$group": {
+                                    "_id": "$event_name",
+                                    "first_event": {"$first": "$$ROOT"},
+                                }
+                            },
+                            {"$replaceRoot": {"newRoot": "$first_event"}},
+                            {
+                                "$lookup": {
+                                    "from": "tasks",
+                                    "localField": "task_id",
+                                    "foreignField": "id",
+                                    "as": "task",
+                                }
+                            },
+                            {"$unwind": "$task"},
+                            {
+                                "$addFields": {
+                                    "event_name": "$event_name",
+                                    "output": "$task.output",
+                                    "input": "$task.input",
+                                }
+                            },
+                            {
+                                "$project": {
+                                    "input": 1,
+                                    "output": 1,
+                                    "event_name": 1,
+                                }
+                            },
+                        ],
+                    }
+                },
+                {
+                    "$project": {
+                        "events": {
+                            "$setDifference": [
+                                "$events",
+                                {
+                                    "$map": {
+                                        "input": "$event_names",
+                                        "as": "event_name",
+                                        "in": {
+                                            "$filter": {
+                                                "input": "$events",
+                                                "as": "event",
+                                                "cond": {
+                                                    "$eq": [
+                                                        "$$event.event_name",
+                                                        "$$event_name._id",
+                                                    ]
+                                                },
+                                            }
+                                        },
+                                    }
+                                },
+                            ]
+                        }
+                    }
+                },
+                {"$unwind": "$events"},
+                {"$replaceRoot": {"newRoot": "$events"}},
+            ]
+        )
+        .to_list(length=None)
+    )
+
+    return {
+        "successful_events": successful_events,
+        "unsuccessful_events": unsuccessful_events,
+    }
+
+
+async def get_few_shot_examples(
+    project: Project, project_version: int
+) -> Dict[str, List[dict]]:
+    """
+    Cached version of fetch_few_shot_examples. The examples are reloaded when the
+    version of the project changes, eg when an event is confirmed or removed.
+    """
+    few_shot_examples = await get_cached(
+        ("few_shot_examples", project.id),
+        project_version,
+        lambda: fetch_few_shot_examples(project),
+    )
+    # The lists are shared by the pipelines using the cache
+    return {key: list(examples) for key, examples in few_shot_examples.items()}
+
+
+# Task fields averaged, and task fields whose most common value is kept, in the stats
+# of a session
+SESSION_AVERAGED_FIELDS = {
+    "sentiment_score": "avg_sentiment_score",
+    "sentiment_magnitude": "avg_magnitude_score",
+}
+SESSION_COUNTED_FIELDS = {
+    "sentiment_label": "most_common_sentiment_label",
+    "language": "most_common_language",
+    "flag": "most_common_flag",
+}
+
+
+def task_session_stats_contribution(task: dict) -> dict:
+    """
+    Values of a task counted in the stats of its session
+    """
+    sentiment = task.get("sentiment") or {}
+    return {
+        "sentiment_score": sentiment.get("score"),
+        "sentiment_magnitude": sentiment.get("magnitude"),
+        "sentiment_label": sentiment.get("label"),
+        "language": task.get("language"),
+        "flag": task.get("flag"),
+    }
+
+
+def task_preview(task: dict) -> str:
+    """Same as Task.preview, but a missing input or output doesn't raise"""
+
+    def first_words(text: str) -> str:
+        words = text.split(" ")
+        return " ".join(words[:10]) + "..." if len(words) > 10 else text
+
+    preview = first_words(task.get("input") or "")
+    if task.get("output") is not None:
+        preview += " -> " + first_words(task["output"])
+    return preview
+
+
+def session_stats_delta(
+    contributions: List[Tuple[Optional[dict], dict]],
+) -> dict:
+    """
+    Change of the stats counters of a session when the contributions of some of its
+    tasks go from the first to the second element of each pair. The first is None
+    for the tasks not counted yet.
+
+    The counters are a sum and a count for the averaged fields, and the number of
+    tasks of every value for the counted fields. Zero changes are left out.
+    """
+    delta: Dict[str, dict] = {
+        **{field: {"sum": 0, "count": 0} for field in SESSION_AVERAGED_FIELDS},
+        **{field: defaultdict(int) for field in SESSION_COUNTED_FIELDS},
+    }
+    for previous, new in contributions:
+        for contribution, sign in ((previous, -1), (new, 1)):
+            if contribution is None:
+                continue
+            for field in SESSION_AVERAGED_FIELDS:
+                if contribution.get(field) is not None:
+                    delta[field]["sum"] += sign * contribution[field]
+                    delta[field]["count"] += sign
+            for field in SESSION_COUNTED_FIELDS:
+                if contribution.get(field) is not None:
+                    delta[field][str(contribution[field])] += sign
+    return {
+        field: {key: value for key, value in counters.items() if value != 0}
+        for field, counters in delta.items()
+    }
+
+
+def _add_to_counter(path: str, key: str, value: object) -> dict:
+    """Expression of the document at path, with value added to its key"""
+    counters = {"$ifNull": [f"${path}", {"$literal": {}}]}
+    return {
+        "$setField": {
+            "field": {"$literal": key},
+            "input": counters,
+            "value": {
+                "$add": [
+                    {
+                        "$ifNull": [
+                            {
+                                "$getField": {
+                                    "field": {"$literal": key},
+                                    "input": counters,
+                                }
+                            },
+                            0,
+                        ]
+                    },
+                    value,
+                ]
+            },
+        }
+    }
+
+
+def session_stats_update(
+    delta: dict, new_previews: List[str], reset: bool = False
+) -> List[dict]:
+    """
+    Update pipeline of a session that applies the delta to its stats counters, then
+    sets its stats from the counters, and appends the previews of its new tasks.
+
+    The stats are computed by the same update as the counters, so that concurrent
+    updates of a session can't leave stats that don't match its counters.
+    """
+    stages: List[dict] = []
+    if reset:
+        stages.append({"$set": {"stats_counters": {"$literal": {}}, "preview": None}})
+    for field, counters in delta.items():
+        for key, value in counters.items():
+            path = f"stats_counters.{field}"
+            stages.append({"$set": {path: _add_to_counter(path, key, value)}})
+
+    stats: Dict[str, object] = {}
+    for field, stat in SESSION_AVERAGED_FIELDS.items():
+        sum_, count = f"$stats_counters.{field}.sum", f"$stats_counters.{field}.count"
+        stats[stat] = {
+            "$cond": [
+                {"$gt": [{"$ifNull": [count, 0]}, 0]},
+                {"$divide": [sum_, count]},
+                None,
+            ]
+        }
+    for field, stat in SESSION_COUNTED_FIELDS.items():
+        # The first of the values with the highest count, or null
+        stats[stat] = {
+            "$getField": {
+                "field": "k",
+                "input": {
+                    "$reduce": {
+                        "input": {
+                            "$objectToArray": {
+                                "$ifNull": [
+                                    f"$stats_counters.{field}",
+                                    {"$literal": {}},
+                                ]
+                            }
+                        },
+                        "initialValue": {"k": None, "v": 0},
+                        "in": {
+                            "$cond": [
+                                {"$gt": ["$$this.v", "$$value.v"]},
+                                "$$this",
+                                "$$value",
+                            ]
+                        },
+                    }
+                },
+            }
+        }
+    stages.append({"$set": {"stats": stats}})
+
+    if new_previews:
+        stages.append(
             {
-                "project_id": task.project_id,
-                "session_id": task.session_id,
-                "created_at": {"$lt": task.created_at},
+                "$set": {
+                    "preview": {
+                        "$concat": [
+                            {"$ifNull": ["$preview", ""]},
+                            {"$literal": "".join(p + "\n" for p in new_previews)},
+                        ]
+                    }
+                }
             }
         )
-        .sort("created_at", -1)
+    return stages
+
+
+async def compute_session_stats(
+    project_id: str, session_ids: List[str], task_ids: List[str]
+) -> Dict[str, SessionStats]:
+    """
+    Update the stats and the preview of the sessions with their tasks task_ids, and
+    return the stats.
+
+    The sessions store counters of the values of their tasks (stats_counters), and
+    the tasks the values they added to these counters
+    (session_stats_contribution). Only the tasks of the batch are read: the
+    counters are updated with the change of their contribution, whatever the length
+    of the sessions. A task processed again replaces its previous contribution, and
+    its preview is not added again.
+
+    The sessions without counters yet (created before them) are computed once from
+    all their tasks.
+    """
+    if not session_ids:
+        return {}
+
+    mongo_db = await get_mongo_db()
+    projection = {
+        "_id": 0,
+        "id": 1,
+        "session_id": 1,
+        "created_at": 1,
+        "input": 1,
+        "output": 1,
+        "sentiment": 1,
+        "language": 1,
+        "flag": 1,
+        "session_stats_contribution": 1,
+    }
+    sessions_to_rebuild = [
+        session["id"]
+        for session in await mongo_db["sessions"]
+        .find(
+            {"id": {"$in": session_ids}, "stats_counters": None},
+            {"_id": 0, "id": 1},
+        )
+        .to_list(length=None)
+    ]
+    tasks = await (
+        mongo_db["tasks"]
+        .find(
+            {
+                "project_id": project_id,
+                "$or": [
+                    {"id": {"$in": task_ids}, "session_id": {"$in": session_ids}},
+                    {"session_id": {"$in": sessions_to_rebuild}},
+                ],
+            },
+            projection,
+        )
+        .sort("created_at", 1)
+        .to_list(length=None)
+    )
+
+    tasks_by_session: Dict[str, List[dict]] = defaultdict(list)
+    for task in tasks:
+        tasks_by_session[task["session_id"]].append(task)
+
+    session_updates: List[UpdateOne] = []
+    task_updates: List[UpdateOne] = []
+    for session_id, session_tasks in tasks_by_session.items():
+        reset = session_id in sessions_to_rebuild
+        contributions: List[Tuple[Optional[dict], dict]] = []
+        new_previews: List[str] = []
+        for task in session_tasks:
+            previous = None if reset else task.get("session_stats_contribution")
+            contribution = task_session_stats_contribution(task)
+            contributions.append((previous, contribution))
+            if previous is None:
+                new_previews.append(task_preview(task))
+            if contribution != task.get("session_stats_contribution"):
+                task_updates.append(
+                    UpdateOne(
+                        {"id": task["id"]},
+                        {"$set": {"session_stats_contribution": contribution}},
+                    )
+                )
+        session_updates.append(
+            UpdateOne(
+                {"id": session_id},
+                session_stats_update(
+                    session_stats_delta(contributions), new_previews, reset=reset
+                ),
+            )
+        )
+
+    if session_updates:
+        await mongo_db["sessions"].bulk_write(session_updates, ordered=False)
+    if task_updates:
+        await mongo_db["tasks"].bulk_write(task_updates, ordered=False)
+
+    sessions = (
+        await mongo_db["sessions"]
+        .find(
+            {"id": {"$in": session_ids}, "stats": {"$ne": None}},
+            {"_id": 0, "id": 1, "stats": 1},
+        )
         .to_list(length=None)
     )
-    if previous_tasks is None:
-        return [task]
-    previous_tasks_models = [Task.model_validate(data) for data in previous_tasks]
-    previous_tasks_models.append(task)
-    return previous_tasks_models
+    return {
+        session["id"]: SessionStats.model_validate(session["stats"])
+        for session in sessions
+    }
 
 
 def generate_task_transcript(
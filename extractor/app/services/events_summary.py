@@ -0,0 +1,97 @@
+"""
+Summary of the events of the tasks and of the sessions.
+
+The `events_summary` field of a task or a session lists its events that are not
+removed, one per event definition:
+[{"id": ..., "event_name": ..., "event_definition_id": ..., "is_last_task": ...}]
+
+The backend uses it to filter the tasks and the sessions by event (see
+backend/app/services/mongo/events_summary.py). Call refresh_events_summary after
+saving detected events.
+"""
+
+from typing import Dict, Iterable, List, Literal, Optional
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.mongo import get_mongo_db
+
+
+def summarize_events(events: List[dict]) -> List[dict]:
+    """
+    Summary of the events of a task or a session: the first event of each event
+    definition, ignoring the removed events
+    """
+    summary: List[dict] = []
+    definitions_ids = set()
+    for event in sorted(events, key=lambda event: event.get("created_at") or 0):
+        if event.get("removed"):
+            continue
+        event_definition = event.get("event_definition") or {}
+        # Old events don't have a definition: deduplicate them by name
+        definition_id = event_definition.get("id") or event["event_name"]
+        if definition_id in definitions_ids:
+            continue
+        definitions_ids.add(definition_id)
+        summary.append(
+            {
+                "id": event["id"],
+                "event_name": event["event_name"],
+                "event_definition_id": event_definition.get("id"),
+                "is_last_task": event_definition.get("is_last_task") is True,
+            }
+        )
+    return summary
+
+
+async def _refresh(
+    collection: Literal["tasks", "sessions"],
+    key: Literal["task_id", "session_id"],
+    ids: List[str],
+) -> None:
+    if not ids:
+        return
+    mongo_db = await get_mongo_db()
+    events = (
+        await mongo_db["events"]
+        .find(
+            {key: {"$in": ids}, "removed": {"$ne": True}},
+            {
+                "_id": 0,
+                "id": 1,
+                key: 1,
+                "event_name": 1,
+                "event_definition.id": 1,
+                "event_definition.is_last_task": 1,
+                "created_at": 1,
+            },
+        )
+        .to_list(length=None)
+    )
+    events_per_id: Dict[str, List[dict]] = {id: [] for id in ids}
+    for event in events:
+        events_per_id[event[key]].append(event)
+    await mongo_db[collection].bulk_write(
+        [
+            UpdateOne({"id": id}, {"$set": {"events_summary": summarize_events(evs)}})
+            for id, evs in events_per_id.items()
+        ],
+        ordered=False,
+    )
+
+
+async def refresh_events_summary(
+    tasks_ids: Optional[Iterable[Optional[str]]] = None,
+    sessions_ids: Optional[Iterable[Optional[str]]] = None,
+) -> None:
+    """
+    Recompute the events summary of these tasks and sessions from the events collection
+    """
+    try:
+        await _refresh("tasks", "task_id", list({id for id in tasks_ids or [] if id}))
+        await _refresh(
+            "sessions", "session_id", list({id for id in sessions_ids or [] if id})
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing the events summary: {e}")
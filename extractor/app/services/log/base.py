@@ -127,17 +127,16 @@ def collect_metadata(log_event: LogEventForTasks) -> dict:
     if metadata is None:
         metadata = {}
 
-    # Add all unknown fields to the metadata
-    for key, value in log_event.model_dump().items():
-        if (
-            key not in metadata.keys()
-            and key not in Task.model_fields.keys()
-            and key not in ["raw_input", "raw_output"]
-            and is_jsonable(value)
-        ):
-            metadata[key] = value
+    # Add all unknown fields to the metadata. The known fields and the raw input and
+    # output, which can be large, are not dumped.
+    extra_fields = log_event.model_dump(
+        exclude={*Task.model_fields.keys(), *metadata.keys(), "raw_input", "raw_output"}
+    )
     # Filter non-jsonable values
     metadata = filter_nonjsonable_keys(metadata)
+    for key, value in extra_fields.items():
+        if is_jsonable(value):
+            metadata[key] = value
 
     # Compute token count
     model = metadata.get("model", None)
@@ -13,6 +13,8 @@ from app.services.log.base import (
     get_time_created_at,
 )
 from app.services.pipelines import MainPipeline
+from app.services.projects import increment_data_version
+from app.services.rollups import update_rollups, update_rollups_of_documents
 from app.services.tasks import compute_task_position
 from app.utils import generate_uuid
 from phospho.models import Session, Task
@@ -186,6 +188,10 @@ async def process_log_without_session_id(
         except Exception as e:
             error_mesagge = f"Error saving tasks to the database: {e}"
             logger.error(error_mesagge)
+        await update_rollups(
+            project_id, "tasks", [task["created_at"] for task in tasks_to_create]
+        )
+        await increment_data_version(project_id)
 
     if trigger_pipeline:
         logger.info(f"Triggering pipeline for {len(tasks_id_to_process)} tasks")
@@ -402,6 +408,17 @@ async def process_log_with_session_id(
         session_ids=list(sessions_to_create.keys()) + sessions_ids_already_in_db,
     )
 
+    # Update the analytics rollups of the new tasks and of their sessions
+    await update_rollups(
+        project_id, "tasks", [task["created_at"] for task in tasks_to_create]
+    )
+    await update_rollups_of_documents(
+        project_id,
+        "sessions",
+        list(sessions_to_create.keys()) + sessions_ids_already_in_db,
+    )
+    await increment_data_version(project_id)
+
     if trigger_pipeline:
         logger.info(f"Triggering pipeline for {len(tasks_id_to_process)} tasks")
         # await add_vectorized_tasks(tasks_id_to_process)
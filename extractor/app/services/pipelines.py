@@ -1,10 +1,11 @@
 import time
 from collections import defaultdict
 import traceback
-from typing import Dict, List, Literal, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from app.utils import generate_uuid
 from loguru import logger
+from pymongo import UpdateOne
 
 from app.core import config
 from app.db.models import (
@@ -15,10 +16,21 @@ from app.db.models import (
     Task,
 )
 from app.db.mongo import get_mongo_db
-from app.services.data import fetch_previous_tasks
-from app.services.projects import get_project_by_id
-from app.services.sentiment_analysis import call_sentiment_and_language_api
-from app.services.webhook import trigger_webhook
+from app.services.data import (
+    compute_session_stats,
+    fetch_previous_tasks,
+    get_few_shot_examples,
+)
+from app.services.events_summary import refresh_events_summary
+from app.services.projects import (
+    get_cached_project,
+    get_project_version,
+    increment_data_version,
+)
+from app.services.rollups import update_rollups
+from app.services.sentiment_analysis import call_sentiment_and_language_api_many
+from app.services.usage import increment_org_usage
+from app.services.webhook import webhook_dispatcher
 from phospho import lab
 from phospho.models import (
     JobResult,
@@ -29,9 +41,27 @@ from phospho.models import (
     PipelineResults,
 )
 
-PHOSPHO_EVENT_MODEL_NAMES = ["phospho-6", "owner", "phospho-4"]
 PHOSPHO_EVAL_MODEL_NAMES = ["phospho", "phospho-4"]
 
+# Shared by all the pipelines, so that the rate limits apply to the whole worker
+openai_limiter = lab.ProviderLimiter(
+    lab.RateLimits(
+        requests_per_minute=config.OPENAI_MAX_REQUESTS_PER_MINUTE,
+        tokens_per_minute=config.OPENAI_MAX_TOKENS_PER_MINUTE,
+    )
+)
+
+
+async def init_llm_cache() -> None:
+    """
+    Cache the LLM calls of the jobs in Mongo, so that the same prompt isn't judged
+    twice by the workers (eg: when running a recipe again)
+    """
+    mongo_db = await get_mongo_db()
+    llm_cache = lab.MongoLLMCache(mongo_db["llm_cache"], ttl=config.LLM_CACHE_TTL)
+    await llm_cache.create_indexes()
+    lab.set_llm_cache(llm_cache)
+
 
 class EventConfig(lab.JobConfig):
     event_name: str
@@ -60,208 +90,19 @@ class MainPipeline:
         Set the input for the pipeline.
         """
 
-        self.project = await get_project_by_id(self.project_id)
-        mongo_db = await get_mongo_db()
-        llm_based_events = []
-        for event_name, event in self.project.settings.events.items():
-            if event.detection_engine == "llm_detection":
-                llm_based_events.append(event_name)
-
-        # Matches at most one successful example per event_name
-        successful_events = (
-            await mongo_db["events"]
-            .aggregate(
-                [
-                    {
-                        "$match": {
-                            "project_id": self.project_id,
-                            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
-                            "confirmed": True,
-                            "removed": False,
-                            "event_name": {
-                                "$in": llm_based_events
-                            },  # filter by event names in project.settings.event
-                        }
-                    },
-                    {
-                        "$facet": {
-                            "event_names": [{"$group": {"_id": "$event_name"}}],
-                            "events": [
-                                {"$sort": {"created_at": -1}},
-                                {
-                                    "$group": {
-                                        "_id": "$event_name",
-                                        "first_event": {"$first": "$$ROOT"},
-                                    }
-                                },
-                                {"$replaceRoot": {"newRoot": "$first_event"}},
-                                {
-                                    "$lookup": {
-                                        "from": "tasks",
-                                        "localField": "task_id",
-                                        "foreignField": "id",
-                                        "as": "task",
-                                    }
-                                },
-                                {"$unwind": "$task"},
-                                {
-                                    "$addFields": {
-                                        "event_name": "$event_name",
-                                        "output": "$task.output",
-                                        "input": "$task.input",
-                                    }
-                                },
-                                {
-                                    "$project": {
-                                        "input": 1,
-                                        "output": 1,
-                                        "event_name": 1,
-                                    }
-                                },
-                            ],
-                        }
-                    },
-                    {
-                        "$project": {
-                            "events": {
-                                "$setDifference": [
-                                    "$events",
-                                    {
-                                        "$map": {
-                                            "input": "$event_names",
-                                            "as": "event_name",
-                                            "in": {
-                                                "$filter": {
-                                                    "input": "$events",
-                                                    "as": "event",
-                                                    "cond": {
-                                                        "$eq": [
-                                                            "$$event.event_name",
-                                                            "$$event_name._id",
-                                                        ]
-                                                    },
-                                                }
-                                            },
-                                        }
-                                    },
-                                ]
-                            }
-                        }
-                    },
-                    {"$unwind": "$events"},
-                    {"$replaceRoot": {"newRoot": "$events"}},
-                ]
-            )
-            .to_list(length=None)
-        )
-
-        # Matches at most one unsuccessful example per event_name
-        unsuccessful_events = (
-            await mongo_db["events"]
-            .aggregate(
-                [
-                    {
-                        "$match": {
-                            "project_id": self.project_id,
-                            "removed": True,
-                            "confirmed": False,
-                            "source": {"$in": PHOSPHO_EVENT_MODEL_NAMES},
-                            "removal_reason": {"$regex": "removed_by_user"},
-                            "event_name": {"$in": llm_based_events},
-                        }
-                    },
-                    {
-                        "$facet": {
-                            "event_names": [{"$group": {"_id": "$event_name"}}],
-                            "events": [
-                                {"$sort": {"created_at": -1}},
-                                {
-                                    "$group": {
-                                        "_id": "$event_name",
-                                        "first_event": {"$first": "$$ROOT"},
-                                    }
-                                },
-                                {"$replaceRoot": {"newRoot": "$first_event"}},
-                                {
-                                    "$lookup": {
-                                        "from": "tasks",
-                                        "localField": "task_id",
-                                        "foreignField": "id",
-                                        "as": "task",
-                                    }
-                                },
-                                {"$unwind": "$task"},
-                                {
-                                    "$addFields": {
-                                        "event_name": "$event_name",
-                                        "output": "$task.output",
-                                        "input": "$task.input",
-                                    }
-                                },
-                                {
-                                    "$project": {
-                                        "input": 1,
-                                        "output": 1,
-                                        "event_name": 1,
-                                    }
-                                },
-                            ],
-                        }
-                    },
-                    {
-                        "$project": {
-                            "events": {
-                                "$setDifference": [
-                                    "$events",
-                                    {
-                                        "$map": {
-                                            "input": "$event_names",
-                                            "as": "event_name",
-                                            "in": {
-                                                "$filter": {
-                                                    "input": "$events",
-                                                    "as": "event",
-                                                    "cond": {
-                                                        "$eq": [
-                                                            "$$event.event_name",
-                                                            "$$event_name._id",
-                                                        ]
-                                                    },
-                                                }
-                                            },
-                                        }
-                                    },
-                                ]
-                            }
-                        }
-                    },
-                    {"$unwind": "$events"},
-                    {"$replaceRoot": {"newRoot": "$events"}},
-                ]
-            )
-            .to_list(length=None)
-        )
-
-        metadata = {
-            "successful_events": successful_events,
-            "unsuccessful_events": unsuccessful_events,
-        }
+        project_version = await get_project_version(self.project_id)
+        self.project = await get_cached_project(self.project_id, project_version)
+        # At most one successful and one unsuccessful example per event_name
+        metadata = await get_few_shot_examples(self.project, project_version)
 
         self.messages = []
         if task:
-            # Get the data of all the tasks before task[task_id]
-            previous_tasks = await fetch_previous_tasks(task.id)
-            if len(previous_tasks) > 1:
-                task_context = previous_tasks[:-1]
-            else:
-                task_context = []
-            self.messages.append(
-                lab.Message.from_task(
-                    task=task, metadata=metadata, previous_tasks=task_context
-                )
-            )
+            if tasks is None:
+                tasks = []
+            tasks = [task] + tasks
         if tasks_ids:
             # Fetch the tasks from the database
+            mongo_db = await get_mongo_db()
             raw_tasks_from_ids = (
                 await mongo_db["tasks"]
                 .find({"id": {"$in": tasks_ids}, "project_id": self.project_id})
@@ -274,16 +115,14 @@ class MainPipeline:
                 tasks = []
             tasks.extend(valid_tasks_from_ids)
         if tasks:
+            # Get the data of the tasks before each task, for all the sessions at once
+            previous_tasks = await fetch_previous_tasks(tasks)
             for task in tasks:
-                # Get the data of all the tasks before task[task_id]
-                previous_tasks = await fetch_previous_tasks(task.id)
-                if len(previous_tasks) > 1:
-                    task_context = previous_tasks[:-1]
-                else:
-                    task_context = []
                 self.messages.append(
                     lab.Message.from_task(
-                        task=task, metadata=metadata, previous_tasks=task_context
+                        task=task,
+                        metadata=metadata,
+                        previous_tasks=previous_tasks.get(task.id, []),
                     )
                 )
         if messages:
@@ -310,7 +149,7 @@ class MainPipeline:
         Run the main event detection pipeline on the messages
         """
         if self.project is None:
-            self.project = await get_project_by_id(self.project_id)
+            self.project = await get_cached_project(self.project_id)
 
         if not self.project.settings.run_event_detection:
             logger.info(
@@ -325,13 +164,19 @@ class MainPipeline:
             self.workload.org_id = recipe.org_id
             self.workload.project_id = recipe.project_id
         else:
-            self.workload = lab.Workload.from_phospho_project_config(self.project)
+            self.workload = lab.Workload.from_phospho_project_config(
+                self.project, group_llm_events=config.GROUPED_EVENT_DETECTION
+            )
         logger.info(
             f"Running event detection pipeline for project {self.project_id} on {len(self.messages)} messages with {len(self.workload.jobs)} jobs"
         )
         # Run
         await self.workload.async_run(
-            messages=self.messages, executor_type="parallel_jobs"
+            messages=self.messages,
+            executor_type="parallel_jobs",
+            max_parallelism=config.EVENT_DETECTION_MAX_CONCURRENCY,
+            rate_limits={"openai": openai_limiter},
+            progress_callback=lambda nb_done, total: None,
         )
 
         if self.workload.results is None or self.workload.jobs is None:
@@ -342,6 +187,8 @@ class MainPipeline:
         events_to_push_to_db: List[dict] = []
         job_results_to_push_to_db: List[dict] = []
         llm_calls_to_push_to_db: List[dict] = []
+        # event_name -> (event definition, events to send to its webhook)
+        webhooks_to_send: Dict[str, Tuple[EventDefinition, List[dict]]] = {}
 
         # Iter over the results
         for message in self.messages:
@@ -356,7 +203,8 @@ class MainPipeline:
                 task_id = task.id if task is not None else None
                 session_id = task.session_id if task is not None else None
 
-                # Store the LLM call in the database
+                # Store the LLM call in the database. The events detected together
+                # share the LLM call, stored with the first one
                 llm_call = result.metadata.get("llm_call", None)
                 if llm_call is not None:
                     llm_call_obj = LlmCall(
@@ -366,7 +214,7 @@ class MainPipeline:
                         recipe_id=result.job_metadata.get("recipe_id"),
                     )
                     llm_calls_to_push_to_db.append(llm_call_obj.model_dump())
-                else:
+                elif "grouped_events" not in result.metadata:
                     logger.warning(f"No LLM call detected for event {event_name}")
 
                 detected_event_data = Event(
@@ -389,12 +237,10 @@ class MainPipeline:
                         event_definition.webhook is not None
                         and event_definition.webhook != ""
                     ):
-                        logger.info(f"Webhook url: {event_definition.webhook}")
-                        await trigger_webhook(
-                            url=event_definition.webhook,
-                            json=detected_event_data.model_dump(),
-                            headers=event_definition.webhook_headers,
+                        _, webhook_events = webhooks_to_send.setdefault(
+                            event_name, (event_definition, [])
                         )
+                        webhook_events.append(detected_event_data.model_dump())
                     events_to_push_to_db.append(detected_event_data.model_dump())
 
                 events_per_task_to_return[task_id].append(detected_event_data)
@@ -411,6 +257,10 @@ class MainPipeline:
                 await mongo_db["events"].insert_many(events_to_push_to_db)
             except Exception as e:
                 logger.error(f"Error saving detected events to the database: {e}")
+            await refresh_events_summary(
+                tasks_ids=[event["task_id"] for event in events_to_push_to_db],
+                sessions_ids=[event["session_id"] for event in events_to_push_to_db],
+            )
         if len(llm_calls_to_push_to_db) > 0:
             try:
                 await mongo_db["llm_calls"].insert_many(llm_calls_to_push_to_db)
@@ -419,14 +269,24 @@ class MainPipeline:
         if len(job_results_to_push_to_db) > 0:
             try:
                 await mongo_db["job_results"].insert_many(job_results_to_push_to_db)
+                await increment_org_usage(job_results_to_push_to_db)
             except Exception as e:
                 logger.error(f"Error saving job results to the database: {e}")
 
+        # The webhooks are sent in the background, once the events are saved
+        for event_definition, events in webhooks_to_send.values():
+            logger.info(f"Webhook url: {event_definition.webhook}")
+            webhook_dispatcher.dispatch(
+                event_definition.webhook,
+                events,
+                headers=event_definition.webhook_headers,
+            )
+
         return events_per_task_to_return
 
     async def update_version_id(self):
         if self.project is None:
-            self.project = await get_project_by_id(self.project_id)
+            self.project = await get_cached_project(self.project_id)
 
         mongo_db = await get_mongo_db()
         tasks_ids = [
@@ -456,6 +316,23 @@ class MainPipeline:
                 },
             )
 
+    async def update_rollups(self, events: Dict[str, List[Event]]) -> None:
+        """
+        Update the analytics rollups of the tasks and of the detected events
+        """
+        tasks_created_at = []
+        for message in self.messages:
+            if message.metadata.get("task") is not None:
+                task = Task.model_validate(message.metadata["task"])
+                tasks_created_at.append(task.created_at)
+        if tasks_created_at:
+            await update_rollups(self.project_id, "tasks", tasks_created_at)
+        events_created_at = [
+            event.created_at for task_events in events.values() for event in task_events
+        ]
+        if events_created_at:
+            await update_rollups(self.project_id, "events", events_created_at)
+
     async def compute_session_info_pipeline(self) -> Dict[str, SessionStats]:
         """
         Compute session information from its tasks
@@ -465,105 +342,19 @@ class MainPipeline:
         - Most common language
         - Most common flag
         """
-        outputs: Dict[str, SessionStats] = {}
-
         session_ids: List[str] = []
+        task_ids: List[str] = []
         for message in self.messages:
             task = Task.model_validate(message.metadata.get("task", None))
             if task.session_id is not None:
                 session_ids.append(task.session_id)
+                task_ids.append(task.id)
         unique_session_ids = list(set(session_ids))
 
-        for session_id in unique_session_ids:
-            logger.debug(f"Compute session info for session {session_id}")
-            mongo_db = await get_mongo_db()
-            tasks = (
-                await mongo_db["tasks"]
-                .find(
-                    {
-                        "project_id": self.project_id,
-                        "session_id": session_id,
-                    },
-                )
-                .to_list(length=None)
-            )
-
-            sentiment_score: list = []
-            sentiment_magnitude: list = []
-            sentiment_label_counter: Dict[str, int] = defaultdict(int)
-            language_counter: Dict[str, int] = defaultdict(int)
-            session_flag: Dict[str, int] = defaultdict(int)
-            preview = ""
-
-            for task in tasks:
-                valid_task = Task.model_validate(task)
-                if (
-                    valid_task.sentiment is not None
-                    and valid_task.sentiment.score is not None
-                ):
-                    sentiment_score.append(valid_task.sentiment.score)
-                if (
-                    valid_task.sentiment is not None
-                    and valid_task.sentiment.magnitude is not None
-                ):
-                    sentiment_magnitude.append(valid_task.sentiment.magnitude)
-                if (
-                    valid_task.sentiment is not None
-                    and valid_task.sentiment.label is not None
-                ):
-                    sentiment_label_counter[valid_task.sentiment.label] += 1
-                if valid_task.language is not None:
-                    language_counter[valid_task.language] += 1
-                if valid_task.flag is not None:
-                    session_flag[valid_task.flag] += 1
-                preview += valid_task.preview() + "\n"
-
-            if len(tasks) > 0:
-                most_common_language = (
-                    max(language_counter, key=language_counter.get)
-                    if language_counter
-                    else None
-                )
-                most_common_label = (
-                    max(sentiment_label_counter, key=sentiment_label_counter.get)
-                    if sentiment_label_counter
-                    else None
-                )
-                most_common_flag = (
-                    max(session_flag, key=session_flag.get) if session_flag else None
-                )
-
-                avg_sentiment_score = None
-                if len(sentiment_score) > 0:
-                    avg_sentiment_score = sum(sentiment_score) / len(sentiment_score)
-
-                avg_magnitude_score = None
-                if len(sentiment_magnitude) > 0:
-                    avg_magnitude_score = sum(sentiment_magnitude) / len(
-                        sentiment_magnitude
-                    )
-
-                session_task_info = SessionStats(
-                    avg_sentiment_score=avg_sentiment_score,
-                    avg_magnitude_score=avg_magnitude_score,
-                    most_common_sentiment_label=most_common_label,
-                    most_common_language=most_common_language,
-                    most_common_flag=most_common_flag,
-                )
-
-                await mongo_db["sessions"].update_one(
-                    {"id": session_id},
-                    {
-                        "$set": {
-                            "stats": session_task_info.model_dump(),
-                            "preview": preview if preview else None,
-                        }
-                    },
-                )
-
-            outputs[session_id] = session_task_info
-
-        return outputs
+        logger.debug(f"Compute session info for {len(unique_session_ids)} sessions")
+        return await compute_session_stats(
+            self.project_id, unique_session_ids, task_ids
+        )
 
     async def run_sentiment_and_language(
         self,
@@ -574,7 +365,7 @@ class MainPipeline:
         mongo_db = await get_mongo_db()
 
         if not self.project:
-            self.project = await get_project_by_id(self.project_id)
+            self.project = await get_cached_project(self.project_id)
 
         if (
             self.project.settings is not None
@@ -632,44 +423,51 @@ class MainPipeline:
         logger.info(
             f"Running sentiment analysis pipeline for project {self.project_id} for {len(self.messages)} messages"
         )
-        # TODO : Parallelize the sentiment analysis
+        tasks = [
+            Task.model_validate(message.metadata.get("task", None))
+            for message in self.messages
+        ]
+        # The calls run concurrently, with a limit and the rate limit of the API
+        results = await call_sentiment_and_language_api_many(
+            [task.input for task in tasks], score_threshold, magnitude_threshold
+        )
+
         results_sentiment: Dict[str, Optional[SentimentObject]] = {}
         results_language: Dict[str, Optional[str]] = {}
-        for message in self.messages:
-            task = Task.model_validate(message.metadata.get("task", None))
-            sentiment_object, language = await call_sentiment_and_language_api(
-                task.input, score_threshold, magnitude_threshold
-            )
-
+        task_updates: List[UpdateOne] = []
+        job_results: List[dict] = []
+        for task, (sentiment_object, language) in zip(tasks, results):
             if not self.project.settings.run_language:
                 language = None
             if not self.project.settings.run_sentiment:
                 sentiment_object = None
 
             # We update the task item
-            await mongo_db["tasks"].update_one(
-                {
-                    "id": task.id,
-                    "project_id": task.project_id,
-                },
-                {
-                    "$set": {
-                        "sentiment": sentiment_object.model_dump()
-                        if sentiment_object
-                        else None,
-                        "language": language,
-                        "metadata.sentiment_score": sentiment_object.score
-                        if sentiment_object
-                        else None,
-                        "metadata.sentiment_magnitude": sentiment_object.magnitude
-                        if sentiment_object
-                        else None,
-                        "metadata.sentiment_label": sentiment_object.label
-                        if sentiment_object
-                        else None,
-                        "metadata.language": language,
-                    }
-                },
+            task_updates.append(
+                UpdateOne(
+                    {
+                        "id": task.id,
+                        "project_id": task.project_id,
+                    },
+                    {
+                        "$set": {
+                            "sentiment": sentiment_object.model_dump()
+                            if sentiment_object
+                            else None,
+                            "language": language,
+                            "metadata.sentiment_score": sentiment_object.score
+                            if sentiment_object
+                            else None,
+                            "metadata.sentiment_magnitude": sentiment_object.magnitude
+                            if sentiment_object
+                            else None,
+                            "metadata.sentiment_label": sentiment_object.label
+                            if sentiment_object
+                            else None,
+                            "metadata.language": language,
+                        }
+                    },
+                )
             )
 
             if sentiment_object:
@@ -683,7 +481,7 @@ class MainPipeline:
                         "input": task.input,
                     },
                 )
-                mongo_db["job_results"].insert_one(jobresult.model_dump())
+                job_results.append(jobresult.model_dump())
                 logger.info(
                     f"Sentiment analysis for task {task.id} : {sentiment_object}"
                 )
@@ -691,6 +489,12 @@ class MainPipeline:
             results_sentiment[task.id] = sentiment_object
             results_language[task.id] = language
 
+        if task_updates:
+            await mongo_db["tasks"].bulk_write(task_updates, ordered=False)
+        if job_results:
+            await mongo_db["job_results"].insert_many(job_results)
+            await increment_org_usage(job_results)
+
         return results_sentiment, results_language
 
     async def recipe_pipeline(
@@ -749,6 +553,8 @@ class MainPipeline:
             await self.update_version_id()
         except Exception as e:
             logger.error(f"Error updating the version id: {e}")
+        await self.update_rollups(events)
+        await increment_data_version(self.project_id)
 
         logger.info("Main pipeline completed")
         return PipelineResults(
@@ -1,6 +1,16 @@
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
 from loguru import logger
+from app.core import config
 from app.db.mongo import get_mongo_db
 from app.db.models import Project, Recipe
+from app.utils.cache import TTLCache
+
+# Values derived from a project (the project itself, its few-shot examples), keyed
+# by the version of the project they were loaded at. The backend increments the
+# version when the event definitions or the confirmed events of the project change.
+project_cache = TTLCache(ttl=config.PROJECT_CACHE_TTL, max_size=1_000)
 
 
 async def get_project_by_id(project_id: str) -> Project:
@@ -99,3 +109,70 @@ async def get_project_by_id(project_id: str) -> Project:
         )
 
     return project
+
+
+async def get_project_version(project_id: str) -> int:
+    """
+    Get the version of a project. It's incremented when the settings, the event
+    definitions or the confirmed events of the project change.
+    """
+    mongo_db = await get_mongo_db()
+    project_data = await mongo_db["projects"].find_one(
+        {"id": project_id}, {"_id": 0, "version": 1}
+    )
+    if project_data is None:
+        raise ValueError(f"Project {project_id} not found")
+    return project_data.get("version", 0)
+
+
+async def increment_data_version(project_id: str) -> None:
+    """
+    Increment the data version of a project, after writing its tasks, sessions or
+    events. The backend invalidates the query results it cached for the project when
+    the data version changes.
+    """
+    try:
+        mongo_db = await get_mongo_db()
+        await mongo_db["projects"].update_one(
+            {"id": project_id}, {"$inc": {"data_version": 1}}
+        )
+    except Exception as e:
+        logger.error(f"Error incrementing the data version of {project_id}: {e}")
+
+
+async def get_cached(
+    key: Hashable, project_version: int, load: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Return the value cached for this key and project version, or load it.
+    Don't mutate the returned value: it's shared.
+    """
+    # The entries of the previous versions are never read again: they expire
+    cache_key = (key, project_version)
+    value = project_cache.get(cache_key)
+    if value is not None:
+        return value
+
+    start_time = time.perf_counter()
+    value = await load()
+    project_cache.record_load_time(time.perf_counter() - start_time)
+    # If the project changed during the load, its version is already higher than
+    # project_version and the value will be reloaded next time
+    project_cache.set(cache_key, value)
+    return value
+
+
+async def get_cached_project(
+    project_id: str, project_version: Optional[int] = None
+) -> Project:
+    """
+    Cached version of get_project_by_id. Returns a copy that can be mutated.
+    """
+    if project_version is None:
+        project_version = await get_project_version(project_id)
+    project = await get_cached(
+        ("project", project_id),
+        project_version,
+        lambda: get_project_by_id(project_id),
+    )
+    return project.model_copy(deep=True)
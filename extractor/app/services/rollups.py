@@ -0,0 +1,545 @@
+"""
+Rollups of the analytics of the projects.
+
+run_analytics_query of the backend answers the dashboard tiles. Instead of scanning the
+tasks, sessions and events of a project on every refresh, it reads hourly and daily
+buckets in the `analytics_rollups` collection.
+
+An hourly bucket is recomputed from the documents created during its hour after the
+extractor writes such documents. Recomputing the bucket, instead of incrementing
+counters, keeps it right when documents are updated (flag, metadata...). The updated
+hours are marked as stale, and the stale hours of a project are recomputed at most once
+per ROLLUP_UPDATE_INTERVAL, so that a busy hour isn't recomputed at every write. The
+daily buckets are merged from the hourly buckets.
+
+The documents of a bucket are:
+- the total of the bucket, with dimension=None
+- one document per value of each rolled up dimension
+  eg: dimension="flag", value="success"
+
+Each one holds the number of documents, the number of successes (flag is "success") and
+the count, sum, min and max of the numeric fields. The total lists the dimensions and
+the numeric fields rolled up in the bucket: the backend scans the raw documents for
+the others.
+
+The `analytics_rollups_status` collection has a document per project and collection:
+- ready: the rollups of the project are backfilled
+- stale_hours: hours with updated documents, not recomputed yet
+- updated_at: when the stale hours were last recomputed
+- backfill_started_at: when the backend started the backfill job
+- resets: incremented by the backend when all the rollups must be backfilled again
+
+The backend scans the raw documents of the stale hours, and of the projects that are
+not ready. The backfill and the recomputation of the stale hours that were left behind
+run in the refresh_rollups job, started by the cron of the backend.
+"""
+
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+from pymongo import ReturnDocument, UpdateOne
+
+from app.core import config
+from app.db.mongo import get_mongo_db
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+ROLLUPS_COLLECTION = "analytics_rollups"
+ROLLUPS_STATUS_COLLECTION = "analytics_rollups_status"
+
+
+def _get_path(document: Any, path: str) -> Any:
+    """document["a"]["b"] for the path "a.b", or None if missing"""
+    for key in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _top_metadata_dimensions(documents: List[dict], exclude: List[str]) -> List[str]:
+    """The most frequent metadata keys with string or boolean values"""
+    keys_count: Counter = Counter()
+    for document in documents:
+        metadata = document.get("metadata")
+        if not isinstance(metadata, dict):
+            continue
+        for key, value in metadata.items():
+            if isinstance(value, (str, bool)) and "." not in key and key[:1] != "$":
+                keys_count[key] += 1
+    dimensions = [
+        f"metadata.{key}"
+        for key, _ in keys_count.most_common()
+        if f"metadata.{key}" not in exclude
+    ]
+    return dimensions[: config.ROLLUP_MAX_METADATA_KEYS]
+
+
+def _empty_rollup(dimension: Optional[str], value: Any) -> Dict[str, Any]:
+    return {
+        "dimension": dimension,
+        "value": value,
+        "count": 0,
+        "success_count": 0,
+        "stats": {},
+    }
+
+
+def _add_stats(stats: Dict[str, Any], field: str, other: Dict[str, Any]) -> None:
+    field_stats = stats.get(field)
+    if field_stats is None:
+        stats[field] = dict(other)
+        return
+    field_stats["count"] += other["count"]
+    field_stats["sum"] += other["sum"]
+    field_stats["min"] = min(field_stats["min"], other["min"])
+    field_stats["max"] = max(field_stats["max"], other["max"])
+
+
+def compute_hourly_rollups(collection: str, documents: List[dict]) -> List[dict]:
+    """
+    Compute the rollups of an hourly bucket from the documents created during the hour.
+    """
+    if not documents:
+        return []
+
+    numeric_fields = config.ROLLUP_NUMERIC_FIELDS.get(collection, [])
+    fixed_dimensions = config.ROLLUP_DIMENSIONS.get(collection, [])
+    candidate_dimensions = fixed_dimensions + _top_metadata_dimensions(
+        documents, exclude=fixed_dimensions
+    )
+
+    # Only the dimensions with few string values can be rolled up
+    dimensions: List[str] = []
+    for dimension in candidate_dimensions:
+        values: Set[Any] = set()
+        for document in documents:
+            value = _get_path(document, dimension)
+            if value is not None and not isinstance(value, (str, bool)):
+                break
+            values.add(value)
+            if len(values) > config.ROLLUP_MAX_DIMENSION_VALUES:
+                break
+        else:
+            dimensions.append(dimension)
+
+    rollups: Dict[Tuple[Optional[str], Any], Dict[str, Any]] = {}
+    for document in documents:
+        document_stats: Dict[str, Dict[str, Any]] = {}
+        for field in numeric_fields:
+            value = _get_path(document, field)
+            if _is_number(value):
+                document_stats[field] = {
+                    "count": 1,
+                    "sum": value,
+                    "min": value,
+                    "max": value,
+                }
+        keys = [(None, None)] + [
+            (dimension, _get_path(document, dimension)) for dimension in dimensions
+        ]
+        for key in keys:
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = _empty_rollup(*key)
+                rollups[key] = rollup
+            rollup["count"] += 1
+            if document.get("flag") == "success":
+                rollup["success_count"] += 1
+            for field, field_stats in document_stats.items():
+                _add_stats(rollup["stats"], field, field_stats)
+
+    total = rollups[(None, None)]
+    total["dimensions"] = dimensions
+    total["fields"] = numeric_fields
+    return list(rollups.values())
+
+
+def merge_rollups(buckets: List[List[dict]]) -> List[dict]:
+    """
+    Merge the rollups of several buckets, eg: the hourly buckets of a day. A dimension
+    or a field is rolled up in the result if it is rolled up in all the buckets.
+    """
+    totals = [
+        rollup for bucket in buckets for rollup in bucket if rollup["dimension"] is None
+    ]
+    if not totals:
+        return []
+    dimensions = [
+        dimension
+        for dimension in totals[0]["dimensions"]
+        if all(dimension in total["dimensions"] for total in totals)
+    ]
+    fields = [
+        field
+        for field in totals[0]["fields"]
+        if all(field in total["fields"] for total in totals)
+    ]
+
+    rollups: Dict[Tuple[Optional[str], Any], Dict[str, Any]] = {}
+    for bucket in buckets:
+        for rollup in bucket:
+            dimension = rollup["dimension"]
+            if dimension is not None and dimension not in dimensions:
+                continue
+            key = (rollup["dimension"], rollup["value"])
+            merged_rollup = rollups.get(key)
+            if merged_rollup is None:
+                merged_rollup = _empty_rollup(*key)
+                rollups[key] = merged_rollup
+            merged_rollup["count"] += rollup["count"]
+            merged_rollup["success_count"] += rollup["success_count"]
+            for field, field_stats in rollup["stats"].items():
+                if field in fields:
+                    _add_stats(merged_rollup["stats"], field, field_stats)
+
+    total = rollups[(None, None)]
+    total["dimensions"] = dimensions
+    total["fields"] = fields
+    return list(rollups.values())
+
+
+def _projection(collection: str) -> Dict[str, int]:
+    fields = (
+        ["created_at", "flag", "metadata"]
+        + config.ROLLUP_DIMENSIONS.get(collection, [])
+        + config.ROLLUP_NUMERIC_FIELDS.get(collection, [])
+    )
+    # A projection can't have a field and one of its subfields
+    return {
+        field: 1
+        for field in fields
+        if not any(field.startswith(f"{other}.") for other in fields)
+    }
+
+
+async def _write_bucket(
+    project_id: str,
+    collection: str,
+    granularity: str,
+    bucket_start: int,
+    rollups: List[dict],
+    computed_at: float,
+) -> None:
+    """
+    Replace the rollups of a bucket. computed_at is the time when the computation
+    started: a rollup computed later is never replaced, and the rollups older than the
+    most recent computation of the bucket are deleted.
+    """
+    mongo_db = await get_mongo_db()
+    bucket_key = {
+        "project_id": project_id,
+        "collection": collection,
+        "granularity": granularity,
+        "bucket_start": bucket_start,
+    }
+    operations = []
+    for rollup in rollups:
+        document = {
+            **rollup,
+            # Field names can't contain dots in the stats
+            "stats": [
+                {"field": field, **field_stats}
+                for field, field_stats in rollup["stats"].items()
+            ],
+            "computed_at": computed_at,
+        }
+        operations.append(
+            UpdateOne(
+                {
+                    **bucket_key,
+                    "dimension": rollup["dimension"],
+                    "value": rollup["value"],
+                },
+                [
+                    {
+                        "$replaceWith": {
+                            "$cond": [
+                                {
+                                    "$lt": [
+                                        {"$ifNull": ["$computed_at", 0]},
+                                        computed_at,
+                                    ]
+                                },
+                                {"$mergeObjects": ["$$ROOT", {"$literal": document}]},
+                                "$$ROOT",
+                            ]
+                        }
+                    }
+                ],
+                upsert=True,
+            )
+        )
+    if operations:
+        await mongo_db[ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+    # If a more recent computation of the bucket ran concurrently, it wins
+    latest = await mongo_db[ROLLUPS_COLLECTION].find_one(
+        bucket_key, {"computed_at": 1}, sort=[("computed_at", -1)]
+    )
+    latest_computed_at = max(computed_at, latest["computed_at"] if latest else 0)
+    await mongo_db[ROLLUPS_COLLECTION].delete_many(
+        {**bucket_key, "computed_at": {"$lt": latest_computed_at}}
+    )
+
+
+def _read_rollup(document: dict) -> dict:
+    """Convert a rollup document of the database to the format of merge_rollups"""
+    rollup = _empty_rollup(document["dimension"], document["value"])
+    rollup["count"] = document["count"]
+    rollup["success_count"] = document["success_count"]
+    rollup["stats"] = {
+        field_stats["field"]: {
+            key: field_stats[key] for key in ("count", "sum", "min", "max")
+        }
+        for field_stats in document["stats"]
+    }
+    if document["dimension"] is None:
+        rollup["dimensions"] = document["dimensions"]
+        rollup["fields"] = document["fields"]
+    return rollup
+
+
+async def _update_hour(
+    project_id: str,
+    collection: str,
+    hour_start: int,
+    documents: Optional[List[dict]] = None,
+) -> None:
+    """Recompute an hourly bucket. The documents of the hour are fetched if None."""
+    computed_at = time.time()
+    if documents is None:
+        mongo_db = await get_mongo_db()
+        documents = (
+            await mongo_db[collection]
+            .find(
+                {
+                    "project_id": project_id,
+                    "created_at": {"$gte": hour_start, "$lt": hour_start + HOUR},
+                },
+                _projection(collection),
+            )
+            .to_list(length=None)
+        )
+    await _write_bucket(
+        project_id=project_id,
+        collection=collection,
+        granularity="hour",
+        bucket_start=hour_start,
+        rollups=compute_hourly_rollups(collection, documents),
+        computed_at=computed_at,
+    )
+
+
+async def _update_day(project_id: str, collection: str, day_start: int) -> None:
+    """Recompute a daily bucket from its hourly buckets"""
+    computed_at = time.time()
+    mongo_db = await get_mongo_db()
+    hourly_rollups = (
+        await mongo_db[ROLLUPS_COLLECTION]
+        .find(
+            {
+                "project_id": project_id,
+                "collection": collection,
+                "granularity": "hour",
+                "bucket_start": {"$gte": day_start, "$lt": day_start + DAY},
+            }
+        )
+        .to_list(length=None)
+    )
+    buckets: Dict[int, List[dict]] = {}
+    for document in hourly_rollups:
+        buckets.setdefault(document["bucket_start"], []).append(_read_rollup(document))
+    await _write_bucket(
+        project_id=project_id,
+        collection=collection,
+        granularity="day",
+        bucket_start=day_start,
+        rollups=merge_rollups(list(buckets.values())),
+        computed_at=computed_at,
+    )
+
+
+async def backfill_rollups(project_id: str, collection: str) -> None:
+    """
+    Rebuild all the rollups of a collection of a project. The backend scans the raw
+    documents of the project until it's done.
+    """
+    started_at = time.time()
+    mongo_db = await get_mongo_db()
+    status_key = {"project_id": project_id, "collection": collection}
+    # The documents written from now on are in the scan or marked as stale
+    status = await mongo_db[ROLLUPS_STATUS_COLLECTION].find_one_and_update(
+        status_key,
+        {"$set": {"ready": False, "stale_hours": []}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+    cursor = (
+        mongo_db[collection]
+        .find({"project_id": project_id}, _projection(collection))
+        .sort("created_at", 1)
+    )
+    days: Set[int] = set()
+    current_hour: Optional[int] = None
+    documents: List[dict] = []
+    async for document in cursor:
+        created_at = document.get("created_at")
+        if not _is_number(created_at):
+            continue
+        hour_start = int(created_at) - int(created_at) % HOUR
+        if hour_start != current_hour:
+            if current_hour is not None:
+                await _update_hour(project_id, collection, current_hour, documents)
+            current_hour = hour_start
+            documents = []
+            days.add(hour_start - hour_start % DAY)
+        documents.append(document)
+    if current_hour is not None:
+        await _update_hour(project_id, collection, current_hour, documents)
+
+    for day_start in sorted(days):
+        await _update_day(project_id, collection, day_start)
+
+    # The buckets without documents anymore
+    await mongo_db[ROLLUPS_COLLECTION].delete_many(
+        {**status_key, "computed_at": {"$lt": started_at}}
+    )
+    # Unless the backend asked for another backfill in the meantime
+    await mongo_db[ROLLUPS_STATUS_COLLECTION].update_one(
+        {**status_key, "resets": status.get("resets")},
+        {
+            "$set": {
+                "ready": True,
+                "backfilled_at": time.time(),
+                "updated_at": time.time(),
+            }
+        },
+    )
+    logger.info(
+        f"Project {project_id}: {collection} rollups backfilled ({len(days)} days)"
+    )
+
+
+async def _update_stale_hours(
+    project_id: str, collection: str, updated_at: Optional[float]
+) -> None:
+    """
+    Recompute the stale hours and their days. Nothing is done if another update
+    recomputed them since updated_at.
+    """
+    mongo_db = await get_mongo_db()
+    status_key = {"project_id": project_id, "collection": collection}
+    # The stale hours are cleared before being recomputed, so that an hour marked
+    # again during the update is recomputed at the next one
+    status = await mongo_db[ROLLUPS_STATUS_COLLECTION].find_one_and_update(
+        {**status_key, "updated_at": updated_at},
+        {"$set": {"stale_hours": [], "updated_at": time.time()}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if status is None:
+        return
+    hours = sorted(status.get("stale_hours", []))
+    try:
+        for hour_start in hours:
+            await _update_hour(project_id, collection, hour_start)
+        days = {hour_start - hour_start % DAY for hour_start in hours}
+        for day_start in sorted(days):
+            await _update_day(project_id, collection, day_start)
+    except Exception:
+        # They are still stale
+        await mongo_db[ROLLUPS_STATUS_COLLECTION].update_one(
+            status_key, {"$addToSet": {"stale_hours": {"$each": hours}}}
+        )
+        raise
+
+
+async def update_rollups(
+    project_id: str,
+    collection: str,
+    timestamps: Iterable[Optional[float]],
+) -> None:
+    """
+    Mark the buckets of the documents created at these timestamps as stale, and
+    recompute the stale hours if they weren't recomputed in the last
+    ROLLUP_UPDATE_INTERVAL. The first update of a project only creates its status:
+    the backfill runs in its own job.
+
+    Errors are logged: the rollups never fail the pipelines.
+    """
+    if not config.ANALYTICS_ROLLUPS_ENABLED:
+        return
+    try:
+        hours = sorted(
+            {
+                int(timestamp) - int(timestamp) % HOUR
+                for timestamp in timestamps
+                if _is_number(timestamp)
+            }
+        )
+        update: Dict[str, Any] = {"$setOnInsert": {"ready": False}}
+        if hours:
+            update["$addToSet"] = {"stale_hours": {"$each": hours}}
+        mongo_db = await get_mongo_db()
+        status = await mongo_db[ROLLUPS_STATUS_COLLECTION].find_one_and_update(
+            {"project_id": project_id, "collection": collection},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if not status.get("ready"):
+            # Rebuilt by the backfill job
+            return
+        updated_at = status.get("updated_at")
+        if (
+            updated_at is not None
+            and time.time() - updated_at < config.ROLLUP_UPDATE_INTERVAL
+        ):
+            # Recomputed by a later update or by the refresh job
+            return
+        await _update_stale_hours(project_id, collection, updated_at)
+    except Exception as e:
+        logger.error(f"Error updating the {collection} rollups of {project_id}: {e}")
+
+
+async def refresh_rollups(project_id: str, collection: str) -> None:
+    """
+    Backfill the rollups of a collection of a project if they're not ready, else
+    recompute their stale hours. Run in its own job, which is retried on errors.
+    """
+    mongo_db = await get_mongo_db()
+    status = await mongo_db[ROLLUPS_STATUS_COLLECTION].find_one(
+        {"project_id": project_id, "collection": collection}
+    )
+    if status is None or not status.get("ready"):
+        await backfill_rollups(project_id, collection)
+    else:
+        await _update_stale_hours(project_id, collection, status.get("updated_at"))
+
+
+async def update_rollups_of_documents(
+    project_id: str, collection: str, ids: List[str]
+) -> None:
+    """update_rollups for the buckets of the documents with these ids"""
+    if not config.ANALYTICS_ROLLUPS_ENABLED or not ids:
+        return
+    try:
+        mongo_db = await get_mongo_db()
+        documents = (
+            await mongo_db[collection]
+            .find({"project_id": project_id, "id": {"$in": ids}}, {"created_at": 1})
+            .to_list(length=None)
+        )
+    except Exception as e:
+        logger.error(f"Error fetching the {collection} to update the rollups: {e}")
+        return
+    await update_rollups(
+        project_id, collection, [document.get("created_at") for document in documents]
+    )
@@ -1,29 +1,69 @@
-from typing import Optional
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, List, Optional, Tuple
 
 from google.cloud import language_v2
 from loguru import logger
 
-from app.core.config import GCP_SENTIMENT_CLIENT
+from app.core import config
 from phospho.models import SentimentObject
 
+# The GCP client is synchronous: its calls run in threads to not block the event loop
+_executor = ThreadPoolExecutor(
+    max_workers=config.SENTIMENT_MAX_CONCURRENCY, thread_name_prefix="sentiment"
+)
 
-async def call_sentiment_and_language_api(
-    text: str, score_threshold: float, magnitude_threshold: float
-) -> tuple[SentimentObject, Optional[str]]:
+
+class RateLimiter:
+    """
+    Space the calls evenly so that there are at most max_per_minute calls per minute.
     """
-    Analyzes Sentiment and Language of a given text.
 
-    The sentiment object contains both a score and a magnitude.
-    - score: positive values indicate positive sentiment, negative values indicate negative sentiment.
-    - magnitude: the overall strength of emotion (both positive and negative) within the given text.
+    def __init__(self, max_per_minute: float):
+        self.interval = 60.0 / max_per_minute
+        self.next_call_at = 0.0
 
-    Args:
-      text_content: The text content to analyze.
+    async def wait(self) -> None:
+        now = time.monotonic()
+        # No await before the slot is reserved: concurrent callers get distinct slots
+        call_at = max(now, self.next_call_at)
+        self.next_call_at = call_at + self.interval
+        if call_at > now:
+            await asyncio.sleep(call_at - now)
+
+
+sentiment_rate_limiter = RateLimiter(config.SENTIMENT_MAX_REQUESTS_PER_MINUTE)
+
+
+class FakeSentimentClient:
+    """
+    Stand-in for the GCP LanguageServiceClient, to benchmark the sentiment analysis
+    without calling GCP. Each call blocks for `latency` seconds.
     """
-    if GCP_SENTIMENT_CLIENT is None:
-        logger.warning("No client available for sentiment analysis")
-        return SentimentObject(), None
 
+    def __init__(self, latency: float = 0.1):
+        self.latency = latency
+
+    def analyze_sentiment(self, request: dict) -> Any:
+        time.sleep(self.latency)
+        digest = hashlib.md5(request["document"]["content"].encode()).digest()
+        return SimpleNamespace(
+            document_sentiment=SimpleNamespace(
+                score=digest[0] / 127.5 - 1, magnitude=digest[1] / 64
+            ),
+            language_code="en",
+        )
+
+
+def analyze_sentiment_and_language(
+    client: Any, text: str, score_threshold: float, magnitude_threshold: float
+) -> tuple[SentimentObject, Optional[str]]:
+    """
+    Blocking call to the sentiment analysis API. See call_sentiment_and_language_api.
+    """
     try:
         # Available types: PLAIN_TEXT, HTML
         document_type_in_plain_text = language_v2.Document.Type.PLAIN_TEXT
@@ -41,7 +81,7 @@ async def call_sentiment_and_language_api(
         # See https://cloud.google.com/natural-language/docs/reference/rest/v2/EncodingType.
         encoding_type = language_v2.EncodingType.UTF8
 
-        response = GCP_SENTIMENT_CLIENT.analyze_sentiment(
+        response = client.analyze_sentiment(
             request={"document": document, "encoding_type": encoding_type}
         )
 
@@ -73,3 +113,60 @@ async def call_sentiment_and_language_api(
         language = None
 
     return sentiment_response, language
+
+
+async def call_sentiment_and_language_api(
+    text: str,
+    score_threshold: float,
+    magnitude_threshold: float,
+    client: Optional[Any] = None,
+) -> tuple[SentimentObject, Optional[str]]:
+    """
+    Analyzes Sentiment and Language of a given text.
+
+    The sentiment object contains both a score and a magnitude.
+    - score: positive values indicate positive sentiment, negative values indicate negative sentiment.
+    - magnitude: the overall strength of emotion (both positive and negative) within the given text.
+
+    Args:
+      text_content: The text content to analyze.
+      client: defaults to the GCP client
+    """
+    if client is None:
+        client = config.GCP_SENTIMENT_CLIENT
+    if client is None:
+        logger.warning("No client available for sentiment analysis")
+        return SentimentObject(), None
+
+    await sentiment_rate_limiter.wait()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor,
+        analyze_sentiment_and_language,
+        client,
+        text,
+        score_threshold,
+        magnitude_threshold,
+    )
+
+
+async def call_sentiment_and_language_api_many(
+    texts: List[str],
+    score_threshold: float,
+    magnitude_threshold: float,
+    client: Optional[Any] = None,
+    max_concurrency: int = config.SENTIMENT_MAX_CONCURRENCY,
+) -> List[Tuple[SentimentObject, Optional[str]]]:
+    """
+    Analyzes the Sentiment and Language of several texts, with at most
+    max_concurrency calls at the same time. Results are in the order of the texts.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(text: str) -> Tuple[SentimentObject, Optional[str]]:
+        async with semaphore:
+            return await call_sentiment_and_language_api(
+                text, score_threshold, magnitude_threshold, client=client
+            )
+
+    return list(await asyncio.gather(*(call(text) for text in texts)))
@@ -0,0 +1,82 @@
+"""
+Usage counters of organizations.
+
+The backend reads the `org_usage` collection to check the usage quotas instead of
+counting the job_results. Keep it up to date every time job_results are inserted.
+
+The /log endpoints reserve one unit of usage per log to process (`nb_reserved`),
+recorded under a reservation_id in `reservations`. Once the job_results of a batch
+are counted, release its reservation with release_reserved_usage, so that the logs
+are not counted twice. Releasing the same reservation twice does nothing.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.db.mongo import get_mongo_db
+
+
+async def increment_org_usage(job_results: List[dict]) -> None:
+    """
+    Increment the usage counter of the orgs of the job_results inserted in the database
+    """
+    nb_job_results_per_org: Dict[str, int] = defaultdict(int)
+    for job_result in job_results:
+        org_id = job_result.get("org_id")
+        if org_id is not None:
+            nb_job_results_per_org[org_id] += 1
+
+    if len(nb_job_results_per_org) == 0:
+        return
+
+    mongo_db = await get_mongo_db()
+    try:
+        # No upsert: the backend creates the counter from the true count
+        await mongo_db["org_usage"].bulk_write(
+            [
+                UpdateOne({"org_id": org_id}, {"$inc": {"nb_job_results": nb}})
+                for org_id, nb in nb_job_results_per_org.items()
+            ],
+            ordered=False,
+        )
+    except Exception as e:
+        logger.error(f"Error incrementing the usage of orgs: {e}")
+
+
+async def release_reserved_usage(
+    org_id: Optional[str], reservation_id: Optional[str]
+) -> None:
+    """
+    Release the usage reserved by the backend for a batch of processed logs.
+    Does nothing if the reservation was already released (eg: retried activity).
+    """
+    if org_id is None or reservation_id is None:
+        return
+    mongo_db = await get_mongo_db()
+    try:
+        await mongo_db["org_usage"].update_one(
+            {"org_id": org_id, f"reservations.{reservation_id}": {"$exists": True}},
+            [
+                {
+                    "$set": {
+                        "nb_reserved": {
+                            "$max": [
+                                0,
+                                {
+                                    "$subtract": [
+                                        {"$ifNull": ["$nb_reserved", 0]},
+                                        f"$reservations.{reservation_id}.nb",
+                                    ]
+                                },
+                            ]
+                        }
+                    }
+                },
+                {"$unset": f"reservations.{reservation_id}"},
+            ],
+        )
+    except Exception as e:
+        logger.error(f"Error releasing the reserved usage of org {org_id}: {e}")
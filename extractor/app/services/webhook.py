@@ -1,40 +1,174 @@
-from typing import Optional
+"""
+Webhooks of the detected events.
+
+The webhooks are sent in the background by the `webhook_dispatcher`, so that a slow
+endpoint doesn't slow down the pipelines:
+- the requests share a session, and its pool of connections
+- the number of requests sent at the same time to a host is bounded
+- timeouts, connection errors, 429 and 5xx responses are retried with backoff
+- the events that couldn't be sent are stored in the `webhook_dead_letters` collection
+"""
+
+import asyncio
+import random
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlparse
 
 import aiohttp
 from loguru import logger
 
+from app.core import config
+from app.db.mongo import get_mongo_db
+from app.utils import generate_timestamp
+
+
+class WebhookDispatcher:
+    def __init__(
+        self,
+        timeout: float = config.WEBHOOK_TIMEOUT,
+        max_connections: int = config.WEBHOOK_MAX_CONNECTIONS,
+        max_concurrency_per_host: int = config.WEBHOOK_MAX_CONCURRENCY_PER_HOST,
+        max_retries: int = config.WEBHOOK_MAX_RETRIES,
+        retry_base_delay: float = config.WEBHOOK_RETRY_BASE_DELAY,
+        batch_size: int = config.WEBHOOK_BATCH_SIZE,
+    ):
+        """
+        :param batch_size: max number of events sent in a request. If 1, the body of
+            a request is an event. Otherwise, it's a list of events.
+        """
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.batch_size = batch_size
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # Keep a reference to the deliveries so they are not garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+        self.nb_sent = 0
+        self.nb_retries = 0
+        self.nb_dead_letters = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    def dispatch(
+        self, url: str, events: List[dict], headers: Optional[dict] = None
+    ) -> None:
+        """
+        Send the events to the webhook url in the background. Returns immediately.
+        """
+        if url == "":
+            logger.warning("No webhook URL set, skipping webhook trigger")
+            return
+        # Filter empty values from the headers (where str is "")
+        headers = {
+            k: v for k, v in (headers or {}).items() if v is not None and v != ""
+        }
+        for i in range(0, len(events), self.batch_size):
+            batch = events[i : i + self.batch_size]
+            task = asyncio.create_task(self.send(url, batch, headers))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def send(self, url: str, events: List[dict], headers: dict) -> bool:
+        """
+        Send a batch of events, with retries. Returns True if the webhook accepted them.
+        Otherwise, the events are stored in the dead letters.
+        """
+        body = events[0] if self.batch_size == 1 else events
+        error = ""
+        attempt = 0
+        while True:
+            try:
+                async with self._get_host_semaphore(url):
+                    async with self._get_session().post(
+                        url, json=body, headers=headers
+                    ) as response:
+                        if response.status < 400:
+                            logger.info(
+                                f"Webhook triggered successfully: {url} {response.status}"
+                            )
+                            self.nb_sent += len(events)
+                            return True
+                        error = f"HTTP {response.status}: {await response.text()}"
+                        retryable = response.status == 429 or response.status >= 500
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+                retryable = True
+
+            if not retryable or attempt >= self.max_retries:
+                break
+            attempt += 1
+            self.nb_retries += 1
+            # Exponential backoff with full jitter
+            await asyncio.sleep(
+                random.uniform(0, self.retry_base_delay * 2 ** (attempt - 1))
+            )
+
+        logger.error(
+            f"Error sending webhook to {url} after {attempt + 1} attempts: {error}"
+        )
+        await self._dead_letter(url, events, error, nb_attempts=attempt + 1)
+        return False
+
+    async def _dead_letter(
+        self, url: str, events: List[dict], error: str, nb_attempts: int
+    ) -> None:
+        # The headers are not stored: they can contain secrets
+        self.nb_dead_letters += len(events)
+        try:
+            mongo_db = await get_mongo_db()
+            await mongo_db["webhook_dead_letters"].insert_many(
+                [
+                    {
+                        "url": url,
+                        "event": event,
+                        "project_id": event.get("project_id"),
+                        "org_id": event.get("org_id"),
+                        "error": error,
+                        "nb_attempts": nb_attempts,
+                        "created_at": generate_timestamp(),
+                    }
+                    for event in events
+                ]
+            )
+        except Exception as e:
+            logger.error(f"Error saving webhook dead letters: {e}")
+
+    async def flush(self) -> None:
+        """Wait for the webhooks being sent"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "nb_pending": len(self._tasks),
+            "nb_sent": self.nb_sent,
+            "nb_retries": self.nb_retries,
+            "nb_dead_letters": self.nb_dead_letters,
+        }
+
 
-async def trigger_webhook(
-    url: str, json: dict, timeout: int = 3, headers: Optional[dict] = None
-):
-    """
-    Async function to trigger a webhook. Sends a POST request to the given URL
-    with the given data.
-
-    :param url: The URL to trigger the webhook on.
-    :param data: The data to send to the webhook.
-    :param timeout: The timeout for the request, an int in seconds.
-    """
-    # Filter empty values from the headers (where str is "")
-    headers = {k: v for k, v in (headers or {}).items() if v is not None and v != ""}
-
-    # If the url is not set, return early
-    if url == "":
-        logger.warning("No webhook URL set, skipping webhook trigger")
-        return
-
-    try:
-        logger.info(f"Triggering webhook: {url}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, json=json, timeout=timeout, headers=headers
-            ) as response:
-                response.raise_for_status()
-                logger.info(f"Webhook triggered successfully: {response.status}")
-                response_txt = await response.text()
-            await session.close()
-        return response_txt
-    except aiohttp.ClientError as e:
-        logger.error(f"Error sending webhook to {url}: {e}")
-        await session.close()
-        return None
+webhook_dispatcher = WebhookDispatcher()
@@ -21,8 +21,11 @@ from app.api.v1.models import (
     RunMainPipelineOnTaskRequest,
     RunRecipeOnTaskRequest,
     BillOnStripeRequest,
+    RefreshRollupsRequest,
 )
 from app.services.projects import get_project_by_id
+from app.services.rollups import refresh_rollups as refresh_project_rollups
+from app.services.usage import release_reserved_usage
 
 from loguru import logger
 
@@ -144,11 +147,29 @@ async def store_open_telemetry_data(
         project_id=request.project_id,
         data=request.open_telemetry_data,
     )
-    return await opentelemetry_connector.process(
+    nb_job_results = await opentelemetry_connector.process(
         org_id=request.org_id,
         current_usage=request.current_usage,
         max_usage=request.max_usage,
     )
+    # The job_results of the logs are counted: release the usage reserved for them
+    if request.nb_reserved_usage > 0:
+        await release_reserved_usage(request.org_id, request.reservation_id)
+    return {
+        "status": "ok",
+        "nb_job_results": nb_job_results,
+    }
+
+
+@activity.defn(name="refresh_rollups")
+async def refresh_rollups(
+    request: RefreshRollupsRequest,
+):
+    logger.info(
+        f"Refreshing the {request.collection} rollups of project id: {request.project_id}"
+    )
+    await refresh_project_rollups(request.project_id, request.collection)
+    return {"status": "ok"}
 
 
 @activity.defn(name="run_process_logs_for_messages")
@@ -167,6 +188,9 @@ async def run_process_logs_for_messages(
         logs_to_process=request_body.logs_to_process,
         extra_logs_to_save=request_body.extra_logs_to_save,
     )
+    # The job_results of the logs are counted: release the usage reserved for them
+    if request_body.nb_reserved_usage > 0:
+        await release_reserved_usage(request_body.org_id, request_body.reservation_id)
     return {
         "status": "ok",
         "nb_job_results": len(request_body.logs_to_process),
@@ -186,6 +210,9 @@ async def run_process_log_for_tasks(
         logs_to_process=request_body.logs_to_process,
         extra_logs_to_save=request_body.extra_logs_to_save,
     )
+    # The job_results of the logs are counted: release the usage reserved for them
+    if request_body.nb_reserved_usage > 0:
+        await release_reserved_usage(request_body.org_id, request_body.reservation_id)
     return {
         "status": "ok",
         "nb_job_results": len(request_body.logs_to_process),
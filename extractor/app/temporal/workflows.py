@@ -39,6 +39,7 @@ with workflow.unsafe.imports_passed_through():
         extract_langsmith_data,
         extract_langfuse_data,
         store_open_telemetry_data,
+        refresh_rollups,
         run_recipe_on_task,
         run_process_logs_for_messages,
         run_process_log_for_tasks,
@@ -52,6 +53,7 @@ with workflow.unsafe.imports_passed_through():
         PipelineLangsmithRequest,
         PipelineOpentelemetryRequest,
         PipelineResults,
+        RefreshRollupsRequest,
         RunMainPipelineOnMessagesRequest,
         RunMainPipelineOnTaskRequest,
         RunRecipeOnTaskRequest,
@@ -66,11 +68,13 @@ class BaseWorkflow:
         request_class,
         bill=True,
         max_retries=1,
+        timeout=timedelta(minutes=15),
     ):
         self.activity_func = activity_func
         self.request_class = request_class
         self.bill = bill
         self.max_retries = max_retries
+        self.timeout = timeout
 
     async def run_activity(self, request):
         retry_policy = RetryPolicy(
@@ -82,7 +86,7 @@ class BaseWorkflow:
         response = await workflow.execute_activity(
             self.activity_func,
             request,
-            start_to_close_timeout=timedelta(minutes=15),
+            start_to_close_timeout=self.timeout,
             retry_policy=retry_policy,
         )
         if self.bill:
@@ -130,7 +134,23 @@ class StoreOpenTelemetryDataWorkflow(BaseWorkflow):
         super().__init__(
             activity_func=store_open_telemetry_data,
             request_class=PipelineOpentelemetryRequest,
+        )
+
+    @workflow.run
+    async def run(self, request):
+        await super().run_activity(request)
+
+
+@workflow.defn(name="refresh_rollups_workflow")
+class RefreshRollupsWorkflow(BaseWorkflow):
+    def __init__(self):
+        super().__init__(
+            activity_func=refresh_rollups,
+            request_class=RefreshRollupsRequest,
             bill=False,
+            # A backfill rebuilds the rollups from scratch: it can be retried
+            max_retries=3,
+            timeout=timedelta(seconds=config.ROLLUP_BACKFILL_TIMEOUT),
         )
 
     @workflow.run
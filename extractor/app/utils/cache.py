@@ -0,0 +1,78 @@
+"""
+Small in-process caches.
+
+Those caches are per worker process: use a short time to live for values that can be
+changed by another worker.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """
+    A cache where entries expire after `ttl` seconds.
+    When the cache holds more than `max_size` entries, the least recently used
+    entry is evicted.
+
+    Hits and misses are counted. Call record_load_time with the time spent computing
+    a missing value to estimate the time saved by the cache.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.nb_loads = 0
+        self.total_load_time = 0.0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record_load_time(self, seconds: float) -> None:
+        self.nb_loads += 1
+        self.total_load_time += seconds
+
+    def stats(self) -> dict:
+        """
+        Hit ratio of the cache and time saved, estimated from the average load time
+        """
+        nb_lookups = self.hits + self.misses
+        avg_load_time = self.total_load_time / self.nb_loads if self.nb_loads else 0.0
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / nb_lookups if nb_lookups else None,
+            "avg_load_time": avg_load_time,
+            "time_saved": self.hits * avg_load_time,
+        }
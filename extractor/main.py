@@ -15,10 +15,14 @@ from loguru import logger
 
 from app.core import config
 from app.db.mongo import close_mongo_db, connect_and_init_db
+from app.services.pipelines import init_llm_cache
+from app.services.webhook import webhook_dispatcher
+from phospho.lab.language_models import close_clients
 from app.temporal.workflows import (
     ExtractLangSmithDataWorkflow,
     ExtractLangfuseDataWorkflow,
     StoreOpenTelemetryDataWorkflow,
+    RefreshRollupsWorkflow,
     RunRecipeOnTaskWorkflow,
     RunProcessLogForTasksWorkflow,
     RunMainPipelineOnMessagesWorkflow,
@@ -28,6 +32,7 @@ from app.temporal.activities import (
     extract_langsmith_data,
     extract_langfuse_data,
     store_open_telemetry_data,
+    refresh_rollups,
     run_recipe_on_task,
     run_process_log_for_tasks,
     bill_on_stripe,
@@ -75,6 +80,8 @@ async def main():
         sentry_sdk.set_level("warning")
 
     await connect_and_init_db()
+    if config.MONGODB_URL is not None:
+        await init_llm_cache()
     client_cert = config.TEMPORAL_MTLS_TLS_CERT
     client_key = config.TEMPORAL_MTLS_TLS_KEY
 
@@ -95,6 +102,7 @@ async def main():
             ExtractLangSmithDataWorkflow,
             ExtractLangfuseDataWorkflow,
             StoreOpenTelemetryDataWorkflow,
+            RefreshRollupsWorkflow,
             RunRecipeOnTaskWorkflow,
             RunProcessLogForTasksWorkflow,
             RunMainPipelineOnMessagesWorkflow,
@@ -104,6 +112,7 @@ async def main():
             extract_langsmith_data,
             extract_langfuse_data,
             store_open_telemetry_data,
+            refresh_rollups,
             run_recipe_on_task,
             run_process_log_for_tasks,
             bill_on_stripe,
@@ -117,6 +126,8 @@ async def main():
     ):
         logger.info("Worker started")
         await interrupt_event.wait()
+        await close_clients()
+        await webhook_dispatcher.close()
         await close_mongo_db()
         logger.info("Shutting down")
 
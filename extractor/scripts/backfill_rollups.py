@@ -0,0 +1,34 @@
+"""
+Rebuild the analytics rollups of existing projects.
+
+Until the rollups of a project are backfilled, run_analytics_query scans the raw
+documents. The refresh_rollups job, started by the cron of the backend, backfills the
+projects that are not ready: run this script to backfill them all at once instead.
+
+Usage: python -m scripts.backfill_rollups [project_id ...] (with the extractor
+environment variables). Without project ids, all the projects are backfilled.
+"""
+
+import asyncio
+import sys
+from typing import List
+
+from app.core import config
+from app.db.mongo import close_mongo_db, connect_and_init_db, get_mongo_db
+from app.services.rollups import backfill_rollups
+
+
+async def main(project_ids: List[str]) -> None:
+    await connect_and_init_db()
+    mongo_db = await get_mongo_db()
+    if not project_ids:
+        project_ids = await mongo_db["projects"].distinct("id")
+    for i, project_id in enumerate(project_ids):
+        print(f"[{i + 1}/{len(project_ids)}] Project {project_id}")
+        for collection in config.ROLLUP_COLLECTIONS:
+            await backfill_rollups(project_id, collection)
+    await close_mongo_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
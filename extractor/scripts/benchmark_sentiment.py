@@ -0,0 +1,46 @@
+"""
+Benchmark of the sentiment and language stage with a fake GCP client: messages per
+second when the calls are made one at a time (like before) and concurrently.
+
+The rate limit of the API is raised for the benchmark: with the default quota, the
+throughput is capped at SENTIMENT_MAX_REQUESTS_PER_MINUTE / 60 messages per second.
+
+Usage: python -m scripts.benchmark_sentiment (with the extractor environment variables)
+"""
+
+import asyncio
+import time
+
+from app.services import sentiment_analysis
+from app.services.sentiment_analysis import (
+    FakeSentimentClient,
+    RateLimiter,
+    call_sentiment_and_language_api_many,
+)
+
+NB_MESSAGES = 200
+LATENCY = 0.05  # Latency of the fake client, in seconds
+MAX_CONCURRENCY = [1, 4, 16]
+
+
+async def benchmark(max_concurrency: int) -> float:
+    texts = [f"Message number {i}, I love this product." for i in range(NB_MESSAGES)]
+    client = FakeSentimentClient(latency=LATENCY)
+    start = time.perf_counter()
+    await call_sentiment_and_language_api_many(
+        texts, 0.3, 0.6, client=client, max_concurrency=max_concurrency
+    )
+    return NB_MESSAGES / (time.perf_counter() - start)
+
+
+async def main() -> None:
+    sentiment_analysis.sentiment_rate_limiter = RateLimiter(max_per_minute=1_000_000)
+    for max_concurrency in MAX_CONCURRENCY:
+        messages_per_second = await benchmark(max_concurrency)
+        print(
+            f"max_concurrency={max_concurrency:<3} {messages_per_second:8.1f} messages/s"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
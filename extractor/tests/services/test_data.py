@@ -0,0 +1,59 @@
+from app.db.models import Task
+from app.services.data import (
+    session_stats_delta,
+    session_stats_update,
+    task_preview,
+    task_session_stats_contribution,
+)
+
+
+def test_session_stats_delta():
+    first = task_session_stats_contribution(
+        {
+            "sentiment": {"score": 0.5, "magnitude": 1, "label": "positive"},
+            "language": "en",
+            "flag": "success",
+        }
+    )
+    second = task_session_stats_contribution(
+        {"sentiment": {"score": -0.1, "label": "neutral"}, "language": "en"}
+    )
+    delta = session_stats_delta([(None, first), (None, second)])
+    assert delta == {
+        "sentiment_score": {"sum": 0.4, "count": 2},
+        "sentiment_magnitude": {"sum": 1, "count": 1},
+        "sentiment_label": {"positive": 1, "neutral": 1},
+        "language": {"en": 2},
+        "flag": {"success": 1},
+    }
+
+    # A task processed again replaces its contribution
+    relabeled = {**second, "sentiment_label": "positive", "flag": "failure"}
+    assert session_stats_delta([(second, relabeled)]) == {
+        "sentiment_score": {},
+        "sentiment_magnitude": {},
+        "sentiment_label": {"neutral": -1, "positive": 1},
+        "language": {},
+        "flag": {"failure": 1},
+    }
+
+
+def test_session_stats_update_appends_new_previews():
+    stages = session_stats_update(session_stats_delta([]), ["a -> b"], reset=True)
+    assert stages[0] == {"$set": {"stats_counters": {"$literal": {}}, "preview": None}}
+    assert "stats" in stages[-2]["$set"]
+    assert stages[-1]["$set"]["preview"]["$concat"][1] == {"$literal": "a -> b\n"}
+
+
+def test_task_preview():
+    task = Task(
+        project_id="project",
+        org_id="org",
+        input="one two three four five six seven eight nine ten eleven",
+        output="Sunny and warm.",
+    )
+    assert task_preview(task.model_dump()) == task.preview()
+    task.output = None
+    assert task_preview(task.model_dump()) == task.preview()
+    # Legacy tasks may have no input
+    assert task_preview({"input": None, "output": "Hi"}) == " -> Hi"
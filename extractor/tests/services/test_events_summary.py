@@ -0,0 +1,54 @@
+from app.services.events_summary import summarize_events
+
+
+def test_summarize_events():
+    events = [
+        {
+            "id": "e2",
+            "event_name": "question",
+            "event_definition": {"id": "d1"},
+            "created_at": 2,
+        },
+        {
+            "id": "e1",
+            "event_name": "question",
+            "event_definition": {"id": "d1"},
+            "created_at": 1,
+        },
+        {
+            "id": "e3",
+            "event_name": "goodbye",
+            "event_definition": {"id": "d2", "is_last_task": True},
+            "created_at": 3,
+        },
+        {
+            "id": "e4",
+            "event_name": "removed",
+            "event_definition": {"id": "d3"},
+            "created_at": 4,
+            "removed": True,
+        },
+        # Old events without a definition
+        {"id": "e5", "event_name": "legacy", "created_at": 5},
+        {"id": "e6", "event_name": "legacy", "created_at": 6},
+    ]
+    assert summarize_events(events) == [
+        {
+            "id": "e1",
+            "event_name": "question",
+            "event_definition_id": "d1",
+            "is_last_task": False,
+        },
+        {
+            "id": "e3",
+            "event_name": "goodbye",
+            "event_definition_id": "d2",
+            "is_last_task": True,
+        },
+        {
+            "id": "e5",
+            "event_name": "legacy",
+            "event_definition_id": None,
+            "is_last_task": False,
+        },
+    ]
@@ -0,0 +1,109 @@
+from app.api.v1.models import PipelineOpentelemetryRequest
+from app.services.connectors.opentelemetry import (
+    iter_spans,
+    span_to_log_event,
+    unpack_attributes,
+)
+
+
+def string_attribute(key: str, value: str) -> dict:
+    return {"key": key, "value": {"stringValue": value}}
+
+
+def make_span(span_id: str, question: str, answer: str) -> dict:
+    return {
+        "traceId": "trace1",
+        "spanId": span_id,
+        "name": "openai.chat",
+        "startTimeUnixNano": "1718000000000000000",
+        "endTimeUnixNano": "1718000002000000000",
+        "attributes": [
+            string_attribute("gen_ai.system", "OpenAI"),
+            string_attribute("gen_ai.request.model", "gpt-4o"),
+            string_attribute("gen_ai.prompt.0.role", "system"),
+            string_attribute("gen_ai.prompt.0.content", "Be nice"),
+            string_attribute("gen_ai.prompt.1.role", "user"),
+            string_attribute("gen_ai.prompt.1.content", question),
+            string_attribute("gen_ai.completion.0.role", "assistant"),
+            string_attribute("gen_ai.completion.0.content", answer),
+            {"key": "gen_ai.usage.input_tokens", "value": {"intValue": "12"}},
+        ],
+    }
+
+
+OTLP_DATA = {
+    "resourceSpans": [
+        {
+            "resource": {"attributes": [string_attribute("service.name", "bot")]},
+            "scopeSpans": [
+                {"spans": [make_span("a", "Hi", "Hello"), make_span("b", "?", "!")]},
+                {
+                    "spans": [
+                        {
+                            "traceId": "trace1",
+                            "spanId": "c",
+                            "attributes": [string_attribute("http.method", "GET")],
+                        }
+                    ]
+                },
+            ],
+        },
+        {"scopeSpans": [{"spans": [make_span("d", "Bye", "Goodbye")]}]},
+    ]
+}
+
+
+def test_unpack_attributes():
+    attributes = unpack_attributes(make_span("a", "Hi", "Hello")["attributes"])
+    assert attributes["gen_ai"]["prompt"] == [
+        {"role": "system", "content": "Be nice"},
+        {"role": "user", "content": "Hi"},
+    ]
+    assert attributes["gen_ai"]["usage"]["input_tokens"] == 12
+
+
+def test_every_span_is_converted():
+    spans = list(iter_spans(OTLP_DATA))
+    assert [span["spanId"] for _, span in spans] == ["a", "b", "c", "d"]
+
+    log_events = []
+    for resource_attributes, span in spans:
+        attributes = unpack_attributes(span["attributes"])
+        if "gen_ai" in attributes:
+            log_events.append(
+                span_to_log_event(
+                    span, attributes, resource_attributes, "project", "org"
+                )
+            )
+
+    assert [(e.input, e.output) for e in log_events] == [
+        ("Hi", "Hello"),
+        ("?", "!"),
+        ("Bye", "Goodbye"),
+    ]
+    log_event = log_events[0]
+    assert log_event.task_id == "trace1a"
+    assert log_event.session_id == "trace1"
+    assert log_event.created_at == 1718000000
+    assert log_event.last_update == 1718000002
+    assert log_event.metadata["model"] == "gpt-4o"
+    assert log_event.metadata["prompt_tokens"] == 12
+    assert log_event.metadata["service_name"] == "bot"
+    assert "service_name" not in log_events[2].metadata
+
+
+def test_backend_request_is_valid():
+    # Same keys as ExtractorClient.store_open_telemetry_data in the backend
+    request = PipelineOpentelemetryRequest(
+        **{
+            "open_telemetry_data": OTLP_DATA,
+            "project_id": "project",
+            "org_id": "org",
+            "current_usage": 10,
+            "max_usage": 14,
+            "nb_reserved_usage": 4,
+            "customer_id": None,
+        }
+    )
+    assert request.max_usage - request.current_usage == request.nb_reserved_usage
+    assert len(list(iter_spans(request.open_telemetry_data))) == 4
@@ -0,0 +1,95 @@
+import pytest
+
+from app.services.rollups import (
+    ROLLUPS_COLLECTION,
+    _write_bucket,
+    compute_hourly_rollups,
+    merge_rollups,
+)
+
+
+def get_rollup(rollups, dimension=None, value=None):
+    return next(
+        rollup
+        for rollup in rollups
+        if rollup["dimension"] == dimension and rollup["value"] == value
+    )
+
+
+def test_compute_hourly_rollups():
+    tasks = [
+        {"flag": "success", "metadata": {"model": "a", "total_tokens": 10}},
+        {"flag": "success", "metadata": {"model": "b", "total_tokens": 30}},
+        {"flag": "failure", "metadata": {"model": "a", "user_id": {"id": 1}}},
+        {"metadata": {"total_tokens": None}},
+    ]
+    rollups = compute_hourly_rollups("tasks", tasks)
+
+    total = get_rollup(rollups)
+    assert total["count"] == 4
+    assert total["success_count"] == 2
+    assert total["stats"]["metadata.total_tokens"] == {
+        "count": 2,
+        "sum": 40,
+        "min": 10,
+        "max": 30,
+    }
+    assert "flag" in total["dimensions"]
+    assert "metadata.model" in total["dimensions"]
+    # Not a string: can't be a dimension
+    assert "metadata.user_id" not in total["dimensions"]
+
+    assert get_rollup(rollups, "flag", "success")["count"] == 2
+    assert get_rollup(rollups, "flag", None)["count"] == 1
+    model_a = get_rollup(rollups, "metadata.model", "a")
+    assert model_a["count"] == 2
+    assert model_a["stats"]["metadata.total_tokens"]["sum"] == 10
+    assert get_rollup(rollups, "metadata.model", None)["count"] == 1
+
+
+def test_merge_rollups():
+    first_hour = compute_hourly_rollups(
+        "tasks", [{"flag": "success", "metadata": {"model": "a", "total_tokens": 5}}]
+    )
+    second_hour = compute_hourly_rollups(
+        "tasks", [{"flag": "failure", "metadata": {"total_tokens": 7}}]
+    )
+    rollups = merge_rollups([first_hour, second_hour])
+
+    total = get_rollup(rollups)
+    assert total["count"] == 2
+    assert total["stats"]["metadata.total_tokens"] == {
+        "count": 2,
+        "sum": 12,
+        "min": 5,
+        "max": 7,
+    }
+    assert get_rollup(rollups, "flag", "failure")["count"] == 1
+    # metadata.model is not rolled up in the second hour
+    assert "metadata.model" not in total["dimensions"]
+    assert all(rollup["dimension"] != "metadata.model" for rollup in rollups)
+
+
+@pytest.mark.asyncio
+async def test_write_bucket_keeps_the_latest_computation(db):
+    async for mongo_db in db:
+        bucket = {
+            "project_id": "test_rollups_project",
+            "collection": "tasks",
+            "granularity": "hour",
+            "bucket_start": 0,
+        }
+        await mongo_db[ROLLUPS_COLLECTION].delete_many(bucket)
+
+        newer = compute_hourly_rollups("tasks", [{"flag": "success"}])
+        older = compute_hourly_rollups("tasks", [{"flag": "failure"}] * 2)
+        await _write_bucket(**bucket, rollups=newer, computed_at=2)
+        # A computation that started before, but finished after
+        await _write_bucket(**bucket, rollups=older, computed_at=1)
+
+        documents = await mongo_db[ROLLUPS_COLLECTION].find(bucket).to_list(None)
+        assert {document["computed_at"] for document in documents} == {2}
+        assert {(d["dimension"], d["value"]) for d in documents} == {
+            (rollup["dimension"], rollup["value"]) for rollup in newer
+        }
+        await mongo_db[ROLLUPS_COLLECTION].delete_many(bucket)
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from app.services import sentiment_analysis
+from app.services.sentiment_analysis import (
+    FakeSentimentClient,
+    RateLimiter,
+    call_sentiment_and_language_api,
+    call_sentiment_and_language_api_many,
+)
+
+
+@pytest.mark.asyncio
+async def test_sentiment_calls_are_concurrent(monkeypatch):
+    monkeypatch.setattr(
+        sentiment_analysis, "sentiment_rate_limiter", RateLimiter(1_000_000)
+    )
+    texts = [f"text {i}" for i in range(8)]
+    client = FakeSentimentClient(latency=0.1)
+
+    start = time.perf_counter()
+    results = await call_sentiment_and_language_api_many(
+        texts, 0.3, 0.6, client=client, max_concurrency=8
+    )
+
+    assert time.perf_counter() - start < 0.5
+    # Same order as the texts
+    for text, result in zip(texts, results):
+        assert result == await call_sentiment_and_language_api(
+            text, 0.3, 0.6, client=FakeSentimentClient(latency=0)
+        )
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter():
+    rate_limiter = RateLimiter(max_per_minute=600)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        await rate_limiter.wait()
+
+    # 0.1s between calls
+    assert time.perf_counter() - start >= 0.2
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from app.services.webhook import WebhookDispatcher
+
+
+async def start_server(handler):
+    app = web.Application()
+    app.router.add_post("/webhook", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/webhook"
+
+
+def make_dispatcher(monkeypatch, **kwargs):
+    dispatcher = WebhookDispatcher(retry_base_delay=0.01, **kwargs)
+    dead_letters = []
+
+    async def dead_letter(url, events, error, nb_attempts):
+        dead_letters.extend(events)
+
+    monkeypatch.setattr(dispatcher, "_dead_letter", dead_letter)
+    return dispatcher, dead_letters
+
+
+@pytest.mark.asyncio
+async def test_webhooks_are_retried_and_bounded_per_host(monkeypatch):
+    bodies = []
+    nb_running = 0
+    max_nb_running = 0
+
+    async def handler(request):
+        nonlocal nb_running, max_nb_running
+        body = await request.json()
+        nb_running += 1
+        max_nb_running = max(max_nb_running, nb_running)
+        await asyncio.sleep(0.05)
+        nb_running -= 1
+        # The first request of each event fails
+        if body not in bodies:
+            bodies.append(body)
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    runner, url = await start_server(handler)
+    dispatcher, dead_letters = make_dispatcher(monkeypatch, max_concurrency_per_host=2)
+    try:
+        dispatcher.dispatch(url, [{"event_name": f"event {i}"} for i in range(6)])
+        await dispatcher.flush()
+    finally:
+        await dispatcher.close()
+        await runner.cleanup()
+
+    assert dispatcher.nb_sent == 6
+    assert dispatcher.nb_retries == 6
+    assert max_nb_running == 2
+    assert dead_letters == []
+
+
+@pytest.mark.asyncio
+async def test_webhooks_batches_and_dead_letters(monkeypatch):
+    bodies = []
+
+    async def handler(request):
+        bodies.append(await request.json())
+        return web.Response(status=400, text="Bad request")
+
+    runner, url = await start_server(handler)
+    dispatcher, dead_letters = make_dispatcher(monkeypatch, batch_size=2)
+    events = [{"event_name": f"event {i}"} for i in range(3)]
+    try:
+        dispatcher.dispatch(url, events, headers={"X-Token": "secret", "X-Empty": ""})
+        await dispatcher.flush()
+    finally:
+        await dispatcher.close()
+        await runner.cleanup()
+
+    # 400 is not retried
+    assert sorted(bodies, key=len) == [events[2:], events[:2]]
+    assert sorted(dead_letters, key=lambda e: e["event_name"]) == events
@@ -19,6 +19,7 @@ import pydantic
 
 from . import config, integrations, models, utils
 from ._version import __version__ as __version__
+from .client import AsyncClient as AsyncClient
 from .client import Client as Client
 from .consumer import Consumer as Consumer
 from .extractor import (
@@ -27,7 +28,9 @@ from .extractor import (
     extract_data_from_output,
     extract_metadata_from_input_output,
 )
-from .log_queue import Event, LogQueue
+from .log_queue import Event, LogQueue, OverflowPolicy
+from .spool import Spool
+from .stream import StreamAccumulator, evict_stream_accumulators
 from .tasks import TaskEntity
 from .testing import PhosphoTest
 from .utils import (
@@ -52,6 +55,8 @@ consumer = None
 latest_task_id = None
 latest_session_id = None
 default_version_id = None
+# Streams being logged, by task_id
+stream_accumulators: Dict[str, StreamAccumulator] = {}
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +69,11 @@ def init(
     tick: float = 0.5,
     raise_error_on_fail_to_send: bool = False,
     version_id: Optional[str] = None,
+    max_queue_events: int = config.LOG_QUEUE_MAX_EVENTS,
+    max_queue_bytes: int = config.LOG_QUEUE_MAX_BYTES,
+    overflow_policy: OverflowPolicy = "drop_oldest",
+    spill_dir: Optional[str] = None,
+    spool_dir: Optional[str] = None,
 ) -> None:
     """
     Initialize the phospho logging module.
@@ -77,6 +87,14 @@ def init(
     :param raise_error_on_fail_to_send: whether to raise an error if the consumer fails to send logs
     :param version_id: the version of the code that generated the logs. If None, the version_id
         will be set to the current date.
+    :param max_queue_events: max number of log events kept in memory while waiting to be sent
+    :param max_queue_bytes: max size of the log events kept in memory while waiting to be sent
+    :param overflow_policy: what to do with new log events when the queue is full:
+        "drop_oldest", "drop_newest", "block" or "spill_to_disk" (requires spill_dir)
+    :param spill_dir: directory where log events are written with overflow_policy="spill_to_disk"
+    :param spool_dir: if set, log events are also written to this directory until the backend
+        receives them, and the events not received are sent again by the next phospho.init().
+        Use one directory per process.
 
     """
 
@@ -94,7 +112,19 @@ def init(
 
     default_version_id = version_id
     client = Client(api_key=api_key, project_id=project_id, base_url=base_url)
-    log_queue = LogQueue()
+    spool = None
+    if spool_dir is not None:
+        # Reinitializing: release the segment file of the previous spool
+        if log_queue is not None and log_queue.spool is not None:
+            log_queue.spool.close()
+        spool = Spool(directory=spool_dir)
+    log_queue = LogQueue(
+        max_events=max_queue_events,
+        max_bytes=max_queue_bytes,
+        overflow_policy=overflow_policy,
+        spill_dir=spill_dir,
+        spool=spool,
+    )
     consumer = Consumer(
         log_queue=log_queue,
         client=client,
@@ -143,6 +173,117 @@ def new_task() -> str:
     return latest_task_id
 
 
+def _extract_input_content(
+    input: Union[RawDataType, str],
+    raw_input: Optional[RawDataType] = None,
+    input_to_str_function: Optional[Callable[[Any], str]] = None,
+    **kwargs: Any,
+) -> Dict[str, Any]:
+    """
+    Process the parts of a log event that don't depend on the output: the input and
+    the kwargs. When streaming, this is done once per task.
+    """
+    global default_version_id
+
+    if "version_id" not in kwargs or kwargs["version_id"] is None:
+        kwargs["version_id"] = default_version_id
+
+    input = convert_content_to_loggable_content(input)
+    raw_input = convert_content_to_loggable_content(raw_input)
+    kwargs = convert_content_to_loggable_content(kwargs)
+
+    # Process the input to convert it to dict
+    (
+        input_to_log,
+        raw_input_to_log,
+    ) = extract_data_from_input(
+        input=input,
+        raw_input=raw_input,
+        input_to_str_function=input_to_str_function,
+    )
+
+    # Every other kwargs will be directly stored in the logs, if it's json serializable
+    if kwargs:
+        kwargs_to_log = filter_nonjsonable_keys(kwargs)
+    else:
+        kwargs_to_log = {}
+
+    return {
+        "converted_input": input,
+        "input": input_to_log,
+        "raw_input": raw_input_to_log,
+        "raw_input_type_name": type(input).__name__,
+        "kwargs": kwargs_to_log,
+    }
+
+
+def _fuse_log_content(
+    existing_log_content: Dict[str, object],
+    log_content: Dict[str, object],
+    concatenate_raw_outputs_if_task_id_exists: bool,
+) -> Dict[str, object]:
+    """
+    Fuse a new log content into the log content of an event already in the queue with
+    the same task_id. The existing log content is updated inplace and returned.
+    """
+    # Concatenate the log event output strings, unless if everything is None
+    if existing_log_content["output"] is None and log_content["output"] is None:
+        fused_output = None
+    else:
+        if existing_log_content["output"] is None:
+            existing_log_content["output"] = ""
+        if log_content["output"] is None:
+            log_content["output"] = ""
+        fused_output = str(existing_log_content["output"]) + str(log_content["output"])
+    # Concatenate the raw_outputs to keep all the intermediate results to openai
+    if existing_log_content["raw_output"] is None and log_content["raw_output"] is None:
+        fused_raw_output = None
+    else:
+        if existing_log_content["raw_output"] is None:
+            existing_log_content["raw_output"] = []
+        if log_content["raw_output"] is None:
+            log_content["raw_output"] = []
+        # Convert to list if not already
+        if not isinstance(existing_log_content["raw_output"], list):
+            existing_log_content["raw_output"] = [existing_log_content["raw_output"]]
+        if not isinstance(log_content["raw_output"], list):
+            log_content["raw_output"] = [log_content["raw_output"]]
+        fused_raw_output = (
+            existing_log_content["raw_output"] + log_content["raw_output"]
+        )
+    # For usage metrics in metadata, apply heuristics
+    fused_completion_tokens: Optional[int] = None
+    if "completion_tokens" in log_content:
+        fused_completion_tokens = log_content["completion_tokens"]
+        fused_completion_tokens += existing_log_content.get("completion_tokens", 0)
+    fused_total_tokens: Optional[int] = None
+    if "total_tokens" in log_content:
+        fused_total_tokens = log_content["total_tokens"]
+        fused_total_tokens += existing_log_content.get("total_tokens", 0)
+
+    # Put all of this into a dict
+    fused_log_content = {
+        # Replace creation timestamp by the original one
+        # Keep a trace of the latest timestamp. This will help computing streaming time
+        "client_created_at": existing_log_content["client_created_at"],
+        "last_update": log_content["client_created_at"],
+        # Concatenate the log event output strings
+        "output": fused_output,
+        "raw_output": fused_raw_output,
+    }
+    if fused_completion_tokens is not None:
+        fused_log_content["completion_tokens"] = fused_completion_tokens
+    if fused_total_tokens is not None:
+        fused_log_content["total_tokens"] = fused_total_tokens
+    # TODO : Turn this bool into a parametrizable list
+    if concatenate_raw_outputs_if_task_id_exists:
+        log_content.pop("raw_output")
+    existing_log_content.update(log_content)
+    # Update the dict inplace
+    existing_log_content.update(fused_log_content)
+    return existing_log_content
+
+
 def _log_single_event(
     input: Union[RawDataType, str],
     output: Optional[Union[RawDataType, str]] = None,
@@ -157,12 +298,17 @@ def _log_single_event(
         Callable[[Any, Any], Dict[str, float]]
     ] = None,
     to_log: bool = True,
+    return_content: bool = True,
     **kwargs: Any,
-) -> Dict[str, object]:
+) -> Optional[Dict[str, object]]:
     """Log a single event.
 
     Internal function used to push stuff to log_queue and mark them as to be sent
     to the logging endpoint or not.
+
+    Returns the content of the log event, fused with the previous chunks when streaming.
+    Callers that don't use it pass return_content=False: the chunks of a stream are
+    then only joined at the end of the stream, and None is returned.
     """
     global client
     global log_queue
@@ -170,28 +316,37 @@ def _log_single_event(
     global latest_session_id
     global default_version_id
 
-    if "version_id" not in kwargs or kwargs["version_id"] is None:
-        kwargs["version_id"] = default_version_id
-
-    input = convert_content_to_loggable_content(input)
-    output = convert_content_to_loggable_content(output)
-    raw_input = convert_content_to_loggable_content(raw_input)
-    raw_output = convert_content_to_loggable_content(raw_output)
-    kwargs = convert_content_to_loggable_content(kwargs)
-
     assert (
         (log_queue is not None) and (client is not None)
     ), "phospho.log() was called but the global variable log_queue was not found. Make sure that phospho.init() was called."
 
-    # Process the input and output to convert them to dict
-    (
-        input_to_log,
-        raw_input_to_log,
-    ) = extract_data_from_input(
-        input=input,
-        raw_input=raw_input,
-        input_to_str_function=input_to_str_function,
-    )
+    # Task: use the task_id parameter, the task_id infered from inputs, or generate one
+    if task_id is None:
+        task_id = generate_uuid()
+
+    # Keep track of the latest task_id and session_id
+    latest_task_id = task_id
+    latest_session_id = session_id
+
+    input_args = {
+        "input": input,
+        "raw_input": raw_input,
+        "input_to_str_function": input_to_str_function,
+        **kwargs,
+    }
+    accumulator = stream_accumulators.get(task_id)
+    if accumulator is not None and accumulator.has_same_input(input_args):
+        # Streaming: the input and kwargs were already processed with the first chunk
+        input_content = accumulator.input_content
+    else:
+        input_content = _extract_input_content(**input_args)
+        if accumulator is not None:
+            # The input or the kwargs changed during the stream
+            accumulator.input_args = input_args
+            accumulator.input_content = input_content
+
+    output = convert_content_to_loggable_content(output)
+    raw_output = convert_content_to_loggable_content(raw_output)
     (
         output_to_log,
         raw_output_to_log,
@@ -201,25 +356,11 @@ def _log_single_event(
         output_to_str_function=output_to_str_function,
     )
     metadata_to_log = extract_metadata_from_input_output(
-        input=input,
+        input=input_content["converted_input"],
         output=output,
         input_output_to_usage_function=input_output_to_usage_function,
     )
 
-    # Task: use the task_id parameter, the task_id infered from inputs, or generate one
-    if task_id is None:
-        task_id = generate_uuid()
-
-    # Keep track of the latest task_id and session_id
-    latest_task_id = task_id
-    latest_session_id = session_id
-
-    # Every other kwargs will be directly stored in the logs, if it's json serializable
-    if kwargs:
-        kwargs_to_log = filter_nonjsonable_keys(kwargs)
-    else:
-        kwargs_to_log = {}
-
     # The log event looks like this:
     log_content: Dict[str, object] = {
         "client_created_at": generate_timestamp(),
@@ -228,97 +369,59 @@ def _log_single_event(
         "session_id": session_id,  # Note: can be None
         "task_id": task_id,
         # input
-        "input": input_to_log,
-        "raw_input": raw_input_to_log,
-        "raw_input_type_name": type(input).__name__,
+        "input": input_content["input"],
+        "raw_input": input_content["raw_input"],
+        "raw_input_type_name": input_content["raw_input_type_name"],
         # output
         "output": output_to_log,
         "raw_output": raw_output_to_log,
         "raw_output_type_name": type(output).__name__,
         # other
         **metadata_to_log,
-        **kwargs_to_log,
+        **input_content["kwargs"],
     }
 
-    logger.debug(f"Existing task_id: {list(log_queue.events.keys())}")
     logger.debug(f"Current task_id: {task_id}")
 
-    if task_id in log_queue.events.keys():
+    existing_event = log_queue.get(task_id)
+    if accumulator is not None and existing_event is None:
+        # The in progress event was dropped from the queue
+        stream_accumulators.pop(task_id, None)
+        accumulator = None
+
+    if accumulator is not None and existing_event is not None:
+        if not to_log:
+            # Intermediate chunk of a stream: buffer it
+            accumulator.add(log_content)
+            if not return_content:
+                return None
+            return dict(accumulator.materialize())
+        # End of the stream: fuse the buffered chunks, then this last log content
+        stream_accumulators.pop(task_id, None)
+        accumulator.materialize()
+
+    if existing_event is not None:
         # If the task_id already exists in log_queue, update the existing event content
         # Update the dict inplace
-        existing_log_content = log_queue.events[task_id].content
-
-        # Concatenate the log event output strings, unless if everything is None
-        if existing_log_content["output"] is None and log_content["output"] is None:
-            fused_output = None
-        else:
-            if existing_log_content["output"] is None:
-                existing_log_content["output"] = ""
-            if log_content["output"] is None:
-                log_content["output"] = ""
-            fused_output = str(existing_log_content["output"]) + str(
-                log_content["output"]
-            )
-        # Concatenate the raw_outputs to keep all the intermediate results to openai
-        if (
-            existing_log_content["raw_output"] is None
-            and log_content["raw_output"] is None
-        ):
-            fused_raw_output = None
-        else:
-            if existing_log_content["raw_output"] is None:
-                existing_log_content["raw_output"] = []
-            if log_content["raw_output"] is None:
-                log_content["raw_output"] = []
-            # Convert to list if not already
-            if not isinstance(existing_log_content["raw_output"], list):
-                existing_log_content["raw_output"] = [
-                    existing_log_content["raw_output"]
-                ]
-            if not isinstance(log_content["raw_output"], list):
-                log_content["raw_output"] = [log_content["raw_output"]]
-            fused_raw_output = (
-                existing_log_content["raw_output"] + log_content["raw_output"]
-            )
-        # For usage metrics in metadata, apply heuristics
-        fused_completion_tokens: Optional[int] = None
-        if "completion_tokens" in log_content:
-            fused_completion_tokens = log_content["completion_tokens"]
-            fused_completion_tokens += existing_log_content.get("completion_tokens", 0)
-        fused_total_tokens: Optional[int] = None
-        if "total_tokens" in log_content:
-            fused_total_tokens = log_content["total_tokens"]
-            fused_total_tokens += existing_log_content.get("total_tokens", 0)
-
-        # Put all of this into a dict
-        fused_log_content = {
-            # Replace creation timestamp by the original one
-            # Keep a trace of the latest timestamp. This will help computing streaming time
-            "client_created_at": existing_log_content["client_created_at"],
-            "last_update": log_content["client_created_at"],
-            # Concatenate the log event output strings
-            "output": fused_output,
-            "raw_output": fused_raw_output,
-        }
-        if fused_completion_tokens is not None:
-            fused_log_content["completion_tokens"] = fused_completion_tokens
-        if fused_total_tokens is not None:
-            fused_log_content["total_tokens"] = fused_total_tokens
-        # TODO : Turn this bool into a parametrizable list
-        if concatenate_raw_outputs_if_task_id_exists:
-            log_content.pop("raw_output")
-        existing_log_content.update(log_content)
-        # Update the dict inplace
-        existing_log_content.update(fused_log_content)
-        log_content = existing_log_content
-        # Update the to_log status of event
-        log_queue.events[task_id].to_log = to_log
+        log_content = _fuse_log_content(
+            existing_event.content,
+            log_content,
+            concatenate_raw_outputs_if_task_id_exists,
+        )
+        # Update the to_log status and the size of the event
+        log_queue.mark(task_id, to_log=to_log)
     else:
+        event = Event(id=task_id, content=log_content, to_log=to_log)
+        if not to_log:
+            # First chunk of a stream. Note: the Event holds a copy of log_content
+            evict_stream_accumulators(stream_accumulators)
+            stream_accumulators[task_id] = StreamAccumulator(
+                input_args=input_args,
+                input_content=input_content,
+                first_log_content=event.content,
+            )
         # Append event to log_queue
-        log_queue.append(event=Event(id=task_id, content=log_content, to_log=to_log))
-
-    # logger.debug("Updated dict:" + str(log_queue.events[task_id].content))
-    # logger.debug("To log" + str(log_queue.events[task_id].to_log))
+        log_queue.append(event=event)
 
     return log_content
 
@@ -355,7 +458,10 @@ def _wrap_iterable(
                     # passed to phospho.log)
                     if hasattr(self, "_phospho_metadata"):
                         _log_single_event(
-                            output=value, to_log=False, **self._phospho_metadata
+                            output=value,
+                            to_log=False,
+                            return_content=False,
+                            **self._phospho_metadata,
                         )
                     return value
                 except StopIteration:
@@ -393,7 +499,10 @@ def _wrap_iterable(
                     # passed to phospho.log)
                     if hasattr(self, "_phospho_metadata"):
                         _log_single_event(
-                            output=value, to_log=False, **self._phospho_metadata
+                            output=value,
+                            to_log=False,
+                            return_content=False,
+                            **self._phospho_metadata,
                         )
                     return value
                 except StopAsyncIteration:
@@ -619,6 +728,7 @@ def _wrap(
                     task_id=task_id,
                     # By default, individual streamed calls are not immediately logged
                     to_log=False,
+                    return_content=False,
                     **_meta_wrap_kwargs,
                 )
             else:
@@ -656,6 +766,7 @@ def _wrap(
                     task_id=task_id,
                     # By default, individual streamed calls are not immediately logged
                     to_log=False,
+                    return_content=False,
                     **_meta_wrap_kwargs,
                 )
             else:
@@ -4,9 +4,11 @@ phospho client to interact with the phospho API
 
 import logging
 import os
-from typing import Dict, List, Literal, Optional
+from typing import AsyncIterator, Dict, Iterator, List, Literal, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import phospho.config as config
 from phospho.models import (
@@ -17,8 +19,18 @@ from phospho.models import (
     Task,
     ProjectDataFilters,
 )
-from phospho.sessions import SessionCollection
-from phospho.tasks import TaskCollection, TaskEntity
+from phospho.sessions import AsyncSessionCollection, SessionCollection
+from phospho.tasks import (
+    AsyncTaskCollection,
+    AsyncTaskEntity,
+    TaskCollection,
+    TaskEntity,
+)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
@@ -31,14 +43,23 @@ class PhosphoClientSideError(Exception):
     pass
 
 
-class Client:
-    """Standard client for calls to the phospho backend"""
+# Path and JSON payload of a request to the backend
+Request = Tuple[str, Optional[Dict[str, object]]]
+
+
+class BaseClient:
+    """
+    Configuration, requests and response handling shared by the sync and async
+    clients. The clients only differ in how they send the requests.
+    """
 
     def __init__(
         self,
         api_key: Optional[str] = None,
         project_id: Optional[str] = None,
         base_url: Optional[str] = None,
+        timeout: float = config.TIMEOUT,
+        max_retries: int = config.MAX_RETRIES,
     ) -> None:
         self.__api_key = api_key
         self.__project_id = project_id
@@ -54,6 +75,9 @@ class Client:
         else:
             self.base_url = base_url
 
+        self.timeout = timeout
+        self.max_retries = max_retries
+
     def _api_key(self) -> str:
         token = self.__api_key
         # Evaluate lazily in case environment variable is set with dotenv, or something
@@ -104,48 +128,207 @@ class Client:
             "accept": "application/json",
         }
 
-    def _get(
-        self, path: str, params: Optional[Dict[str, str]] = None
-    ) -> requests.Response:
-        url = f"{self.base_url}{path}"
-        response = requests.get(url, headers=self._headers(), params=params)
-
+    def _check_response(self, method: str, url: str, response):
+        """
+        Return the response if it's a success, otherwise raise an error.
+        Works with both requests.Response and httpx.Response.
+        """
         if response.status_code >= 200 and response.status_code < 300:
             return response
         elif response.status_code >= 400 and response.status_code < 500:
+            if method == "POST":
+                raise PhosphoClientSideError(
+                    f"Error {response.status_code} POST {url} with API key {self._displayable_api_key()} : {response.text}."
+                    + "\nThere is likely an issue with your config. Make sure you have the correct API key and project id: https://platform.phospho.ai"
+                )
             raise PhosphoClientSideError(
-                f"Client-side error {response.status_code} GET {url}: {response.text}"
+                f"Client-side error {response.status_code} {method} {url}: {response.text}"
             )
         elif response.status_code >= 500:
             raise PhosphoServerSideError(
-                f"Server-side error {response.status_code} GET {url}: {response.text}"
+                f"Server-side error {response.status_code} {method} {url}: {response.text}"
             )
         else:
             raise ValueError(
-                f"Unknwon error {response.status_code} GET {url}: {response.text}"
+                f"Unknown error {response.status_code} {method} {url}: {response.text}"
             )
 
+    def _compare_request(
+        self,
+        context_input: str,
+        old_output: str,
+        new_output: str,
+        test_id: Optional[str] = None,
+    ) -> Request:
+        return "/evals/compare", {
+            "project_id": self._project_id(),
+            "context_input": context_input,
+            "old_output": old_output,
+            "new_output": new_output,
+            "test_id": test_id,
+        }
+
+    def _flag_request(
+        self,
+        task_id: str,
+        flag: Literal["success", "failure"],
+        notes: Optional[str] = None,
+    ) -> Request:
+        return f"/tasks/{task_id}/human-eval", {
+            "human_eval": flag,
+            "project_id": self._project_id(),
+            "source": "user",
+            "notes": notes,
+        }
+
+    def _create_test_request(self, summary: Optional[dict] = None) -> Request:
+        return "/tests", {
+            "project_id": self._project_id(),
+            "summary": summary,
+        }
+
+    def _update_test_request(
+        self, test_id: str, status: Literal["completed", "canceled"]
+    ) -> Request:
+        return f"/tests/{test_id}", {
+            "status": status,
+        }
+
+    def _tasks_page_request(
+        self, filters: ProjectDataFilters, pagination: Dict[str, object]
+    ) -> Request:
+        return f"/projects/{self._project_id()}/tasks", {
+            "filters": filters.model_dump(),
+            "pagination": pagination,
+        }
+
+    @staticmethod
+    def _next_tasks_pagination(
+        content: dict, page_size: int
+    ) -> Optional[Dict[str, object]]:
+        """Pagination of the next page of tasks, following the cursor of this one"""
+        if content.get("next_cursor") is None:
+            return None
+        return {"per_page": page_size, "cursor": content["next_cursor"]}
+
+    def _tasks_flat_request(
+        self,
+        limit: int = 1000,
+        with_events: bool = True,
+        with_sessions: bool = True,
+        with_removed_events: bool = False,
+    ) -> Request:
+        return f"/projects/{self._project_id()}/tasks/flat", {
+            "limit": limit,
+            "with_events": with_events,
+            "with_sessions": with_sessions,
+            "with_removed_events": with_removed_events,
+        }
+
+    def _update_tasks_flat_request(
+        self, flattened_tasks: List[FlattenedTask]
+    ) -> Request:
+        return f"/projects/{self._project_id()}/tasks/flat-update", {
+            "flattened_tasks": [task.model_dump() for task in flattened_tasks]
+        }
+
+
+class Client(BaseClient):
+    """
+    Standard client for calls to the phospho backend
+
+    Requests go through a pooled session: connections to the backend are kept alive
+    between calls. Connection errors and 502/503/504 responses to GET requests are
+    retried with an exponential backoff. POST requests are only retried if the
+    connection failed, so that logs are never sent twice.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        project_id: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = config.TIMEOUT,
+        max_retries: int = config.MAX_RETRIES,
+        pool_maxsize: int = config.POOL_MAXSIZE,
+    ) -> None:
+        super().__init__(
+            api_key=api_key,
+            project_id=project_id,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+        )
+        self._session = self._build_session(pool_maxsize=pool_maxsize)
+
+    def _build_session(self, pool_maxsize: int) -> requests.Session:
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET"],
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _get(
+        self, path: str, params: Optional[Dict[str, str]] = None
+    ) -> requests.Response:
+        url = f"{self.base_url}{path}"
+        response = self._session.get(
+            url,
+            headers=self._headers(),
+            params=params,
+            timeout=(config.CONNECT_TIMEOUT, self.timeout),
+        )
+        return self._check_response("GET", url, response)
+
     def _post(
         self, path: str, payload: Optional[Dict[str, object]] = None
     ) -> requests.Response:
         url = f"{self.base_url}{path}"
-        response = requests.post(url, headers=self._headers(), json=payload)
+        response = self._session.post(
+            url,
+            headers=self._headers(),
+            json=payload,
+            timeout=(config.CONNECT_TIMEOUT, self.timeout),
+        )
+        return self._check_response("POST", url, response)
 
-        if response.status_code >= 200 and response.status_code < 300:
-            return response
-        elif response.status_code >= 400 and response.status_code < 500:
-            raise PhosphoClientSideError(
-                f"Error {response.status_code} POST {url} with API key {self._displayable_api_key()} : {response.text}."
-                + "\nThere is likely an issue with your config. Make sure you have the correct API key and project id: https://platform.phospho.ai"
-            )
-        elif response.status_code >= 500:
-            raise PhosphoServerSideError(
-                f"Error {response.status_code} POST {url}: {response.text}"
-            )
-        else:
-            raise ValueError(
-                f"Uknown error {response.status_code} POST {url}: {response.text}"
-            )
+    def _post_bytes(
+        self, path: str, content: bytes, content_encoding: Optional[str] = None
+    ) -> requests.Response:
+        """Post an already serialized JSON body, optionally compressed"""
+        url = f"{self.base_url}{path}"
+        headers = self._headers()
+        if content_encoding is not None:
+            headers["Content-Encoding"] = content_encoding
+        response = self._session.post(
+            url,
+            headers=headers,
+            data=content,
+            timeout=(config.CONNECT_TIMEOUT, self.timeout),
+        )
+        return self._check_response("POST", url, response)
+
+    def close(self) -> None:
+        """Close the connections of the session"""
+        self._session.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
 
     @property
     def sessions(self) -> SessionCollection:
@@ -168,14 +351,7 @@ class Client:
         Compare the old and new answers to the context_input with an LLM
         """
         comparison_result = self._post(
-            "/evals/compare",
-            payload={
-                "project_id": self._project_id(),
-                "context_input": context_input,
-                "old_output": old_output,
-                "new_output": new_output,
-                "test_id": test_id,
-            },
+            *self._compare_request(context_input, old_output, new_output, test_id)
         )
 
         return Comparison.model_validate(comparison_result.json())
@@ -191,15 +367,7 @@ class Client:
         Flag a task as a success or a failure. Returns the task.
         """
 
-        response = self._post(
-            f"/tasks/{task_id}/human-eval",
-            payload={
-                "human_eval": flag,
-                "project_id": self._project_id(),
-                "source": "user",
-                "notes": notes,
-            },
-        )
+        response = self._post(*self._flag_request(task_id, flag, notes))
         return TaskEntity(client=self, task_id=task_id, _content=response.json())
 
     def create_test(self, summary: Optional[dict] = None) -> Test:
@@ -207,13 +375,7 @@ class Client:
         Start a test
         """
 
-        response = self._post(
-            "/tests",
-            payload={
-                "project_id": self._project_id(),
-                "summary": summary,
-            },
-        )
+        response = self._post(*self._create_test_request(summary))
         return Test(**response.json())
 
     def update_test(
@@ -223,27 +385,33 @@ class Client:
         Update a test
         """
 
-        response = self._post(
-            f"/tests/{test_id}",
-            payload={
-                "status": status,
-            },
-        )
+        response = self._post(*self._update_test_request(test_id, status))
         return Test(**response.json())
 
     def fetch_tasks(self, filters: Optional[ProjectDataFilters] = None) -> List[Task]:
         """
         Get the tasks of a project.
         """
+        return list(self.iter_tasks(filters=filters))
+
+    def iter_tasks(
+        self,
+        filters: Optional[ProjectDataFilters] = None,
+        page_size: int = config.FETCH_PAGE_SIZE,
+    ) -> Iterator[Task]:
+        """
+        Iterate over the tasks of a project. The pages of tasks are fetched lazily,
+        following the cursor of the previous page.
+        """
         if filters is None:
             filters = ProjectDataFilters()
-        response = self._post(
-            f"/projects/{self._project_id()}/tasks",
-            payload={
-                "filters": filters.model_dump(),
-            },
-        )
-        return [Task.model_validate(task) for task in response.json()["tasks"]]
+        pagination: Optional[Dict[str, object]] = {"page": 0, "per_page": page_size}
+        while pagination is not None:
+            response = self._post(*self._tasks_page_request(filters, pagination))
+            content = response.json()
+            for task in content["tasks"]:
+                yield Task.model_validate(task)
+            pagination = self._next_tasks_pagination(content, page_size)
 
     def tasks_flat(
         self,
@@ -257,13 +425,9 @@ class Client:
         """
 
         response = self._post(
-            f"/projects/{self._project_id()}/tasks/flat",
-            payload={
-                "limit": limit,
-                "with_events": with_events,
-                "with_sessions": with_sessions,
-                "with_removed_events": with_removed_events,
-            },
+            *self._tasks_flat_request(
+                limit, with_events, with_sessions, with_removed_events
+            )
         )
         return response.json()
 
@@ -272,12 +436,7 @@ class Client:
         Update the tasks of a project using a flattened format.
         """
 
-        self._post(
-            f"/projects/{self._project_id()}/tasks/flat-update",
-            payload={
-                "flattened_tasks": [task.model_dump() for task in flattened_tasks]
-            },
-        )
+        self._post(*self._update_tasks_flat_request(flattened_tasks))
         return None
 
     def project_config(self) -> Project:
@@ -309,3 +468,194 @@ class Client:
         response_body = response.json()
 
         return response_body
+
+
+class AsyncClient(BaseClient):
+    """
+    Asynchronous client for calls to the phospho backend, for apps running on asyncio.
+
+    Backed by a pooled httpx.AsyncClient. Pass `http2=True` to multiplex the requests
+    on a single HTTP/2 connection (requires `pip install httpx[http2]`).
+
+    ```python
+    async with phospho.AsyncClient() as client:
+        tasks = await client.tasks.get_all()
+    ```
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        project_id: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = config.TIMEOUT,
+        max_retries: int = config.MAX_RETRIES,
+        pool_maxsize: int = config.POOL_MAXSIZE,
+        http2: bool = False,
+    ) -> None:
+        if httpx is None:
+            raise ImportError(
+                "phospho.AsyncClient requires the httpx library. Install it with `pip install httpx`."
+            )
+        super().__init__(
+            api_key=api_key,
+            project_id=project_id,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=max_retries,
+        )
+        # httpx only retries on connection errors, which is safe for POST requests
+        transport = httpx.AsyncHTTPTransport(
+            retries=max_retries,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize
+            ),
+        )
+        self._session = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(timeout, connect=config.CONNECT_TIMEOUT),
+        )
+
+    async def _get(self, path: str, params: Optional[Dict[str, str]] = None):
+        url = f"{self.base_url}{path}"
+        response = await self._session.get(url, headers=self._headers(), params=params)
+        return self._check_response("GET", url, response)
+
+    async def _post(self, path: str, payload: Optional[Dict[str, object]] = None):
+        url = f"{self.base_url}{path}"
+        response = await self._session.post(url, headers=self._headers(), json=payload)
+        return self._check_response("POST", url, response)
+
+    async def close(self) -> None:
+        """Close the connections of the client"""
+        await self._session.aclose()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    @property
+    def sessions(self) -> AsyncSessionCollection:
+        """Return a AsyncSessionCollection to interact with the sessions of the project"""
+        return AsyncSessionCollection(client=self)
+
+    @property
+    def tasks(self) -> AsyncTaskCollection:
+        """Return a AsyncTaskCollection to interact with the tasks of the project"""
+        return AsyncTaskCollection(client=self)
+
+    async def log(self, batched_log_events: List[Dict[str, object]]) -> dict:
+        """
+        Send a batch of log events to phospho, without going through the LogQueue
+        and the Consumer thread.
+        """
+        response = await self._post(
+            f"/log/{self._project_id()}",
+            payload={"batched_log_events": batched_log_events},
+        )
+        return response.json()
+
+    async def compare(
+        self,
+        context_input: str,
+        old_output: str,
+        new_output: str,
+        test_id: Optional[str] = None,
+    ) -> Comparison:
+        """
+        Compare the old and new answers to the context_input with an LLM
+        """
+        comparison_result = await self._post(
+            *self._compare_request(context_input, old_output, new_output, test_id)
+        )
+        return Comparison.model_validate(comparison_result.json())
+
+    async def flag(
+        self,
+        task_id: str,
+        flag: Literal["success", "failure"],
+        notes: Optional[str] = None,
+        **kwargs,
+    ) -> AsyncTaskEntity:
+        """
+        Flag a task as a success or a failure. Returns the task.
+        """
+        response = await self._post(*self._flag_request(task_id, flag, notes))
+        return AsyncTaskEntity(client=self, task_id=task_id, _content=response.json())
+
+    async def create_test(self, summary: Optional[dict] = None) -> Test:
+        """
+        Start a test
+        """
+        response = await self._post(*self._create_test_request(summary))
+        return Test(**response.json())
+
+    async def update_test(
+        self, test_id: str, status: Literal["completed", "canceled"]
+    ) -> Test:
+        """
+        Update a test
+        """
+        response = await self._post(*self._update_test_request(test_id, status))
+        return Test(**response.json())
+
+    async def fetch_tasks(
+        self, filters: Optional[ProjectDataFilters] = None
+    ) -> List[Task]:
+        """
+        Get the tasks of a project.
+        """
+        return [task async for task in self.iter_tasks(filters=filters)]
+
+    async def iter_tasks(
+        self,
+        filters: Optional[ProjectDataFilters] = None,
+        page_size: int = config.FETCH_PAGE_SIZE,
+    ) -> AsyncIterator[Task]:
+        """
+        Iterate over the tasks of a project. The pages of tasks are fetched lazily,
+        following the cursor of the previous page.
+        """
+        if filters is None:
+            filters = ProjectDataFilters()
+        pagination: Optional[Dict[str, object]] = {"page": 0, "per_page": page_size}
+        while pagination is not None:
+            response = await self._post(*self._tasks_page_request(filters, pagination))
+            content = response.json()
+            for task in content["tasks"]:
+                yield Task.model_validate(task)
+            pagination = self._next_tasks_pagination(content, page_size)
+
+    async def tasks_flat(
+        self,
+        limit: int = 1000,
+        with_events: bool = True,
+        with_sessions: bool = True,
+        with_removed_events: bool = False,
+    ) -> dict:
+        """
+        Get the tasks of a project in a flattened format.
+        """
+        response = await self._post(
+            *self._tasks_flat_request(
+                limit, with_events, with_sessions, with_removed_events
+            )
+        )
+        return response.json()
+
+    async def update_tasks_flat(self, flattened_tasks: List[FlattenedTask]) -> None:
+        """
+        Update the tasks of a project using a flattened format.
+        """
+        await self._post(*self._update_tasks_flat_request(flattened_tasks))
+        return None
+
+    async def project_config(self) -> Project:
+        """
+        Get the project configuration and settings
+        """
+        response = await self._get(f"/projects/{self._project_id()}")
+        return Project.model_validate(response.json())
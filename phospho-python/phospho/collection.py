@@ -4,6 +4,6 @@ class Collection:
     """
 
     def __init__(self, client) -> None:
-        from phospho.client import Client
+        from phospho.client import AsyncClient, Client
 
-        self._client: Client = client
+        self._client: "Client | AsyncClient" = client
@@ -11,3 +11,46 @@ MISTRAL_API_KEY = os.environ.get("MISTRAL_API_KEY")
 
 # Optional: Set this environment variable to instead use an Ollama model everywhere
 OVERRIDE_WITH_OLLAMA_MODEL = os.getenv("OVERRIDE_WITH_OLLAMA_MODEL", None)
+
+# HTTP transport of the phospho client
+TIMEOUT = 30.0  # in seconds
+CONNECT_TIMEOUT = 5.0  # in seconds
+MAX_RETRIES = 3  # Retries on connection errors and 502/503/504 responses
+POOL_MAXSIZE = 10  # Max number of keep-alive connections to the backend
+FETCH_PAGE_SIZE = 500  # Number of tasks per request when fetching the tasks
+
+# Batches of log events sent by the consumer
+MAX_BATCH_SIZE = 500  # Max number of log events per request
+MAX_BATCH_BYTES = 1024 * 1024  # Max size of the JSON body of a request, in bytes
+COMPRESSION_MIN_BYTES = 1024  # Bodies smaller than this are sent uncompressed
+
+# In-memory queue of log events waiting to be sent
+LOG_QUEUE_MAX_EVENTS = 10_000  # Max number of events in the queue
+# Max size of the events ready to be sent, in bytes
+LOG_QUEUE_MAX_BYTES = 100 * 1024 * 1024
+LOG_QUEUE_BLOCK_TIMEOUT = 5.0  # in seconds, with overflow_policy="block"
+
+# Optional on-disk spool of the log events, see phospho.init(spool_dir=...)
+# Size of a segment file before rotation, in bytes
+SPOOL_MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+# Oldest segments are dropped above, in bytes
+SPOOL_MAX_TOTAL_BYTES = 1024 * 1024 * 1024
+SPOOL_FSYNC_INTERVAL = 1.0  # in seconds
+
+# Scheduler of the lab workloads
+LAB_MAX_CONCURRENCY = 10  # Default max number of jobs running at the same time
+LAB_MAX_QUEUE_SIZE = 1_000  # Max number of jobs waiting for a worker
+LAB_MAX_RETRIES = 5  # Retries on rate limit (429), 5xx and connection errors
+LAB_RETRY_BASE_DELAY = 1.0  # in seconds, doubled at each retry
+LAB_RETRY_MAX_DELAY = 60.0  # in seconds
+
+# Cache of the LLM calls of the job library, see phospho.lab.llm_cache
+LLM_CACHE_TTL = 7 * 24 * 60 * 60  # in seconds
+LLM_CACHE_MAX_SIZE = 1_000  # Max number of responses in the in-memory cache
+
+# HTTP connections of the clients of the LLM providers, see phospho.lab.language_models
+LLM_MAX_CONNECTIONS = 100  # Max number of connections per client
+LLM_MAX_KEEPALIVE_CONNECTIONS = 20
+LLM_HTTP2 = True  # Only used if the h2 package is installed
+LLM_TIMEOUT = 600.0  # in seconds
+LLM_CONNECT_TIMEOUT = 5.0  # in seconds
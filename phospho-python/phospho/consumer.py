@@ -1,15 +1,25 @@
-from .log_queue import LogQueue
+from .log_queue import Event, LogQueue
 from .client import Client, PhosphoClientSideError
+from . import config
 
 import time
 import atexit
+import gzip
+import json
 import os
 from threading import Thread
+from typing import List, Literal, Optional, Tuple
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# A log event and the JSON serialization of its content
+Encoded = Tuple[Event, bytes]
+
+BODY_PREFIX = b'{"batched_log_events":['
+BODY_SUFFIX = b"]}"
+
 
 class Consumer(Thread):
     """Every tick, the consumer tries to send the accumulated logs to the backend."""
@@ -20,12 +30,18 @@ class Consumer(Thread):
         client: Client,
         tick: float = 0.5,  # How often to try to send logs
         raise_error_on_fail_to_send: bool = False,
+        max_batch_size: int = config.MAX_BATCH_SIZE,
+        max_batch_bytes: int = config.MAX_BATCH_BYTES,
+        compression: Optional[Literal["gzip"]] = "gzip",
     ) -> None:
         self.running = True
         self.log_queue = log_queue
         self.client = client
         self.tick = tick
         self.raise_error_on_fail_to_send = raise_error_on_fail_to_send
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.compression = compression
         self.nb_consecutive_errors = 0
 
         Thread.__init__(self, daemon=True)
@@ -43,37 +59,99 @@ class Consumer(Thread):
     def run(self) -> None:
         while self.running:
             self.send_batch()
+            self.log_queue.sync()
             time.sleep(self.get_wait_time())
 
         self.send_batch()
+        self.log_queue.sync()
+
+    def encode_batch(self, batch: List[Event]) -> List[List[Encoded]]:
+        """
+        Serialize the log events and split them in batches of at most max_batch_size
+        events and max_batch_bytes bytes. An event bigger than max_batch_bytes is
+        sent alone.
+        """
+        batches: List[List[Encoded]] = []
+        current_batch: List[Encoded] = []
+        current_size = len(BODY_PREFIX) + len(BODY_SUFFIX)
+        for event in batch:
+            try:
+                encoded_event = json.dumps(event.content).encode("utf-8")
+            except (TypeError, ValueError) as e:
+                # It would fail the same way at every tick: drop it
+                logger.error(
+                    f"Could not serialize log event {event.id}: {e}. Dropping it."
+                )
+                self.log_queue.ack([event])
+                continue
+            # +1 for the comma separator
+            event_size = len(encoded_event) + 1
+            if len(current_batch) > 0 and (
+                len(current_batch) >= self.max_batch_size
+                or current_size + event_size > self.max_batch_bytes
+            ):
+                batches.append(current_batch)
+                current_batch = []
+                current_size = len(BODY_PREFIX) + len(BODY_SUFFIX)
+            current_batch.append((event, encoded_event))
+            current_size += event_size
+        if len(current_batch) > 0:
+            batches.append(current_batch)
+        return batches
+
+    def post_batch(self, encoded_batch: List[Encoded]) -> None:
+        """
+        Send a batch of serialized log events. The body is compressed if it's big enough.
+        """
+        body = (
+            BODY_PREFIX
+            + b",".join(encoded_event for _, encoded_event in encoded_batch)
+            + BODY_SUFFIX
+        )
+        content_encoding = None
+        if self.compression == "gzip" and len(body) >= config.COMPRESSION_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            content_encoding = "gzip"
+        self.client._post_bytes(
+            f"/log/{self.client._project_id()}",
+            content=body,
+            content_encoding=content_encoding,
+        )
 
     def send_batch(self) -> None:
-        batch = self.log_queue.get_batch()
+        """
+        Send the ready log events, max_batch_size at a time, until the queue is drained
+        or a request fails.
+        """
+        while True:
+            batch = self.log_queue.get_batch_events(self.max_batch_size)
+            if len(batch) == 0:
+                return
+            if not self.send_events(batch) or len(batch) < self.max_batch_size:
+                return
 
-        if len(batch) > 0:
-            logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+    def send_events(self, batch: List[Event]) -> bool:
+        """
+        Send log events. Returns False if they couldn't be sent: they are requeued.
+        """
+        PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
+        PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
+        if PHOSPHO_TEST_ID is not None:
+            # Test mode: send logs only if we are in the right metric
+            if PHOSPHO_TEST_METRIC != "evaluate":
+                self.log_queue.ack(batch)
+                return True
+            # Add the test_id to the log events
+            for event in batch:
+                event.content["test_id"] = PHOSPHO_TEST_ID
 
+        logger.debug(f"Sending {len(batch)} log events to {self.client.base_url}")
+        encoded_batches = self.encode_batch(batch)
+        for i, encoded_batch in enumerate(encoded_batches):
             try:
-                PHOSPHO_TEST_ID = os.getenv("PHOSPHO_TEST_ID")
-                PHOSPHO_TEST_METRIC = os.getenv("PHOSPHO_TEST_METRIC")
-                if PHOSPHO_TEST_ID is None:
-                    # Normal behaviour : send logs to backend
-                    self.client._post(
-                        f"/log/{self.client._project_id()}",
-                        {"batched_log_events": batch},
-                    )
-                    self.nb_consecutive_errors = 0
-                elif PHOSPHO_TEST_ID is not None:
-                    # Test mode: send logs if we are in the right metric
-                    if PHOSPHO_TEST_METRIC == "evaluate":
-                        # Add the test_id to the log events
-                        for event in batch:
-                            event["test_id"] = PHOSPHO_TEST_ID
-                        self.client._post(
-                            f"/log/{self.client._project_id()}",
-                            {"batched_log_events": batch},
-                        )
-                        self.nb_consecutive_errors = 0
+                self.post_batch(encoded_batch)
+                self.log_queue.ack([event for event, _ in encoded_batch])
+                self.nb_consecutive_errors = 0
             except PhosphoClientSideError as e:
                 # If the error is a client-side error, we don't want to retry
                 raise e
@@ -85,9 +163,18 @@ class Consumer(Thread):
                 logger.warning(
                     f"Error sending phospho log events: {e}. Retrying in {self.get_wait_time()}s"
                 )
-                # Put all the events back into the log queue, so they are logged next tick
-                self.log_queue.add_batch(batch)
+                # Put the events not sent back into the log queue, so they are logged next tick
+                self.log_queue.requeue(
+                    [
+                        event
+                        for remaining_batch in encoded_batches[i:]
+                        for event, _ in remaining_batch
+                    ]
+                )
+                return False
+        return True
 
     def stop(self):
         self.running = False
-        self.join()
+        if self.is_alive():
+            self.join()
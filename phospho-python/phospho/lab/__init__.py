@@ -1,4 +1,5 @@
 from .lab import Workload, Job
+from .scheduler import ProviderLimiter, RateLimits, Scheduler
 from .models import (
     JobResult,
     Message,
@@ -10,4 +11,19 @@ from .models import (
 )
 from . import job_library as job_library
 from . import utils as utils
-from .language_models import get_provider_and_model, get_async_client, get_sync_client
+from .llm_cache import (
+    LLMCache,
+    MemoryLLMCache,
+    MongoLLMCache,
+    SQLiteLLMCache,
+    get_llm_cache,
+    set_llm_cache,
+)
+from .language_models import (
+    close_async_clients,
+    close_clients,
+    get_async_client,
+    get_client_metrics,
+    get_provider_and_model,
+    get_sync_client,
+)
@@ -5,12 +5,15 @@ The result is a JobResult object.
 """
 
 from collections import defaultdict
+import asyncio
+import json
 import logging
 import math
 import os
 import random
+import re
 import time
-from typing import List, Literal, Optional, Tuple, cast
+from typing import Dict, List, Literal, Optional, Set, Tuple, cast
 
 from phospho.models import ScoreRange, ScoreRangeSettings
 from phospho.utils import get_number_of_tokens, shorten_text
@@ -21,6 +24,8 @@ except ImportError:
     pass
 
 from .language_models import get_async_client, get_provider_and_model, get_sync_client
+from .llm_cache import cached_chat_completion
+from .scheduler import is_retryable_error
 from phospho.models import JobResult, Message, ResultType, DetectionScope
 
 logger = logging.getLogger(__name__)
@@ -143,12 +148,15 @@ async def event_detection(
     score_range_settings: Optional[ScoreRangeSettings] = None,
     event_scope: DetectionScope = "task",
     model: str = "openai:gpt-4o",
+    use_cache: bool = True,
     **kwargs,
 ) -> JobResult:
     """
     Detects if an event is present in a message.
 
     - We can use message metadatas to get examples of successful and unsuccessful interactions
+    - If use_cache, the response of the LLM is read from the cache of the lab when the
+    same prompt was already judged
     """
     # Identifier of the source of the evaluation, with the version of the model if phospho
     EVALUATION_SOURCE = "phospho-6"
@@ -345,7 +353,10 @@ If the event '{event_name}' is not present in the interaction or you can't categ
     # Call the API
     start_time = time.time()
     try:
-        response = await async_openai_client.chat.completions.create(
+        response, cache_hit = await cached_chat_completion(
+            async_openai_client,
+            provider,
+            use_cache=use_cache,
             model=model_name,
             messages=[
                 {
@@ -360,6 +371,9 @@ If the event '{event_name}' is not present in the interaction or you can't categ
             top_logprobs=20,
         )
     except Exception as e:
+        if is_retryable_error(e):
+            # Retried by the scheduler of the workload
+            raise
         logger.error(f"event_detection call to OpenAI API failed : {e}")
         return JobResult(
             result_type=ResultType.error,
@@ -374,6 +388,7 @@ If the event '{event_name}' is not present in the interaction or you can't categ
         "prompt": prompt,
         "llm_output": llm_response,
         "api_call_time": api_call_time,
+        "cache_hit": cache_hit,
     }
     metadata = {
         "api_call_time": api_call_time,
@@ -604,9 +619,431 @@ If the event '{event_name}' is not present in the interaction or you can't categ
     return JobResult(result_type=result_type, value=detected_event, metadata=metadata)
 
 
+class GroupedEventDetection:
+    """
+    Detects several events with the same scope on a message with a single LLM call.
+
+    Each event still has its own job, whose job_function is `detect`: the first job
+    run on a message makes the LLM call for all the events, and the other jobs read its
+    result. So the workload returns one JobResult per event, as with event_detection.
+
+    The LLM answers with a JSON object. If the answer for an event can't be parsed,
+    the job of this event falls back to event_detection. Events configured with
+    different models are detected with one call per model.
+    """
+
+    # Same source as event_detection
+    EVALUATION_SOURCE = "phospho-6"
+    MAX_TOKENS = 128_000
+    # Calls kept for the jobs that didn't read them yet. Past this, the oldest are
+    # forgotten, eg when the job of an event was sampled out for a message.
+    MAX_PENDING_CALLS = 1000
+
+    def __init__(
+        self,
+        events: List[dict],
+        event_scope: DetectionScope = "task",
+        model: str = "openai:gpt-4o",
+        use_cache: bool = True,
+    ):
+        """
+        :param events: the configs of the events, with event_name, event_description,
+            score_range_settings and optionally the model (defaults to model)
+        """
+        self.events = {}
+        for event in events:
+            score_range_settings = event.get("score_range_settings")
+            if score_range_settings is None:
+                score_range_settings = ScoreRangeSettings()
+            elif isinstance(score_range_settings, dict):
+                score_range_settings = ScoreRangeSettings.model_validate(
+                    score_range_settings
+                )
+            self.events[event["event_name"]] = {
+                "event_description": event.get("event_description"),
+                "score_range_settings": score_range_settings,
+                "model": event.get("model") or model,
+            }
+        self.event_names = list(self.events.keys())
+        self.event_scope = event_scope
+        self.model = model
+        self.use_cache = use_cache
+        # (message.id, model) -> LLM call for all the events of this model
+        self._calls: Dict[
+            Tuple[str, str], "asyncio.Task[Dict[str, Optional[JobResult]]]"
+        ] = {}
+        # (message.id, model) -> events whose job read the call
+        self._readers: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+
+    def _event_names_of_model(self, model: str) -> List[str]:
+        return [
+            event_name
+            for event_name in self.event_names
+            if self.events[event_name]["model"] == model
+        ]
+
+    def _answer_instructions(self, score_range_settings: ScoreRangeSettings) -> str:
+        if score_range_settings.score_type == "range":
+            return f"a whole number between {score_range_settings.min} and {score_range_settings.max}"
+        if score_range_settings.score_type == "category":
+            categories = ", ".join(
+                f"{i+1} for '{category}'"
+                for i, category in enumerate(score_range_settings.categories or [])
+            )
+            return f"the number of the category ({categories}), or 0 if the event is not present"
+        return "true if the event happened during the interaction, false otherwise"
+
+    def build_prompts(
+        self, message: Message, event_names: Optional[List[str]] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        System prompt and prompt of the LLM call for the events event_names (all the
+        events by default). None if the message has nothing to label in this scope.
+        """
+        if event_names is None:
+            event_names = self.event_names
+        successful_events = message.metadata.get("successful_events", [])
+        unsuccessful_events = message.metadata.get("unsuccessful_events", [])
+
+        system_prompt = """You are an impartial judge reading a conversation between a user and an assistant.
+You must evaluate several events during the latest interaction. Here are the events:
+"""
+        for event_name in event_names:
+            event = self.events[event_name]
+            system_prompt += f"""
+[EVENT '{event_name}' START]
+"""
+            if event["event_description"]:
+                system_prompt += f"""Description: '{event["event_description"]}'
+"""
+            system_prompt += f"""Answer: {self._answer_instructions(event["score_range_settings"])}
+"""
+            for examples, verb in (
+                (successful_events, "happened"),
+                (unsuccessful_events, "did not happen"),
+            ):
+                example = next(
+                    (e for e in examples if e["event_name"] == event_name), None
+                )
+                if example is not None:
+                    system_prompt += f"""Example of an interaction where the event {verb}: {example['input']} -> {example['output']}
+"""
+            system_prompt += """[EVENT END]
+"""
+
+        if len(message.previous_messages) > 1 and "task" in self.event_scope:
+            truncated_context = shorten_text(
+                message.latest_interaction_context(),
+                self.MAX_TOKENS,
+                get_number_of_tokens(system_prompt) + 100,
+                how="right",
+            )
+            system_prompt += f"""
+Here is the context of the conversation:
+[CONTEXT START]
+{truncated_context}
+[CONTEXT END]
+"""
+
+        if self.event_scope == "task":
+            interaction = message.latest_interaction()
+        elif self.event_scope in ("task_input_only", "task_output_only"):
+            role = "user" if self.event_scope == "task_input_only" else "assistant"
+            message_list = [m for m in message.as_list() if m.role.lower() == role]
+            if len(message_list) == 0:
+                return None
+            interaction = f"{role.capitalize()}: {message_list[-1].content}"
+        elif self.event_scope == "session":
+            interaction = message.transcript(
+                with_role=True, with_previous_messages=True
+            )
+        else:
+            raise ValueError(
+                f"Unknown event_scope : {self.event_scope}. Valid values are: {DetectionScope.__args__}"
+            )
+        if self.event_scope != "task":
+            # Like in event_detection, only the latest interaction isn't truncated
+            interaction = shorten_text(
+                interaction,
+                self.MAX_TOKENS,
+                get_number_of_tokens(system_prompt) + 100,
+                how="right",
+            )
+
+        example_answer = ", ".join(f'"{event_name}": ...' for event_name in event_names)
+        prompt = f"""Label the following interaction with the events:
+[INTERACTION TO LABEL START]
+{interaction}
+[INTERACTION END]
+
+Respond with only a JSON object with the answer for each event: {{{example_answer}}}"""
+        return system_prompt, prompt
+
+    def answer_logprob_score(
+        self, response: object, llm_response: str, event_name: str
+    ) -> Optional[Dict[str, float]]:
+        """
+        Normalized probabilities of "yes" and "no" for the answer of a confidence
+        event, read from the top logprobs of the first token of its value in the JSON.
+        None if the logprobs are not available.
+        """
+        choice = response.choices[0]  # type: ignore
+        if choice.logprobs is None or not choice.logprobs.content:
+            return None
+        event_key = re.search(
+            re.escape(json.dumps(event_name)) + r'\s*:\s*"?', llm_response
+        )
+        if event_key is None:
+            return None
+        # Find the token where the value starts
+        offset = 0
+        for token_logprob in choice.logprobs.content:
+            offset += len(token_logprob.token)
+            if offset > event_key.end():
+                break
+        else:
+            return None
+        logprob_score: Dict[str, float] = defaultdict(float)
+        for logprob in token_logprob.top_logprobs:
+            stripped_token = logprob.token.lower().strip(' "')
+            if stripped_token in ("yes", "true"):
+                logprob_score["yes"] += math.exp(logprob.logprob)
+            elif stripped_token in ("no", "false"):
+                logprob_score["no"] += math.exp(logprob.logprob)
+        total_score = sum(logprob_score.values())
+        if total_score == 0:
+            return None
+        return {key: score / total_score for key, score in logprob_score.items()}
+
+    def parse_answer(
+        self,
+        event_name: str,
+        answer: object,
+        metadata: dict,
+        logprob_score: Optional[Dict[str, float]] = None,
+    ) -> Optional[JobResult]:
+        """
+        JobResult of an event from its answer. None if the answer is invalid.
+        For confidence events, logprob_score gives the confidence of the answer.
+        """
+        settings: ScoreRangeSettings = self.events[event_name]["score_range_settings"]
+        # bool is a subclass of int
+        is_number = isinstance(answer, (int, float)) and not isinstance(answer, bool)
+        if settings.score_type == "confidence":
+            if isinstance(answer, str) and answer.strip().lower() in ("yes", "no"):
+                answer = answer.strip().lower() == "yes"
+            if not isinstance(answer, bool):
+                return None
+            label = "yes" if answer else "no"
+            if logprob_score is None:
+                score_metadata = {}
+                score = 1 if answer else 0
+                options_confidence = {label: 1.0}
+            else:
+                # Like event_detection, the score is the confidence of the answer
+                score_metadata = {"logprob_score": logprob_score}
+                score = logprob_score.get(label, 0)
+                options_confidence = logprob_score
+            return JobResult(
+                result_type=ResultType.bool,
+                value=answer,
+                metadata={
+                    **metadata,
+                    **score_metadata,
+                    "score_range": ScoreRange(
+                        score_type="confidence",
+                        max=1,
+                        min=0,
+                        value=score,
+                        label=label,
+                        options_confidence=options_confidence,
+                    ),
+                },
+            )
+        if settings.score_type == "range":
+            if not is_number or not settings.min <= answer <= settings.max:
+                return None
+            return JobResult(
+                result_type=ResultType.bool,
+                value=True,
+                metadata={
+                    **metadata,
+                    "score_range": ScoreRange(
+                        score_type="range",
+                        max=settings.max,
+                        min=settings.min,
+                        value=float(answer),
+                        label=str(int(answer)),
+                        options_confidence={float(answer): 1},
+                    ),
+                },
+            )
+        # category
+        categories = settings.categories or []
+        if not is_number or int(answer) != answer:
+            return None
+        category_index = int(answer)
+        if not 0 <= category_index <= len(categories):
+            return None
+        label = categories[category_index - 1] if category_index > 0 else "None"
+        return JobResult(
+            result_type=ResultType.literal,
+            value=category_index > 0,
+            metadata={
+                **metadata,
+                "score_range": ScoreRange(
+                    score_type="category",
+                    value=category_index,
+                    min=1 if category_index > 0 else 0,
+                    max=len(categories),
+                    label=label,
+                    options_confidence={label: 1},
+                ),
+            },
+        )
+
+    async def detect_all(
+        self, message: Message, model: Optional[str] = None
+    ) -> Dict[str, Optional[JobResult]]:
+        """
+        Detect all the events of the model (by default, of self.model) with a single
+        LLM call. The result of an event is None if it must be detected with
+        event_detection instead.
+        """
+        if model is None:
+            model = self.model
+        event_names = self._event_names_of_model(model)
+        no_results: Dict[str, Optional[JobResult]] = {
+            event_name: None for event_name in event_names
+        }
+        prompts = self.build_prompts(message, event_names)
+        if prompts is None:
+            return {
+                event_name: JobResult(
+                    result_type=ResultType.bool,
+                    value=False,
+                    logs=["No message to label in the interaction"],
+                )
+                for event_name in event_names
+            }
+        system_prompt, prompt = prompts
+
+        # The confidence of yes/no answers is read from the logprobs
+        logprobs_kwargs = {}
+        if any(
+            self.events[event_name]["score_range_settings"].score_type == "confidence"
+            for event_name in event_names
+        ):
+            logprobs_kwargs = {"logprobs": True, "top_logprobs": 20}
+
+        provider, model_name = get_provider_and_model(model)
+        async_openai_client = get_async_client(provider)
+        start_time = time.time()
+        try:
+            response, cache_hit = await cached_chat_completion(
+                async_openai_client,
+                provider,
+                use_cache=self.use_cache,
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0,
+                response_format={"type": "json_object"},
+                **logprobs_kwargs,
+            )
+        except Exception as e:
+            if is_retryable_error(e):
+                # Retried by the scheduler of the workload
+                raise
+            logger.warning(f"Grouped event detection failed, falling back: {e}")
+            return no_results
+        api_call_time = time.time() - start_time
+
+        llm_response = response.choices[0].message.content if response.choices else None
+        try:
+            answers = json.loads(llm_response or "")
+        except ValueError:
+            answers = None
+        if not isinstance(answers, dict):
+            logger.warning(
+                f"Grouped event detection returned an invalid JSON, falling back: {llm_response}"
+            )
+            return no_results
+
+        metadata = {
+            "api_call_time": api_call_time,
+            "evaluation_source": self.EVALUATION_SOURCE,
+            "grouped_events": event_names,
+        }
+        results: Dict[str, Optional[JobResult]] = {}
+        for event_name in event_names:
+            logprob_score = None
+            if logprobs_kwargs:
+                logprob_score = self.answer_logprob_score(
+                    response, cast(str, llm_response), event_name
+                )
+            results[event_name] = self.parse_answer(
+                event_name, answers.get(event_name), metadata, logprob_score
+            )
+        # The LLM call is stored once, with the first result
+        first_result = next((r for r in results.values() if r is not None), None)
+        llm_call = {
+            "model": model_name,
+            "prompt": prompt,
+            "llm_output": llm_response,
+            "api_call_time": api_call_time,
+            "cache_hit": cache_hit,
+        }
+        if first_result is not None:
+            first_result.metadata["llm_call"] = llm_call
+        return results
+
+    async def detect(self, message: Message, event_name: str, **kwargs) -> JobResult:
+        """
+        Job function of the event event_name. kwargs are the params of
+        event_detection, used if the grouped detection fails.
+        """
+        model = kwargs.get("model") or self.events[event_name]["model"]
+        if model != self.events[event_name]["model"]:
+            # Can't share the call of the events configured with another model
+            results: Dict[str, Optional[JobResult]] = {}
+        else:
+            key = (message.id, model)
+            call = self._calls.get(key)
+            if call is None or (call.done() and call.exception() is not None):
+                if call is None and len(self._calls) >= self.MAX_PENDING_CALLS:
+                    oldest_key = next(iter(self._calls))
+                    self._calls.pop(oldest_key)
+                    self._readers.pop(oldest_key, None)
+                call = asyncio.ensure_future(self.detect_all(message, model))
+                self._calls[key] = call
+            try:
+                results = await call
+            finally:
+                # Forget the call once all the events read it, even if it failed: a
+                # retry makes a new call
+                if self._calls.get(key) is call:
+                    self._readers[key].add(event_name)
+                    if self._readers[key] >= set(self._event_names_of_model(model)):
+                        self._calls.pop(key)
+                        self._readers.pop(key)
+
+        result = results.get(event_name)
+        if result is None:
+            kwargs.setdefault("event_scope", self.event_scope)
+            kwargs["model"] = model
+            kwargs.setdefault("use_cache", self.use_cache)
+            return await event_detection(message, event_name=event_name, **kwargs)
+        # Each job gets its own copy of the result
+        return result.model_copy(deep=True)
+
+
 async def evaluate_task(
     message: Message,
     model: str = "openai:gpt-4o",
+    use_cache: bool = True,
     **kwargs,
 ) -> JobResult:
     """
@@ -662,7 +1099,10 @@ async def evaluate_task(
             return None
 
         start_time = time.time()
-        response = await async_openai_client.chat.completions.create(
+        response, cache_hit = await cached_chat_completion(
+            async_openai_client,
+            provider,
+            use_cache=use_cache,
             model=model_name,
             messages=[
                 {
@@ -684,6 +1124,7 @@ async def evaluate_task(
             "llm_output": llm_response,
             "api_call_time": api_call_time,
             "evaluation_source": "phospho-6",
+            "cache_hit": cache_hit,
         }
 
         # Parse the llm response to avoid basic errors
@@ -927,6 +1368,7 @@ async def regex_event_detection(
 async def get_topic_of_conversation(
     message: Message,
     model: str = "openai:gpt-4o",
+    use_cache: bool = True,
 ) -> JobResult:
     """
     Uses an LLM to get the topic of the session
@@ -935,7 +1377,7 @@ async def get_topic_of_conversation(
     from phospho.utils import shorten_text
 
     provider, model_name = get_provider_and_model(model)
-    openai_client = get_sync_client(provider)
+    async_openai_client = get_async_client(provider)
 
     # We look at the full session
     messages = message.transcript(with_role=True, with_previous_messages=True)
@@ -948,7 +1390,11 @@ async def get_topic_of_conversation(
     prompt = "DISCUSSION START" + messages + "DISCUSSION END"
 
     try:
-        response = openai_client.chat.completions.create(
+        start_time = time.time()
+        response, cache_hit = await cached_chat_completion(
+            async_openai_client,
+            provider,
+            use_cache=use_cache,
             model=model_name,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -960,6 +1406,7 @@ async def get_topic_of_conversation(
             temperature=0,
             max_tokens=2,
         )
+        api_call_time = time.time() - start_time
 
         llm_response = response.choices[0].message.content
         llm_response = llm_response.lower()
@@ -968,6 +1415,16 @@ async def get_topic_of_conversation(
             result_type=ResultType.bool,
             value=llm_response,
             logs=[prompt, llm_response],
+            metadata={
+                "api_call_time": api_call_time,
+                "llm_call": {
+                    "model": model_name,
+                    "prompt": prompt,
+                    "llm_output": llm_response,
+                    "api_call_time": api_call_time,
+                    "cache_hit": cache_hit,
+                },
+            },
         )
 
     except Exception as e:
@@ -3,6 +3,7 @@ import concurrent.futures
 import itertools
 import logging
 import random
+from collections import defaultdict
 from typing import (
     Any,
     Awaitable,
@@ -20,6 +21,7 @@ from typing import (
 from tqdm import tqdm
 
 import phospho.client as client
+import phospho.config as config
 import phospho.lab.job_library as job_library
 
 from .models import (
@@ -34,6 +36,8 @@ from .models import (
     Project,
     Recipe,
 )
+from .language_models import close_async_clients
+from .scheduler import ProgressCallback, ProviderLimiter, RateLimits, Scheduler
 
 
 logger = logging.getLogger(__name__)
@@ -173,7 +177,8 @@ class Job:
         if asyncio.iscoroutinefunction(self.job_function):
             result = await self.job_function(message, **params)
         else:
-            result = self.job_function(message, **params)
+            # Don't block the event loop, so that the other jobs keep running
+            result = await asyncio.to_thread(self.job_function, message, **params)
 
         if result is None:
             logger.error(f"Job {self.id} returned None for message {message.id}.")
@@ -441,10 +446,43 @@ class Workload:
 
     @classmethod
     def from_phospho_events(
-        cls, event_definitions: List[EventDefinition]
+        cls,
+        event_definitions: List[EventDefinition],
+        group_llm_events: bool = False,
     ) -> "Workload":
+        """
+        Create a workload with one job per event definition.
+
+        :param group_llm_events: if True, the events detected with an LLM and with the
+            same detection scope are detected with a single LLM call per message (see
+            job_library.GroupedEventDetection). There is still one job per event.
+        """
         workload = cls()
 
+        # detection_scope -> detection of the llm events with this scope
+        groups: Dict[str, job_library.GroupedEventDetection] = {}
+        if group_llm_events:
+            llm_events_per_scope: Dict[str, List[EventDefinition]] = defaultdict(list)
+            for event_definition in event_definitions:
+                if event_definition.detection_engine == "llm_detection":
+                    llm_events_per_scope[event_definition.detection_scope].append(
+                        event_definition
+                    )
+            for scope, scope_event_definitions in llm_events_per_scope.items():
+                if len(scope_event_definitions) < 2:
+                    continue
+                groups[scope] = job_library.GroupedEventDetection(
+                    events=[
+                        {
+                            "event_name": event_definition.event_name,
+                            "event_description": event_definition.description,
+                            "score_range_settings": event_definition.score_range_settings,
+                        }
+                        for event_definition in scope_event_definitions
+                    ],
+                    event_scope=scope,
+                )
+
         for event_definition in event_definitions:
             event_name = event_definition.event_name
             workload.project_id = event_definition.project_id
@@ -455,10 +493,15 @@ class Workload:
 
             # We stick to the LLM detection engine
             if event_definition.detection_engine == "llm_detection":
+                group = groups.get(event_definition.detection_scope)
                 workload.add_job(
                     Job(
                         id=event_name,
-                        job_function=job_library.event_detection,
+                        job_function=(
+                            group.detect
+                            if group is not None
+                            else job_library.event_detection
+                        ),
                         config=EventConfig(
                             event_name=event_name,
                             event_description=event_definition.description,
@@ -549,18 +592,23 @@ class Workload:
     def from_phospho_project_config(
         cls,
         project_config: Project,
+        group_llm_events: bool = False,
     ):
         """
         Create a workload from a phospho project configuration.
 
         To fetch the project configuration, look at `Workload.from_phospho()`
+
+        :param group_llm_events: see `Workload.from_phospho_events()`
         """
         project_events = project_config.settings.events
         if project_events is None:
             logger.warning(f"Project with id {project_config.id} has no event setup")
             return cls()
 
-        workload = cls.from_phospho_events(list(project_events.values()))
+        workload = cls.from_phospho_events(
+            list(project_events.values()), group_llm_events=group_llm_events
+        )
         workload.project_id = project_config.id
         workload.org_id = project_config.org_id
         return workload
@@ -586,88 +634,78 @@ class Workload:
         project_config = phospho_client.project_config()
         return cls.from_phospho_project_config(project_config)
 
+    def _sampled(
+        self, job: Job, messages: Iterable[Message]
+    ) -> Iterable[Tuple[Job, Message]]:
+        """The (job, message) pairs to run, according to the sample rate of the job"""
+        for message in messages:
+            if job.sample >= 1 or random.random() < job.sample:
+                yield job, message
+
     async def async_run(
         self,
         messages: Iterable[Message],
         executor_type: Literal["parallel", "sequential", "parallel_jobs"] = "parallel",
-        max_parallelism: int = 10,
+        max_parallelism: int = config.LAB_MAX_CONCURRENCY,
+        rate_limits: Optional[Dict[str, Union[RateLimits, ProviderLimiter]]] = None,
+        max_retries: int = config.LAB_MAX_RETRIES,
+        progress_callback: Optional[ProgressCallback] = None,
     ) -> Dict[str, Dict[str, JobResult]]:
         """
         Runs all the jobs on the message.
 
         Args:
         :param messages: The messages to run the jobs on.
-        :param executor_type: The type of executor to use. Can be "parallel" or "sequential".
-        :param max_parallelism: The maximum number of parallel jobs to run per seconds.
-            Use this to adhere to rate limits. Only used if executor_type is "parallel" or "parallel_jobs".
+        :param executor_type: The type of executor to use.
+            - "parallel": the jobs are run one after the other, each on all the messages in parallel
+            - "parallel_jobs": all the jobs are run on all the messages in parallel
+            - "sequential": one job on one message at a time
+        :param max_parallelism: The maximum number of jobs running at the same time.
+            Only used if executor_type is "parallel" or "parallel_jobs".
+        :param rate_limits: The rate limits of the LLM providers, eg
+            {"openai": lab.RateLimits(requests_per_minute=500, tokens_per_minute=200_000)}
+        :param max_retries: The number of retries of a job on rate limit (429), server
+            and connection errors. After that, the result of the job is an error.
+        :param progress_callback: Called with (nb_done, total) after each job. Defaults
+            to a progress bar.
 
         Returns: a mapping of message.id -> job_id -> job_result
         """
-
-        # Run the jobs sequentially on every message
-        # TODO : For Jobs, implement a batched_run method that takes a list of messages
-        if executor_type == "parallel":
-            for job_id, job in self.jobs.items():
-                # Await all the results
-                semaphore = asyncio.Semaphore(max_parallelism)
-                # Create a progress bar
-                if hasattr(messages, "__len__"):
-                    t = tqdm(total=len(messages))
-                else:
-                    t = tqdm()
-
-                async def job_limit_wrap(message: Message):
-                    # Account for the semaphore (rate limit, max_parallelism)
-                    async with semaphore:
-                        if job.sample >= 1 or random.random() < job.sample:
-                            await job.async_run(message)
-                        # Update the progress bar
-                        t.update()
-
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(job_limit_wrap, messages)
-
-                t.display()
-                await asyncio.gather(*executor_results)
-                t.close()
-        elif executor_type == "parallel_jobs":
-            # Create a progress bar
-            if isinstance(messages, list):
-                t = tqdm(total=len(messages) * len(self.jobs))
-            else:
-                t = tqdm()
-
-            messages_and_jobs = itertools.product(messages, self.jobs.values())
-            semaphore = asyncio.Semaphore(max_parallelism)
-
-            async def message_job_limit_wrap(message_and_job: Tuple[Message, Job]):
-                message, job = message_and_job
-                if job.sample >= 1 or random.random() < job.sample:
-                    await job.async_run(message)
-                # Update the progress bar
-                t.update()
-
-            async with semaphore:
-                # Account for the semaphore (rate limit, max_parallelism)
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(
-                        message_job_limit_wrap, messages_and_jobs
-                    )
-
-            t.display()
-            await asyncio.gather(*executor_results)
-            t.close()
-        elif executor_type == "sequential":
-            for job_id, job in self.jobs.items():
-                for one_message in tqdm(messages):
-                    if job.sample >= 1 or random.random() < job.sample:
-                        await job.async_run(one_message)
-        else:
+        if executor_type not in ["parallel", "sequential", "parallel_jobs"]:
             raise NotImplementedError(
                 f"Executor type {executor_type} is not implemented"
             )
+        # The messages are iterated several times
+        messages = list(messages)
+
+        progress_bar = None
+        if progress_callback is None:
+            progress_bar = tqdm(total=len(messages) * len(self.jobs))
+
+            def progress_callback(nb_done: int, total: Optional[int]) -> None:
+                progress_bar.update()
+
+        scheduler = Scheduler(
+            max_concurrency=1 if executor_type == "sequential" else max_parallelism,
+            rate_limits=rate_limits,
+            max_retries=max_retries,
+            progress_callback=progress_callback,
+        )
+        total = len(messages) * len(self.jobs)
+        try:
+            if executor_type == "parallel_jobs":
+                await scheduler.run(
+                    itertools.chain.from_iterable(
+                        self._sampled(job, messages) for job in self.jobs.values()
+                    ),
+                    total=total,
+                )
+            else:
+                for job in self.jobs.values():
+                    await scheduler.run(self._sampled(job, messages), total=total)
+        finally:
+            if progress_bar is not None:
+                progress_bar.close()
 
         # Collect the results:
         # Result is a mapping of message.id -> job_id -> job_result
@@ -719,94 +757,40 @@ class Workload:
         self,
         messages: Iterable[Message],
         executor_type: Literal["parallel", "sequential", "parallel_jobs"] = "parallel",
-        max_parallelism: int = 10,
-    ):
+        max_parallelism: int = config.LAB_MAX_CONCURRENCY,
+        rate_limits: Optional[Dict[str, Union[RateLimits, ProviderLimiter]]] = None,
+        max_retries: int = config.LAB_MAX_RETRIES,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Dict[str, JobResult]]:
         """
-        Runs all the jobs on the message.
-
-        Args:
-        :param messages: The messages to run the jobs on.
-        :param executor_type: The type of executor to use. Can be "parallel" or "sequential".
-        :param max_parallelism: The maximum number of parallel jobs to run per seconds.
-            Use this to adhere to rate limits. Only used if executor_type is "parallel" or "parallel_jobs".
+        Runs all the jobs on the message. Synchronous version of async_run: the jobs
+        run on a single event loop. Synchronous job functions run in threads.
 
         Returns: a mapping of message.id -> job_id -> job_result
         """
 
-        # Run the jobs sequentially on every message
-        # TODO : For Jobs, implement a batched_run method that takes a list of messages
-        if executor_type == "parallel":
-            for job_id, job in self.jobs.items():
-                # Create a progress bar
-                if hasattr(messages, "__len__"):
-                    t = tqdm(total=len(messages))
-                else:
-                    t = tqdm()
-
-                def job_limit_wrap(message: Message):
-                    # Account for the semaphore (rate limit, max_parallelism)
-                    if job.sample >= 1 or random.random() < job.sample:
-                        asyncio.run(job.async_run(message))
-                    # Update the progress bar
-                    t.update()
-
-                t.display()
-                with concurrent.futures.ThreadPoolExecutor(
-                    max_workers=max_parallelism
-                ) as executor:
-                    # Submit tasks to the executor
-                    executor_results = executor.map(job_limit_wrap, messages)
-
-                t.close()
-        elif executor_type == "parallel_jobs":
-            # Create a progress bar
-            if isinstance(messages, list):
-                t = tqdm(total=len(messages) * len(self.jobs))
-            else:
-                t = tqdm()
-
-            messages_and_jobs = itertools.product(messages, self.jobs.values())
-
-            def message_job_limit_wrap(message_and_job: Tuple[Message, Job]):
-                message, job = message_and_job
-                if job.sample >= 1 or random.random() < job.sample:
-                    asyncio.run(job.async_run(message))
-                # Update the progress bar
-                t.update()
-
-            t.display()
-            # Account for the semaphore (rate limit, max_parallelism)
-            with concurrent.futures.ThreadPoolExecutor(
-                max_workers=max_parallelism
-            ) as executor:
-                # Submit tasks to the executor
-                executor_results = executor.map(
-                    message_job_limit_wrap, messages_and_jobs
+        async def run_in_new_loop() -> Dict[str, Dict[str, JobResult]]:
+            try:
+                return await self.async_run(
+                    messages=messages,
+                    executor_type=executor_type,
+                    max_parallelism=max_parallelism,
+                    rate_limits=rate_limits,
+                    max_retries=max_retries,
+                    progress_callback=progress_callback,
                 )
-
-            t.close()
-        elif executor_type == "sequential":
-            for job_id, job in self.jobs.items():
-                for one_message in tqdm(messages):
-                    if job.sample >= 1 or random.random() < job.sample:
-                        asyncio.run(job.async_run(one_message))
-        else:
-            raise NotImplementedError(
-                f"Executor type {executor_type} is not implemented"
-            )
-
-        # Collect the results:
-        # Result is a mapping of message.id -> job_id -> job_result
-        results: Dict[str, Dict[str, JobResult]] = {}
-        for one_message in messages:
-            results[one_message.id] = {}
-            for job_id, job in self.jobs.items():
-                job_result = job.results.get(one_message.id, None)
-                if job_result is not None:
-                    results[one_message.id][job.id] = job_result
-
-        self._results = results
-        return results
+            finally:
+                # The clients of the LLM providers can't be reused after the loop
+                await close_async_clients()
+
+        coroutine = run_in_new_loop()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        # An event loop is already running in this thread (eg: in a notebook)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
 
     def optimize_jobs(
         self, accuracy_threshold: float = 1.0, min_count: int = 10
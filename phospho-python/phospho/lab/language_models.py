@@ -1,5 +1,22 @@
+"""
+Clients of the LLM providers.
+
+Creating a client creates a new pool of HTTP connections. So the clients are kept in a
+registry keyed by (provider, base_url, hash of the api key) and reused by the jobs. The
+limits of the connection pools are read from phospho.config when a client is created.
+
+The async clients are bound to the event loop where they are created: each event loop
+has its own clients. Call `close_clients` at shutdown.
+"""
+
+import asyncio
+import hashlib
 import os
-from typing import Literal, Optional, Tuple
+import threading
+import weakref
+from typing import Any, Dict, Literal, Optional, Tuple
+
+import httpx
 
 import phospho.config as config
 
@@ -9,6 +26,46 @@ try:
 except ImportError:
     AsyncOpenAI = OpenAI = object
 
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+Provider = Literal[
+    "openai",
+    "mistral",
+    "ollama",
+    "solar",
+    "together",
+    "anyscale",
+    "fireworks",
+]
+
+# provider -> (base_url, environment variable of the api key)
+# None means the default of the openai package
+PROVIDERS: Dict[str, Tuple[Optional[str], Optional[str]]] = {
+    "openai": (None, None),
+    "mistral": ("https://api.mistral.ai/v1/", "MISTRAL_API_KEY"),
+    "ollama": ("http://localhost:11434/v1/", None),
+    "solar": ("https://api.upstage.ai/v1/solar/", "SOLAR_API_KEY"),
+    "together": ("https://api.together.xyz/v1/", "TOGETHER_API_KEY"),
+    "anyscale": ("https://api.endpoints.anyscale.com/v1/", "ANYSCALE_API_KEY"),
+    "fireworks": ("https://api.fireworks.ai/inference/v1/", "FIREWORKS_API_KEY"),
+}
+
+ClientKey = Tuple[str, Optional[str], Optional[str]]
+
+_lock = threading.Lock()
+_sync_clients: Dict[ClientKey, OpenAI] = {}
+# event loop -> {key: async client created in this event loop}
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# provider -> number of HTTP requests waiting for a response
+_nb_in_flight: Dict[str, int] = {}
+# provider -> number of HTTP requests sent
+_nb_requests: Dict[str, int] = {}
+
 
 def get_provider_and_model(model: str) -> Tuple[str, str]:
     """
@@ -43,95 +100,180 @@ def get_provider_and_model(model: str) -> Tuple[str, str]:
     return provider, model_name
 
 
+def _start_request(provider: str) -> None:
+    with _lock:
+        _nb_in_flight[provider] = _nb_in_flight.get(provider, 0) + 1
+        _nb_requests[provider] = _nb_requests.get(provider, 0) + 1
+
+
+def _end_request(provider: str) -> None:
+    with _lock:
+        _nb_in_flight[provider] -= 1
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    def __init__(self, provider: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _start_request(self.provider)
+        try:
+            return super().handle_request(request)
+        finally:
+            _end_request(self.provider)
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, provider: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _start_request(self.provider)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            _end_request(self.provider)
+
+
+def _http_client_kwargs(provider: str, is_async: bool) -> Dict[str, Any]:
+    transport_class = _AsyncCountingTransport if is_async else _CountingTransport
+    return {
+        "transport": transport_class(
+            provider,
+            limits=httpx.Limits(
+                max_connections=config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            http2=config.LLM_HTTP2 and HTTP2_AVAILABLE,
+        ),
+        "timeout": httpx.Timeout(
+            config.LLM_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT
+        ),
+        "follow_redirects": True,
+    }
+
+
+def _get_client_params(
+    provider: str, api_key: Optional[str]
+) -> Tuple[ClientKey, Dict[str, Any]]:
+    """Key of the client in the registry and the kwargs to create it"""
+    if provider not in PROVIDERS:
+        raise NotImplementedError(f"Provider {provider} is not supported.")
+    base_url, api_key_env = PROVIDERS[provider]
+    if provider == "openai":
+        # The openai package reads OPENAI_API_KEY
+        api_key = os.getenv("OPENAI_API_KEY")
+    elif provider == "ollama":
+        api_key = "ollama"
+    elif api_key_env is not None:
+        api_key = api_key or os.getenv(api_key_env)
+
+    api_key_hash = (
+        hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        if api_key is not None
+        else None
+    )
+    client_kwargs: Dict[str, Any] = {}
+    if base_url is not None:
+        client_kwargs["base_url"] = base_url
+    if api_key is not None:
+        client_kwargs["api_key"] = api_key
+    return (provider, base_url, api_key_hash), client_kwargs
+
+
 def get_async_client(
-    provider: Literal[
-        "openai",
-        "mistral",
-        "ollama",
-        "solar",
-        "together",
-        "anyscale",
-        "fireworks",
-    ],
+    provider: Provider,
     api_key: Optional[str] = None,
 ) -> AsyncOpenAI:
-    if provider == "openai":
-        return AsyncOpenAI()
-    if provider == "mistral":
-        return AsyncOpenAI(
-            base_url="https://api.mistral.ai/v1/",
-            api_key=api_key or os.getenv("MISTRAL_API_KEY"),
-        )
-    if provider == "ollama":
-        return AsyncOpenAI(
-            base_url="http://localhost:11434/v1/",
-            api_key="ollama",
-        )
-    if provider == "solar":
-        return AsyncOpenAI(
-            base_url="https://api.upstage.ai/v1/solar/",
-            api_key=api_key or os.getenv("SOLAR_API_KEY"),
-        )
-    if provider == "together":
-        return AsyncOpenAI(
-            base_url="https://api.together.xyz/v1/",
-            api_key=api_key or os.getenv("TOGETHER_API_KEY"),
-        )
-    if provider == "anyscale":
-        return AsyncOpenAI(
-            base_url="https://api.endpoints.anyscale.com/v1/",
-            api_key=api_key or os.getenv("ANYSCALE_API_KEY"),
-        )
-    if provider == "fireworks":
+    """
+    Get the async client of a provider. Inside an event loop, the client is shared
+    with the other callers in the same event loop.
+    """
+    key, client_kwargs = _get_client_params(provider, api_key)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not in an event loop: we don't know where the client will be used
         return AsyncOpenAI(
-            base_url="https://api.fireworks.ai/inference/v1/",
-            api_key=api_key or os.getenv("FIREWORKS_API_KEY"),
+            **client_kwargs,
+            http_client=httpx.AsyncClient(**_http_client_kwargs(provider, True)),
         )
-    raise NotImplementedError(f"Provider {provider} is not supported.")
+
+    with _lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                **client_kwargs,
+                http_client=httpx.AsyncClient(**_http_client_kwargs(provider, True)),
+            )
+            loop_clients[key] = client
+    return client
 
 
 def get_sync_client(
-    provider: Literal[
-        "openai",
-        "mistral",
-        "ollama",
-        "solar",
-        "together",
-        "anyscale",
-        "fireworks",
-    ],
+    provider: Provider,
     api_key: Optional[str] = None,
 ) -> OpenAI:
-    if provider == "openai":
-        return OpenAI()
-    if provider == "mistral":
-        return OpenAI(
-            base_url="https://api.mistral.ai/v1/",
-            api_key=api_key or os.getenv("MISTRAL_API_KEY"),
-        )
-    if provider == "ollama":
-        return OpenAI(
-            base_url="http://localhost:11434/v1/",
-            api_key="ollama",
-        )
-    if provider == "solar":
-        return OpenAI(
-            base_url="https://api.upstage.ai/v1/solar/",
-            api_key=api_key or os.getenv("SOLAR_API_KEY"),
-        )
-    if provider == "together":
-        return OpenAI(
-            base_url="https://api.together.xyz/v1/",
-            api_key=api_key or os.getenv("TOGETHER_API_KEY"),
-        )
-    if provider == "anyscale":
-        return OpenAI(
-            base_url="https://api.endpoints.anyscale.com/v1/",
-            api_key=api_key or os.getenv("ANYSCALE_API_KEY"),
-        )
-    if provider == "fireworks":
-        return OpenAI(
-            base_url="https://api.fireworks.ai/inference/v1/",
-            api_key=api_key or os.getenv("FIREWORKS_API_KEY"),
+    """
+    Get the client of a provider. The client is shared with the other callers.
+    """
+    key, client_kwargs = _get_client_params(provider, api_key)
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            client = OpenAI(
+                **client_kwargs,
+                http_client=httpx.Client(**_http_client_kwargs(provider, False)),
+            )
+            _sync_clients[key] = client
+    return client
+
+
+async def close_async_clients() -> None:
+    """
+    Close the async clients of the current event loop. Call it before the end of a
+    short-lived event loop (eg: asyncio.run), since its clients can't be reused.
+    """
+    with _lock:
+        async_clients = list(
+            _async_clients.pop(asyncio.get_running_loop(), {}).values()
         )
-    raise NotImplementedError(f"Provider {provider} is not supported.")
+    for async_client in async_clients:
+        await async_client.close()
+
+
+async def close_clients() -> None:
+    """
+    Close the sync clients and the async clients of the current event loop
+    """
+    with _lock:
+        sync_clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in sync_clients:
+        client.close()
+    await close_async_clients()
+
+
+def get_client_metrics() -> Dict[str, Dict[str, int]]:
+    """
+    Metrics of the clients per provider: number of clients, number of requests
+    waiting for a response, and total number of requests
+    """
+    with _lock:
+        nb_clients: Dict[str, int] = {}
+        for provider, _, _ in _sync_clients.keys():
+            nb_clients[provider] = nb_clients.get(provider, 0) + 1
+        for loop_clients in _async_clients.values():
+            for provider, _, _ in loop_clients.keys():
+                nb_clients[provider] = nb_clients.get(provider, 0) + 1
+        return {
+            provider: {
+                "nb_clients": nb_clients.get(provider, 0),
+                "nb_in_flight": _nb_in_flight.get(provider, 0),
+                "nb_requests": _nb_requests.get(provider, 0),
+            }
+            for provider in set(nb_clients) | set(_nb_requests)
+        }
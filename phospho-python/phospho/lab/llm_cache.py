@@ -0,0 +1,282 @@
+"""
+Cache of the LLM calls of the job library.
+
+The jobs of the lab call the LLMs with temperature 0: the same request gives the same
+result. When a recipe is run again on the same tasks (backfills, backtests, retried
+logs), the response is read from the cache instead of calling the LLM again.
+
+A response is cached under a hash of the normalized request: provider, model,
+messages and parameters. Only successful responses are cached.
+
+The default cache is in memory. Use `set_llm_cache` to use another backend:
+
+```python
+from phospho import lab
+
+lab.set_llm_cache(lab.SQLiteLLMCache("llm_cache.db"))
+```
+
+To opt-out for a job, pass `use_cache=False` in its config.
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import phospho.config as config
+
+try:
+    from openai.types.chat import ChatCompletion
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(provider: str, model: str, **request: Any) -> str:
+    """
+    Hash of an LLM request. Parameters set to None are ignored, so that they don't
+    change the key.
+    """
+    normalized_request = {
+        "provider": provider,
+        "model": model,
+        **{key: value for key, value in request.items() if value is not None},
+    }
+    serialized_request = json.dumps(
+        normalized_request, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(serialized_request.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Base class of the cache backends. Implement `_get` and `_set`, which read and
+    write a JSON serializable value with its expiration timestamp.
+    """
+
+    def __init__(self, ttl: Optional[float] = config.LLM_CACHE_TTL):
+        """
+        :param ttl: time to live of the entries, in seconds. None means no expiration.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def _get(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        raise NotImplementedError
+
+    async def _set(
+        self, key: str, value: Dict[str, Any], expires_at: Optional[float]
+    ) -> None:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = await self._get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        await self._set(key, value, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        nb_lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / nb_lookups if nb_lookups else None,
+        }
+
+
+class MemoryLLMCache(LLMCache):
+    """
+    Cache in memory. When it holds more than `max_size` entries, the least recently
+    used entry is evicted.
+    """
+
+    def __init__(
+        self,
+        max_size: int = config.LLM_CACHE_MAX_SIZE,
+        ttl: Optional[float] = config.LLM_CACHE_TTL,
+    ):
+        super().__init__(ttl=ttl)
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], Optional[float]]]" = (
+            OrderedDict()
+        )
+
+    async def _get(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def _set(
+        self, key: str, value: Dict[str, Any], expires_at: Optional[float]
+    ) -> None:
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteLLMCache(LLMCache):
+    """
+    Cache in a SQLite database on disk, shared by the runs of the lab on this machine.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = config.LLM_CACHE_TTL):
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    async def _get(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    async def _set(
+        self, key: str, value: Dict[str, Any], expires_at: Optional[float]
+    ) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(value, default=str), expires_at),
+            )
+
+    def delete_expired(self) -> int:
+        """Delete the expired entries. Returns the number of entries deleted."""
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class MongoLLMCache(LLMCache):
+    """
+    Cache in a Mongo collection, shared by all the workers using it.
+
+    The collection can be a pymongo or a motor collection. Call `create_indexes` once
+    to let Mongo delete the expired entries.
+    """
+
+    def __init__(self, collection: Any, ttl: Optional[float] = config.LLM_CACHE_TTL):
+        super().__init__(ttl=ttl)
+        self.collection = collection
+
+    async def _call(self, result: Any) -> Any:
+        # motor returns awaitables, pymongo returns the result
+        if inspect.isawaitable(result):
+            return await result
+        return result
+
+    async def _get(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        document = await self._call(self.collection.find_one({"_id": key}))
+        if document is None:
+            return None
+        expires_at = document.get("expires_at")
+        if isinstance(expires_at, datetime):
+            if expires_at.tzinfo is None:
+                # pymongo returns naive datetimes in UTC
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            expires_at = expires_at.timestamp()
+        return document["value"], expires_at
+
+    async def _set(
+        self, key: str, value: Dict[str, Any], expires_at: Optional[float]
+    ) -> None:
+        await self._call(
+            self.collection.replace_one(
+                {"_id": key},
+                {
+                    "value": value,
+                    "expires_at": (
+                        datetime.fromtimestamp(expires_at, tz=timezone.utc)
+                        if expires_at is not None
+                        else None
+                    ),
+                },
+                upsert=True,
+            )
+        )
+
+    async def create_indexes(self) -> None:
+        await self._call(
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+        )
+
+
+_llm_cache: Optional[LLMCache] = MemoryLLMCache()
+
+
+def set_llm_cache(cache: Optional[LLMCache]) -> None:
+    """Set the cache used by the job library. None disables the cache."""
+    global _llm_cache
+    _llm_cache = cache
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    return _llm_cache
+
+
+async def cached_chat_completion(
+    client: Any,
+    provider: str,
+    use_cache: bool = True,
+    **request: Any,
+) -> Tuple["ChatCompletion", bool]:
+    """
+    Call `client.chat.completions.create(**request)`, unless the same request is in
+    the cache. Returns the response and whether it was a cache hit.
+
+    Errors of the cache backend are logged and the LLM is called.
+    """
+    cache = _llm_cache if use_cache else None
+    key = None
+    if cache is not None:
+        key = make_cache_key(provider, **request)
+        try:
+            cached_response = await cache.get(key)
+            if cached_response is not None:
+                return ChatCompletion.model_validate(cached_response), True
+        except Exception as e:
+            logger.warning(f"Could not read the LLM cache: {e}")
+
+    response = await client.chat.completions.create(**request)
+
+    if cache is not None and key is not None:
+        try:
+            await cache.set(key, response.model_dump(mode="json"))
+        except Exception as e:
+            logger.warning(f"Could not write the LLM cache: {e}")
+    return response, False
@@ -0,0 +1,287 @@
+"""
+Asyncio scheduler of the jobs of a Workload.
+
+The (job, message) pairs are pulled into a bounded queue and run by a fixed number of
+workers. Before each call, the workers wait for the rate limits of the LLM provider of
+the job (requests and tokens per minute). Calls failing with a rate limit (429), a
+server error (5xx) or a connection error are retried with an exponential backoff and
+full jitter.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from pydantic import BaseModel
+
+import phospho.config as config
+
+from .language_models import get_provider_and_model
+from .models import JobResult, Message, ResultType
+
+if TYPE_CHECKING:
+    from .lab import Job
+
+logger = logging.getLogger(__name__)
+
+# Tokens of the prompt of a job that are not in the message (instructions, examples)
+PROMPT_TOKENS_OVERHEAD = 500
+
+ProgressCallback = Callable[[int, Optional[int]], None]
+
+
+class RateLimits(BaseModel):
+    """
+    Rate limits of an LLM provider. None means no limit.
+    """
+
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+class TokenBucket:
+    """
+    A bucket of `per_minute` tokens, refilled continuously. acquire waits until the
+    requested tokens are available.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60  # tokens per second
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A request larger than the bucket would never fit: wait for a full bucket
+        amount = min(amount, self.capacity)
+        self._refill()
+        # Reserve the tokens now, even if the bucket goes negative: the callers are
+        # served in order and no await happens before the reservation
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class ProviderLimiter:
+    """
+    Request and token buckets of a provider. Pass the same limiter to several
+    schedulers to share the rate limits between them.
+    """
+
+    def __init__(self, rate_limits: RateLimits):
+        self.requests = (
+            TokenBucket(rate_limits.requests_per_minute)
+            if rate_limits.requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(rate_limits.tokens_per_minute)
+            if rate_limits.tokens_per_minute
+            else None
+        )
+
+    async def acquire(self, nb_tokens: int) -> None:
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(nb_tokens)
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """HTTP status code of an error raised by an LLM client, if any"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Rate limits, server errors and connection errors are worth retrying"""
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code == 429 or 500 <= status_code < 600
+    # openai.APIConnectionError and openai.APITimeoutError have no status code
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(
+        error
+    ).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Delay asked by the provider in the Retry-After header, in seconds"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(message: Message) -> int:
+    """Rough number of tokens of the prompt of a job on this message"""
+    nb_characters = len(message.content) + sum(
+        len(previous_message.content) for previous_message in message.previous_messages
+    )
+    return nb_characters // 4 + PROMPT_TOKENS_OVERHEAD
+
+
+def get_job_provider(job: "Job") -> Optional[str]:
+    """LLM provider of a job, if it has a model in its config"""
+    model = getattr(job.config, "model", None)
+    if not isinstance(model, str):
+        return None
+    provider, _ = get_provider_and_model(model)
+    return provider
+
+
+class Scheduler:
+    def __init__(
+        self,
+        max_concurrency: int = config.LAB_MAX_CONCURRENCY,
+        max_queue_size: int = config.LAB_MAX_QUEUE_SIZE,
+        rate_limits: Optional[Dict[str, Union[RateLimits, ProviderLimiter]]] = None,
+        max_retries: int = config.LAB_MAX_RETRIES,
+        retry_base_delay: float = config.LAB_RETRY_BASE_DELAY,
+        retry_max_delay: float = config.LAB_RETRY_MAX_DELAY,
+        progress_callback: Optional[ProgressCallback] = None,
+    ):
+        """
+        Run jobs on messages with at most max_concurrency jobs at the same time.
+
+        :param rate_limits: provider -> rate limits, eg {"openai": RateLimits(
+            requests_per_minute=500, tokens_per_minute=200_000)}. The provider of a job
+            is read from the `model` of its config. A ProviderLimiter is used as is,
+            so that its limits are shared with the other schedulers using it.
+        :param progress_callback: called with (nb_done, total) after each job. total is
+            None if the number of jobs isn't known.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.limiters = {
+            provider: (
+                limits
+                if isinstance(limits, ProviderLimiter)
+                else ProviderLimiter(limits)
+            )
+            for provider, limits in (rate_limits or {}).items()
+        }
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.progress_callback = progress_callback
+        self.nb_done = 0
+        self.nb_retries = 0
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        """Stop scheduling new jobs. The jobs already running are finished."""
+        self._cancelled = True
+
+    def _retry_delay(self, attempt: int, error: BaseException) -> float:
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter: spread the retries of the concurrent jobs
+        return random.uniform(
+            0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt)
+        )
+
+    async def _run_one(self, job: "Job", message: Message) -> None:
+        provider = get_job_provider(job)
+        limiter = self.limiters.get(provider) if provider is not None else None
+        attempt = 0
+        while True:
+            if limiter is not None:
+                await limiter.acquire(estimate_tokens(message))
+            try:
+                await job.async_run(message)
+                return
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                if attempt >= self.max_retries:
+                    logger.error(
+                        f"Job {job.id} failed on message {message.id} after {attempt} retries: {e}"
+                    )
+                    job.results[message.id] = JobResult(
+                        job_id=job.id,
+                        result_type=ResultType.error,
+                        value=None,
+                        logs=[str(e)],
+                    )
+                    return
+                delay = self._retry_delay(attempt, e)
+                logger.debug(
+                    f"Job {job.id} failed on message {message.id} ({e}). Retrying in {delay:.1f}s"
+                )
+                self.nb_retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def run(
+        self,
+        jobs_and_messages: Iterable[Tuple["Job", Message]],
+        total: Optional[int] = None,
+    ) -> None:
+        """
+        Run each job on its message. The iterable is consumed lazily.
+
+        If a job raises an error that isn't retryable, the other jobs are cancelled
+        and the error is raised. Cancelling the task running this method cancels the
+        running jobs.
+        """
+        queue: "asyncio.Queue[Optional[Tuple[Job, Message]]]" = asyncio.Queue(
+            maxsize=self.max_queue_size
+        )
+
+        async def produce() -> None:
+            for job_and_message in jobs_and_messages:
+                if self._cancelled:
+                    break
+                await queue.put(job_and_message)
+            # One stop signal per worker
+            for _ in range(self.max_concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while True:
+                job_and_message = await queue.get()
+                if job_and_message is None:
+                    return
+                if self._cancelled:
+                    continue
+                job, message = job_and_message
+                await self._run_one(job, message)
+                self.nb_done += 1
+                if self.progress_callback is not None:
+                    self.progress_callback(self.nb_done, total)
+
+        tasks = [asyncio.create_task(produce())] + [
+            asyncio.create_task(work()) for _ in range(self.max_concurrency)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # On error or cancellation, stop the other workers
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,63 +1,406 @@
+import glob
+import json
+import logging
+import os
 import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Literal, Optional, Set
+
 import pydantic
-from typing import Dict, List
 
+from . import config
+from .spool import Spool
 from .utils import generate_uuid
 
+logger = logging.getLogger(__name__)
+
+OverflowPolicy = Literal["drop_oldest", "drop_newest", "block", "spill_to_disk"]
+
 
 class Event(pydantic.BaseModel, extra="allow"):
     id: str
     content: Dict[str, object]
     to_log: bool = True
+    # Sequence number in the spool, if the event is written in one
+    spool_seq: Optional[int] = None
+
+
+# json.dumps creates a new encoder on each call when passed arguments: reuse one
+_size_encoder = json.JSONEncoder(default=str)
+
+
+def estimate_size(content: Dict[str, object]) -> int:
+    """Approximate size in bytes of a log event once sent to the backend"""
+    try:
+        return len(_size_encoder.encode(content))
+    except (TypeError, ValueError):
+        return 0
 
 
 class LogQueue:
-    """Queue logs here to group them in batchs"""
+    """
+    Queue logs here to group them in batchs.
+
+    Events marked as to_log are "ready" to be sent. The others are "in progress" (eg: a
+    streamed response that isn't finished) and stay in the queue until they are marked
+    as to_log. Both are dicts keyed by event id, so draining a batch only touches the
+    ready events.
+
+    The queue is bounded by max_events (ready and in progress events) and max_bytes (ready
+    events). When a new event doesn't fit, the overflow_policy applies:
+    - drop_oldest: drop the oldest ready events to make room
+    - drop_newest: drop the new event
+    - block: wait up to block_timeout seconds for the consumer to make room, then drop
+        the new event
+    - spill_to_disk: write the oldest ready events to a file in spill_dir. They are sent
+        again, before the events in memory, by the next get_batch.
+
+    If a spool is passed, the ready events are also written to it and removed from it
+    once acknowledged with `ack`. The events left in the spool by a previous process are
+    added to the queue.
+    """
+
+    def __init__(
+        self,
+        max_events: int = config.LOG_QUEUE_MAX_EVENTS,
+        max_bytes: int = config.LOG_QUEUE_MAX_BYTES,
+        overflow_policy: OverflowPolicy = "drop_oldest",
+        block_timeout: float = config.LOG_QUEUE_BLOCK_TIMEOUT,
+        spill_dir: Optional[str] = None,
+        spool: Optional[Spool] = None,
+    ) -> None:
+        if overflow_policy == "spill_to_disk" and spill_dir is None:
+            raise ValueError("spill_dir is required with overflow_policy=spill_to_disk")
 
-    def __init__(self) -> None:
         self.lock = threading.Lock()
-        # The queue itself is a dictionary. Each event has a unique id.
-        self.events: Dict[str, Event] = {}
+        self.not_full = threading.Condition(self.lock)
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.spill_dir = spill_dir
+        # Spill files that couldn't be read nor moved aside
+        self.bad_spill_files: Set[str] = set()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        # Insertion ordered, so that the oldest events are dropped or spilled first
+        self.ready: "OrderedDict[str, Event]" = OrderedDict()
+        self.in_progress: Dict[str, Event] = {}
+        # Estimated size of the ready events
+        self.ready_sizes: Dict[str, int] = {}
+        self.ready_bytes = 0
+
+        self.nb_dropped = 0
+        self.nb_spilled = 0
+
+        self.spool = spool
+        if spool is not None and spool.replayed:
+            self.requeue(
+                [
+                    Event(
+                        id=str(content.get("task_id", generate_uuid())),
+                        content=content,
+                        spool_seq=seq,
+                    )
+                    for seq, content in spool.replayed
+                ]
+            )
+            spool.replayed = []
+
+    def __len__(self) -> int:
+        return len(self.ready) + len(self.in_progress)
+
+    @property
+    def events(self) -> Dict[str, Event]:
+        """Snapshot of all the events in memory, ready or in progress"""
+        with self.lock:
+            return {**self.in_progress, **self.ready}
+
+    def get(self, event_id: str) -> Optional[Event]:
+        """Return the event with this id, if it's still in memory"""
+        with self.lock:
+            event = self.in_progress.get(event_id)
+            if event is None:
+                event = self.ready.get(event_id)
+            return event
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "nb_ready": len(self.ready),
+                "nb_in_progress": len(self.in_progress),
+                "ready_bytes": self.ready_bytes,
+                "nb_dropped": self.nb_dropped,
+                "nb_spilled": self.nb_spilled,
+            }
+
+    def _is_full(self, extra_events: int, extra_bytes: int) -> bool:
+        return (
+            len(self.ready) + len(self.in_progress) + extra_events > self.max_events
+            or self.ready_bytes + extra_bytes > self.max_bytes
+        )
+
+    def _pop_ready(self, event_id: str) -> Optional[Event]:
+        event = self.ready.pop(event_id, None)
+        if event is not None:
+            self.ready_bytes -= self.ready_sizes.pop(event_id, 0)
+        return event
+
+    def _pop_oldest_ready(self) -> Event:
+        event_id, event = self.ready.popitem(last=False)
+        self.ready_bytes -= self.ready_sizes.pop(event_id, 0)
+        return event
+
+    def _spill(self, events: List[Event]) -> None:
+        """Write events to a new file in spill_dir. Lock must be held."""
+        assert self.spill_dir is not None
+        path = os.path.join(
+            self.spill_dir, f"spill-{time.time_ns()}-{generate_uuid()[:8]}.jsonl"
+        )
+        try:
+            with open(path, "w") as f:
+                for event in events:
+                    f.write(event.model_dump_json() + "\n")
+            self.nb_spilled += len(events)
+        except OSError as e:
+            logger.warning(f"Could not spill {len(events)} phospho log events: {e}")
+            self._drop(events)
+
+    def _read_spilled(self, max_events: int) -> List[Event]:
+        """
+        Read and delete the spill files, oldest first, until max_events are read. The
+        events of a file left unread are written back to it. Lock must be held.
+        """
+        if self.spill_dir is None:
+            return []
+        events: List[Event] = []
+        for path in self._spill_files():
+            if len(events) >= max_events:
+                break
+            try:
+                with open(path) as f:
+                    lines = f.readlines()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read spilled phospho log events {path}: {e}")
+                self._discard_spill_file(path)
+                continue
+            unread_lines: List[str] = []
+            for i, line in enumerate(lines):
+                if not line.strip():
+                    continue
+                try:
+                    event = Event.model_validate_json(line)
+                except ValueError as e:
+                    # Eg: a line truncated by a crash. Keep the other events.
+                    logger.warning(f"Dropping a corrupt spilled phospho log event: {e}")
+                    self.nb_dropped += 1
+                    continue
+                if len(events) >= max_events:
+                    unread_lines = lines[i:]
+                    break
+                events.append(event)
+            try:
+                if unread_lines:
+                    with open(path + ".tmp", "w") as f:
+                        f.writelines(unread_lines)
+                    os.replace(path + ".tmp", path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not update spill file {path}: {e}")
+                self._discard_spill_file(path)
+        return events
+
+    def _spill_files(self) -> List[str]:
+        """Spill files to read, oldest first"""
+        if self.spill_dir is None:
+            return []
+        return [
+            path
+            for path in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.jsonl")))
+            if path not in self.bad_spill_files
+        ]
+
+    def _discard_spill_file(self, path: str) -> None:
+        """
+        Move an unreadable spill file aside, so that it doesn't block the queue.
+        If it can't be moved, it's ignored until the process restarts.
+        """
+        try:
+            os.replace(path, path + ".bad")
+        except OSError:
+            self.bad_spill_files.add(path)
+
+    def _has_spilled(self) -> bool:
+        return len(self._spill_files()) > 0
+
+    def _make_room(self, size: int, blocking: bool) -> bool:
+        """
+        Apply the overflow policy until an event of this size fits.
+        Returns False if the event must be dropped. Lock must be held.
+        """
+        if not self._is_full(1, size):
+            return True
+
+        if self.overflow_policy == "block" and blocking:
+            deadline = time.monotonic() + self.block_timeout
+            while self._is_full(1, size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.not_full.wait(remaining):
+                    return False
+            return True
+
+        if self.overflow_policy == "drop_oldest":
+            while self.ready and self._is_full(1, size):
+                self._drop([self._pop_oldest_ready()])
+            return not self._is_full(1, 0)
+
+        if self.overflow_policy == "spill_to_disk":
+            # Spill half of the ready events at once, to avoid writing a file per event
+            to_spill: List[Event] = []
+            nb_to_spill = len(self.ready) // 2
+            while self.ready and (
+                len(to_spill) < nb_to_spill or self._is_full(1, size)
+            ):
+                to_spill.append(self._pop_oldest_ready())
+            if to_spill:
+                self._spill(to_spill)
+            return not self._is_full(1, 0)
+
+        return False
+
+    def _drop(self, events: List[Event]) -> None:
+        """Lock must be held"""
+        self.nb_dropped += len(events)
+        if self.spool is not None:
+            self.spool.ack([e.spool_seq for e in events if e.spool_seq is not None])
+
+    def _add(self, event: Event, blocking: bool = True, respool: bool = True) -> None:
+        """
+        Add or replace an event. If respool is False, an event already written in the
+        spool isn't written again. Lock must be held.
+        """
+        existing = self.in_progress.pop(event.id, None) or self._pop_ready(event.id)
+        size = estimate_size(event.content) if event.to_log else 0
+        # Updates of an event already in the queue are always accepted
+        if existing is None and not self._make_room(size, blocking=blocking):
+            self._drop([event])
+            return
+        if self.spool is not None:
+            # Replace the version of the event written in the spool
+            outdated_seqs = [
+                e.spool_seq
+                for e in (existing, event)
+                if e is not None and e.spool_seq is not None
+            ]
+            if event.to_log and (respool or event.spool_seq is None):
+                event.spool_seq = self.spool.append(event.content)
+            elif not event.to_log:
+                event.spool_seq = None
+            self.spool.ack([s for s in set(outdated_seqs) if s != event.spool_seq])
+        if event.to_log:
+            self.ready[event.id] = event
+            self.ready_sizes[event.id] = size
+            self.ready_bytes += size
+        else:
+            self.in_progress[event.id] = event
 
     def append(self, event: Event) -> None:
         with self.lock:
-            self.events[event.id] = event
+            self._add(event)
 
     def extend(self, events_queue: Dict[str, Event]) -> None:
         with self.lock:
-            self.events.update(events_queue)
+            for event in events_queue.values():
+                self._add(event)
 
-    def add_batch(self, events_content_list: List[Dict[str, object]]) -> None:
+    def mark(self, event_id: str, to_log: bool) -> None:
+        """
+        Call this after updating the content of an event inplace: set its to_log status
+        and update its size.
+        """
+        with self.lock:
+            event = self.in_progress.get(event_id) or self.ready.get(event_id)
+            if event is None:
+                return
+            event.to_log = to_log
+            self._add(event)
+
+    def requeue(self, events: List[Event]) -> None:
         """This is used to add back events to the log queue, eg when they
-        couldn't be sent."""
-        with self.lock:
-            # Create new event with id task_id
-            def get_event_id(event: object) -> str:
-                assert isinstance(event, dict)
-                task_id = str(event.get("task_id", generate_uuid()))
-                return task_id
-
-            new_events: Dict[str, Event] = {
-                get_event_id(event_content): Event(
-                    to_log=True,  # We will send them in the next batch
-                    id=get_event_id(event_content),
+        couldn't be sent. It never blocks: if the queue is full, the events are
+        dropped or spilled according to the overflow policy."""
+        with self.lock:
+            # Reversed, so that the events keep their order at the front of the queue
+            for event in reversed(events):
+                event.to_log = True  # We will send them in the next batch
+                if event.id in self.ready or event.id in self.in_progress:
+                    # A newer version of the event (same task_id) was logged in
+                    # the meantime: it supersedes this one
+                    self.ack([event])
+                    continue
+                self._add(event, blocking=False, respool=False)
+                if event.id in self.ready:
+                    # Older than the events logged in the meantime: send them first
+                    self.ready.move_to_end(event.id, last=False)
+
+    def add_batch(self, events_content_list: List[Dict[str, object]]) -> None:
+        """Add back the content of events to the log queue. See requeue."""
+        self.requeue(
+            [
+                Event(
+                    id=str(event_content.get("task_id", generate_uuid())),
                     content=event_content,
                 )
                 for event_content in events_content_list
-            }
-            self.events.update(new_events)
+            ]
+        )
 
-    def get_batch(self) -> List[Dict[str, object]]:
-        if self.lock.acquire(False):  # non-blocking
-            try:
-                # The batch is only made of events marked as to_log
-                events_to_log = filter(lambda e: e.to_log, self.events.values())
-                # Events not marked as to_log will stay in queue
-                self.events = dict(
-                    filter(lambda pair: not pair[1].to_log, self.events.items())
-                )
-                return [e.content for e in events_to_log]
-            finally:
-                self.lock.release()
-        else:
-            return []
+    def ack(self, events: List[Event]) -> None:
+        """Call this once the events are received by the backend"""
+        if self.spool is not None:
+            self.spool.ack([e.spool_seq for e in events if e.spool_seq is not None])
+
+    def sync(self) -> None:
+        """fsync the spool, if any"""
+        if self.spool is not None:
+            self.spool.sync()
+
+    def get_batch_events(self, max_events: Optional[int] = None) -> List[Event]:
+        """
+        Remove and return the ready events, oldest first. Events spilled to disk are
+        returned before the events in memory. Without max_events, at most the capacity
+        of the queue is read from the spill files.
+        """
+        with self.lock:
+            # Spilled events are older than the events in memory: send them first
+            batch = self._read_spilled(
+                max_events if max_events is not None else self.max_events
+            )
+            if self._has_spilled():
+                self.not_full.notify_all()
+                return batch
+            if max_events is not None:
+                max_events -= len(batch)
+            if max_events is None or len(self.ready) <= max_events:
+                # Swap the whole dict instead of popping the events one by one
+                ready = self.ready
+                self.ready = OrderedDict()
+                self.ready_sizes = {}
+                self.ready_bytes = 0
+                batch.extend(ready.values())
+            else:
+                for _ in range(max_events):
+                    batch.append(self._pop_oldest_ready())
+            if batch:
+                self.not_full.notify_all()
+            return batch
+
+    def get_batch(self, max_events: Optional[int] = None) -> List[Dict[str, object]]:
+        """
+        Remove and return the content of the ready events. Call `ack` with
+        get_batch_events instead if the queue has a spool.
+        """
+        return [event.content for event in self.get_batch_events(max_events)]
@@ -386,6 +386,8 @@ class LlmCall(DatedBaseModel, extra="allow"):
     session_id: Optional[str] = None
     job_id: Optional[str] = None
     recipe_id: Optional[str] = None
+    # Whether the response was read from the LLM cache of the lab
+    cache_hit: Optional[bool] = None
 
 
 class FlattenedTask(BaseModel, extra="allow"):
@@ -4,7 +4,7 @@ Access sessions
 
 from phospho.collection import Collection
 
-from phospho.tasks import TaskEntity
+from phospho.tasks import AsyncTaskEntity, TaskEntity
 
 from typing import Optional, Dict
 
@@ -113,3 +113,69 @@ class SessionCollection(Collection):
 
         else:
             raise ValueError(f"Error creating session: {response.json()}")
+
+
+class AsyncSession(Session):
+    """A session fetched with an AsyncClient. Use `await refresh()` to load its content."""
+
+    @property
+    def content(self):
+        """
+        WARNING : can cause divergence with the server
+        """
+        if self._content is None:
+            raise ValueError(
+                f"The content of session {self._session_id} is not loaded. Call `await session.refresh()` first."
+            )
+        return self._content
+
+    async def refresh(self):
+        """
+        Refresh the content of the session from the server
+        Done inplace
+        """
+        response = await self._client._get(f"/sessions/{self._session_id}")
+        self._content = response.json()
+
+    async def list_tasks(self):
+        response = await self._client._post(f"/sessions/{self._session_id}/tasks")
+
+        return [
+            AsyncTaskEntity(
+                self._client, task_content["task_id"], _content=task_content
+            )
+            for task_content in response.json()["tasks"]
+        ]
+
+
+class AsyncSessionCollection(Collection):
+    """Same as SessionCollection, for an AsyncClient"""
+
+    async def get(self, session_id: str):
+        response = await self._client._get(f"/sessions/{session_id}")
+
+        return AsyncSession(
+            self._client, response.json()["id"], _content=response.json()
+        )
+
+    async def list(self):
+        response = await self._client._get(
+            f"/projects/{self._client._project_id()}/sessions"
+        )
+
+        return [
+            AsyncSession(self._client, session_content["id"], _content=session_content)
+            for session_content in response.json()["sessions"]
+        ]
+
+    async def create(self, data: Optional[Dict[str, object]] = None):
+        payload = {
+            "project_id": self._client._project_id(),
+            "data": data or {},
+        }
+
+        response = await self._client._post("/sessions", payload=payload)
+
+        return AsyncSession(
+            self._client, response.json()["id"], _content=response.json()
+        )
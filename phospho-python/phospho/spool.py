@@ -0,0 +1,202 @@
+"""
+Durable on-disk spool of the log events, to not lose them when the process is killed
+or when the backend is unreachable.
+
+The spool is an append-only log split in segment files:
+- an event ready to be sent is appended as `{"seq": 12, "content": {...}}`
+- once the backend acknowledged it, `{"ack": [12, ...]}` is appended
+
+When it is opened, the spool replays the events that were not acknowledged. A segment
+is deleted once all its events, and the events of the segments before it, are
+acknowledged. So an ack record is never deleted before the event it acknowledges.
+
+Use one spool directory per process.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Set, Tuple
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+_encoder = json.JSONEncoder(default=str)
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str,
+        max_segment_bytes: int = config.SPOOL_MAX_SEGMENT_BYTES,
+        max_total_bytes: int = config.SPOOL_MAX_TOTAL_BYTES,
+        fsync_interval: float = config.SPOOL_FSYNC_INTERVAL,
+    ) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_total_bytes = max_total_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        # Sequence numbers of the events not acknowledged yet, per segment
+        self.pending: Dict[int, Set[int]] = {}
+        self.segment_of_seq: Dict[int, int] = {}
+        self.segment_sizes: Dict[int, int] = {}
+        self.next_seq = 0
+        self.nb_dropped = 0
+        self.last_fsync = time.monotonic()
+        self.needs_fsync = False
+
+        self.replayed = self._load()
+        self.current_segment = max(self.segment_sizes.keys(), default=-1) + 1
+        self.segment_sizes[self.current_segment] = 0
+        self.pending[self.current_segment] = set()
+        self.file = open(self._path(self.current_segment), "a")
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:012d}.jsonl")
+
+    def _load(self) -> List[Tuple[int, Dict[str, object]]]:
+        """Read the existing segments and return the events not acknowledged"""
+        contents: Dict[int, Dict[str, object]] = {}
+        acked: Set[int] = set()
+        for path in sorted(glob.glob(os.path.join(self.directory, "segment-*.jsonl"))):
+            segment = int(os.path.basename(path)[len("segment-") : -len(".jsonl")])
+            self.pending[segment] = set()
+            self.segment_sizes[segment] = os.path.getsize(path)
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Last line of a segment interrupted by a crash
+                        continue
+                    if "ack" in record:
+                        acked.update(record["ack"])
+                    else:
+                        contents[record["seq"]] = record["content"]
+                        self.pending[segment].add(record["seq"])
+                        self.segment_of_seq[record["seq"]] = segment
+                    self.next_seq = max(self.next_seq, record.get("seq", -1) + 1)
+            # Acks are written after the events, so a segment only acks older events
+            for seq in acked:
+                self.pending.get(self.segment_of_seq.pop(seq, -1), set()).discard(seq)
+                contents.pop(seq, None)
+            acked.clear()
+        self._delete_acknowledged_segments()
+        if contents:
+            logger.info(f"Replaying {len(contents)} phospho log events from the spool")
+        return sorted(contents.items())
+
+    def _write(self, record: dict) -> None:
+        """Lock must be held"""
+        line = _encoder.encode(record) + "\n"
+        self.file.write(line)
+        # Flush to the OS so that the record survives if the process is killed
+        self.file.flush()
+        self.needs_fsync = True
+        self.segment_sizes[self.current_segment] += len(line)
+        if time.monotonic() - self.last_fsync > self.fsync_interval:
+            self._fsync()
+        if self.segment_sizes[self.current_segment] > self.max_segment_bytes:
+            self._rotate()
+
+    def _fsync(self) -> None:
+        """Lock must be held"""
+        if self.needs_fsync:
+            os.fsync(self.file.fileno())
+            self.needs_fsync = False
+        self.last_fsync = time.monotonic()
+
+    def _rotate(self) -> None:
+        """Lock must be held"""
+        self._fsync()
+        self.file.close()
+        self.current_segment += 1
+        self.segment_sizes[self.current_segment] = 0
+        self.pending[self.current_segment] = set()
+        self.file = open(self._path(self.current_segment), "a")
+        self._delete_acknowledged_segments()
+        self._enforce_max_total_bytes()
+
+    def _delete_segment(self, segment: int) -> None:
+        try:
+            os.remove(self._path(segment))
+        except OSError as e:
+            logger.warning(f"Could not delete phospho spool segment {segment}: {e}")
+        for seq in self.pending.pop(segment, set()):
+            self.segment_of_seq.pop(seq, None)
+        self.segment_sizes.pop(segment, None)
+
+    def _delete_acknowledged_segments(self) -> None:
+        """Delete the oldest segments as long as they are fully acknowledged"""
+        for segment in sorted(self.pending.keys()):
+            if (
+                segment == getattr(self, "current_segment", None)
+                or self.pending[segment]
+            ):
+                break
+            self._delete_segment(segment)
+
+    def _enforce_max_total_bytes(self) -> None:
+        while sum(self.segment_sizes.values()) > self.max_total_bytes:
+            oldest = min(self.segment_sizes.keys())
+            if oldest == self.current_segment:
+                break
+            nb_dropped = len(self.pending.get(oldest, set()))
+            self.nb_dropped += nb_dropped
+            logger.warning(
+                f"phospho spool is larger than {self.max_total_bytes} bytes: dropping {nb_dropped} log events"
+            )
+            self._delete_segment(oldest)
+
+    def append(self, content: Dict[str, object]) -> int:
+        """Write an event and return its sequence number"""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.pending[self.current_segment].add(seq)
+            self.segment_of_seq[seq] = self.current_segment
+            self._write({"seq": seq, "content": content})
+            return seq
+
+    def ack(self, seqs: List[int]) -> None:
+        """Mark events as acknowledged: they won't be replayed"""
+        if not seqs:
+            return
+        with self.lock:
+            for seq in seqs:
+                segment = self.segment_of_seq.pop(seq, None)
+                if segment is not None:
+                    self.pending[segment].discard(seq)
+            self._write({"ack": seqs})
+            self._delete_acknowledged_segments()
+
+    def sync(self) -> None:
+        """fsync the pending writes"""
+        with self.lock:
+            self._fsync()
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self._fsync()
+                self.file.close()
+
+    def __len__(self) -> int:
+        """Number of events not acknowledged"""
+        return len(self.segment_of_seq)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "nb_pending": len(self.segment_of_seq),
+                "nb_segments": len(self.segment_sizes),
+                "total_bytes": sum(self.segment_sizes.values()),
+                "nb_dropped": self.nb_dropped,
+            }
@@ -0,0 +1,144 @@
+"""
+Accumulate the chunks of a streamed output before logging it.
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+
+# Streams that are not finished (eg: the iteration was interrupted) keep their
+# accumulator. Past these bounds, the oldest accumulators are materialized and dropped:
+# the following chunks of their stream, if any, are fused into the log event directly.
+MAX_STREAM_ACCUMULATORS = 1000
+STREAM_ACCUMULATOR_TTL = 600  # seconds without a new chunk
+
+
+class StreamAccumulator:
+    """
+    Buffer the log contents of the chunks of a streamed output.
+
+    Fusing every chunk into the log event (`str(output) + str(new_output)`,
+    `raw_output + [new_raw_output]`) is quadratic in the number of chunks. Instead,
+    the output strings are buffered and joined once by `materialize`, and the raw
+    outputs are appended to a list shared with the log event.
+
+    The parts of the log content computed from the input and the kwargs usually don't
+    change during a stream: they are computed once and stored in `input_content`, with
+    the arguments they were computed from in `input_args`.
+    """
+
+    def __init__(
+        self,
+        input_args: Dict[str, Any],
+        input_content: Dict[str, Any],
+        first_log_content: Dict[str, object],
+    ) -> None:
+        self.input_args = input_args
+        self.input_content = input_content
+        self.first_log_content = first_log_content
+        self.nb_chunks = 0
+        self.last_used = time.monotonic()
+
+        self.output_parts: List[str] = []
+        self.raw_output_parts: List[object] = []
+        self.has_output = False
+        self.has_raw_output = False
+        self.token_counts: Dict[str, Any] = {}
+        # Latest value of every other key of the log content
+        self.latest_log_content: Dict[str, object] = {}
+        self.last_update: Optional[object] = None
+
+        self._add_output(first_log_content)
+
+    def _add_output(self, log_content: Dict[str, object]) -> None:
+        output = log_content["output"]
+        if output is not None:
+            self.has_output = True
+            self.output_parts.append(str(output))
+        raw_output = log_content["raw_output"]
+        if raw_output is not None:
+            self.has_raw_output = True
+            if isinstance(raw_output, list):
+                self.raw_output_parts.extend(raw_output)
+            else:
+                self.raw_output_parts.append(raw_output)
+        for key in ("completion_tokens", "total_tokens"):
+            if key in log_content:
+                self.token_counts[key] = (
+                    self.token_counts.get(key, 0) + log_content[key]
+                )
+
+    def has_same_input(self, input_args: Dict[str, Any]) -> bool:
+        """
+        Whether input_content can be reused for a chunk logged with these arguments
+        """
+        if input_args.keys() != self.input_args.keys():
+            return False
+        for key, value in input_args.items():
+            previous_value = self.input_args[key]
+            try:
+                if value is not previous_value and value != previous_value:
+                    return False
+            except Exception:
+                return False
+        return True
+
+    def add(self, log_content: Dict[str, object]) -> None:
+        """Add the log content of a new chunk"""
+        self.nb_chunks += 1
+        self.last_used = time.monotonic()
+        self._add_output(log_content)
+        self.latest_log_content.update(log_content)
+        self.last_update = log_content["client_created_at"]
+        # Keep the raw outputs of the in progress log event up to date, in O(1)
+        if self.has_raw_output:
+            self.first_log_content["raw_output"] = self.raw_output_parts
+
+    def materialize(self) -> Dict[str, object]:
+        """
+        Update the first log content inplace so that it's the same as if every chunk
+        had been fused into it one by one. Returns it.
+        """
+        log_content = self.first_log_content
+        if self.nb_chunks == 0:
+            return log_content
+
+        client_created_at = log_content["client_created_at"]
+        log_content.update(self.latest_log_content)
+        log_content["client_created_at"] = client_created_at
+        log_content["last_update"] = self.last_update
+        log_content["output"] = "".join(self.output_parts) if self.has_output else None
+        log_content["raw_output"] = (
+            list(self.raw_output_parts) if self.has_raw_output else None
+        )
+        log_content.update(self.token_counts)
+        return log_content
+
+
+def evict_stream_accumulators(
+    stream_accumulators: Dict[str, StreamAccumulator],
+    max_accumulators: int = MAX_STREAM_ACCUMULATORS,
+    ttl: float = STREAM_ACCUMULATOR_TTL,
+) -> None:
+    """
+    Materialize and drop the accumulators unused for ttl seconds, then the oldest ones
+    until there are less than max_accumulators.
+    """
+    now = time.monotonic()
+    expired = [
+        task_id
+        for task_id, accumulator in stream_accumulators.items()
+        if now - accumulator.last_used > ttl
+    ]
+    # Accumulators are inserted in the order the streams started
+    nb_too_many = len(stream_accumulators) - len(expired) - max_accumulators + 1
+    if nb_too_many > 0:
+        expired_set = set(expired)
+        expired.extend(
+            [
+                task_id
+                for task_id in stream_accumulators.keys()
+                if task_id not in expired_set
+            ][:nb_too_many]
+        )
+    for task_id in expired:
+        stream_accumulators.pop(task_id).materialize()
@@ -1,6 +1,7 @@
 from phospho.collection import Collection
 
-from typing import Dict, Literal, Optional, List
+import phospho.config as config
+from typing import AsyncIterator, Dict, Iterator, Literal, Optional, List
 from phospho.models import Task
 
 
@@ -107,12 +108,128 @@ class TaskCollection(Collection):
         """Returns a list of all of the project tasks"""
         # TODO : Filters
         # TODO : Limit
-        # TODO : Pagination
+        return list(self.iter_all())
+
+    def iter_all(self, page_size: int = config.FETCH_PAGE_SIZE) -> Iterator[TaskEntity]:
+        """Iterate over the project tasks, fetched lazily page by page"""
+        pagination: Dict[str, object] = {"page": 0, "per_page": page_size}
+        while True:
+            response = self._client._post(
+                f"/projects/{self._client._project_id()}/tasks",
+                payload={"pagination": pagination},
+            )
+            content = response.json()
+            for task in content["tasks"]:
+                yield TaskEntity(client=self._client, task_id=task["id"], _content=task)
+            if content.get("next_cursor") is None:
+                return
+            pagination = {"per_page": page_size, "cursor": content["next_cursor"]}
+
+
+class AsyncTaskEntity(TaskEntity):
+    """A task fetched with an AsyncClient. Use `await refresh()` to load its content."""
 
-        response = self._client._post(
-            f"/projects/{self._client._project_id()}/tasks",
+    @property
+    def content(self):
+        """
+        WARNING : can cause divergence with the server
+        """
+        if self._content is None:
+            raise ValueError(
+                f"The content of task {self._task_id} is not loaded. Call `await task.refresh()` first."
+            )
+        return self._content
+
+    async def refresh(self) -> None:
+        """
+        Refresh the content of the task from the server
+        Done inplace
+        """
+        response = await self._client._get(f"/tasks/{self._task_id}")
+        self._content = response.json()
+
+    async def update(
+        self,
+        metadata: Optional[dict] = None,
+        data: Optional[dict] = None,
+        notes: Optional[str] = None,
+        flag: Optional[Literal["success", "failure"]] = None,
+        flag_source: Optional[str] = None,
+    ):
+        response = await self._client._post(
+            f"/tasks/{self._task_id}",
+            payload={
+                "metadata": metadata,
+                "data": data,
+                "notes": notes,
+                "flag": flag,
+                "flag_source": flag_source,
+            },
+        )
+        return AsyncTaskEntity(
+            client=self._client, task_id=self._task_id, _content=response.json()
         )
-        return [
-            TaskEntity(client=self._client, task_id=task["id"], _content=task)
-            for task in response.json()["tasks"]
-        ]
+
+
+class AsyncTaskCollection(Collection):
+    """Same as TaskCollection, for an AsyncClient"""
+
+    async def get(self, task_id: str):
+        """Get a task by id"""
+        response = await self._client._get(f"/tasks/{task_id}")
+
+        return AsyncTaskEntity(
+            self._client, response.json()["id"], _content=response.json()
+        )
+
+    async def create(
+        self,
+        session_id: str,
+        sender_id: str,
+        input: str,
+        output: str,
+        additional_input: Optional[dict] = None,
+        additional_output: Optional[dict] = None,
+        data: Optional[dict] = None,
+    ):
+        """
+        Create a task
+        """
+        payload: Dict[str, object] = {
+            "session_id": session_id,
+            "sender_id": sender_id,
+            "input": input,
+            "additional_input": additional_input or {},
+            "output": output,
+            "additional_output": additional_output or {},
+            "data": data or {},
+        }
+
+        response = await self._client._post("/tasks", payload=payload)
+
+        return AsyncTaskEntity(
+            self._client, response.json()["id"], _content=response.json()
+        )
+
+    async def get_all(self) -> List[AsyncTaskEntity]:
+        """Returns a list of all of the project tasks"""
+        return [task async for task in self.iter_all()]
+
+    async def iter_all(
+        self, page_size: int = config.FETCH_PAGE_SIZE
+    ) -> AsyncIterator[AsyncTaskEntity]:
+        """Iterate over the project tasks, fetched lazily page by page"""
+        pagination: Dict[str, object] = {"page": 0, "per_page": page_size}
+        while True:
+            response = await self._client._post(
+                f"/projects/{self._client._project_id()}/tasks",
+                payload={"pagination": pagination},
+            )
+            content = response.json()
+            for task in content["tasks"]:
+                yield AsyncTaskEntity(
+                    client=self._client, task_id=task["id"], _content=task
+                )
+            if content.get("next_cursor") is None:
+                return
+            pagination = {"per_page": page_size, "cursor": content["next_cursor"]}
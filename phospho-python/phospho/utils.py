@@ -1,3 +1,4 @@
+import sys
 import time
 import json
 import uuid
@@ -13,6 +14,7 @@ from typing import (
     Callable,
     Literal,
     Optional,
+    Tuple,
     Union,
 )
 from random import choice
@@ -77,12 +79,84 @@ def generate_version_id() -> str:
     return f"{datetime.datetime.now().strftime('%Y%m%d')}_{choice(adjectives)}-{choice(animals)}"
 
 
-def is_jsonable(x: Any) -> bool:
-    try:
-        json.dumps(x)
+# Kinds of types, as handled by _check_jsonable and _convert
+_SCALAR = 0
+_DICT = 1
+_SEQUENCE = 2
+_PYDANTIC = 3
+_PYDANTIC_V1 = 4
+_BYTES = 5
+_OTHER = 6
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+# The kind of a type is computed once: the same types are logged over and over
+_kinds_by_type: Dict[type, int] = {}
+
+
+def _is_pydantic_v1_model(x_type: type) -> bool:
+    # A pydantic.v1 model can only exist if pydantic.v1 was imported
+    pydantic_v1 = sys.modules.get("pydantic.v1")
+    return pydantic_v1 is not None and issubclass(x_type, pydantic_v1.BaseModel)
+
+
+def _kind(x_type: type) -> int:
+    kind = _kinds_by_type.get(x_type)
+    if kind is not None:
+        return kind
+    if issubclass(x_type, _JSON_SCALARS):
+        kind = _SCALAR
+    elif issubclass(x_type, dict):
+        kind = _DICT
+    elif issubclass(x_type, (list, tuple)):
+        kind = _SEQUENCE
+    elif issubclass(x_type, pydantic.BaseModel):
+        kind = _PYDANTIC
+    elif _is_pydantic_v1_model(x_type):
+        kind = _PYDANTIC_V1
+    elif issubclass(x_type, bytes):
+        kind = _BYTES
+    else:
+        kind = _OTHER
+    _kinds_by_type[x_type] = kind
+    return kind
+
+
+def _enter(x: Any, markers: set) -> int:
+    """Same circular reference check as json.dumps"""
+    marker = id(x)
+    if marker in markers:
+        raise ValueError("Circular reference detected")
+    markers.add(marker)
+    return marker
+
+
+def _check_jsonable(x: Any, markers: set) -> bool:
+    kind = _kind(type(x))
+    if kind == _SCALAR:
+        return True
+    if kind == _DICT:
+        marker = _enter(x, markers)
+        for key, value in x.items():
+            if _kind(type(key)) != _SCALAR or not _check_jsonable(value, markers):
+                return False
+        markers.discard(marker)
+        return True
+    if kind == _SEQUENCE:
+        marker = _enter(x, markers)
+        for value in x:
+            if not _check_jsonable(value, markers):
+                return False
+        markers.discard(marker)
         return True
-    except TypeError:
-        return False
+    return False
+
+
+def is_jsonable(x: Any) -> bool:
+    """
+    Returns True if json.dumps(x) works. The structure is walked without encoding it.
+    """
+    return _check_jsonable(x, set())
 
 
 def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str, object]:
@@ -103,37 +177,67 @@ def filter_nonjsonable_keys(arg_dict: dict, verbose: bool = False) -> Dict[str,
     return new_arg_dict
 
 
+def _convert(content: Any, markers: set) -> Tuple[Any, bool]:
+    """
+    Returns the converted content, and whether it differs from the content.
+    Jsonable content is returned as is.
+    """
+    kind = _kind(type(content))
+    if kind == _SCALAR:
+        return content, False
+    if kind == _DICT:
+        marker = _enter(content, markers)
+        new_content = {}
+        changed = False
+        for key, value in content.items():
+            new_value, value_changed = _convert(value, markers)
+            new_content[key] = new_value
+            # A non-jsonable key is kept, like the value
+            changed = changed or value_changed or _kind(type(key)) != _SCALAR
+        markers.discard(marker)
+        if not changed:
+            return content, False
+        return new_content, True
+    if kind == _SEQUENCE:
+        marker = _enter(content, markers)
+        new_items = []
+        changed = False
+        for value in content:
+            new_value, value_changed = _convert(value, markers)
+            new_items.append(new_value)
+            changed = changed or value_changed
+        markers.discard(marker)
+        if not changed:
+            return content, False
+        if isinstance(content, list):
+            # Special case for list
+            return str(new_items), True
+        return str(content), True
+    if kind == _PYDANTIC:
+        return content.model_dump(), True
+    if kind == _PYDANTIC_V1:
+        return content.dict(), True
+    if kind == _BYTES:
+        # Probably a byte representation of json
+        return json.loads(content.decode()), True
+    # Fallback to str
+    logger.debug(
+        f"Unknown type {type(content)} for content {content}. Fallback to str."
+    )
+    return str(content), True
+
+
 def convert_content_to_loggable_content(
     content: Any,
 ) -> Union[Dict[str, object], str, None]:
     """
     Convert objects to json serializable content. Notably, nested dicts and lists are converted.
+
+    The content is walked once: jsonable parts are returned as is, pydantic models are
+    dumped, bytes are parsed as json and other types are converted to str.
     """
-    if is_jsonable(content):
-        return content
-
-    if isinstance(content, dict):
-        new_content = {
-            key: convert_content_to_loggable_content(value)
-            for key, value in content.items()
-        }
-        return new_content
-    elif isinstance(content, list):
-        # Special case for list
-        return str([convert_content_to_loggable_content(x) for x in content])
-    elif isinstance(content, pydantic.BaseModel):
-        return content.model_dump()
-    elif isinstance(content, pydantic.v1.BaseModel):
-        return content.dict()
-    elif isinstance(content, bytes):
-        # Probably a byte representation of json
-        return json.loads(content.decode())
-    else:
-        # Fallback to str
-        logger.debug(
-            f"Unknwon type {type(content)} for content {content}. Fallback to str."
-        )
-        return str(content)
+    new_content, _ = _convert(content, set())
+    return new_content
 
 
 class MutableGenerator:
@@ -0,0 +1,164 @@
+"""
+Micro-benchmark of the serializability checks done when logging, on OpenAI chat
+completion requests and responses, compared to the previous json.dumps based
+implementation which encoded the content at every level of nesting.
+
+Usage: python scripts/benchmark_jsonable.py
+"""
+
+import json
+import time
+from typing import Any, Callable
+
+import pydantic
+
+from phospho.utils import (
+    convert_content_to_loggable_content,
+    filter_nonjsonable_keys,
+    is_jsonable,
+)
+
+NB_ITERATIONS = 2_000
+NB_MESSAGES = 20
+
+
+def previous_is_jsonable(x: Any) -> bool:
+    try:
+        json.dumps(x)
+        return True
+    except TypeError:
+        return False
+
+
+def previous_convert(content: Any) -> Any:
+    if previous_is_jsonable(content):
+        return content
+    if isinstance(content, dict):
+        return {key: previous_convert(value) for key, value in content.items()}
+    elif isinstance(content, list):
+        return str([previous_convert(x) for x in content])
+    elif isinstance(content, pydantic.BaseModel):
+        return content.model_dump()
+    elif isinstance(content, bytes):
+        return json.loads(content.decode())
+    return str(content)
+
+
+def previous_filter(arg_dict: dict) -> dict:
+    return {k: v for k, v in arg_dict.items() if previous_is_jsonable(v)}
+
+
+class ChatCompletionMessage(pydantic.BaseModel):
+    role: str
+    content: str
+
+
+class Choice(pydantic.BaseModel):
+    index: int
+    finish_reason: str
+    message: ChatCompletionMessage
+
+
+class ChatCompletion(pydantic.BaseModel):
+    id: str
+    model: str
+    created: int
+    choices: list
+    usage: dict
+
+
+def make_request() -> dict:
+    return {
+        "model": "gpt-4o",
+        "temperature": 0.2,
+        "messages": [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"Message number {i}. "
+                + "Some text of the conversation. " * 20,
+            }
+            for i in range(NB_MESSAGES)
+        ],
+        "tools": [
+            {
+                "type": "function",
+                "function": {
+                    "name": "get_weather",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {"city": {"type": "string"}},
+                    },
+                },
+            }
+        ],
+    }
+
+
+def make_response() -> ChatCompletion:
+    return ChatCompletion(
+        id="chatcmpl-123",
+        model="gpt-4o",
+        created=1715000000,
+        choices=[
+            Choice(
+                index=0,
+                finish_reason="stop",
+                message=ChatCompletionMessage(
+                    role="assistant", content="The answer. " * 50
+                ),
+            )
+        ],
+        usage={"prompt_tokens": 800, "completion_tokens": 150, "total_tokens": 950},
+    )
+
+
+def log_content(
+    request: dict,
+    response: ChatCompletion,
+    convert: Callable[[Any], Any],
+    filter_keys: Callable[[dict], dict],
+    check: Callable[[Any], bool],
+) -> None:
+    """What is done to the content of a log event"""
+    content = {
+        "raw_input": convert(request),
+        "raw_output": convert(response),
+        # The request kwargs and an object the user passed by mistake
+        "metadata": filter_keys(
+            {"model": "gpt-4o", "stream": False, "client": object()}
+        ),
+    }
+    for value in content.values():
+        check(value)
+
+
+def benchmark(
+    name: str, convert: Callable, filter_keys: Callable, check: Callable
+) -> float:
+    request = make_request()
+    response = make_response()
+    start = time.perf_counter()
+    for _ in range(NB_ITERATIONS):
+        log_content(request, response, convert, filter_keys, check)
+    per_log = (time.perf_counter() - start) / NB_ITERATIONS
+    print(f"{name:<10} {per_log * 1e6:8.1f} µs per log")
+    return per_log
+
+
+if __name__ == "__main__":
+    assert convert_content_to_loggable_content(make_request()) == previous_convert(
+        make_request()
+    )
+    assert convert_content_to_loggable_content(make_response()) == previous_convert(
+        make_response()
+    )
+    previous = benchmark(
+        "previous", previous_convert, previous_filter, previous_is_jsonable
+    )
+    current = benchmark(
+        "current",
+        convert_content_to_loggable_content,
+        filter_nonjsonable_keys,
+        is_jsonable,
+    )
+    print(f"Speedup: {previous / current:.1f}x")
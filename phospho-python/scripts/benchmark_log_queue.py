@@ -0,0 +1,126 @@
+"""
+Micro-benchmark of the LogQueue: enqueue throughput with several producer threads
+and drain time, compared to the previous implementation which rebuilt the whole dict of
+events on every get_batch.
+
+Some events are left "in progress" (like streamed responses that are not finished)
+since the previous implementation scanned them on every drain.
+
+Usage: python scripts/benchmark_log_queue.py
+"""
+
+import threading
+import time
+from typing import Dict, List
+
+from phospho.log_queue import Event, LogQueue
+
+NB_PRODUCERS = [1, 4, 8]
+NB_EVENTS_PER_PRODUCER = 20_000
+NB_IN_PROGRESS = 5_000
+TICK = 0.001  # The consumer drains the queue every tick, in seconds
+
+
+class PreviousLogQueue:
+    """The LogQueue before the ready / in progress split"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.events: Dict[str, Event] = {}
+
+    def append(self, event: Event) -> None:
+        with self.lock:
+            self.events[event.id] = event
+
+    def get_batch(self) -> List[Dict[str, object]]:
+        if self.lock.acquire(False):
+            try:
+                events_to_log = filter(lambda e: e.to_log, self.events.values())
+                self.events = dict(
+                    filter(lambda pair: not pair[1].to_log, self.events.items())
+                )
+                return [e.content for e in events_to_log]
+            finally:
+                self.lock.release()
+        else:
+            return []
+
+
+def enqueue_throughput(queue, nb_producers: int) -> float:
+    """Events per second enqueued by the producers while a consumer drains the queue"""
+    for i in range(NB_IN_PROGRESS):
+        queue.append(Event(id=f"stream-{i}", content={"task_id": i}, to_log=False))
+    # Build the events beforehand to only measure the queue
+    events = [
+        [
+            Event(
+                id=f"{producer_id}-{i}",
+                content={"task_id": f"{producer_id}-{i}", "input": "Say hi !"},
+            )
+            for i in range(NB_EVENTS_PER_PRODUCER)
+        ]
+        for producer_id in range(nb_producers)
+    ]
+    producers_done = threading.Event()
+
+    def produce(producer_events: List[Event]) -> None:
+        for event in producer_events:
+            queue.append(event)
+
+    def consume() -> None:
+        while not producers_done.is_set():
+            queue.get_batch()
+            time.sleep(TICK)
+        queue.get_batch()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    producers = [threading.Thread(target=produce, args=(e,)) for e in events]
+    start = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    elapsed = time.perf_counter() - start
+    producers_done.set()
+    consumer.join()
+    return nb_producers * NB_EVENTS_PER_PRODUCER / elapsed
+
+
+def drain_time(queue, batch_size: int) -> float:
+    """Time of a get_batch of batch_size events, with NB_IN_PROGRESS events in progress"""
+    for i in range(NB_IN_PROGRESS):
+        queue.append(Event(id=f"stream-{i}", content={"task_id": i}, to_log=False))
+    nb_runs = 200
+    total = 0.0
+    for run in range(nb_runs):
+        for i in range(batch_size):
+            queue.append(Event(id=f"{run}-{i}", content={"task_id": i}))
+        start = time.perf_counter()
+        batch = queue.get_batch()
+        total += time.perf_counter() - start
+        assert len(batch) == batch_size
+    return total / nb_runs
+
+
+def main():
+    print(f"Enqueue throughput ({NB_IN_PROGRESS} events in progress)")
+    for nb_producers in NB_PRODUCERS:
+        previous = enqueue_throughput(PreviousLogQueue(), nb_producers)
+        current = enqueue_throughput(LogQueue(max_events=10**7), nb_producers)
+        print(
+            f"  {nb_producers} producers: previous {previous:,.0f} events/s, "
+            f"current {current:,.0f} events/s"
+        )
+    print(f"Drain time ({NB_IN_PROGRESS} events in progress)")
+    for batch_size in [10, 100, 1000]:
+        previous = drain_time(PreviousLogQueue(), batch_size)
+        current = drain_time(LogQueue(max_events=10**7), batch_size)
+        print(
+            f"  batch of {batch_size}: previous {previous * 1e6:,.0f}us, "
+            f"current {current * 1e6:,.0f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import httpx
+import pytest
+
+import phospho
+from phospho.client import PhosphoClientSideError
+from phospho.tasks import AsyncTaskEntity
+
+BASE_URL = "http://test.phospho.ai/v2"
+
+
+def test_client_reuses_session(requests_mock):
+    requests_mock.get(f"{BASE_URL}/tasks/task-1", json={"id": "task-1"})
+    client = phospho.Client(api_key="key", project_id="project", base_url=BASE_URL)
+
+    session = client._session
+    task = client.tasks.get("task-1")
+    client.tasks.get("task-1")
+
+    assert task.id == "task-1"
+    assert client._session is session
+    assert requests_mock.call_count == 2
+    client.close()
+
+
+def test_client_raises_on_client_side_error(requests_mock):
+    requests_mock.post(f"{BASE_URL}/tasks", status_code=403, text="Forbidden")
+    client = phospho.Client(api_key="key", project_id="project", base_url=BASE_URL)
+
+    with pytest.raises(PhosphoClientSideError):
+        client.tasks.create(session_id="s", sender_id="u", input="hi", output="hey")
+
+
+def test_client_iterates_over_the_pages_of_tasks(requests_mock):
+    requests_mock.post(
+        f"{BASE_URL}/projects/project/tasks",
+        [
+            {"json": {"tasks": [{"id": "task-1"}], "next_cursor": "cursor-1"}},
+            {"json": {"tasks": [{"id": "task-2"}], "next_cursor": None}},
+        ],
+    )
+    client = phospho.Client(api_key="key", project_id="project", base_url=BASE_URL)
+
+    tasks = client.tasks.iter_all(page_size=1)
+    assert next(tasks).id == "task-1"
+    # The next page is only fetched when needed
+    assert requests_mock.call_count == 1
+    assert [task.id for task in tasks] == ["task-2"]
+
+    assert requests_mock.request_history[0].json() == {
+        "pagination": {"page": 0, "per_page": 1}
+    }
+    assert requests_mock.request_history[1].json() == {
+        "pagination": {"per_page": 1, "cursor": "cursor-1"}
+    }
+    client.close()
+
+
+@pytest.mark.asyncio
+async def test_async_client():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["Authorization"] == "Bearer key"
+        if request.url.path == "/v2/projects/project/tasks":
+            return httpx.Response(200, json={"tasks": [{"id": "task-1"}]})
+        return httpx.Response(404, text="Not found")
+
+    async with phospho.AsyncClient(
+        api_key="key", project_id="project", base_url=BASE_URL
+    ) as client:
+        await client._session.aclose()
+        client._session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        tasks = await client.tasks.get_all()
+        assert isinstance(tasks[0], AsyncTaskEntity)
+        assert tasks[0].content == {"id": "task-1"}
+
+        with pytest.raises(PhosphoClientSideError):
+            await client.tasks.get("unknown")
@@ -0,0 +1,54 @@
+import gzip
+import json
+
+import phospho
+from phospho.consumer import Consumer
+from phospho.log_queue import Event, LogQueue
+
+BASE_URL = "http://test.phospho.ai/v2"
+
+
+def make_consumer(**kwargs) -> Consumer:
+    client = phospho.Client(api_key="key", project_id="project", base_url=BASE_URL)
+    return Consumer(log_queue=LogQueue(), client=client, **kwargs)
+
+
+def decode_body(request) -> dict:
+    body = request.body
+    if request.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+def test_send_batch_splits_and_compresses(requests_mock):
+    requests_mock.post(f"{BASE_URL}/log/project", json={})
+    consumer = make_consumer(max_batch_size=3, max_batch_bytes=10_000)
+    for i in range(7):
+        consumer.log_queue.append(
+            Event(id=f"task-{i}", content={"task_id": f"task-{i}", "input": "a" * 500})
+        )
+
+    consumer.send_batch()
+
+    bodies = [decode_body(request) for request in requests_mock.request_history]
+    assert [len(body["batched_log_events"]) for body in bodies] == [3, 3, 1]
+    assert requests_mock.request_history[0].headers["Content-Encoding"] == "gzip"
+    sent_ids = [e["task_id"] for body in bodies for e in body["batched_log_events"]]
+    assert sent_ids == [f"task-{i}" for i in range(7)]
+
+
+def test_send_batch_requeues_unsent_events(requests_mock):
+    requests_mock.post(
+        f"{BASE_URL}/log/project",
+        [{"json": {}}, {"status_code": 500, "text": "Error"}],
+    )
+    consumer = make_consumer(max_batch_size=1)
+    for i in range(3):
+        consumer.log_queue.append(
+            Event(id=f"task-{i}", content={"task_id": f"task-{i}"})
+        )
+
+    consumer.send_batch()
+
+    assert consumer.nb_consecutive_errors == 1
+    assert sorted(consumer.log_queue.events.keys()) == ["task-1", "task-2"]
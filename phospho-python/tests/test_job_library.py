@@ -0,0 +1,237 @@
+import asyncio
+import json
+import math
+from typing import Dict, List, Optional
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from phospho import lab
+from phospho.lab import job_library
+from phospho.models import EventDefinition, ScoreRangeSettings
+
+
+class FakeCompletions:
+    def __init__(self, grouped_answer: str, logprobs: Optional[List[dict]] = None):
+        self.grouped_answer = grouped_answer
+        self.logprobs = logprobs
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        logprobs = None
+        if "response_format" in kwargs:
+            content = self.grouped_answer
+            if self.logprobs is not None and kwargs.get("logprobs"):
+                logprobs = {"content": self.logprobs}
+        else:
+            # Single event detection
+            content = "Yes"
+        return ChatCompletion.model_validate(
+            {
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": kwargs["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                        "logprobs": logprobs,
+                    }
+                ],
+            }
+        )
+
+
+class FakeClient:
+    def __init__(self, grouped_answer: str, logprobs: Optional[List[dict]] = None):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = FakeCompletions(grouped_answer, logprobs)
+
+
+def token_logprobs(tokens: List[str], top_logprobs: Dict[str, List[tuple]]) -> list:
+    """Logprobs of the tokens. By default, a token is the only top logprob."""
+    return [
+        {
+            "token": token,
+            "logprob": 0,
+            "top_logprobs": [
+                {"token": top_token, "logprob": logprob}
+                for top_token, logprob in top_logprobs.get(token, [(token, 0)])
+            ],
+        }
+        for token in tokens
+    ]
+
+
+EVENT_DEFINITIONS = [
+    EventDefinition(event_name="refund", description="The user asks for a refund"),
+    EventDefinition(
+        event_name="politeness",
+        description="How polite is the assistant",
+        score_range_settings=ScoreRangeSettings(score_type="range", min=1, max=5),
+    ),
+    EventDefinition(
+        event_name="topic",
+        description="Topic of the question",
+        score_range_settings=ScoreRangeSettings(
+            score_type="category", categories=["billing", "shipping"]
+        ),
+    ),
+    EventDefinition(
+        event_name="keyword",
+        description="Mentions a refund",
+        detection_engine="keyword_detection",
+        keywords="refund",
+    ),
+]
+
+
+def run_grouped_detection(
+    monkeypatch,
+    grouped_answer: str,
+    logprobs: Optional[List[dict]] = None,
+    sample: float = 1,
+):
+    client = FakeClient(grouped_answer, logprobs)
+    monkeypatch.setattr(job_library, "get_async_client", lambda provider: client)
+    lab.set_llm_cache(None)
+    workload = lab.Workload.from_phospho_events(
+        EVENT_DEFINITIONS, group_llm_events=True
+    )
+    workload.jobs["politeness"].sample = sample
+    messages = [
+        lab.Message(id=f"message-{i}", role="User", content="I want a refund")
+        for i in range(2)
+    ]
+    try:
+        results = workload.run(
+            messages,
+            executor_type="parallel_jobs",
+            progress_callback=lambda nb_done, total: None,
+        )
+    finally:
+        lab.set_llm_cache(lab.MemoryLLMCache())
+    group = workload.jobs["refund"].job_function.__self__
+    return results, client.chat.completions.requests, group
+
+
+def test_grouped_event_detection(monkeypatch):
+    results, requests, _ = run_grouped_detection(
+        monkeypatch, json.dumps({"refund": True, "politeness": 4, "topic": 1})
+    )
+
+    # One LLM call per message for the 3 LLM events
+    assert len(requests) == 2
+    for message_results in results.values():
+        assert set(message_results.keys()) == {
+            "refund",
+            "politeness",
+            "topic",
+            "keyword",
+        }
+        assert message_results["refund"].value is True
+        assert message_results["politeness"].metadata["score_range"].value == 4
+        assert message_results["topic"].metadata["score_range"].label == "billing"
+        assert message_results["refund"].job_id == "refund"
+        # The LLM call is stored once
+        assert (
+            sum("llm_call" in result.metadata for result in message_results.values())
+            == 1
+        )
+
+
+def test_grouped_event_detection_fallback(monkeypatch):
+    # The answer for politeness is out of range
+    results, requests, _ = run_grouped_detection(
+        monkeypatch, json.dumps({"refund": False, "politeness": 10, "topic": 0})
+    )
+    assert len(requests) == 2 + 2
+    for message_results in results.values():
+        assert message_results["refund"].value is False
+        assert message_results["topic"].value is False
+        # Detected with event_detection
+        assert "grouped_events" not in message_results["politeness"].metadata
+        assert message_results["politeness"].metadata["llm_call"] is not None
+
+    # Invalid JSON: every event falls back
+    results, requests, _ = run_grouped_detection(monkeypatch, "refund: yes")
+    assert len(requests) == 2 + 2 * 3
+    assert all(
+        "grouped_events" not in result.metadata
+        for message_results in results.values()
+        for result in message_results.values()
+    )
+
+
+def test_grouped_event_detection_confidence(monkeypatch):
+    answer = '{"refund": true, "politeness": 4, "topic": 1}'
+    tokens = ['{"', "refund", '":', " true", ', "', "politeness", '":', " 4", ', "']
+    tokens += ["topic", '":', " 1", "}"]
+    assert "".join(tokens) == answer
+    logprobs = token_logprobs(
+        tokens, {" true": [(" true", math.log(0.6)), (" false", math.log(0.2))]}
+    )
+    results, requests, _ = run_grouped_detection(monkeypatch, answer, logprobs)
+
+    assert requests[0]["logprobs"] is True
+    for message_results in results.values():
+        score_range = message_results["refund"].metadata["score_range"]
+        assert score_range.value == pytest.approx(0.75)
+        assert score_range.options_confidence == pytest.approx(
+            {"yes": 0.75, "no": 0.25}
+        )
+
+
+def test_grouped_event_detection_forgets_calls(monkeypatch):
+    answer = json.dumps({"refund": True, "politeness": 4, "topic": 1})
+    _, _, group = run_grouped_detection(monkeypatch, answer)
+    assert group._calls == {}
+
+    # The job of politeness is sampled out: its calls are never read
+    monkeypatch.setattr(job_library.GroupedEventDetection, "MAX_PENDING_CALLS", 1)
+    _, _, group = run_grouped_detection(monkeypatch, answer, sample=0)
+    assert len(group._calls) == 1
+
+
+def test_grouped_event_detection_per_model(monkeypatch):
+    client = FakeClient(json.dumps({"refund": True, "topic": 2}))
+    monkeypatch.setattr(job_library, "get_async_client", lambda provider: client)
+    lab.set_llm_cache(None)
+    group = job_library.GroupedEventDetection(
+        events=[
+            {"event_name": "refund", "event_description": "A refund"},
+            {
+                "event_name": "topic",
+                "event_description": "Topic",
+                "score_range_settings": {
+                    "score_type": "category",
+                    "categories": ["billing", "shipping"],
+                },
+                "model": "openai:gpt-4o-mini",
+            },
+        ]
+    )
+    message = lab.Message(content="I want a refund")
+
+    async def detect_all_events():
+        return await asyncio.gather(
+            group.detect(message, event_name="refund"),
+            group.detect(message, event_name="topic"),
+        )
+
+    try:
+        refund, topic = asyncio.run(detect_all_events())
+    finally:
+        lab.set_llm_cache(lab.MemoryLLMCache())
+
+    requests = client.chat.completions.requests
+    assert sorted(request["model"] for request in requests) == [
+        "gpt-4o",
+        "gpt-4o-mini",
+    ]
+    assert refund.metadata["grouped_events"] == ["refund"]
+    assert topic.metadata["score_range"].label == "shipping"
+    assert group._calls == {}
@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+
+from phospho.lab import language_models
+from phospho.lab.language_models import (
+    close_clients,
+    get_async_client,
+    get_client_metrics,
+    get_sync_client,
+)
+
+
+def test_clients_are_reused(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "key-1")
+
+    async def get_clients():
+        first = get_async_client("mistral")
+        second = get_async_client("mistral")
+        other_key = get_async_client("mistral", api_key="key-2")
+        await close_clients()
+        return first, second, other_key
+
+    first, second, other_key = asyncio.run(get_clients())
+    assert first is second
+    assert first is not other_key
+    # Each event loop has its own clients
+    first_in_new_loop, _, _ = asyncio.run(get_clients())
+    assert first_in_new_loop is not first
+
+    assert get_sync_client("mistral") is get_sync_client("mistral")
+    asyncio.run(close_clients())
+
+
+def test_in_flight_metrics(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "key-1")
+    nb_in_flight_during_request = []
+
+    async def handle_async_request(self, request):
+        await asyncio.sleep(0.01)
+        nb_in_flight_during_request.append(
+            get_client_metrics()["mistral"]["nb_in_flight"]
+        )
+        return httpx.Response(
+            200,
+            json={
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "mistral-large",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "Hi"},
+                    }
+                ],
+            },
+        )
+
+    monkeypatch.setattr(
+        httpx.AsyncHTTPTransport, "handle_async_request", handle_async_request
+    )
+    nb_requests_before = language_models._nb_requests.get("mistral", 0)
+
+    async def call():
+        client = get_async_client("mistral")
+        await asyncio.gather(
+            *[
+                client.chat.completions.create(
+                    model="mistral-large",
+                    messages=[{"role": "user", "content": "Hello"}],
+                )
+                for _ in range(3)
+            ]
+        )
+        metrics = get_client_metrics()["mistral"]
+        await close_clients()
+        return metrics
+
+    metrics = asyncio.run(call())
+    assert max(nb_in_flight_during_request) == 3
+    assert metrics["nb_in_flight"] == 0
+    assert metrics["nb_requests"] == nb_requests_before + 3
+    assert metrics["nb_clients"] == 1
+
+
+def test_workload_run_closes_its_clients(monkeypatch):
+    monkeypatch.setenv("MISTRAL_API_KEY", "key-1")
+    from phospho.lab import JobResult, Message, ResultType, Workload
+
+    clients = []
+
+    async def get_client(message: Message) -> JobResult:
+        clients.append(get_async_client("mistral"))
+        return JobResult(result_type=ResultType.bool, value=True)
+
+    Workload(jobs=[get_client]).run(messages=[Message(content="Hello")])
+
+    assert clients[0].is_closed()
+    # Other tests may have left clients in the registry: only check this workload's
+    assert all(
+        clients[0] not in loop_clients.values()
+        for loop_clients in language_models._async_clients.values()
+    )
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+from openai.types.chat import ChatCompletion
+
+from phospho import lab
+from phospho.lab import job_library
+from phospho.lab.llm_cache import cached_chat_completion, make_cache_key
+
+
+def make_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                    "logprobs": None,
+                }
+            ],
+        }
+    )
+
+
+class FakeCompletions:
+    def __init__(self, content: str):
+        self.content = content
+        self.nb_calls = 0
+
+    async def create(self, **kwargs):
+        self.nb_calls += 1
+        return make_completion(self.content)
+
+
+class FakeClient:
+    def __init__(self, content: str):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = FakeCompletions(content)
+
+
+def test_make_cache_key():
+    messages = [{"role": "user", "content": "Hello"}]
+    key = make_cache_key("openai", model="gpt-4o", messages=messages, temperature=0)
+    assert key == make_cache_key(
+        "openai", temperature=0, messages=messages, model="gpt-4o", max_tokens=None
+    )
+    assert key != make_cache_key("openai", model="gpt-4o", messages=messages)
+    assert key != make_cache_key("mistral", model="gpt-4o", messages=messages)
+
+
+def test_memory_cache_lru_and_ttl():
+    async def run():
+        cache = lab.MemoryLLMCache(max_size=2, ttl=60)
+        await cache.set("a", {"value": 1})
+        await cache.set("b", {"value": 2})
+        assert await cache.get("a") == {"value": 1}
+        # b is the least recently used
+        await cache.set("c", {"value": 3})
+        assert await cache.get("b") is None
+        assert await cache.get("a") == {"value": 1}
+
+        expired_cache = lab.MemoryLLMCache(ttl=-1)
+        await expired_cache.set("a", {"value": 1})
+        assert await expired_cache.get("a") is None
+        return cache.stats()
+
+    stats = asyncio.run(run())
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / "llm_cache.db")
+
+    async def run():
+        cache = lab.SQLiteLLMCache(path)
+        await cache.set("a", {"value": [1, 2]})
+        cache.close()
+        # Persisted on disk
+        cache = lab.SQLiteLLMCache(path, ttl=-1)
+        value = await cache.get("a")
+        await cache.set("b", {"value": 3})
+        assert await cache.get("b") is None
+        assert cache.delete_expired() == 1
+        cache.close()
+        return value
+
+    assert asyncio.run(run()) == {"value": [1, 2]}
+
+
+def test_cached_chat_completion():
+    client = FakeClient("Yes")
+    request = {"model": "gpt-4o", "messages": [{"role": "user", "content": "Hi"}]}
+
+    async def run():
+        lab.set_llm_cache(lab.MemoryLLMCache())
+        try:
+            first, first_hit = await cached_chat_completion(client, "openai", **request)
+            second, second_hit = await cached_chat_completion(
+                client, "openai", **request
+            )
+            _, opt_out_hit = await cached_chat_completion(
+                client, "openai", use_cache=False, **request
+            )
+        finally:
+            lab.set_llm_cache(lab.MemoryLLMCache())
+        return first, first_hit, second, second_hit, opt_out_hit
+
+    first, first_hit, second, second_hit, opt_out_hit = asyncio.run(run())
+    assert (first_hit, second_hit, opt_out_hit) == (False, True, False)
+    assert second.choices[0].message.content == "Yes"
+    assert client.chat.completions.nb_calls == 2
+
+
+def test_event_detection_cache_hit(monkeypatch):
+    client = FakeClient("Yes")
+    monkeypatch.setattr(job_library, "get_async_client", lambda provider: client)
+    lab.set_llm_cache(lab.MemoryLLMCache())
+    message = lab.Message(id="message", role="User", content="I want a refund")
+
+    async def detect(use_cache: bool = True):
+        return await job_library.event_detection(
+            message,
+            event_name="refund",
+            event_description="The user asks for a refund",
+            use_cache=use_cache,
+        )
+
+    try:
+        first = asyncio.run(detect())
+        second = asyncio.run(detect())
+        third = asyncio.run(detect(use_cache=False))
+    finally:
+        lab.set_llm_cache(lab.MemoryLLMCache())
+
+    assert first.value is True and second.value is True
+    assert first.metadata["llm_call"]["cache_hit"] is False
+    assert second.metadata["llm_call"]["cache_hit"] is True
+    assert third.metadata["llm_call"]["cache_hit"] is False
+    assert client.chat.completions.nb_calls == 2
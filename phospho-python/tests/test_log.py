@@ -343,3 +343,81 @@ async def test_async_stream():
     assert i <= len(MOCK_OPENAI_STREAM_RESPONSE), str(r)
 
     time.sleep(0.1)
+
+
+class NoAccumulation(dict):
+    """Disable the stream accumulator: every chunk is fused into the log event"""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+def test_stream_accumulator_logs_same_content(monkeypatch):
+    phospho.init(tick=0.05)
+
+    def stream_and_get_content() -> dict:
+        query = {**MOCK_OPENAI_QUERY, "stream": True}
+        output = iter(MOCK_OPENAI_STREAM_RESPONSE * 50)
+        task_id = phospho.generate_uuid()
+        for chunk in output:
+            phospho._log_single_event(
+                input=query, output=chunk, task_id=task_id, to_log=False
+            )
+        phospho._log_single_event(input=query, output=None, task_id=task_id)
+        content = phospho.log_queue.get(task_id).content
+        for key in ["client_created_at", "last_update", "task_id"]:
+            content.pop(key)
+        return content
+
+    content = stream_and_get_content()
+    monkeypatch.setattr(phospho, "stream_accumulators", NoAccumulation())
+    content_without_accumulator = stream_and_get_content()
+
+    assert content["output"] == "Hello you!" * 50
+    assert content == content_without_accumulator
+
+
+def test_stream_merges_later_kwargs_and_returns_fused_content():
+    phospho.init(tick=0.05)
+    task_id = phospho.generate_uuid()
+
+    log = phospho._log_single_event(
+        input="hi", output="Hello", task_id=task_id, to_log=False
+    )
+    assert log["output"] == "Hello"
+    log = phospho._log_single_event(
+        input="hi", output=" you", task_id=task_id, to_log=False, user_id="user-1"
+    )
+    assert log["output"] == "Hello you"
+    assert log["user_id"] == "user-1"
+    log = phospho._log_single_event(input="hi", output="!", task_id=task_id)
+
+    content = phospho.log_queue.get(task_id).content
+    assert content["output"] == log["output"] == "Hello you!"
+    assert content["user_id"] == "user-1"
+
+
+def test_evict_stream_accumulators():
+    phospho.init(tick=0.05)
+    phospho.stream_accumulators.clear()
+    task_ids = [phospho.generate_uuid() for _ in range(3)]
+    for task_id in task_ids:
+        phospho._log_single_event(
+            input="hi", output="Hello", task_id=task_id, to_log=False
+        )
+        phospho._log_single_event(
+            input="hi", output=" you", task_id=task_id, to_log=False
+        )
+
+    phospho.stream.evict_stream_accumulators(
+        phospho.stream_accumulators, max_accumulators=3
+    )
+    assert task_ids[0] not in phospho.stream_accumulators
+    assert task_ids[1] in phospho.stream_accumulators
+    phospho.stream.evict_stream_accumulators(phospho.stream_accumulators, ttl=0)
+    assert not any(t in phospho.stream_accumulators for t in task_ids)
+
+    # The stream goes on without its accumulator
+    for task_id in task_ids:
+        phospho._log_single_event(input="hi", output="!", task_id=task_id)
+        assert phospho.log_queue.get(task_id).content["output"] == "Hello you!"
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+from phospho.log_queue import Event, LogQueue
+
+
+def make_event(i: int, to_log: bool = True) -> Event:
+    return Event(id=f"task-{i}", content={"task_id": f"task-{i}"}, to_log=to_log)
+
+
+def test_get_batch_only_drains_ready_events():
+    queue = LogQueue()
+    queue.append(make_event(0))
+    queue.append(make_event(1, to_log=False))
+    queue.append(make_event(2))
+
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-0", "task-2"]
+    assert queue.get_batch() == []
+    assert list(queue.events.keys()) == ["task-1"]
+
+    queue.mark("task-1", to_log=True)
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-1"]
+
+
+def test_get_batch_max_events():
+    queue = LogQueue()
+    for i in range(5):
+        queue.append(make_event(i))
+
+    assert len(queue.get_batch(max_events=2)) == 2
+    assert len(queue.get_batch()) == 3
+
+
+def test_drop_oldest():
+    queue = LogQueue(max_events=3, overflow_policy="drop_oldest")
+    for i in range(5):
+        queue.append(make_event(i))
+
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-2", "task-3", "task-4"]
+    assert queue.nb_dropped == 2
+
+
+def test_drop_newest():
+    queue = LogQueue(max_events=3, overflow_policy="drop_newest")
+    for i in range(5):
+        queue.append(make_event(i))
+    # Updates of an event already in the queue are accepted
+    queue.append(Event(id="task-0", content={"task_id": "task-0", "output": "hi"}))
+
+    batch = queue.get_batch()
+    assert [e["task_id"] for e in batch] == ["task-1", "task-2", "task-0"]
+    assert batch[-1]["output"] == "hi"
+    assert queue.nb_dropped == 2
+
+
+def test_max_bytes():
+    queue = LogQueue(max_bytes=100, overflow_policy="drop_newest")
+    queue.append(Event(id="big", content={"input": "a" * 80}))
+    queue.append(Event(id="other", content={"input": "a" * 80}))
+
+    assert queue.nb_dropped == 1
+    assert queue.stats()["nb_ready"] == 1
+
+
+def test_block_waits_for_consumer():
+    queue = LogQueue(max_events=1, overflow_policy="block", block_timeout=5)
+    queue.append(make_event(0))
+
+    def drain():
+        time.sleep(0.1)
+        queue.get_batch()
+
+    thread = threading.Thread(target=drain)
+    thread.start()
+    queue.append(make_event(1))
+    thread.join()
+
+    assert queue.nb_dropped == 0
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-1"]
+
+
+def test_block_timeout():
+    queue = LogQueue(max_events=1, overflow_policy="block", block_timeout=0.05)
+    queue.append(make_event(0))
+    queue.append(make_event(1))
+
+    assert queue.nb_dropped == 1
+
+
+def test_spill_to_disk(tmp_path):
+    queue = LogQueue(
+        max_events=2, overflow_policy="spill_to_disk", spill_dir=str(tmp_path)
+    )
+    for i in range(4):
+        queue.append(make_event(i))
+
+    assert queue.nb_spilled == 2
+    assert [e["task_id"] for e in queue.get_batch()] == [f"task-{i}" for i in range(4)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spilled_events_are_read_in_bounded_batches(tmp_path):
+    queue = LogQueue(
+        max_events=4, overflow_policy="spill_to_disk", spill_dir=str(tmp_path)
+    )
+    for i in range(10):
+        queue.append(make_event(i))
+    assert queue.nb_spilled == 6
+
+    batches = []
+    while batch := queue.get_batch(max_events=3):
+        batches.append([e["task_id"] for e in batch])
+
+    assert all(len(batch) <= 3 for batch in batches)
+    assert sum(batches, []) == [f"task-{i}" for i in range(10)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spill_to_disk_requires_dir():
+    with pytest.raises(ValueError):
+        LogQueue(overflow_policy="spill_to_disk")
+
+
+def test_add_batch_keeps_newer_event():
+    queue = LogQueue()
+    queue.append(Event(id="task-0", content={"task_id": "task-0", "output": "new"}))
+    queue.add_batch([{"task_id": "task-0", "output": "old"}])
+
+    assert [e["output"] for e in queue.get_batch()] == ["new"]
+
+
+def test_requeued_events_are_sent_first():
+    queue = LogQueue()
+    queue.append(make_event(0))
+    queue.append(make_event(1))
+    unsent = queue.get_batch_events()
+    queue.append(make_event(2))
+    queue.requeue(unsent)
+
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-0", "task-1", "task-2"]
+
+
+def test_corrupt_spill_file_does_not_block_the_queue(tmp_path):
+    queue = LogQueue(
+        max_events=2, overflow_policy="spill_to_disk", spill_dir=str(tmp_path)
+    )
+    for i in range(4):
+        queue.append(make_event(i))
+    # A truncated line, and a file that can't be decoded
+    spill_file = sorted(tmp_path.iterdir())[-1]
+    with open(spill_file, "a") as f:
+        f.write('{"id": "task-9", "cont')
+    (tmp_path / "spill-0-unreadable.jsonl").write_bytes(b"\xff\xfe")
+
+    assert [e["task_id"] for e in queue.get_batch()] == [f"task-{i}" for i in range(4)]
+    assert [path.name for path in tmp_path.iterdir()] == [
+        "spill-0-unreadable.jsonl.bad"
+    ]
+    queue.append(make_event(5))
+    assert [e["task_id"] for e in queue.get_batch()] == ["task-5"]
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import pytest
+
+from phospho import lab
+from phospho.lab.models import JobResult, ResultType
+from phospho.lab.scheduler import TokenBucket
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def make_messages(n: int):
+    return [lab.Message(id=f"message-{i}", content="Hello") for i in range(n)]
+
+
+def test_max_parallelism_is_respected():
+    nb_running = 0
+    max_nb_running = 0
+
+    async def job_function(message, **kwargs):
+        nonlocal nb_running, max_nb_running
+        nb_running += 1
+        max_nb_running = max(max_nb_running, nb_running)
+        await asyncio.sleep(0.01)
+        nb_running -= 1
+        return JobResult(result_type=ResultType.bool, value=True)
+
+    workload = lab.Workload(jobs=[lab.Job(id="job", job_function=job_function)])
+    results = workload.run(
+        make_messages(30),
+        executor_type="parallel_jobs",
+        max_parallelism=4,
+        progress_callback=lambda nb_done, total: None,
+    )
+
+    assert len(results) == 30
+    assert max_nb_running == 4
+
+
+def test_rate_limit_errors_are_retried():
+    nb_calls = 0
+
+    async def job_function(message, **kwargs):
+        nonlocal nb_calls
+        nb_calls += 1
+        if nb_calls <= 2:
+            raise RateLimitError("Too many requests")
+        return JobResult(result_type=ResultType.bool, value=True)
+
+    workload = lab.Workload(jobs=[lab.Job(id="job", job_function=job_function)])
+    scheduler = lab.Scheduler(retry_base_delay=0.01)
+
+    asyncio.run(scheduler.run([(workload.jobs["job"], make_messages(1)[0])]))
+
+    assert nb_calls == 3
+    assert scheduler.nb_retries == 2
+    assert workload.jobs["job"].results["message-0"].value is True
+
+
+def test_error_result_after_max_retries():
+    async def job_function(message, **kwargs):
+        raise RateLimitError("Too many requests")
+
+    workload = lab.Workload(jobs=[lab.Job(id="job", job_function=job_function)])
+    progress = []
+    results = asyncio.run(
+        workload.async_run(
+            make_messages(2),
+            max_retries=1,
+            progress_callback=lambda nb_done, total: progress.append((nb_done, total)),
+        )
+    )
+
+    assert results["message-0"]["job"].result_type == ResultType.error
+    assert progress == [(1, 2), (2, 2)]
+
+
+def test_other_errors_are_raised():
+    async def job_function(message, **kwargs):
+        raise ValueError("Bug in the job")
+
+    workload = lab.Workload(jobs=[lab.Job(id="job", job_function=job_function)])
+
+    with pytest.raises(ValueError):
+        workload.run(make_messages(5), progress_callback=lambda nb_done, total: None)
+
+
+def test_token_bucket():
+    async def acquire_all():
+        # 600 per minute: 10 per second
+        bucket = TokenBucket(per_minute=600)
+        await bucket.acquire(600)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire(1)
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire_all()) == pytest.approx(0.3, abs=0.1)
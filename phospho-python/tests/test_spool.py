@@ -0,0 +1,54 @@
+from phospho.log_queue import Event, LogQueue
+from phospho.spool import Spool
+
+
+def make_event(i: int) -> Event:
+    return Event(id=f"task-{i}", content={"task_id": f"task-{i}"})
+
+
+def test_replay_events_not_acknowledged(tmp_path):
+    queue = LogQueue(spool=Spool(str(tmp_path)))
+    for i in range(3):
+        queue.append(make_event(i))
+    batch = queue.get_batch_events()
+    queue.ack(batch[:2])
+    # The process is killed before the last event is sent
+    queue.append(make_event(3))
+    queue.spool.close()
+
+    replayed_queue = LogQueue(spool=Spool(str(tmp_path)))
+
+    assert [e["task_id"] for e in replayed_queue.get_batch()] == ["task-2", "task-3"]
+
+
+def test_update_replaces_spooled_event(tmp_path):
+    queue = LogQueue(spool=Spool(str(tmp_path)))
+    queue.append(Event(id="task-0", content={"task_id": "task-0", "output": "a"}))
+    event = queue.get("task-0")
+    event.content["output"] = "ab"
+    queue.mark("task-0", to_log=True)
+    queue.spool.close()
+
+    replayed = Spool(str(tmp_path)).replayed
+
+    assert [content["output"] for _, content in replayed] == ["ab"]
+
+
+def test_segments_rotated_and_deleted(tmp_path):
+    spool = Spool(str(tmp_path), max_segment_bytes=100)
+    seqs = [spool.append({"task_id": f"task-{i}", "input": "a" * 50}) for i in range(5)]
+    assert spool.stats()["nb_segments"] > 1
+
+    spool.ack(seqs)
+
+    assert spool.stats()["nb_pending"] == 0
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_max_total_bytes_drops_oldest_segments(tmp_path):
+    spool = Spool(str(tmp_path), max_segment_bytes=100, max_total_bytes=300)
+    for i in range(20):
+        spool.append({"task_id": f"task-{i}", "input": "a" * 50})
+
+    assert spool.nb_dropped > 0
+    assert spool.stats()["total_bytes"] <= 300 + 200
@@ -0,0 +1,90 @@
+import json
+from typing import Any
+
+import pydantic
+import pytest
+
+from phospho.utils import (
+    convert_content_to_loggable_content,
+    filter_nonjsonable_keys,
+    is_jsonable,
+)
+
+
+def reference_is_jsonable(x: Any) -> bool:
+    try:
+        json.dumps(x)
+        return True
+    except TypeError:
+        return False
+
+
+def reference_convert(content: Any) -> Any:
+    """The json.dumps based implementation"""
+    if reference_is_jsonable(content):
+        return content
+    if isinstance(content, dict):
+        return {key: reference_convert(value) for key, value in content.items()}
+    elif isinstance(content, list):
+        return str([reference_convert(x) for x in content])
+    elif isinstance(content, pydantic.BaseModel):
+        return content.model_dump()
+    elif isinstance(content, bytes):
+        return json.loads(content.decode())
+    return str(content)
+
+
+class Message(pydantic.BaseModel):
+    role: str
+    content: str
+
+
+class Unknown:
+    def __str__(self) -> str:
+        return "unknown"
+
+
+CONTENTS = [
+    "text",
+    1,
+    1.5,
+    None,
+    True,
+    {"a": [1, 2, {"b": None}], "c": (1, "d")},
+    {"message": Message(role="user", content="Hi")},
+    [Message(role="user", content="Hi"), 1, "a"],
+    {"a": (1, Unknown())},
+    [[1, Unknown()], {"b": b'{"c": 1}'}],
+    {1: "int key", 2.5: "float key", None: "none key"},
+    {(1, 2): "tuple key"},
+    {"nested": {"nested": {"object": Unknown()}}},
+    b'{"a": [1, 2]}',
+    Unknown(),
+]
+
+
+@pytest.mark.parametrize("content", CONTENTS)
+def test_same_result_as_json_dumps(content):
+    assert is_jsonable(content) == reference_is_jsonable(content)
+    assert convert_content_to_loggable_content(content) == reference_convert(content)
+
+
+def test_jsonable_content_is_not_copied():
+    content = {"messages": [{"role": "user", "content": "Hi"}]}
+    assert convert_content_to_loggable_content(content) is content
+
+
+def test_circular_reference():
+    content: dict = {}
+    content["self"] = content
+    with pytest.raises(ValueError):
+        is_jsonable(content)
+    # The same object twice isn't a circular reference
+    shared = [1]
+    assert is_jsonable({"a": shared, "b": shared})
+
+
+def test_filter_nonjsonable_keys():
+    assert filter_nonjsonable_keys({"a": 1, "b": Unknown(), "c": [Unknown()]}) == {
+        "a": 1
+    }